@@ -0,0 +1,104 @@
+"""
+Đo độ trễ (p50 / p95 / p99) khi nhiều trình duyệt cùng mở dashboard: mỗi client song song
+gọi lần lượt các API mà trang chủ gọi (rooms, chi tiết phòng, latest, unread-count, statistics).
+
+Chạy từ thư mục backend, với server đang chạy:
+    python benchmarks/dashboard_concurrency_benchmark.py --email a@b.c --password ... \
+        [--base-url http://localhost:8000] [--concurrency 200] [--rounds 5]
+
+So sánh trước / sau khi đổi DB_THREADPOOL_SIZE: khi route async chặn event loop, p99 tăng
+gần tuyến tính theo concurrency vì mọi request xếp hàng sau truy vấn chậm nhất.
+"""
+import argparse
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def request(base_url: str, path: str, token: str = None, body: dict = None, timeout: float = 60):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method="POST" if data else "GET")
+    req.add_header("Content-Type", "application/json")
+    if token:
+        req.add_header("Authorization", f"Bearer {token}")
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return response.status, json.loads(response.read() or b"null")
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def dashboard_paths(room_id: str):
+    paths = ["/rooms/", "/sensor-data/latest", "/notifications/unread-count", "/sensor-data/statistics"]
+    if room_id:
+        paths.insert(1, f"/rooms/{room_id}/details")
+    return paths
+
+
+def run_client(base_url: str, token: str, paths, rounds: int):
+    """Một client: gọi lần lượt các API dashboard rounds lần, trả về [(path, ms, ok)]"""
+    samples = []
+    for _ in range(rounds):
+        for path in paths:
+            started = time.perf_counter()
+            try:
+                status_code, _ = request(base_url, path, token)
+                ok = status_code == 200
+            except (urllib.error.URLError, OSError, ValueError):
+                ok = False
+            samples.append((path, (time.perf_counter() - started) * 1000, ok))
+    return samples
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark độ trễ dashboard khi có nhiều request song song")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5, help="Số lần mỗi client tải lại dashboard")
+    args = parser.parse_args()
+
+    _, login = request(args.base_url, "/users/login", body={"email": args.email, "password": args.password})
+    token = login["data"]["access_token"]
+    _, rooms = request(args.base_url, "/rooms/", token)
+    room_list = (rooms.get("data") or {}).get("rooms") or []
+    room_id = room_list[0]["_id"] if room_list else None
+    paths = dashboard_paths(room_id)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(run_client, args.base_url, token, paths, args.rounds) for _ in range(args.concurrency)]
+        samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.perf_counter() - started
+
+    by_path = defaultdict(list)
+    errors = defaultdict(int)
+    for path, ms, ok in samples:
+        by_path[path].append(ms)
+        if not ok:
+            errors[path] += 1
+
+    print(f"{args.concurrency} client x {args.rounds} lượt, {len(samples)} request trong {elapsed:.1f}s "
+          f"({len(samples) / elapsed:.0f} req/s)")
+    print(f"{'endpoint':<34} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'lỗi':>6}")
+    for path in paths:
+        values = by_path[path]
+        print(f"{path[:34]:<34} {percentile(values, 0.5):>9.1f} {percentile(values, 0.95):>9.1f} "
+              f"{percentile(values, 0.99):>9.1f} {errors[path]:>6}")
+    all_values = [ms for _, ms, _ in samples]
+    print(f"{'tất cả':<34} {percentile(all_values, 0.5):>9.1f} {percentile(all_values, 0.95):>9.1f} "
+          f"{percentile(all_values, 0.99):>9.1f} {sum(errors.values()):>6}")
+    return 1 if sum(errors.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
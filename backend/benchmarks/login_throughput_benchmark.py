@@ -0,0 +1,99 @@
+"""
+Đo thông lượng đăng nhập khi có loạt login đồng thời (ví dụ sau khi deploy) và độ trễ của
+một API nhẹ (/health) chạy song song, để thấy bcrypt có làm nghẽn các endpoint khác không.
+
+Chạy từ thư mục backend, với server đang chạy:
+    python benchmarks/login_throughput_benchmark.py --email a@b.c --password ... \
+        [--base-url http://localhost:8000] [--concurrency 50] [--requests 500]
+
+Kết quả gồm số login/s, số request 200 / 401 / 503 (pool bcrypt đầy) và p50 / p95 / p99 của
+login và /health. So sánh các giá trị BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS,
+PASSWORD_HASH_QUEUE_SIZE.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def request(base_url: str, path: str, body: dict = None, timeout: float = 60) -> int:
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method="POST" if data else "GET")
+    req.add_header("Content-Type", "application/json")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def timed(func, *args):
+    """Gọi func, trả về (status, ms); status 0 nếu lỗi kết nối"""
+    started = time.perf_counter()
+    try:
+        status_code = func(*args)
+    except (urllib.error.URLError, OSError, ValueError):
+        status_code = 0
+    return status_code, (time.perf_counter() - started) * 1000
+
+
+def probe_health(base_url: str, stop: threading.Event, samples: list, interval: float):
+    while not stop.is_set():
+        samples.append(timed(request, base_url, "/health")[1])
+        stop.wait(interval)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark thông lượng đăng nhập (bcrypt)")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500, help="Tổng số request đăng nhập")
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="Giây giữa hai lần gọi /health")
+    args = parser.parse_args()
+
+    body = {"email": args.email, "password": args.password}
+    if request(args.base_url, "/users/login", body) != 200:
+        print("Đăng nhập thử thất bại, kiểm tra --email / --password")
+        return 1
+
+    stop = threading.Event()
+    health_samples = []
+    prober = threading.Thread(target=probe_health, args=(args.base_url, stop, health_samples, args.probe_interval), daemon=True)
+    prober.start()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda _: timed(request, args.base_url, "/users/login", body), range(args.requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    prober.join()
+
+    statuses = Counter(status_code for status_code, _ in results)
+    login_ms = [ms for status_code, ms in results if status_code == 200]
+    print(f"{args.requests} login, {args.concurrency} client song song trong {elapsed:.1f}s: "
+          f"{statuses[200] / elapsed:.1f} login thành công/s")
+    print("status: " + ", ".join(f"{status_code or 'lỗi kết nối'}={count}" for status_code, count in sorted(statuses.items())))
+    print(f"{'':<14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'n':>6}")
+    for name, values in (("login 200", login_ms), ("/health", health_samples)):
+        print(f"{name:<14} {percentile(values, 0.5):>9.1f} {percentile(values, 0.95):>9.1f} "
+              f"{percentile(values, 0.99):>9.1f} {len(values):>6}")
+    return 0 if statuses[200] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
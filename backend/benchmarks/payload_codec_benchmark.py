@@ -0,0 +1,75 @@
+"""
+So sánh kích thước payload trên đường truyền và thời gian giải mã (µs/message)
+của các codec cho topic device/{device_id}/data.
+
+Chạy từ thư mục backend:  python benchmarks/payload_codec_benchmark.py [--iterations 20000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.payload_codec import (  # noqa: E402
+    CODEC_CBOR, CODEC_JSON, CODEC_MSGPACK, SENSOR_TYPE_CODES, decode_payload_bytes, encode_payload, get_supported_codecs
+)
+
+# Payload giống esp32_simulator: 5 sensor, 2 actuator
+VERBOSE_PAYLOAD = {
+    "device_id": "esp32_living_room_01",
+    "sensors": [
+        {"sensor_id": "sensor_temp_01", "value": 25.4},
+        {"sensor_id": "sensor_hum_02", "value": 61.2},
+        {"sensor_id": "sensor_gas_03", "value": 212},
+        {"sensor_id": "sensor_pir_06", "type": "motion", "value": 0},
+        {"sensor_id": "sensor_ir_07", "type": "obstacle", "value": 1}
+    ],
+    "actuators": [
+        {"actuator_id": "relay_light_04", "state": True},
+        {"actuator_id": "relay_fan_05", "state": False}
+    ]
+}
+
+COMPACT_PAYLOAD = {
+    "s": [
+        [sensor["sensor_id"], sensor["value"]] + ([SENSOR_TYPE_CODES.index(sensor["type"])] if "type" in sensor else [])
+        for sensor in VERBOSE_PAYLOAD["sensors"]
+    ],
+    "a": [[actuator["actuator_id"], actuator["state"]] for actuator in VERBOSE_PAYLOAD["actuators"]]
+}
+
+
+def measure(label: str, payload: bytes, decode, iterations: int):
+    decode(payload)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        decode(payload)
+    elapsed_us = (time.perf_counter() - started) * 1_000_000 / iterations
+    print(f"{label:<34} {len(payload):>8} {elapsed_us:>14.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark codec payload MQTT")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"Codec hỗ trợ: {', '.join(get_supported_codecs())}")
+    print(f"{'format':<34} {'bytes':>8} {'decode µs/msg':>14}")
+
+    verbose_json = json.dumps(VERBOSE_PAYLOAD).encode("utf-8")
+    measure("json verbose (json.loads)", verbose_json, json.loads, args.iterations)
+    measure("json verbose (codec layer)", verbose_json, lambda p: decode_payload_bytes(p, CODEC_JSON), args.iterations)
+
+
+    for codec in (CODEC_MSGPACK, CODEC_CBOR):
+        if codec not in get_supported_codecs():
+            print(f"{codec + ' compact':<34} {'(chưa cài thư viện)':>23}")
+            continue
+        encoded = encode_payload(COMPACT_PAYLOAD, codec)
+        measure(f"{codec} compact (codec layer)", encoded, lambda p, c=codec: decode_payload_bytes(p, c), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
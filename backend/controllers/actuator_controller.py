@@ -1,7 +1,9 @@
 from fastapi import HTTPException, status
 from fastapi.responses import JSONResponse
-from utils.database import actuators_collection, devices_collection, user_room_devices_collection, sanitize_for_json
+from utils.database import actuators_collection, devices_collection, sanitize_for_json
 from utils.mqtt_client import mqtt_client
+from utils.metadata_cache import metadata_cache
+from utils.access_control import access_control
 from datetime import datetime
 from utils.timezone import get_vietnam_now_naive
 import logging
@@ -34,8 +36,7 @@ def control_actuator(actuator_id: str, state: bool, user_id: str = None):
 
         # Kiểm tra device có enabled không và thuộc về user (nếu có user_id) - từ bảng user_room_devices
         if user_id:
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+            if not access_control.can_access_device(user_id, device_id):
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={
@@ -69,6 +70,7 @@ def control_actuator(actuator_id: str, state: bool, user_id: str = None):
             {"_id": actuator_id},
             {"$set": {"state": state, "updated_at": get_vietnam_now_naive()}}
         )
+        metadata_cache.invalidate_actuator(actuator_id, device_id)
 
         # Gửi command qua MQTT
         from utils.database import sensors_collection, actuators_collection as actuators
@@ -135,8 +137,7 @@ def update_actuator(actuator_id: str, name: str = None, pin: int = None, enabled
 
         # Kiểm tra device thuộc về user (nếu có user_id) - từ bảng user_room_devices
         if user_id:
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+            if not access_control.can_access_device(user_id, device_id):
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={
@@ -160,6 +161,7 @@ def update_actuator(actuator_id: str, name: str = None, pin: int = None, enabled
             {"_id": actuator_id},
             {"$set": update_data}
         )
+        metadata_cache.invalidate_actuator(actuator_id, device_id)
 
         logger.info(f"Đã cập nhật actuator {actuator_id}: name={name}, pin={pin}, enabled={enabled}")
 
@@ -2,6 +2,10 @@ from fastapi import HTTPException, status
 from fastapi.responses import JSONResponse
 from utils.database import devices_collection, user_room_devices_collection, rooms_collection, sensors_collection, actuators_collection, sanitize_for_json
 from utils.mqtt_client import mqtt_client
+from utils.metadata_cache import metadata_cache
+from utils.threshold_engine import threshold_engine
+from utils.access_control import access_control
+from utils.room_summary import room_summary
 from datetime import datetime
 from utils.timezone import get_vietnam_now_naive
 import logging
@@ -34,8 +38,7 @@ def control_device_power(device_id: str, enabled: bool, user_id: str = None):
         
         # Kiểm tra quyền truy cập từ bảng user_room_devices (nếu có user_id)
         if user_id:
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+            if not access_control.can_access_device(user_id, device_id):
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={
@@ -50,6 +53,7 @@ def control_device_power(device_id: str, enabled: bool, user_id: str = None):
             {"_id": device_id},
             {"$set": {"enabled": enabled, "updated_at": get_vietnam_now_naive()}}
         )
+        metadata_cache.invalidate_device(device_id)
 
         # Gửi command qua MQTT
         command = {
@@ -112,8 +116,7 @@ def get_device(device_id: str, user_id: str = None):
         
         # Kiểm tra quyền truy cập từ bảng user_room_devices (nếu có user_id)
         if user_id:
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+            if not access_control.can_access_device(user_id, device_id):
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={
@@ -161,8 +164,7 @@ def get_device_detail(device_id: str, user_id: str = None):
         
         # Kiểm tra quyền truy cập từ bảng user_room_devices (nếu có user_id)
         if user_id:
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+            if not access_control.can_access_device(user_id, device_id):
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={
@@ -221,9 +223,9 @@ def get_all_devices(user_id: str = None):
                 }
             )
 
-        # Lấy danh sách device_ids từ bảng user_room_devices (cấu trúc mới)
-        linked_devices = list(user_room_devices_collection.find({"user_id": user_id}))
-        device_ids = list(set([str(link["device_id"]) for link in linked_devices if "device_id" in link and link["device_id"]]))  # Loại bỏ duplicate và đảm bảo là string
+        # Lấy danh sách device_ids từ chỉ mục quyền của user (bảng user_room_devices)
+        access = access_control.get(user_id)
+        device_ids = access.device_ids
 
         if not device_ids:
             return JSONResponse(
@@ -238,19 +240,8 @@ def get_all_devices(user_id: str = None):
         # Lấy detailed info từ devices_collection (sử dụng _id thay vì device_id)
         devices = list(devices_collection.find({"_id": {"$in": device_ids}}))
 
-        # Tạo mapping từ device_id -> room_id từ linked_devices
-        # Ưu tiên link có room_id (không phải None) nếu có nhiều links cho cùng một device
-        device_room_map = {}
-        for link in linked_devices:
-            device_id = link.get("device_id")
-            room_id = link.get("room_id")
-            if device_id:
-                # Nếu device chưa có trong map, thêm vào
-                if device_id not in device_room_map:
-                    device_room_map[device_id] = room_id
-                # Nếu đã có nhưng room_id hiện tại là None và link mới có room_id, cập nhật
-                elif device_room_map[device_id] is None and room_id is not None:
-                    device_room_map[device_id] = room_id
+        # Mapping device_id -> room_id (chỉ mục đã ưu tiên link có room_id nếu có nhiều links)
+        device_room_map = access.device_rooms
 
         # Lấy thông tin room cho các room_id không phải None
         room_ids = list(set([room_id for room_id in device_room_map.values() if room_id is not None]))
@@ -335,12 +326,9 @@ def get_devices_by_room(room_id: str, user_id: str = None):
                 }
             )
         
-        user_room_device_links = list(user_room_devices_collection.find({
-            "user_id": user_id,
-            "room_id": room_id
-        }))
+        device_ids = access_control.get(user_id).room_device_ids(room_id)
         
-        if not user_room_device_links:
+        if not device_ids:
             return JSONResponse(
                 status_code=status.HTTP_200_OK,
                 content={
@@ -350,9 +338,6 @@ def get_devices_by_room(room_id: str, user_id: str = None):
                 }
             )
         
-        # Lấy device_ids từ links
-        device_ids = [link["device_id"] for link in user_room_device_links]
-        
         # Lấy devices
         devices = list(devices_collection.find({"_id": {"$in": device_ids}}))
         
@@ -379,7 +364,8 @@ def get_devices_by_room(room_id: str, user_id: str = None):
 def delete_device(device_id: str, user_id: str = None):
     """
     Xóa liên kết thiết bị khỏi user (chỉ xóa trong bảng user_room_devices)
-    Không xóa thiết bị, sensors, actuators, sensor_data
+    Không xóa thiết bị, sensors, actuators, sensor_data; khi device mất liên kết cuối cùng
+    thì ghi devices.unlinked_at (dùng cho RETENTION_ORPHAN_DAYS)
     DELETE /devices/{device_id}
     """
     try:
@@ -410,8 +396,7 @@ def delete_device(device_id: str, user_id: str = None):
             )
         
         # Kiểm tra user có liên kết với device này không
-        link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-        if not link:
+        if not access_control.can_access_device(user_id, device_id):
             return JSONResponse(
                 status_code=status.HTTP_404_NOT_FOUND,
                 content={
@@ -429,6 +414,13 @@ def delete_device(device_id: str, user_id: str = None):
         })
         
         deleted_count = user_room_devices_result.deleted_count
+        # Device không còn liên kết nào: ghi thời điểm để retention nhận diện dữ liệu mồ côi
+        if deleted_count and not user_room_devices_collection.find_one({"device_id": device_id}, {"_id": 1}):
+            devices_collection.update_one({"_id": device_id}, {"$set": {"unlinked_at": get_vietnam_now_naive()}})
+        metadata_cache.invalidate_device(device_id)
+        threshold_engine.invalidate_device_users(device_id)
+        access_control.invalidate_user(user_id)
+        room_summary.refresh_device(device_id)
         
         if deleted_count == 0:
             return JSONResponse(
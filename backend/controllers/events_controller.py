@@ -0,0 +1,96 @@
+import asyncio
+import logging
+
+from fastapi import Request, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from utils.access_control import access_control
+from utils.auth import check_stream_session, create_stream_ticket, STREAM_TICKET_EXPIRE_SECONDS
+from utils.db_executor import run_db
+from utils.live_events import live_events, format_event, LIVE_EVENTS_KEEPALIVE_SECONDS, LIVE_EVENTS_REVALIDATE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def create_ticket(session: dict):
+    """Ticket dùng một lần cho GET /events/stream?ticket= (không đưa access token vào URL)"""
+    try:
+        ticket = create_stream_ticket(session)
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content={
+                "status": True,
+                "message": "Đã tạo ticket cho luồng sự kiện",
+                "data": {"ticket": ticket, "expires_in": STREAM_TICKET_EXPIRE_SECONDS}
+            }
+        )
+    except Exception as e:
+        logger.error(f"Lỗi tạo ticket luồng sự kiện: {str(e)}")
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={
+                "status": False,
+                "message": f"Lỗi tạo ticket: {str(e)}",
+                "data": None
+            }
+        )
+
+
+def _revalidate(session: dict, device_ids: set):
+    """
+    (lý do đóng luồng hoặc None, tập device hiện đang liên kết); lý do là lý do của
+    check_stream_session hoặc "link_revoked" khi một device trong device_ids đã bị gỡ liên kết
+    """
+    reason = check_stream_session(session)
+    if reason is not None:
+        return reason, device_ids
+    current = set(access_control.get(session["user"]["_id"]).device_rooms)
+    return ("link_revoked" if not device_ids.issubset(current) else None), current
+
+
+def stream_events(session: dict, request: Request):
+    """
+    Luồng Server-Sent Events cho user: reading mới, device online/offline, trạng thái
+    actuator và notification mới của các device user đang liên kết.
+
+    Mỗi LIVE_EVENTS_REVALIDATE_SECONDS session được kiểm tra lại; nếu không còn hợp lệ
+    server gửi sự kiện "close" với lý do rồi đóng luồng. Device mới liên kết được thêm vào
+    subscription ở lần kiểm tra đó
+    """
+    user_id = str(session["user"]["_id"])
+
+    async def event_stream():
+        device_ids = set((await run_db(access_control.get, user_id)).device_rooms)
+        subscription = live_events.subscribe(user_id, device_ids)
+        loop = asyncio.get_running_loop()
+        next_check = loop.time() + LIVE_EVENTS_REVALIDATE_SECONDS
+        try:
+            yield f"retry: 5000\n\n{format_event('ready', {'user_id': user_id})}"
+            while True:
+                if loop.time() >= next_check:
+                    reason, subscription.device_ids = await run_db(_revalidate, session, subscription.device_ids)
+                    if reason:
+                        logger.info(f"Đóng luồng sự kiện của user {user_id}: {reason}")
+                        yield format_event("close", {"reason": reason})
+                        break
+                    next_check = loop.time() + LIVE_EVENTS_REVALIDATE_SECONDS
+                try:
+                    timeout = max(0.0, min(LIVE_EVENTS_KEEPALIVE_SECONDS, next_check - loop.time()))
+                    message = await asyncio.wait_for(subscription.queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                dropped = subscription.take_dropped()
+                if dropped:
+                    # Client đọc chậm, đã mất sự kiện: báo để client tải lại dữ liệu
+                    yield format_event("overflow", {"dropped": dropped})
+                yield message
+        finally:
+            live_events.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
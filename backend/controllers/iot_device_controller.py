@@ -3,6 +3,8 @@ from fastapi.responses import JSONResponse
 from utils.database import devices_collection, sensors_collection, sanitize_for_json
 from models.device_models import create_device_dict
 from models.sensor_models import create_sensor_dict
+from utils.metadata_cache import metadata_cache
+from utils.access_control import access_control
 from datetime import datetime
 from utils.timezone import get_vietnam_now_naive
 import uuid
@@ -42,6 +44,7 @@ def register_device(device_id: str, device_name: str, device_type: str,
         device["_id"] = str(device_id)
         
         result = devices_collection.insert_one(device)
+        metadata_cache.invalidate_device(device_id)
         
         return JSONResponse(
             status_code=status.HTTP_201_CREATED,
@@ -101,6 +104,7 @@ def add_sensor(device_id: str, sensor_id: str, name: str, sensor_type: str, note
                 {"_id": sensor_id, "device_id": device_id},
                 {"$set": update_fields}
             )
+            metadata_cache.invalidate_sensor(sensor_id, device_id)
             
             return JSONResponse(
                 status_code=status.HTTP_200_OK,
@@ -139,6 +143,8 @@ def add_sensor(device_id: str, sensor_id: str, name: str, sensor_type: str, note
             sensor["note"] = note
         
         sensors_collection.insert_one(sensor)
+        metadata_cache.invalidate_sensor(sensor_id, device_id)
+        access_control.add_sensor(device_id, sensor_id)
         
         return JSONResponse(
             status_code=status.HTTP_201_CREATED,
@@ -1,6 +1,7 @@
 from fastapi import status
 from fastapi.responses import JSONResponse
 from utils.database import notifications_collection, sanitize_for_json
+from utils.threshold_engine import threshold_engine
 from datetime import datetime
 import logging
 
@@ -92,6 +93,8 @@ def mark_notification_as_read(user_id: str, notification_id: str):
             {"message_id": notification_id, "user_id": user_id},
             {"$set": {"read": True}}
         )
+        if notification.get("sensor_id"):
+            threshold_engine.clear_cooldown(user_id, notification["sensor_id"])
         
         return JSONResponse(
             status_code=status.HTTP_200_OK,
@@ -124,6 +127,7 @@ def mark_all_notifications_as_read(user_id: str):
             {"user_id": user_id, "read": False},
             {"$set": {"read": True}}
         )
+        threshold_engine.clear_cooldown(user_id)
         
         return JSONResponse(
             status_code=status.HTTP_200_OK,
@@ -1,9 +1,14 @@
 from fastapi import HTTPException, status
 from fastapi.responses import JSONResponse
-from utils.database import rooms_collection, devices_collection, user_room_devices_collection, sensors_collection, actuators_collection, sensor_data_collection, sanitize_for_json
+from utils.database import rooms_collection, devices_collection, user_room_devices_collection, sensors_collection, actuators_collection, sanitize_for_json
 from models.room_models import create_room_dict
 from models.user_room_device_models import create_user_room_device_dict
 from utils.mqtt_client import mqtt_client
+from utils.metadata_cache import metadata_cache
+from utils.threshold_engine import threshold_engine
+from utils.access_control import access_control
+from utils.sensor_latest import sensor_latest
+from utils.room_summary import room_summary, summarize
 import logging
 from datetime import datetime, timedelta
 from utils.timezone import get_vietnam_now_naive
@@ -42,12 +47,7 @@ def add_device_to_room(user_data: dict, room_id: str, device_id: str):
                 }
             )
         
-        user_device_link = user_room_devices_collection.find_one({
-            "user_id": user_id,
-            "device_id": device_id
-        })
-        
-        if not user_device_link:
+        if not access_control.can_access_device(user_id, device_id):
             return JSONResponse(
                 status_code=status.HTTP_403_FORBIDDEN,
                 content={
@@ -87,10 +87,12 @@ def add_device_to_room(user_data: dict, room_id: str, device_id: str):
                 {"user_id": user_id, "device_id": device_id},
                 {"$set": {"room_id": room_id, "updated_at": get_vietnam_now_naive()}}
             )
-            pass
         else:
             link = create_user_room_device_dict(user_id, device_id, room_id)
             user_room_devices_collection.insert_one(link)
+        threshold_engine.invalidate_device_users(device_id)
+        access_control.invalidate_user(user_id)
+        room_summary.refresh_device(device_id)
         
         return JSONResponse(
             status_code=status.HTTP_200_OK,
@@ -164,6 +166,9 @@ def remove_device_from_room(user_data: dict, room_id: str, device_id: str):
             {"user_id": user_id, "room_id": room_id, "device_id": device_id},
             {"$set": {"room_id": None, "updated_at": get_vietnam_now_naive()}}
         )
+        threshold_engine.invalidate_device_users(device_id)
+        access_control.invalidate_user(user_id)
+        room_summary.refresh_device(device_id)
         
         # Không cần cập nhật room.device_ids nữa - chỉ sử dụng bảng user_room_devices
         
@@ -279,8 +284,8 @@ def get_all_rooms_with_data(user_id: str = None):
                 }
             )
         
-        all_user_device_links = list(user_room_devices_collection.find({"user_id": user_id}))
-        all_device_ids = list(set([link["device_id"] for link in all_user_device_links if "device_id" in link and link["device_id"]]))
+        access = access_control.get(user_id)
+        all_device_ids = access.device_ids
         
         all_devices = {}
         all_sensors = {}
@@ -327,19 +332,7 @@ def get_all_rooms_with_data(user_id: str = None):
         
         latest_sensor_data_map = {}
         if all_sensor_ids:
-            pipeline = [
-                {"$match": {"sensor_id": {"$in": all_sensor_ids}}},
-                {"$sort": {"timestamp": -1}},
-                {
-                    "$group": {
-                        "_id": "$sensor_id",
-                        "latest_data": {"$first": "$$ROOT"}
-                    }
-                },
-                {"$replaceRoot": {"newRoot": "$latest_data"}}
-            ]
-            
-            latest_sensor_data_list = list(sensor_data_collection.aggregate(pipeline))
+            latest_sensor_data_list = sensor_latest.get_many(all_sensor_ids).values()
             for data in latest_sensor_data_list:
                 sensor_id = data.get("sensor_id")
                 if sensor_id:
@@ -353,14 +346,7 @@ def get_all_rooms_with_data(user_id: str = None):
         for room in rooms:
             room_id = room["_id"]
             
-            room_device_links = []
-            for link in all_user_device_links:
-                link_room_id = link.get("room_id")
-                if link_room_id is not None:
-                    if str(link_room_id) == str(room_id) or link_room_id == room_id:
-                        room_device_links.append(link)
-            
-            room_device_ids = [link["device_id"] for link in room_device_links if "device_id" in link and link["device_id"]]
+            room_device_ids = access.room_device_ids(room_id)
             
             room_devices = []
             room_sensors = []
@@ -485,13 +471,10 @@ def control_room(room_id: str, action: str, user_id: str = None):
                 }
             )
 
-        # Lấy devices từ bảng user_room_devices (cấu trúc mới)
-        user_room_device_links = list(user_room_devices_collection.find({
-            "user_id": user_id,
-            "room_id": room_id
-        }))
+        # Lấy devices trong phòng từ chỉ mục quyền của user
+        device_ids = access_control.get(user_id).room_device_ids(room_id)
         
-        if not user_room_device_links:
+        if not device_ids:
             return JSONResponse(
                 status_code=status.HTTP_200_OK,
                 content={
@@ -501,9 +484,6 @@ def control_room(room_id: str, action: str, user_id: str = None):
                 }
             )
 
-        # Lấy device_ids từ links
-        device_ids = [link["device_id"] for link in user_room_device_links]
-        
         # Lấy devices
         devices = list(devices_collection.find({"_id": {"$in": device_ids}}))
         
@@ -526,6 +506,8 @@ def control_room(room_id: str, action: str, user_id: str = None):
             {"_id": {"$in": device_ids_to_update}},
             {"$set": {"enabled": enabled, "updated_at": get_vietnam_now_naive()}}
         )
+        for device_id in device_ids_to_update:
+            metadata_cache.invalidate_device(device_id)
 
         # Gửi command qua MQTT cho từng device
         for device_id in device_ids_to_update:
@@ -583,12 +565,16 @@ def get_room_details(room_id: str, user_id: str = None):
                 }
             )
 
-        links = list(user_room_devices_collection.find({
-            "user_id": user_id,
-            "room_id": room_id
-        }))
+        # Một document tóm tắt thay cho truy vấn liên kết / sensor / giá trị mới nhất của từng sensor
+        summary = room_summary.get(room["_id"]) or {}
+        device_ids = summary.get("device_ids") or []
+        overview = summarize(summary, TIME_THRESHOLD_SECONDS)
+        room["device_counts"] = {
+            "total": overview["total_devices"],
+            "online": overview["online_devices"]
+        }
 
-        if not links:
+        if not device_ids:
             room["devices"] = []
             room["averaged_sensors"] = []
             return JSONResponse(
@@ -600,8 +586,6 @@ def get_room_details(room_id: str, user_id: str = None):
                 }
             )
 
-        device_ids = [link["device_id"] for link in links if link.get("device_id")]
-
         devices_raw = list(devices_collection.find({"_id": {"$in": device_ids}}))
 
         devices = []
@@ -618,93 +602,21 @@ def get_room_details(room_id: str, user_id: str = None):
                 "device_name": d.get("device_name")
             })
 
-        sensors = list(sensors_collection.find({"device_id": {"$in": device_ids}}))
-
-        sensor_latest = {}
-
-        for s in sensors:
-            sid_str = str(s["_id"])
-            latest = sensor_data_collection.find_one(
-                {"sensor_id": {"$in": [sid_str, s["_id"]]}},
-                sort=[("timestamp", -1)]
-            )
-            if latest:
-                sensor_latest[sid_str] = {
-                    "value": latest.get("value"),
-                    "timestamp": latest.get("timestamp") or latest.get("created_at")
-                }
-
-        sensors_with_data = []
-        for s in sensors:
-            sd = s.copy()
-            sid = str(sd["_id"])
-
-            if sid in sensor_latest:
-                sd["value"] = sensor_latest[sid]["value"]
-                sd["lastUpdate"] = sensor_latest[sid]["timestamp"]
-            else:
-                sd["value"] = None
-                sd["lastUpdate"] = None
-
-            sensors_with_data.append(sd)
-
-        sensors_by_type = {}
-        for s in sensors_with_data:
-            stype = s.get("type", "unknown")
-            sensors_by_type.setdefault(stype, []).append(s)
-
-        averaged_sensors = []
-
-        for sensor_type, type_sensors in sensors_by_type.items():
-            valid = [
-                s for s in type_sensors
-                if s.get("value") is not None and isinstance(s.get("lastUpdate"), datetime)
-            ]
-
-            if not valid:
-                averaged_sensors.append({
-                    "type": sensor_type,
-                    "name": (
-                        "Nhiệt độ" if sensor_type == "temperature"
-                        else "Độ ẩm" if sensor_type == "humidity"
-                        else "Khí gas" if sensor_type == "gas"
-                        else sensor_type
-                    ),
-                    "unit": type_sensors[0].get("unit", ""),
-                    "value": None,
-                    "lastUpdate": None
-                })
-                continue
-
-            valid.sort(key=lambda x: x["lastUpdate"], reverse=True)
-            latest_sensor = valid[0]
-            latest_time = latest_sensor["lastUpdate"]
-
-            in_range = [
-                s for s in valid
-                if abs((latest_time - s["lastUpdate"]).total_seconds()) <= TIME_THRESHOLD_SECONDS
-            ]
-
-            if len(in_range) == 1:
-                final_value = latest_sensor["value"]
-            else:
-                final_value = round(
-                    sum(s["value"] for s in in_range) / len(in_range),
-                    1
-                )
-
-            averaged_sensors.append({
-                "type": sensor_type,
+        averaged_sensors = [
+            {
+                "type": item["type"],
                 "name": (
-                    "Nhiệt độ" if sensor_type == "temperature"
-                    else "Độ ẩm" if sensor_type == "humidity"
-                    else "Khí gas" if sensor_type == "gas"
-                    else sensor_type
+                    "Nhiệt độ" if item["type"] == "temperature"
+                    else "Độ ẩm" if item["type"] == "humidity"
+                    else "Khí gas" if item["type"] == "gas"
+                    else item["type"]
                 ),
-                "unit": latest_sensor.get("unit", ""),
-                "value": final_value,
-                "lastUpdate": latest_time
-            })
+                "unit": item["unit"],
+                "value": item["value"],
+                "lastUpdate": item["lastUpdate"]
+            }
+            for item in overview["types"]
+        ]
 
         room["devices"] = devices
         room["averaged_sensors"] = averaged_sensors
@@ -870,6 +782,10 @@ def delete_room(user_data: dict, room_name: str = None, room_id: str = None):
         
         # Xóa room
         rooms_collection.delete_one({"_id": room_id_to_delete})
+        room_summary.remove(room_id_to_delete)
+        for device_id in device_ids_in_room:
+            threshold_engine.invalidate_device_users(device_id)
+        access_control.invalidate_user(user_id)
 
         return JSONResponse(
             status_code=status.HTTP_200_OK,
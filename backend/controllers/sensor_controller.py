@@ -1,7 +1,10 @@
 from fastapi import HTTPException, status
 from fastapi.responses import JSONResponse
-from utils.database import sensors_collection, devices_collection, user_room_devices_collection, sanitize_for_json
+from utils.database import sensors_collection, devices_collection, sanitize_for_json
 from utils.mqtt_client import mqtt_client
+from utils.metadata_cache import metadata_cache
+from utils.access_control import access_control
+from utils.threshold_engine import threshold_engine
 from datetime import datetime
 from utils.timezone import get_vietnam_now_naive
 import logging
@@ -34,8 +37,7 @@ def control_sensor_enable(sensor_id: str, enabled: bool, user_id: str = None):
         
         # Kiểm tra device thuộc về user (nếu có user_id) - từ bảng user_room_devices
         if user_id:
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+            if not access_control.can_access_device(user_id, device_id):
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={
@@ -51,6 +53,7 @@ def control_sensor_enable(sensor_id: str, enabled: bool, user_id: str = None):
             {"_id": sensor_id},
             {"$set": {"enabled": enabled, "updated_at": get_vietnam_now_naive()}}
         )
+        metadata_cache.invalidate_sensor(sensor_id, device_id)
 
         # Gửi command qua MQTT
         device = devices_collection.find_one({"_id": device_id})
@@ -154,8 +157,7 @@ def update_sensor(sensor_id: str, name: str = None, sensor_type: str = None, pin
         
         # Kiểm tra device thuộc về user (nếu có user_id) - từ bảng user_room_devices
         if user_id:
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+            if not access_control.can_access_device(user_id, device_id):
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={
@@ -195,6 +197,7 @@ def update_sensor(sensor_id: str, name: str = None, sensor_type: str = None, pin
             {"_id": sensor_id},
             {"$set": update_data}
         )
+        metadata_cache.invalidate_sensor(sensor_id, device_id)
 
         # Lấy sensor đã cập nhật để trả về
         updated_sensor = sensors_collection.find_one({"_id": sensor_id})
@@ -252,8 +255,7 @@ def update_sensor_threshold(sensor_id: str, min_threshold: float = None, max_thr
         
         # Kiểm tra device thuộc về user (nếu có user_id) - từ bảng user_room_devices
         if user_id:
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+            if not access_control.can_access_device(user_id, device_id):
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={
@@ -296,6 +298,8 @@ def update_sensor_threshold(sensor_id: str, min_threshold: float = None, max_thr
             {"_id": sensor_id},
             update_query
         )
+        metadata_cache.invalidate_sensor(sensor_id, device_id)
+        threshold_engine.reload_sensor(sensor_id, device_id)
 
         logger.info(f"Đã cập nhật ngưỡng sensor {sensor_id}: min={min_threshold}, max={max_threshold}")
 
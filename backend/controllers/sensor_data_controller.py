@@ -1,9 +1,7 @@
 from fastapi import HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from utils.database import (
-    sensor_data_collection, 
     devices_collection, 
-    user_room_devices_collection,
     sensors_collection,
     sanitize_for_json
 )
@@ -11,33 +9,42 @@ from datetime import datetime, timedelta
 from utils.timezone import get_vietnam_now_naive, convert_to_vietnam_naive
 from typing import Optional, Dict, List
 from bson import ObjectId
+from utils.sensor_data_store import sensor_data_store, encode_cursor, decode_cursor
+from utils.sensor_rollups import sensor_rollups
+from utils.sensor_latest import sensor_latest
+from utils.access_control import access_control
+from utils.downsampling import BucketAccumulator, lttb
+from utils.sensor_export import export_stream, MEDIA_TYPES, SENSOR_EXPORT_BATCH_SIZE
 
+# Với method=lttb, số khoảng được gom trước khi chọn điểm = limit_per_type * TRENDS_LTTB_OVERSAMPLE
+TRENDS_LTTB_OVERSAMPLE = 4
 
-def get_sensor_data(
-    user_data: dict,
+
+def _build_sensor_data_query(
+    user_id: str,
     device_id: Optional[str] = None,
     sensor_id: Optional[str] = None,
     sensor_type: Optional[str] = None,
-    limit: int = 100,
     start_time: Optional[str] = None,
     end_time: Optional[str] = None
 ):
     """
-    Lấy dữ liệu sensor từ database
+    Bộ lọc cho sensor_data_store (sensor_ids / device_ids / sensor_type / start / end) sau
+    khi kiểm tra quyền truy cập của user. Trả về (query, None) hoặc (None, JSONResponse lỗi)
     """
-    try:
-        user_id = str(user_data["_id"])
-        
-        # Xây dựng query filter
-        query = {}
-        
-        # Nếu có sensor_id, tìm sensor để lấy device_id và kiểm tra quyền truy cập
-        if sensor_id:
-            sensor_id = str(sensor_id)
-            # Tìm sensor theo sensor_id
-            sensor = sensors_collection.find_one({"_id": sensor_id})
+    # Xây dựng query filter
+    query = {}
+    access = access_control.get(user_id)
+
+    # Nếu có sensor_id, lấy device_id của sensor từ chỉ mục quyền của user
+    if sensor_id:
+        sensor_id = str(sensor_id)
+        sensor_device_id = access.sensor_device(sensor_id)
+        if sensor_device_id is None:
+            # User không có quyền: tra sensor chỉ để trả đúng thông báo lỗi
+            sensor = sensors_collection.find_one({"_id": sensor_id}, {"device_id": 1})
             if not sensor:
-                return JSONResponse(
+                return None, JSONResponse(
                     status_code=status.HTTP_200_OK,
                     content={
                         "status": False,
@@ -45,11 +52,9 @@ def get_sensor_data(
                         "data": {"sensor_data": [], "total": 0}
                     }
                 )
-            
-            # Lấy device_id từ sensor
-            sensor_device_id = sensor.get("device_id")
-            if not sensor_device_id:
-                return JSONResponse(
+
+            if not sensor.get("device_id"):
+                return None, JSONResponse(
                     status_code=status.HTTP_200_OK,
                     content={
                         "status": False,
@@ -57,121 +62,165 @@ def get_sensor_data(
                         "data": {"sensor_data": [], "total": 0}
                     }
                 )
-            
-            # Kiểm tra quyền truy cập device
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": str(sensor_device_id)})
-            if not link:
-                return JSONResponse(
-                    status_code=status.HTTP_200_OK,
+
+            return None, JSONResponse(
+                status_code=status.HTTP_200_OK,
+                content={
+                    "status": False,
+                    "message": "Sensor does not belong to any device accessible by this user",
+                    "data": {"sensor_data": [], "total": 0}
+                }
+            )
+
+        # Query theo sensor_id (không cần filter device_id vì đã kiểm tra quyền)
+        query["sensor_ids"] = sensor_id
+
+        # Nếu có device_id được truyền vào và khác với device_id của sensor, báo lỗi
+        if device_id and str(device_id) != str(sensor_device_id):
+            return None, JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={
+                    "status": False,
+                    "message": "Device ID does not match the sensor's device",
+                    "data": None
+                }
+            )
+
+    # Nếu không có sensor_id, kiểm tra quyền truy cập device
+    elif device_id:
+        # Đảm bảo device_id là string
+        device_id = str(device_id)
+        # Kiểm tra device có thuộc về user không
+        if not access.has_device(device_id):
+            return None, JSONResponse(
+                status_code=status.HTTP_200_OK,
+                content={
+                    "status": False,
+                    "message": "Device not linked to this user or not found",
+                    "data": None
+                }
+            )
+        query["device_ids"] = device_id
+
+    # Nếu không có cả sensor_id và device_id, lấy tất cả devices của user
+    else:
+        device_ids = access.device_ids
+
+        if not device_ids:
+            return None, JSONResponse(
+                status_code=status.HTTP_200_OK,
+                content={
+                    "status": True,
+                    "message": "No devices found for this user",
+                    "data": {"sensor_data": [], "total": 0}
+                }
+            )
+        query["device_ids"] = device_ids
+
+    # Filter theo sensor_type
+    if sensor_type:
+        query["sensor_type"] = sensor_type
+
+    # Filter theo thời gian
+    if start_time or end_time:
+        if start_time:
+            try:
+                # Parse UTC time từ frontend
+                start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
+                # Chuyển đổi sang giờ Việt Nam (naive) để so sánh với timestamp trong database
+                start_dt_vietnam = convert_to_vietnam_naive(start_dt)
+                query["start"] = start_dt_vietnam
+            except ValueError:
+                return None, JSONResponse(
+                    status_code=status.HTTP_400_BAD_REQUEST,
                     content={
                         "status": False,
-                        "message": "Sensor does not belong to any device accessible by this user",
-                        "data": {"sensor_data": [], "total": 0}
+                        "message": "Invalid start_time format. Use ISO format (e.g., 2024-01-01T00:00:00Z)",
+                        "data": None
                     }
                 )
-            
-            # Query theo sensor_id (không cần filter device_id vì đã kiểm tra quyền)
-            query["sensor_id"] = sensor_id
-            
-            # Nếu có device_id được truyền vào và khác với device_id của sensor, báo lỗi
-            if device_id and str(device_id) != str(sensor_device_id):
-                return JSONResponse(
+
+        if end_time:
+            try:
+                # Parse UTC time từ frontend
+                end_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
+                # Chuyển đổi sang giờ Việt Nam (naive) để so sánh với timestamp trong database
+                end_dt_vietnam = convert_to_vietnam_naive(end_dt)
+                query["end"] = end_dt_vietnam
+            except ValueError:
+                return None, JSONResponse(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     content={
                         "status": False,
-                        "message": "Device ID does not match the sensor's device",
+                        "message": "Invalid end_time format. Use ISO format (e.g., 2024-01-01T23:59:59Z)",
                         "data": None
                     }
                 )
-        
-        # Nếu không có sensor_id, kiểm tra quyền truy cập device
-        elif device_id:
-            # Đảm bảo device_id là string
-            device_id = str(device_id)
-            # Kiểm tra device có thuộc về user không
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+
+    return query, None
+
+
+def get_sensor_data(
+    user_data: dict,
+    device_id: Optional[str] = None,
+    sensor_id: Optional[str] = None,
+    sensor_type: Optional[str] = None,
+    limit: int = 100,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    cursor: Optional[str] = None,
+    total: str = "exact"
+):
+    """
+    Lấy dữ liệu sensor từ database, mới nhất trước, phân trang bằng cursor
+
+    - cursor: next_cursor của trang trước (None là trang đầu)
+    - total: "exact" (count_documents, mặc định), "estimate" (xấp xỉ từ rollup, thiếu phần lịch sử
+      chưa được backfill) hoặc "none" (không đếm)
+    """
+    try:
+        user_id = str(user_data["_id"])
+
+        after = None
+        if cursor:
+            try:
+                after = decode_cursor(cursor)
+            except ValueError:
                 return JSONResponse(
-                    status_code=status.HTTP_200_OK,
+                    status_code=status.HTTP_400_BAD_REQUEST,
                     content={
                         "status": False,
-                        "message": "Device not linked to this user or not found",
+                        "message": "Invalid cursor",
                         "data": None
                     }
                 )
-            query["device_id"] = device_id
-        
-        # Nếu không có cả sensor_id và device_id, lấy tất cả devices của user
-        else:
-            linked_devices = user_room_devices_collection.find({"user_id": user_id})
-            device_ids = list(set([link["device_id"] for link in linked_devices]))  # Loại bỏ duplicate
-            
-            if not device_ids:
-                return JSONResponse(
-                    status_code=status.HTTP_200_OK,
-                    content={
-                        "status": True,
-                        "message": "No devices found for this user",
-                        "data": {"sensor_data": [], "total": 0}
-                    }
-                )
-            query["device_id"] = {"$in": device_ids}
-        
-        # Filter theo sensor_type
-        if sensor_type:
-            query["sensor_type"] = sensor_type
-        
-        # Filter theo thời gian
-        if start_time or end_time:
-            time_query = {}
-            if start_time:
-                try:
-                    # Parse UTC time từ frontend
-                    start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                    # Chuyển đổi sang giờ Việt Nam (naive) để so sánh với timestamp trong database
-                    start_dt_vietnam = convert_to_vietnam_naive(start_dt)
-                    time_query["$gte"] = start_dt_vietnam
-                except ValueError:
-                    return JSONResponse(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        content={
-                            "status": False,
-                            "message": "Invalid start_time format. Use ISO format (e.g., 2024-01-01T00:00:00Z)",
-                            "data": None
-                        }
-                    )
-            
-            if end_time:
-                try:
-                    # Parse UTC time từ frontend
-                    end_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                    # Chuyển đổi sang giờ Việt Nam (naive) để so sánh với timestamp trong database
-                    end_dt_vietnam = convert_to_vietnam_naive(end_dt)
-                    time_query["$lte"] = end_dt_vietnam
-                except ValueError:
-                    return JSONResponse(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        content={
-                            "status": False,
-                            "message": "Invalid end_time format. Use ISO format (e.g., 2024-01-01T23:59:59Z)",
-                            "data": None
-                        }
-                    )
-            
-            if time_query:
-                query["timestamp"] = time_query
         
-        # Lấy dữ liệu từ database, sắp xếp theo timestamp giảm dần (mới nhất trước)
-        cursor = sensor_data_collection.find(query).sort("timestamp", -1).limit(limit)
-        sensor_data_list = list(cursor)
+        query, error_response = _build_sensor_data_query(user_id, device_id, sensor_id, sensor_type, start_time, end_time)
+        if error_response is not None:
+            return error_response
+
+        # Lấy dữ liệu từ database, sắp xếp theo timestamp giảm dần (mới nhất trước);
+        # lấy thêm một record để biết còn trang sau hay không
+        sensor_data_list = sensor_data_store.find(**query, sort_direction=-1, limit=limit + 1, after=after)
+        next_cursor = None
+        if len(sensor_data_list) > limit:
+            sensor_data_list = sensor_data_list[:limit]
+            next_cursor = encode_cursor(sensor_data_list[-1])
         
         # Convert ObjectId và datetime
         for item in sensor_data_list:
             if "_id" in item:
                 item["_id"] = str(item["_id"])
         
-        # Đếm tổng số records (không giới hạn)
-        total_count = sensor_data_collection.count_documents(query)
+        # Tổng số records của bộ lọc (không phụ thuộc cursor)
+        total_count = None
+        if total == "estimate":
+            total_count = sensor_rollups.estimate_count(**query)
+            if total_count is None:
+                # Rollup bị tắt: không có nguồn xấp xỉ
+                total = "exact"
+        if total == "exact":
+            total_count = sensor_data_store.count(**query)
         
         return JSONResponse(
             status_code=status.HTTP_200_OK,
@@ -181,8 +230,10 @@ def get_sensor_data(
                 "data": {
                     "sensor_data": sanitize_for_json(sensor_data_list),
                     "total": total_count,
+                    "total_mode": total,
                     "returned": len(sensor_data_list),
-                    "limit": limit
+                    "limit": limit,
+                    "next_cursor": next_cursor
                 }
             }
         )
@@ -198,6 +249,48 @@ def get_sensor_data(
         )
 
 
+def export_sensor_data(
+    user_data: dict,
+    device_id: Optional[str] = None,
+    sensor_id: Optional[str] = None,
+    sensor_type: Optional[str] = None,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    export_format: str = "ndjson",
+    compress: bool = True
+):
+    """
+    Xuất toàn bộ reading theo bộ lọc (cùng kiểm tra quyền như get_sensor_data) dạng luồng
+    NDJSON / CSV, cũ nhất trước
+    """
+    try:
+        user_id = str(user_data["_id"])
+        query, error_response = _build_sensor_data_query(user_id, device_id, sensor_id, sensor_type, start_time, end_time)
+        if error_response is not None:
+            return error_response
+
+        readings = sensor_data_store.stream(**query, batch_size=SENSOR_EXPORT_BATCH_SIZE)
+        filename = f"sensor_data_{get_vietnam_now_naive().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+        headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+        return StreamingResponse(
+            export_stream(readings, export_format, compress),
+            media_type=MEDIA_TYPES[export_format],
+            headers=headers
+        )
+
+    except Exception as e:
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={
+                "status": False,
+                "message": f"Unexpected error: {str(e)}",
+                "data": None
+            }
+        )
+
+
 def get_latest_sensor_data(
     user_data: dict,
     device_id: Optional[str] = None,
@@ -208,16 +301,16 @@ def get_latest_sensor_data(
     """
     try:
         user_id = str(user_data["_id"])
+        access = access_control.get(user_id)
         
         query = {}
         
-        # Kiểm tra quyền truy cập device từ bảng user_room_devices
+        # Kiểm tra quyền truy cập device từ chỉ mục quyền của user
         if device_id:
             # Đảm bảo device_id là string
             device_id = str(device_id)
             # Kiểm tra device thuộc về user
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+            if not access.has_device(device_id):
                 return JSONResponse(
                     status_code=status.HTTP_200_OK,
                     content={
@@ -238,8 +331,7 @@ def get_latest_sensor_data(
                 )
             
             # Có device_id cụ thể, lấy sensors của device này
-            device_sensors = list(sensors_collection.find({"device_id": device_id}))
-            sensor_ids = [s["_id"] for s in device_sensors]
+            sensor_ids = access.sensor_ids(device_id)
             
             if sensor_id:
                 # Kiểm tra sensor_id có thuộc device không
@@ -256,7 +348,7 @@ def get_latest_sensor_data(
             else:
                 # Query theo sensor_id (vì sensor_data có thể không có device_id)
                 if sensor_ids:
-                    query["sensor_id"] = {"$in": sensor_ids}
+                    query["sensor_id"] = sensor_ids
                 else:
                     return JSONResponse(
                         status_code=status.HTTP_200_OK,
@@ -267,9 +359,8 @@ def get_latest_sensor_data(
                         }
                     )
         else:
-            # Lấy tất cả devices của user từ bảng user_room_devices
-            linked_devices = user_room_devices_collection.find({"user_id": user_id})
-            device_ids = list(set([link["device_id"] for link in linked_devices]))  # Loại bỏ duplicate
+            # Lấy tất cả devices của user
+            device_ids = access.device_ids
             
             if not device_ids:
                 return JSONResponse(
@@ -283,8 +374,7 @@ def get_latest_sensor_data(
             
             # Lấy tất cả sensors của các devices này
             # Query sensor_data qua sensor_id (vì sensor_data cũ có thể không có device_id)
-            user_sensors = list(sensors_collection.find({"device_id": {"$in": device_ids}}))
-            sensor_ids = [s["_id"] for s in user_sensors]
+            sensor_ids = access.sensor_ids()
             
             if not sensor_ids:
                 return JSONResponse(
@@ -310,25 +400,15 @@ def get_latest_sensor_data(
                     )
                 query["sensor_id"] = sensor_id
             else:
-                query["sensor_id"] = {"$in": sensor_ids}
-        
-        # Lấy dữ liệu mới nhất cho mỗi sensor
-        # Nếu query có device_id, dùng trực tiếp
-        # Nếu không, query qua sensor_id (đã filter ở trên)
-        pipeline = [
-            {"$match": query},
-            {"$sort": {"timestamp": -1}},
-            {
-                "$group": {
-                    "_id": "$sensor_id",
-                    "latest_data": {"$first": "$$ROOT"}
-                }
-            },
-            {"$replaceRoot": {"newRoot": "$latest_data"}},
-            {"$sort": {"timestamp": -1}}
-        ]
-        
-        sensor_data_list = list(sensor_data_collection.aggregate(pipeline))
+                query["sensor_id"] = sensor_ids
+        
+        # Lấy dữ liệu mới nhất cho mỗi sensor (query qua sensor_id đã filter ở trên)
+        latest_ids = [query["sensor_id"]] if isinstance(query["sensor_id"], str) else query["sensor_id"]
+        sensor_data_list = sorted(
+            sensor_latest.get_many(latest_ids).values(),
+            key=lambda item: item.get("timestamp") or datetime.min,
+            reverse=True
+        )
         
         # Convert ObjectId
         for item in sensor_data_list:
@@ -371,6 +451,7 @@ def get_sensor_statistics(
     """
     try:
         user_id = str(user_data["_id"])
+        access = access_control.get(user_id)
         
         query = {}
         
@@ -378,8 +459,7 @@ def get_sensor_statistics(
         if device_id:
             # Đảm bảo device_id là string
             device_id = str(device_id)
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+            if not access.has_device(device_id):
                 return JSONResponse(
                     status_code=status.HTTP_200_OK,
                     content={
@@ -388,10 +468,9 @@ def get_sensor_statistics(
                         "data": None
                     }
                 )
-            query["device_id"] = device_id
+            query["device_ids"] = device_id
         else:
-            linked_devices = user_room_devices_collection.find({"user_id": user_id})
-            device_ids = list(set([link["device_id"] for link in linked_devices]))  # Loại bỏ duplicate
+            device_ids = access.device_ids
             
             if not device_ids:
                 return JSONResponse(
@@ -402,21 +481,20 @@ def get_sensor_statistics(
                         "data": {"statistics": []}
                     }
                 )
-            query["device_id"] = {"$in": device_ids}
+            query["device_ids"] = device_ids
         
         if sensor_id:
-            query["sensor_id"] = sensor_id
+            query["sensor_ids"] = sensor_id
         
         if sensor_type:
             query["sensor_type"] = sensor_type
         
         # Filter theo thời gian
         if start_time or end_time:
-            time_query = {}
             if start_time:
                 try:
                     start_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                    time_query["$gte"] = start_dt
+                    query["start"] = convert_to_vietnam_naive(start_dt)
                 except ValueError:
                     return JSONResponse(
                         status_code=status.HTTP_400_BAD_REQUEST,
@@ -430,7 +508,7 @@ def get_sensor_statistics(
             if end_time:
                 try:
                     end_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                    time_query["$lte"] = end_dt
+                    query["end"] = convert_to_vietnam_naive(end_dt)
                 except ValueError:
                     return JSONResponse(
                         status_code=status.HTTP_400_BAD_REQUEST,
@@ -440,45 +518,9 @@ def get_sensor_statistics(
                             "data": None
                         }
                     )
-            
-            if time_query:
-                query["timestamp"] = time_query
         
-        # Tính toán thống kê
-        pipeline = [
-            {"$match": query},
-            {
-                "$group": {
-                    "_id": {
-                        "sensor_id": "$sensor_id",
-                        "sensor_type": "$sensor_type",
-                        "device_id": "$device_id"
-                    },
-                    "count": {"$sum": 1},
-                    "min_value": {"$min": "$value"},
-                    "max_value": {"$max": "$value"},
-                    "avg_value": {"$avg": "$value"},
-                    "latest_timestamp": {"$max": "$timestamp"},
-                    "earliest_timestamp": {"$min": "$timestamp"}
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "sensor_id": "$_id.sensor_id",
-                    "sensor_type": "$_id.sensor_type",
-                    "device_id": "$_id.device_id",
-                    "count": 1,
-                    "min_value": {"$round": ["$min_value", 2]},
-                    "max_value": {"$round": ["$max_value", 2]},
-                    "avg_value": {"$round": ["$avg_value", 2]},
-                    "latest_timestamp": 1,
-                    "earliest_timestamp": 1
-                }
-            }
-        ]
-        
-        statistics = list(sensor_data_collection.aggregate(pipeline))
+        # Tính toán thống kê từ rollup ngày / giờ / phút, phần lẻ hai đầu đọc từ dữ liệu raw
+        statistics = sensor_rollups.statistics(**query)
         
         return JSONResponse(
             status_code=status.HTTP_200_OK,
@@ -503,16 +545,60 @@ def get_sensor_statistics(
         )
 
 
+def _legacy_trend_type(sensor_type: str) -> Optional[str]:
+    """Key cũ (temperature / humidity / energy) tương ứng với tên loại sensor, None nếu không có"""
+    if "temp" in sensor_type:
+        return "temperature"
+    if "humid" in sensor_type:
+        return "humidity"
+    if "energy" in sensor_type or "power" in sensor_type:
+        return "energy"
+    return None
+
+
+def _merge_trend_point(points: Dict[datetime, Dict], point: Dict):
+    """Cộng điểm vào khoảng cùng timestamp: value là trung bình theo count, min / max gộp"""
+    merged = points.get(point["timestamp"])
+    if merged is None:
+        points[point["timestamp"]] = dict(point)
+        return
+    count = merged["count"] + point["count"]
+    merged["value"] = (merged["value"] * merged["count"] + point["value"] * point["count"]) / count
+    merged["count"] = count
+    merged["min"] = min(merged["min"], point["min"])
+    merged["max"] = max(merged["max"], point["max"])
+
+
+def _format_trend_points(type_points: List[Dict], method: str, limit_per_type: int) -> List[Dict]:
+    """Giảm còn tối đa limit_per_type điểm (LTTB hoặc các khoảng mới nhất) rồi format cho chart"""
+    if method == "lttb":
+        type_points = lttb(type_points, limit_per_type)
+    else:
+        type_points = type_points[-limit_per_type:]
+    return [
+        {
+            "time": point["timestamp"].strftime("%H:%M"),
+            "timestamp": point["timestamp"].isoformat(),
+            "value": round(point["value"], 2),
+            "min": round(point["min"], 2),
+            "max": round(point["max"], 2)
+        }
+        for point in type_points
+    ]
+
+
 def get_sensor_trends(
     user_data: dict,
     device_id: Optional[str] = None,
     room: Optional[str] = None,
     hours: int = 24,
-    limit_per_type: int = 100
+    limit_per_type: int = 100,
+    method: str = "minmax"
 ):
     """
     Lấy dữ liệu trends đã được format sẵn cho charts
-    Trả về dữ liệu theo sensor type: temperature, humidity, energy
+    Trả về dữ liệu theo từng sensor type trong "series", kèm các key temperature, humidity, energy
+    - method: minmax (min / max / trung bình theo khoảng) hoặc lttb
     
     - device_id: Nếu có, chỉ lấy dữ liệu của device này
     - room: Nếu có (và không có device_id), lấy dữ liệu của tất cả devices trong phòng
@@ -520,21 +606,19 @@ def get_sensor_trends(
     """
     try:
         user_id = str(user_data["_id"])
+        access = access_control.get(user_id)
         
         # Tính thời gian bắt đầu
         start_time = get_vietnam_now_naive() - timedelta(hours=hours)
         
         # Xây dựng query filter
-        query = {
-            "timestamp": {"$gte": start_time}
-        }
+        query = {"start": start_time}
         
         # Kiểm tra quyền truy cập device
         # Ưu tiên device_id trước, sau đó mới đến room
         if device_id:
             # Chỉ lấy dữ liệu của device này
-            link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": device_id})
-            if not link:
+            if not access.has_device(device_id):
                 return JSONResponse(
                     status_code=status.HTTP_200_OK,
                     content={
@@ -543,7 +627,7 @@ def get_sensor_trends(
                         "data": None
                     }
                 )
-            query["device_id"] = device_id
+            query["device_ids"] = device_id
         elif room:
             # Lấy tất cả devices trong phòng này từ user_room_devices
             # Tìm room theo tên
@@ -563,12 +647,8 @@ def get_sensor_trends(
                     }
                 )
             
-            # Lấy devices trong phòng từ user_room_devices
-            linked_devices = user_room_devices_collection.find({
-                "user_id": user_id,
-                "room_id": room_obj["_id"]
-            })
-            device_ids_in_room = [link["device_id"] for link in linked_devices if link.get("device_id")]
+            # Lấy devices trong phòng từ chỉ mục quyền của user
+            device_ids_in_room = access.room_device_ids(room_obj["_id"])
             
             if not device_ids_in_room:
                 return JSONResponse(
@@ -584,11 +664,10 @@ def get_sensor_trends(
                     }
                 )
             
-            query["device_id"] = {"$in": device_ids_in_room}
+            query["device_ids"] = device_ids_in_room
         else:
             # Lấy tất cả devices của user
-            linked_devices = user_room_devices_collection.find({"user_id": user_id})
-            device_ids = list(set([link["device_id"] for link in linked_devices if link.get("device_id")]))  # Loại bỏ duplicate
+            device_ids = access.device_ids
             
             if not device_ids:
                 return JSONResponse(
@@ -603,75 +682,65 @@ def get_sensor_trends(
                         }
                     }
                 )
-            query["device_id"] = {"$in": device_ids}
-        
-        # Lấy dữ liệu sensor
-        cursor = sensor_data_collection.find(query).sort("timestamp", 1)  # Sort tăng dần theo thời gian
-        sensor_data_list = list(cursor)
-        
-        # Group và format dữ liệu theo sensor type
-        temperature_data: List[Dict] = []
-        humidity_data: List[Dict] = []
-        energy_data: List[Dict] = []
-        
-        for item in sensor_data_list:
-            sensor_type = (item.get("sensor_type", "") or "").lower()
-            value = item.get("value", 0)
-            timestamp = item.get("timestamp") or item.get("created_at")
-            
-            if not timestamp:
+            query["device_ids"] = device_ids
+        
+        # Mỗi loại sensor trả về tối đa limit_per_type điểm; mỗi điểm là min / max / trung bình
+        # của một khoảng resolution. Với method=lttb, gom mịn hơn TRENDS_LTTB_OVERSAMPLE lần
+        # rồi chọn điểm bằng LTTB để giữ hình dạng đường cong.
+        resolution = timedelta(hours=hours) / limit_per_type
+        if method == "lttb":
+            resolution = resolution / TRENDS_LTTB_OVERSAMPLE
+
+        # Dùng tầng rollup thô nhất có độ phân giải đủ, chỉ duyệt raw khi khoảng thời gian quá ngắn
+        tier = sensor_rollups.choose_tier(start_time, resolution)
+        if tier is not None:
+            points = sensor_rollups.series(tier, **query, resolution=resolution)
+        else:
+            accumulator = BucketAccumulator(start_time, resolution)
+            accumulator.add_readings(sensor_data_store.iter_readings(**query))
+            points = accumulator.points()
+
+        # Group theo sensor type (điểm đã sắp xếp theo thời gian)
+        series: Dict[str, List[Dict]] = {}
+        for point in points:
+            sensor_type = (point.get("sensor_type") or "").lower()
+            if not sensor_type:
                 continue
-            
-            # Format timestamp thành time string (HH:MM)
-            if isinstance(timestamp, datetime):
-                time_str = timestamp.strftime("%H:%M")
-            else:
-                try:
-                    if isinstance(timestamp, str):
-                        timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                    time_str = timestamp.strftime("%H:%M")
-                except:
-                    continue
-            
-            data_point = {
-                "time": time_str,
-                "value": round(float(value), 2)
-            }
-            
-            # Phân loại theo sensor type
-            if "temperature" in sensor_type or "temp" in sensor_type:
-                temperature_data.append(data_point)
-            elif "humidity" in sensor_type or "humid" in sensor_type:
-                humidity_data.append(data_point)
-            elif "energy" in sensor_type or "power" in sensor_type:
-                energy_data.append(data_point)
-        
-        # Giới hạn số lượng điểm dữ liệu cho mỗi type
-        def limit_data(data_list: List[Dict], limit: int) -> List[Dict]:
-            if len(data_list) <= limit:
-                return data_list
-            # Lấy đều các điểm dữ liệu
-            step = len(data_list) // limit
-            return [data_list[i] for i in range(0, len(data_list), step)][:limit]
-        
-        temperature_data = limit_data(temperature_data, limit_per_type)
-        humidity_data = limit_data(humidity_data, limit_per_type)
-        energy_data = limit_data(energy_data, limit_per_type)
-        
+            series.setdefault(sensor_type, []).append(point)
+
+        data = {
+            sensor_type: _format_trend_points(type_points, method, limit_per_type)
+            for sensor_type, type_points in series.items()
+        }
+
+        # Giữ các key temperature / humidity / energy cho frontend: gộp các tên loại tương đương
+        # theo từng khoảng (cùng timestamp, trung bình theo count) trước khi giảm còn limit_per_type điểm
+        legacy = {"temperature": {}, "humidity": {}, "energy": {}}
+        for sensor_type, type_points in series.items():
+            legacy_type = _legacy_trend_type(sensor_type)
+            if legacy_type is None:
+                continue
+            for point in type_points:
+                _merge_trend_point(legacy[legacy_type], point)
+        legacy = {
+            legacy_type: _format_trend_points(
+                sorted(points.values(), key=lambda point: point["timestamp"]), method, limit_per_type
+            )
+            for legacy_type, points in legacy.items()
+        }
+
         return JSONResponse(
             status_code=status.HTTP_200_OK,
             content={
                 "status": True,
                 "message": "Sensor trends retrieved successfully",
                 "data": {
-                    "temperature": sanitize_for_json(temperature_data),
-                    "humidity": sanitize_for_json(humidity_data),
-                    "energy": sanitize_for_json(energy_data),
-                    "count": {
-                        "temperature": len(temperature_data),
-                        "humidity": len(humidity_data),
-                        "energy": len(energy_data)
-                    }
+                    **legacy,
+                    "series": data,
+                    "count": {sensor_type: len(type_points) for sensor_type, type_points in {**data, **legacy}.items()},
+                    "resolution_seconds": resolution.total_seconds(),
+                    "source": tier.name if tier is not None else "raw",
+                    "method": method
                 }
             }
         )
@@ -686,3 +755,92 @@ def get_sensor_trends(
             }
         )
 
+
+
+def get_sensor_statistics_table(
+    user_data: dict,
+    sensor_type: str = "temperature",
+    device_id: Optional[str] = None,
+    days: int = 1
+):
+    """
+    Bảng thống kê min / max / avg / count theo giờ (days = 1) hoặc theo ngày (days > 1)
+    cho một loại sensor, đọc từ rollup giờ / ngày
+    """
+    try:
+        access = access_control.get(user_data["_id"])
+
+        if device_id:
+            device_id = str(device_id)
+            if not access.has_device(device_id):
+                return JSONResponse(
+                    status_code=status.HTTP_200_OK,
+                    content={
+                        "status": False,
+                        "message": "Device not linked to this user or not found",
+                        "data": None
+                    }
+                )
+            device_ids = device_id
+        else:
+            device_ids = access.device_ids
+
+        now = get_vietnam_now_naive()
+        if days == 1:
+            tier = sensor_rollups.get_tier("hour")
+            start = tier.truncate(now) - timedelta(hours=23)
+            display_format = "%H:00"
+        else:
+            tier = sensor_rollups.get_tier("day")
+            start = tier.truncate(now) - timedelta(days=days - 1)
+            display_format = "%d/%m/%Y"
+
+        rows = []
+        if device_ids:
+            rows = sensor_rollups.period_table(tier, device_ids=device_ids, sensor_type=sensor_type, start=start, end=now)
+
+        table_data = [
+            {
+                "time": row["period_start"].isoformat(),
+                "time_display": row["period_start"].strftime(display_format),
+                "min": round(row["min"], 2),
+                "max": round(row["max"], 2),
+                "avg": round(row["sum"] / row["count"], 2),
+                "count": row["count"]
+            }
+            for row in rows if row["count"]
+        ]
+
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content={
+                "status": True,
+                "message": "Sensor statistics table retrieved successfully",
+                "data": {
+                    "sensor_type": sensor_type,
+                    "table_data": table_data,
+                    "days": days,
+                    "start_time": start.isoformat(),
+                    "end_time": now.isoformat()
+                }
+            }
+        )
+
+    except Exception as e:
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={
+                "status": False,
+                "message": f"Unexpected error: {str(e)}",
+                "data": None
+            }
+        )
+
+
+def get_temperature_statistics_table(
+    user_data: dict,
+    device_id: Optional[str] = None,
+    days: int = 1
+):
+    """Bảng thống kê nhiệt độ (giữ cho route /sensor-data/temperature/table)"""
+    return get_sensor_statistics_table(user_data, sensor_type="temperature", device_id=device_id, days=days)
@@ -4,7 +4,20 @@ from fastapi.encoders import jsonable_encoder
 from utils.database import users_collection
 from models.user_models import create_user_dict
 from utils.auth import create_access_token, create_refresh_token, revoke_all_user_refresh_tokens
-import bcrypt
+from utils.user_cache import user_cache
+from utils.password_hasher import password_hasher, PasswordHasherBusy
+
+
+def _password_hasher_busy_response():
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+        content={
+            "status": False,
+            "message": "Server is busy, please try again",
+            "data": None
+        }
+    )
 
 
 # ==========================
@@ -33,9 +46,7 @@ def register_user(user_data):
             )
 
         # Tạo user
-        hashed_pw = bcrypt.hashpw(
-            user_data.password.encode(), bcrypt.gensalt()
-        ).decode()
+        hashed_pw = password_hasher.hash_password(user_data.password)
 
         new_user = create_user_dict(
             full_name=user_data.full_name,
@@ -57,6 +68,9 @@ def register_user(user_data):
             }
         )
 
+    except PasswordHasherBusy:
+        return _password_hasher_busy_response()
+
     except Exception as e:
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -76,7 +90,7 @@ def login_user(user_data):
         # Kiểm tra độ dài password
         if not (8 <= len(user_data.password) <= 30):
             return JSONResponse(
-                status_code=status.HTTP_401_BAD_REQUEST,
+                status_code=status.HTTP_401_UNAUTHORIZED,
                 content={"status": False, "message": "Invalid email or password", "data": None}
             )
 
@@ -89,17 +103,14 @@ def login_user(user_data):
             )
 
         # Kiểm tra password
-        if not bcrypt.checkpw(
-            user_data.password.encode("utf-8"),
-            user["password_hash"].encode("utf-8")
-        ):
+        if not password_hasher.check_password(user_data.password, user["password_hash"]):
             return JSONResponse(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 content={"status": False, "message": "Invalid email or password", "data": None}
             )
 
         # Tạo access token và refresh token
-        access_token = create_access_token({"sub": user["email"]})
+        access_token = create_access_token({"sub": user["email"], "uid": str(user["_id"])})
         refresh_token = create_refresh_token(user["email"])
 
         # Convert dữ liệu user để trả về
@@ -119,6 +130,9 @@ def login_user(user_data):
             })
         )
 
+    except PasswordHasherBusy:
+        return _password_hasher_busy_response()
+
     except Exception as e:
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -191,7 +205,9 @@ def logout_user(current_user=None, refresh_token: str = None):
         if refresh_token:
             from utils.auth import revoke_refresh_token
             try:
-                revoke_refresh_token(refresh_token)
+                user_email = revoke_refresh_token(refresh_token)
+                if user_email:
+                    user_cache.invalidate(user_email)
             except:
                 pass  # Ignore nếu token không hợp lệ
         
@@ -264,7 +280,7 @@ def refresh_access_token(refresh_token: str):
             )
         
         # Tạo access token mới
-        new_access_token = create_access_token({"sub": user_email})
+        new_access_token = create_access_token({"sub": user_email, "uid": str(user["_id"])})
         
         # Tạo refresh token mới (token rotation - tăng cường bảo mật)
         new_refresh_token = create_refresh_token(user_email)
@@ -325,6 +341,7 @@ def change_user_info(payload, current_user):
             )
 
         users_collection.update_one({"email": email}, {"$set": update_data})
+        user_cache.invalidate(email)
         updated_user = users_collection.find_one({"email": email})
 
         updated_user["_id"] = str(updated_user["_id"])
@@ -381,10 +398,7 @@ def change_password(payload, current_user):
             )
 
         # Kiểm tra mật khẩu cũ
-        if not bcrypt.checkpw(
-            payload.old_password.encode("utf-8"),
-            user["password_hash"].encode("utf-8")
-        ):
+        if not password_hasher.check_password(payload.old_password, user["password_hash"]):
             return JSONResponse(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 content={
@@ -395,10 +409,7 @@ def change_password(payload, current_user):
             )
 
         # Kiểm tra mật khẩu mới không được trùng với mật khẩu cũ
-        if bcrypt.checkpw(
-            payload.new_password.encode("utf-8"),
-            user["password_hash"].encode("utf-8")
-        ):
+        if password_hasher.check_password(payload.new_password, user["password_hash"]):
             return JSONResponse(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 content={
@@ -409,15 +420,14 @@ def change_password(payload, current_user):
             )
 
         # Hash mật khẩu mới
-        new_password_hash = bcrypt.hashpw(
-            payload.new_password.encode(), bcrypt.gensalt()
-        ).decode()
+        new_password_hash = password_hasher.hash_password(payload.new_password)
 
         # Cập nhật mật khẩu
         users_collection.update_one(
             {"email": email},
             {"$set": {"password_hash": new_password_hash}}
         )
+        user_cache.invalidate(email)
 
         return JSONResponse(
             status_code=200,
@@ -428,6 +438,9 @@ def change_password(payload, current_user):
             }
         )
 
+    except PasswordHasherBusy:
+        return _password_hasher_busy_response()
+
     except Exception as e:
         return JSONResponse(
             status_code=500,
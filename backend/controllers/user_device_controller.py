@@ -3,6 +3,10 @@ from fastapi.responses import JSONResponse
 from utils.database import devices_collection, user_room_devices_collection, rooms_collection, sanitize_for_json
 from models.user_room_device_models import create_user_room_device_dict
 from utils.mqtt_client import mqtt_client
+from utils.metadata_cache import metadata_cache
+from utils.threshold_engine import threshold_engine
+from utils.access_control import access_control
+from utils.room_summary import room_summary
 from datetime import datetime
 from utils.timezone import get_vietnam_now_naive
 import logging
@@ -116,12 +120,15 @@ def add_device(user_data: dict, device_id: str, device_password: str = None, dev
                     {"user_id": user_id, "device_id": device_id},
                     {"$set": {"room_id": room_id, "updated_at": get_vietnam_now_naive()}}
                 )
-                pass
-            else:
-                pass
+                threshold_engine.invalidate_device_users(device_id)
+                access_control.invalidate_user(user_id)
+                room_summary.refresh_device(device_id)
         else:
             user_room_device = create_user_room_device_dict(user_id, device_id, room_id=room_id)
             user_room_devices_collection.insert_one(user_room_device)
+            threshold_engine.invalidate_device_users(device_id)
+            access_control.invalidate_user(user_id)
+            room_summary.refresh_device(device_id)
 
         response_data = {
             "device_id": device_id,
@@ -164,8 +171,7 @@ def get_info_device(user_data: dict, id_device: str):
         id_device = str(id_device)
 
         # Tìm liên kết
-        link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": id_device})
-        if not link:
+        if not access_control.can_access_device(user_id, id_device):
             return {
                 "status": False,
                 "message": "Device not linked to this user",
@@ -211,9 +217,9 @@ def get_all_device(user_data: dict):
     try:
         user_id = str(user_data["_id"])
 
-        # Lấy danh sách device_ids từ bảng user_room_devices (cấu trúc mới)
-        linked_devices = list(user_room_devices_collection.find({"user_id": user_id}))
-        device_ids = list(set([str(link["device_id"]) for link in linked_devices if "device_id" in link and link["device_id"]]))  # Loại bỏ duplicate và đảm bảo là string
+        # Lấy danh sách device_ids từ chỉ mục quyền của user (bảng user_room_devices)
+        access = access_control.get(user_id)
+        device_ids = access.device_ids
 
         if not device_ids:
             return JSONResponse(
@@ -228,19 +234,8 @@ def get_all_device(user_data: dict):
         # Lấy detailed info từ devices_collection (sử dụng _id thay vì device_id)
         devices = list(devices_collection.find({"_id": {"$in": device_ids}}))
 
-        # Tạo mapping từ device_id -> room_id từ linked_devices
-        # Ưu tiên link có room_id (không phải None) nếu có nhiều links cho cùng một device
-        device_room_map = {}
-        for link in linked_devices:
-            device_id = link.get("device_id")
-            room_id = link.get("room_id")
-            if device_id:
-                # Nếu device chưa có trong map, thêm vào
-                if device_id not in device_room_map:
-                    device_room_map[device_id] = room_id
-                # Nếu đã có nhưng room_id hiện tại là None và link mới có room_id, cập nhật
-                elif device_room_map[device_id] is None and room_id is not None:
-                    device_room_map[device_id] = room_id
+        # Mapping device_id -> room_id (chỉ mục đã ưu tiên link có room_id nếu có nhiều links)
+        device_room_map = access.device_rooms
 
         # Lấy thông tin room cho các room_id không phải None
         room_ids = list(set([room_id for room_id in device_room_map.values() if room_id is not None]))
@@ -315,8 +310,7 @@ def update_device(user_data: dict, id_device: str, update_data: dict):
         id_device = str(id_device)
         
         # Kiểm tra quyền sở hữu - chỉ người đã liên kết với thiết bị mới có thể cập nhật
-        link = user_room_devices_collection.find_one({"user_id": user_id, "device_id": id_device})
-        if not link:
+        if not access_control.can_access_device(user_id, id_device):
             return JSONResponse(
                 status_code=status.HTTP_200_OK,
                 content={
@@ -391,6 +385,9 @@ def update_device(user_data: dict, id_device: str, update_data: dict):
                 user_room_device = create_user_room_device_dict(user_id, id_device, room_id=room_id_to_set)
                 user_room_devices_collection.insert_one(user_room_device)
                 logger.info(f" Created user-room-device link: user={user_id}, device={id_device}, room_id={room_id_to_set}")
+            threshold_engine.invalidate_device_users(id_device)
+            access_control.invalidate_user(user_id)
+            room_summary.refresh_device(id_device)
             
             location_updated = True
         
@@ -436,6 +433,7 @@ def update_device(user_data: dict, id_device: str, update_data: dict):
             {"_id": id_device},
             {"$set": update_fields}
         )
+        metadata_cache.invalidate_device(id_device)
 
         # Nếu cloud_status thay đổi, gửi command qua MQTT đến thiết bị
         if new_cloud_status is not None and new_cloud_status != old_cloud_status:
@@ -1,9 +1,27 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
-from routes import user_routes, user_device_router, sensor_data_router, room_router, iot_device_router, device_router, sensor_router, actuator_router, notification_router
+from routes import user_routes, user_device_router, sensor_data_router, room_router, iot_device_router, device_router, sensor_router, actuator_router, notification_router, events_router
 from utils.mqtt_client import mqtt_client
+from utils.ingest_buffer import sensor_data_buffer
+from utils.circuit_breaker import STATE_CLOSED
+from utils.auth import get_current_user
+from utils.device_presence import device_presence
+from utils.mqtt_workers import mqtt_workers
+from utils.message_dedup import message_filter
+from utils.threshold_engine import threshold_engine
+from utils.user_cache import user_cache
+from utils.access_control import access_control
+from utils.password_hasher import password_hasher
+from utils.indexes import apply_indexes
+from utils.retention import retention_manager
+from utils.sensor_rollups import sensor_rollups
+from utils.sensor_latest import sensor_latest
+from utils.room_summary import room_summary
+from utils.live_events import live_events
+from utils.db_executor import run_db, get_stats as get_db_pool_stats
+from utils.database import db
 import logging
 import os
 import asyncio
@@ -42,6 +60,7 @@ app.include_router(device_router.router)
 app.include_router(sensor_router.router)
 app.include_router(actuator_router.router)
 app.include_router(notification_router.router)
+app.include_router(events_router.router)
 
 static_dir = Path(__file__).parent / "static"
 if static_dir.exists() and (static_dir / "index.html").exists():
@@ -76,12 +95,52 @@ def root():
 def health_check():
     return {"status": "hoạt động bình thường"}
 
+@app.get("/health/ingest")
+def ingest_health_check():
+    """
+    Trạng thái tóm tắt của pipeline ingest cho probe (không cần đăng nhập): "ok" hoặc
+    "degraded" khi thread ghi dừng, circuit breaker không đóng hoặc hàng đợi đã đầy.
+    Số liệu chi tiết ở /health/ingest/details (cần access token)
+    """
+    buffer = sensor_data_buffer.get_stats()
+    degraded = (
+        not buffer["running"]
+        or buffer["circuit"]["state"] != STATE_CLOSED
+        or buffer["queue_depth"] >= buffer["max_queue"]
+        or not mqtt_workers.get_stats()["running"]
+    )
+    return {"status": "degraded" if degraded else "ok"}
+
+@app.get("/health/ingest/details")
+def ingest_health_details(current_user: dict = Depends(get_current_user)):
+    """Số liệu nội bộ của pipeline ingest: bộ đệm ghi sensor data, worker pool MQTT, bảng last_seen"""
+    return {
+        "status": True,
+        "message": "Trạng thái ingest pipeline",
+        "data": {
+            "buffer": sensor_data_buffer.get_stats(),
+            "workers": mqtt_workers.get_stats(),
+            "presence": device_presence.get_stats(),
+            "dedup": message_filter.get_stats(),
+            "thresholds": threshold_engine.get_stats(),
+            "retention": retention_manager.get_stats(),
+            "rollups": sensor_rollups.get_stats(),
+            "latest": sensor_latest.get_stats(),
+            "room_summaries": room_summary.get_stats(),
+            "live": live_events.get_stats(),
+            "db_pool": get_db_pool_stats(),
+            "auth_users": user_cache.get_stats(),
+            "access": access_control.get_stats(),
+            "password_hasher": password_hasher.get_stats()
+        }
+    }
+
 async def check_offline_devices_periodically():
     """Chạy định kỳ để kiểm tra và cập nhật trạng thái offline cho devices"""
     while True:
         try:
             await asyncio.sleep(60)
-            mqtt_client.check_and_update_offline_devices(timeout_minutes=5)
+            await run_db(mqtt_client.check_and_update_offline_devices, timeout_minutes=5)
         except Exception as e:
             logger.error(f"Lỗi trong background task kiểm tra offline devices: {str(e)}")
             import traceback
@@ -92,6 +151,13 @@ async def check_offline_devices_periodically():
 async def startup_event():
     logger.info("Đang khởi động IoT Backend API...")
     try:
+        apply_indexes(db)
+    except Exception as e:
+        logger.error(f"Lỗi tạo index MongoDB: {str(e)}")
+    try:
+        sensor_data_buffer.start()
+        device_presence.start()
+        retention_manager.start()
         mqtt_client.connect()
         asyncio.create_task(check_offline_devices_periodically())
     except Exception as e:
@@ -104,3 +170,10 @@ async def shutdown_event():
         mqtt_client.disconnect()
     except Exception as e:
         logger.error(f"Lỗi ngắt kết nối MQTT client: {str(e)}")
+    try:
+        # Xả hết dữ liệu sensor còn trong bộ đệm trước khi tắt
+        sensor_data_buffer.stop()
+        device_presence.stop()
+        retention_manager.stop()
+    except Exception as e:
+        logger.error(f"Lỗi xả ingest buffer: {str(e)}")
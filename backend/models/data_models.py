@@ -3,16 +3,29 @@ import uuid
 from utils.timezone import get_vietnam_now_naive
 
 
-def create_sensor_data_dict(sensor_id: str, value: float, timestamp: datetime = None, device_id: str = None) -> dict:
+def create_sensor_data_dict(
+    sensor_id: str,
+    value: float,
+    timestamp: datetime = None,
+    device_id: str = None,
+    sensor_type: str = None,
+    unit: str = None,
+    room_id: str = None
+) -> dict:
     """
     Tạo dict SensorData
     {
       "sensor_data_id": "uuid",
       "sensor_id": "sensor_01",
       "device_id": "device_01",
+      "sensor_type": "temperature",
+      "unit": "°C",
+      "room_id": "room_01",
       "value": 30,
       "timestamp": "2025-12-21T09:30:00Z"
     }
+    sensor_type / unit / room_id được sao chép từ metadata sensor lúc ingest để truy vấn
+    thống kê lọc và nhóm trực tiếp mà không cần join với sensors
     """
     sensor_data = {
         "sensor_data_id": str(uuid.uuid4()),
@@ -23,4 +36,10 @@ def create_sensor_data_dict(sensor_id: str, value: float, timestamp: datetime =
     }
     if device_id:
         sensor_data["device_id"] = device_id
+    if sensor_type:
+        sensor_data["sensor_type"] = sensor_type
+    if unit:
+        sensor_data["unit"] = unit
+    if room_id:
+        sensor_data["room_id"] = room_id
     return sensor_data
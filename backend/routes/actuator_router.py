@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends
 from controllers import actuator_controller
+from utils.db_executor import run_db
 from schemas.actuator_schemas import *
 from utils.auth import get_current_user
 
@@ -16,7 +17,7 @@ async def control_actuator_route(actuator_id: str, payload: ActuatorControl, cur
     }
     """
     user_id = str(current_user["_id"])
-    return actuator_controller.control_actuator(actuator_id, payload.state, user_id)
+    return await run_db(actuator_controller.control_actuator, actuator_id, payload.state, user_id)
 
 
 @router.post("/{actuator_id}/update", response_model=ResponseSchema)
@@ -31,7 +32,8 @@ async def update_actuator_route(actuator_id: str, payload: ActuatorUpdate, curre
     }
     """
     user_id = str(current_user["_id"])
-    return actuator_controller.update_actuator(
+    return await run_db(
+        actuator_controller.update_actuator,
         actuator_id, 
         payload.name, 
         payload.pin, 
@@ -44,4 +46,4 @@ async def update_actuator_route(actuator_id: str, payload: ActuatorUpdate, curre
 async def get_actuators_by_device_route(device_id: str, current_user: dict = Depends(get_current_user)):
     """Lấy danh sách actuator theo thiết bị của user"""
     user_id = str(current_user["_id"])
-    return actuator_controller.get_actuators_by_device(device_id, user_id)
+    return await run_db(actuator_controller.get_actuators_by_device, device_id, user_id)
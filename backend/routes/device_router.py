@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends
 from controllers import device_controller
+from utils.db_executor import run_db
 from schemas.device_schemas import *
 from utils.auth import get_current_user
 
@@ -13,7 +14,7 @@ async def get_all_devices_route(current_user: dict = Depends(get_current_user)):
     Trả về danh sách thiết bị kèm thông tin room (nếu có)
     """
     user_id = str(current_user["_id"])
-    return device_controller.get_all_devices(user_id)
+    return await run_db(device_controller.get_all_devices, user_id)
 
 
 @router.post("/{device_id}/power", response_model=ResponseSchema)
@@ -26,32 +27,32 @@ async def control_device_power_route(device_id: str, payload: DevicePowerControl
     }
     """
     user_id = str(current_user["_id"])
-    return device_controller.control_device_power(device_id, payload.enabled, user_id)
+    return await run_db(device_controller.control_device_power, device_id, payload.enabled, user_id)
 
 
 @router.get("/{device_id}", response_model=ResponseSchema)
 async def get_device_route(device_id: str, current_user: dict = Depends(get_current_user)):
     """Lấy thông tin thiết bị của user"""
     user_id = str(current_user["_id"])
-    return device_controller.get_device(device_id, user_id)
+    return await run_db(device_controller.get_device, device_id, user_id)
 
 
 @router.get("/{device_id}/detail", response_model=ResponseSchema)
 async def get_device_detail_route(device_id: str, current_user: dict = Depends(get_current_user)):
     """Lấy thông tin chi tiết thiết bị kèm sensors và actuators"""
     user_id = str(current_user["_id"])
-    return device_controller.get_device_detail(device_id, user_id)
+    return await run_db(device_controller.get_device_detail, device_id, user_id)
 
 
 @router.get("/room/{room_id}", response_model=ResponseSchema)
 async def get_devices_by_room_route(room_id: str, current_user: dict = Depends(get_current_user)):
     """Lấy danh sách thiết bị theo phòng của user"""
     user_id = str(current_user["_id"])
-    return device_controller.get_devices_by_room(room_id, user_id)
+    return await run_db(device_controller.get_devices_by_room, room_id, user_id)
 
 
 @router.delete("/{device_id}", response_model=ResponseSchema)
 async def delete_device_route(device_id: str, current_user: dict = Depends(get_current_user)):
     """Xóa liên kết thiết bị khỏi user (chỉ xóa trong bảng user_room_devices, không xóa thiết bị)"""
     user_id = str(current_user["_id"])
-    return device_controller.delete_device(device_id, user_id)
+    return await run_db(device_controller.delete_device, device_id, user_id)
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, Request
+from controllers import events_controller
+from utils.db_executor import run_db
+from schemas.sensor_schemas import ResponseSchema
+from utils.auth import get_current_session, get_stream_session
+
+router = APIRouter(prefix="/events", tags=["Events"])
+
+
+@router.post("/ticket", response_model=ResponseSchema)
+async def create_stream_ticket_route(session: dict = Depends(get_current_session)):
+    """
+    Cấp ticket dùng một lần để mở luồng sự kiện
+    POST /events/ticket  (header Authorization: Bearer)
+    """
+    return await run_db(events_controller.create_ticket, session)
+
+
+@router.get("/stream")
+async def stream_events_route(
+    request: Request,
+    session: dict = Depends(get_stream_session)
+):
+    """
+    Luồng sự kiện thời gian thực (text/event-stream) thay cho polling
+    GET /events/stream?ticket=<ticket từ POST /events/ticket>  (hoặc header Authorization: Bearer)
+
+    Sự kiện: reading, device_status, actuator, notification; "overflow" khi client đọc
+    chậm và đã bị bỏ bớt sự kiện (nên tải lại dữ liệu); "close" trước khi server đóng luồng
+    vì token hết hạn, đăng xuất hoặc mất liên kết device (lấy ticket mới rồi kết nối lại)
+    """
+    return events_controller.stream_events(session, request)
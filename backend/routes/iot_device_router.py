@@ -1,5 +1,6 @@
 from fastapi import APIRouter
 from controllers import iot_device_controller
+from utils.db_executor import run_db
 from schemas.iot_device_schemas import *
 
 router = APIRouter(prefix="/iot/device", tags=["IoT Device"])
@@ -18,7 +19,8 @@ async def register_device_route(payload: IoTRegisterDevice):
     
     Trả về device_id để thiết bị sử dụng cho các API khác
     """
-    return iot_device_controller.register_device(
+    return await run_db(
+        iot_device_controller.register_device,
         device_id=payload.device_id,
         device_name=payload.device_name,
         device_type=payload.device_type,
@@ -38,7 +40,8 @@ async def add_sensor_route(device_id: str, payload: IoTAddSensor):
     - sensor_type: Loại sensor (temperature, humidity, light, motion, energy)
     - note: Ghi chú (tùy chọn)
     """
-    return iot_device_controller.add_sensor(
+    return await run_db(
+        iot_device_controller.add_sensor,
         device_id=device_id,
         sensor_id=payload.sensor_id,
         name=payload.name,
@@ -60,4 +63,4 @@ async def get_device_status_route(device_id: str):
     
     Khi gọi API này, trạng thái device sẽ được cập nhật thành "online"
     """
-    return iot_device_controller.get_device_status(device_id)
+    return await run_db(iot_device_controller.get_device_status, device_id)
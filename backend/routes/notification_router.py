@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, Query
 from controllers import notification_controller
+from utils.db_executor import run_db
 from schemas.sensor_schemas import ResponseSchema
 from utils.auth import get_current_user
 
@@ -17,7 +18,7 @@ async def get_notifications_route(
     GET /notifications?limit=100&unread_only=false
     """
     user_id = str(current_user["_id"])
-    return notification_controller.get_notifications(user_id, limit, unread_only)
+    return await run_db(notification_controller.get_notifications, user_id, limit, unread_only)
 
 
 @router.post("/{notification_id}/read", response_model=ResponseSchema)
@@ -30,7 +31,7 @@ async def mark_notification_as_read_route(
     POST /notifications/{notification_id}/read
     """
     user_id = str(current_user["_id"])
-    return notification_controller.mark_notification_as_read(user_id, notification_id)
+    return await run_db(notification_controller.mark_notification_as_read, user_id, notification_id)
 
 
 @router.post("/read-all", response_model=ResponseSchema)
@@ -42,7 +43,7 @@ async def mark_all_notifications_as_read_route(
     POST /notifications/read-all
     """
     user_id = str(current_user["_id"])
-    return notification_controller.mark_all_notifications_as_read(user_id)
+    return await run_db(notification_controller.mark_all_notifications_as_read, user_id)
 
 
 @router.get("/unread-count", response_model=ResponseSchema)
@@ -54,4 +55,4 @@ async def get_unread_count_route(
     GET /notifications/unread-count
     """
     user_id = str(current_user["_id"])
-    return notification_controller.get_unread_count(user_id)
+    return await run_db(notification_controller.get_unread_count, user_id)
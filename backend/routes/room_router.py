@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends
 from controllers import room_controller
+from utils.db_executor import run_db
 from schemas.room_schemas import *
 from utils.auth import get_current_user
 
@@ -11,7 +12,7 @@ router = APIRouter(prefix="/rooms", tags=["Room"])
 async def create_room_route(payload: RoomCreate, current_user: dict = Depends(get_current_user)):
     """Tạo phòng mới"""
     user_id = str(current_user["_id"])
-    return room_controller.create_room(payload.name, payload.description or "", user_id)
+    return await run_db(room_controller.create_room, payload.name, payload.description or "", user_id)
 
 
 @router.get("/", response_model=ResponseSchema)
@@ -21,21 +22,21 @@ async def get_all_rooms_route(current_user: dict = Depends(get_current_user)):
     Để lấy chi tiết phòng kèm devices, sensors, actuators, gọi GET /rooms/{room_id}/details
     """
     user_id = str(current_user["_id"])
-    return room_controller.get_all_rooms(user_id)
+    return await run_db(room_controller.get_all_rooms, user_id)
 
 
 @router.get("/{room_id}", response_model=ResponseSchema)
 async def get_room_route(room_id: str, current_user: dict = Depends(get_current_user)):
     """Lấy thông tin phòng của user"""
     user_id = str(current_user["_id"])
-    return room_controller.get_room(room_id, user_id)
+    return await run_db(room_controller.get_room, room_id, user_id)
 
 
 @router.get("/{room_id}/details", response_model=ResponseSchema)
 async def get_room_details_route(room_id: str, current_user: dict = Depends(get_current_user)):
     """Lấy thông tin chi tiết phòng kèm devices, sensors, actuators của user"""
     user_id = str(current_user["_id"])
-    return room_controller.get_room_details(room_id, user_id)
+    return await run_db(room_controller.get_room_details, room_id, user_id)
 
 
 @router.post("/{room_id}/control", response_model=ResponseSchema)
@@ -48,7 +49,7 @@ async def control_room_route(room_id: str, payload: RoomControl, current_user: d
     }
     """
     user_id = str(current_user["_id"])
-    return room_controller.control_room(room_id, payload.action, user_id)
+    return await run_db(room_controller.control_room, room_id, payload.action, user_id)
 
 
 @router.post("/update-name", response_model=ResponseSchema)
@@ -60,7 +61,8 @@ async def update_room_name_route(payload: UpdateRoomName, current_user: dict = D
     
     Tất cả devices trong phòng cũ sẽ được chuyển sang phòng mới.
     """
-    return room_controller.update_room_name(
+    return await run_db(
+        room_controller.update_room_name,
         current_user,
         payload.old_room_name,
         payload.new_room_name
@@ -75,7 +77,8 @@ async def delete_room_route(payload: DeleteRoom, current_user: dict = Depends(ge
     
     Tất cả devices trong phòng sẽ được chuyển sang phòng "Không xác định".
     """
-    return room_controller.delete_room(
+    return await run_db(
+        room_controller.delete_room,
         current_user,
         payload.room_name
     )
@@ -83,10 +86,10 @@ async def delete_room_route(payload: DeleteRoom, current_user: dict = Depends(ge
 @router.post("/{room_id}/devices/{device_id}", response_model=ResponseSchema)
 async def add_device_to_room_route(room_id: str, device_id: str, current_user: dict = Depends(get_current_user)):
     """Thêm device vào room (thêm device_id vào room.device_ids)"""
-    return room_controller.add_device_to_room(current_user, room_id, device_id)
+    return await run_db(room_controller.add_device_to_room, current_user, room_id, device_id)
 
 @router.delete("/{room_id}/devices/{device_id}", response_model=ResponseSchema)
 async def remove_device_from_room_route(room_id: str, device_id: str, current_user: dict = Depends(get_current_user)):
     """Xóa device khỏi room (xóa device_id khỏi room.device_ids)"""
-    return room_controller.remove_device_from_room(current_user, room_id, device_id)
+    return await run_db(room_controller.remove_device_from_room, current_user, room_id, device_id)
 
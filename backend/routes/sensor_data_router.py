@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, Query
 from controllers import sensor_data_controller
+from utils.db_executor import run_db
 from schemas.sensor_data_schemas import ResponseSchema
 from utils.auth import get_current_user
 from typing import Optional
@@ -16,6 +17,8 @@ async def get_sensor_data_route(
     limit: int = Query(100, ge=1, le=1000, description="Maximum number of records to return"),
     start_time: Optional[str] = Query(None, description="Start time in ISO format (e.g., 2024-01-01T00:00:00Z)"),
     end_time: Optional[str] = Query(None, description="End time in ISO format (e.g., 2024-01-01T23:59:59Z)"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    total: str = Query("exact", pattern="^(none|estimate|exact)$", description="Total count mode"),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -27,17 +30,57 @@ async def get_sensor_data_route(
     - **limit**: Số lượng records tối đa (1-1000, mặc định: 100)
     - **start_time**: Thời gian bắt đầu (ISO format)
     - **end_time**: Thời gian kết thúc (ISO format)
+    - **cursor**: next_cursor của trang trước để lấy trang tiếp theo (optional)
+    - **total**: exact (count_documents, mặc định), estimate (xấp xỉ từ rollup, cần SENSOR_ROLLUPS_ENABLED và đã backfill) hoặc none (không đếm)
     
-    Trả về danh sách dữ liệu sensor, sắp xếp theo timestamp giảm dần (mới nhất trước)
+    Trả về danh sách dữ liệu sensor, sắp xếp theo timestamp giảm dần (mới nhất trước);
+    next_cursor là null khi đã tới trang cuối
     """
-    return sensor_data_controller.get_sensor_data(
+    return await run_db(
+        sensor_data_controller.get_sensor_data,
         current_user,
         device_id=device_id,
         sensor_id=sensor_id,
         sensor_type=sensor_type,
         limit=limit,
         start_time=start_time,
-        end_time=end_time
+        end_time=end_time,
+        cursor=cursor,
+        total=total
+    )
+
+
+@router.get("/export")
+async def export_sensor_data_route(
+    device_id: Optional[str] = Query(None, description="Filter by device ID"),
+    sensor_id: Optional[str] = Query(None, description="Filter by sensor ID"),
+    sensor_type: Optional[str] = Query(None, description="Filter by sensor type"),
+    start_time: Optional[str] = Query(None, description="Start time in ISO format (e.g., 2024-01-01T00:00:00Z)"),
+    end_time: Optional[str] = Query(None, description="End time in ISO format (e.g., 2024-01-01T23:59:59Z)"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="Export format"),
+    gzip: bool = Query(True, description="Compress the response with gzip"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Xuất lịch sử dữ liệu sensor dạng luồng (không giới hạn số records)
+    
+    - **device_id** / **sensor_id** / **sensor_type**: bộ lọc như GET /sensor-data
+    - **start_time** / **end_time**: khoảng thời gian (ISO format)
+    - **format**: ndjson (mặc định, mỗi dòng một JSON) hoặc csv
+    - **gzip**: nén response (Content-Encoding: gzip), mặc định bật
+    
+    Dữ liệu được sắp xếp theo timestamp tăng dần (cũ nhất trước)
+    """
+    return await run_db(
+        sensor_data_controller.export_sensor_data,
+        current_user,
+        device_id=device_id,
+        sensor_id=sensor_id,
+        sensor_type=sensor_type,
+        start_time=start_time,
+        end_time=end_time,
+        export_format=format,
+        compress=gzip
     )
 
 
@@ -55,7 +98,8 @@ async def get_latest_sensor_data_route(
     
     Trả về dữ liệu mới nhất của mỗi sensor
     """
-    return sensor_data_controller.get_latest_sensor_data(
+    return await run_db(
+        sensor_data_controller.get_latest_sensor_data,
         current_user,
         device_id=device_id,
         sensor_id=sensor_id
@@ -82,7 +126,8 @@ async def get_sensor_statistics_route(
     
     Trả về thống kê: count, min_value, max_value, avg_value cho mỗi sensor
     """
-    return sensor_data_controller.get_sensor_statistics(
+    return await run_db(
+        sensor_data_controller.get_sensor_statistics,
         current_user,
         device_id=device_id,
         sensor_id=sensor_id,
@@ -98,6 +143,7 @@ async def get_sensor_trends_route(
     room: Optional[str] = Query(None, description="Filter by room/location (nếu có thì lấy dữ liệu của tất cả devices trong phòng)"),
     hours: int = Query(24, ge=1, le=168, description="Number of hours to look back (1-168, default: 24)"),
     limit_per_type: int = Query(100, ge=10, le=500, description="Maximum data points per sensor type (10-500, default: 100)"),
+    method: str = Query("minmax", pattern="^(minmax|lttb)$", description="Downsampling: minmax (min/max/avg per bucket) or lttb"),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -111,19 +157,23 @@ async def get_sensor_trends_route(
     Lưu ý: Nếu có cả device_id và room, device_id sẽ được ưu tiên.
     Nếu không có cả hai, lấy tất cả devices của user.
     
+    - **method**: minmax (mặc định, mỗi điểm là min / max / trung bình của một khoảng) hoặc lttb
+    
     Trả về dữ liệu đã được format sẵn theo sensor type:
-    - temperature: Array of {time, value}
-    - humidity: Array of {time, value}
-    - energy: Array of {time, value}
+    - series: {sensor_type: Array of {time, timestamp, value, min, max}} cho mọi loại sensor
+    - temperature, humidity, energy: như trong series (giữ cho frontend hiện tại)
     
-    Dữ liệu được sắp xếp theo thời gian và tự động giới hạn số lượng điểm để tối ưu hiển thị.
+    Dữ liệu được gom theo khoảng thời gian trong database / một lượt duyệt nên bộ nhớ không
+    tăng theo số reading.
     """
-    return sensor_data_controller.get_sensor_trends(
+    return await run_db(
+        sensor_data_controller.get_sensor_trends,
         current_user,
         device_id=device_id,
         room=room,
         hours=hours,
-        limit_per_type=limit_per_type
+        limit_per_type=limit_per_type,
+        method=method
     )
 
 
@@ -151,8 +201,34 @@ async def get_temperature_statistics_table_route(
     - avg: Giá trị trung bình
     - count: Số lượng mẫu
     """
-    return sensor_data_controller.get_temperature_statistics_table(
+    return await run_db(
+        sensor_data_controller.get_temperature_statistics_table,
         current_user,
         device_id=device_id,
         days=days
     )
+
+
+@router.get("/table", response_model=ResponseSchema)
+async def get_sensor_statistics_table_route(
+    sensor_type: str = Query("temperature", description="Sensor type (temperature, humidity, energy, ...)"),
+    device_id: Optional[str] = Query(None, description="Filter by device ID (optional)"),
+    days: int = Query(1, ge=1, le=7, description="Number of days: 1, 3, or 7 (default: 1)"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Bảng thống kê theo khoảng thời gian cho một loại sensor bất kỳ
+
+    - **sensor_type**: Loại sensor (mặc định: temperature)
+    - **device_id**: Lọc theo device ID (optional, nếu không có thì lấy tất cả devices của user)
+    - **days**: Số ngày (1, 3, hoặc 7 ngày, mặc định: 1)
+
+    Định dạng giống /sensor-data/temperature/table
+    """
+    return await run_db(
+        sensor_data_controller.get_sensor_statistics_table,
+        current_user,
+        sensor_type=sensor_type,
+        device_id=device_id,
+        days=days
+    )
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends
 from controllers import sensor_controller
+from utils.db_executor import run_db
 from schemas.sensor_schemas import *
 from utils.auth import get_current_user
 
@@ -16,14 +17,14 @@ async def control_sensor_enable_route(sensor_id: str, payload: SensorEnableContr
     }
     """
     user_id = str(current_user["_id"])
-    return sensor_controller.control_sensor_enable(sensor_id, payload.enabled, user_id)
+    return await run_db(sensor_controller.control_sensor_enable, sensor_id, payload.enabled, user_id)
 
 
 @router.get("/device/{device_id}", response_model=ResponseSchema)
 async def get_sensors_by_device_route(device_id: str, current_user: dict = Depends(get_current_user)):
     """Lấy danh sách cảm biến theo thiết bị của user"""
     user_id = str(current_user["_id"])
-    return sensor_controller.get_sensors_by_device(device_id, user_id)
+    return await run_db(sensor_controller.get_sensors_by_device, device_id, user_id)
 
 
 @router.post("/{sensor_id}/update", response_model=ResponseSchema)
@@ -39,7 +40,8 @@ async def update_sensor_route(sensor_id: str, payload: SensorUpdate, current_use
     }
     """
     user_id = str(current_user["_id"])
-    return sensor_controller.update_sensor(
+    return await run_db(
+        sensor_controller.update_sensor,
         sensor_id, 
         payload.name, 
         payload.type, 
@@ -59,7 +61,8 @@ async def update_sensor_threshold_route(sensor_id: str, payload: SensorThreshold
     }
     """
     user_id = str(current_user["_id"])
-    return sensor_controller.update_sensor_threshold(
+    return await run_db(
+        sensor_controller.update_sensor_threshold,
         sensor_id, 
         payload.min_threshold, 
         payload.max_threshold, 
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from controllers import user_device_controller
+from utils.db_executor import run_db
 from schemas.user_device_schemas import *
 from utils.auth import get_current_user
 
@@ -17,7 +18,8 @@ async def add_device_route(payload: AddDevice, current_user: dict = Depends(get_
     - location: Phòng/vị trí thiết bị
     - note: Ghi chú (tùy chọn)
     """
-    return user_device_controller.add_device(
+    return await run_db(
+        user_device_controller.add_device,
         current_user,
         payload.device_id,
         payload.device_password,
@@ -28,7 +30,7 @@ async def add_device_route(payload: AddDevice, current_user: dict = Depends(get_
 
 @router.post("/get-device", response_model=ResponseSchema)
 async def get_info_device_route(payload: Device, current_user: dict = Depends(get_current_user)):
-    return user_device_controller.get_info_device(current_user, payload.device_id)
+    return await run_db(user_device_controller.get_info_device, current_user, payload.device_id)
 
 @router.post("/update", response_model=ResponseSchema)
 async def update_device_route(payload: UpdateDevice, current_user: dict = Depends(get_current_user)):
@@ -45,7 +47,7 @@ async def update_device_route(payload: UpdateDevice, current_user: dict = Depend
     """
     update_dict = payload.dict(exclude_none=True)
     device_id = update_dict.pop("device_id")
-    return user_device_controller.update_device(current_user, device_id, update_dict)
+    return await run_db(user_device_controller.update_device, current_user, device_id, update_dict)
 
 @router.get("/get-all-device", response_model=ResponseSchema)
 async def get_all_device_route(current_user: dict = Depends(get_current_user)):
@@ -53,4 +55,4 @@ async def get_all_device_route(current_user: dict = Depends(get_current_user)):
     Lấy tất cả thiết bị của người dùng
     Trả về danh sách thiết bị kèm thông tin room (nếu có)
     """
-    return user_device_controller.get_all_device(current_user)
\ No newline at end of file
+    return await run_db(user_device_controller.get_all_device, current_user)
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+Bổ sung sensor_type / unit / room_id cho reading cũ (ghi trước khi ingest sao chép metadata).
+
+Chạy từ thư mục backend:
+    python scripts/backfill_sensor_data_metadata.py [--batch-size 1000] [--pause 0.1] [--dry-run]
+
+Với từng sensor, document chưa có sensor_type trong sensor_data, sensor_data_buckets và các
+collection rollup được cập nhật theo lô (_id $in) qua index (sensor_id, thời gian), nghỉ
+--pause giây giữa các lô. room_id chỉ được ghi khi device thuộc đúng một phòng.
+Chạy lại nhiều lần an toàn: document đã có sensor_type được bỏ qua.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.database import (  # noqa: E402
+    sensor_data_collection, sensor_data_buckets_collection, sensors_collection, user_room_devices_collection,
+    sensor_rollups_minute_collection, sensor_rollups_hour_collection, sensor_rollups_day_collection
+)
+
+# (collection, có sao chép unit / room_id hay không)
+TARGETS = [
+    (sensor_data_collection, True),
+    (sensor_data_buckets_collection, True),
+    (sensor_rollups_minute_collection, False),
+    (sensor_rollups_hour_collection, False),
+    (sensor_rollups_day_collection, False),
+]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Bổ sung metadata sensor cho reading cũ")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.1, help="Số giây nghỉ giữa các lô")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ đếm số document cần cập nhật")
+    args = parser.parse_args()
+
+    device_rooms = defaultdict(set)
+    for link in user_room_devices_collection.find({}, {"device_id": 1, "room_id": 1}):
+        if link.get("room_id"):
+            device_rooms[str(link["device_id"])].add(str(link["room_id"]))
+
+    started = time.monotonic()
+    totals = defaultdict(int)
+    for sensor in sensors_collection.find({}, {"type": 1, "unit": 1, "device_id": 1}):
+        if not sensor.get("type"):
+            continue
+        rooms = device_rooms.get(str(sensor.get("device_id")), set())
+        metadata = {"sensor_type": sensor["type"]}
+        if sensor.get("unit"):
+            metadata["unit"] = sensor["unit"]
+        if len(rooms) == 1:
+            metadata["room_id"] = next(iter(rooms))
+
+        for collection, full_metadata in TARGETS:
+            query = {"sensor_id": sensor["_id"], "sensor_type": {"$exists": False}}
+            update = metadata if full_metadata else {"sensor_type": metadata["sensor_type"]}
+            if args.dry_run:
+                totals[collection.name] += collection.count_documents(query)
+                continue
+            while True:
+                ids = [document["_id"] for document in collection.find(query, {"_id": 1}).limit(args.batch_size)]
+                if not ids:
+                    break
+                totals[collection.name] += collection.update_many({"_id": {"$in": ids}}, {"$set": update}).modified_count
+                if len(ids) < args.batch_size:
+                    break
+                time.sleep(args.pause)
+
+    for name, count in totals.items():
+        print(f"  {name}: {count} document")
+    print(f"Hoàn tất trong {time.monotonic() - started:.1f}s" + (" (dry run)" if args.dry_run else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
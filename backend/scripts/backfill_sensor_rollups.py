@@ -0,0 +1,63 @@
+"""
+Tính lại rollup phút / giờ / ngày từ dữ liệu sensor đã lưu (raw hoặc bucket).
+
+Chạy từ thư mục backend:
+    python scripts/backfill_sensor_rollups.py [--days 7] [--dry-run]
+
+Xử lý từng ngày (chỉ các ngày trước hôm nay) và từng sensor; rollup của ngày đó được
+ghi đè bằng giá trị tính từ toàn bộ reading nên chạy lại nhiều lần vẫn cho cùng kết quả.
+Không backfill ngày hiện tại vì ingest buffer đang cộng dồn vào rollup của ngày này.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.database import sensors_collection  # noqa: E402
+from utils.sensor_data_store import sensor_data_store  # noqa: E402
+from utils.sensor_rollups import SensorRollups, sensor_rollups  # noqa: E402
+from utils.timezone import get_vietnam_now_naive  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Backfill rollup dữ liệu sensor")
+    parser.add_argument("--days", type=int, default=7, help="Số ngày gần nhất cần tính lại (không gồm hôm nay)")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ đếm số rollup sẽ ghi")
+    args = parser.parse_args()
+
+    sensors = {str(sensor["_id"]): sensor.get("type") for sensor in sensors_collection.find({}, {"type": 1})}
+    today = get_vietnam_now_naive().replace(hour=0, minute=0, second=0, microsecond=0)
+    started = time.monotonic()
+    total_readings = 0
+    total_rollups = 0
+
+    for offset in range(args.days, 0, -1):
+        day_start = today - timedelta(days=offset)
+        day_end = day_start + timedelta(days=1) - timedelta(microseconds=1)
+        day_readings = 0
+        day_rollups = 0
+        for sensor_id, sensor_type in sensors.items():
+            readings = sensor_data_store.find(sensor_ids=sensor_id, start=day_start, end=day_end, sort_direction=1)
+            if not readings:
+                continue
+            for reading in readings:
+                reading.setdefault("sensor_type", sensor_type)
+            day_readings += len(readings)
+            for tier in sensor_rollups.tiers:
+                operations = SensorRollups.build_replace_operations(tier, readings)
+                day_rollups += len(operations)
+                if operations and not args.dry_run:
+                    tier.collection.bulk_write(operations, ordered=False)
+        total_readings += day_readings
+        total_rollups += day_rollups
+        print(f"  {day_start.date()}: {day_readings} reading, {day_rollups} rollup, {time.monotonic() - started:.1f}s")
+
+    print(f"Hoàn tất: {total_readings} reading, {total_rollups} rollup" + (" (dry run)" if args.dry_run else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
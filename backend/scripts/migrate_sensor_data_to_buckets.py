@@ -0,0 +1,94 @@
+"""
+Chuyển dữ liệu sensor_data (mỗi reading một document) sang sensor_data_buckets
+(mỗi sensor mỗi giờ một document).
+
+Chạy từ thư mục backend:
+    python scripts/migrate_sensor_data_to_buckets.py [--batch-size 5000] [--dry-run]
+
+Tiến độ (_id cuối cùng đã chuyển) được lưu trong collection migrations nên có thể dừng
+và chạy lại để tiếp tục. Tiến độ được ghi sau lô bucket, nhưng mỗi reading mang _id của
+document gốc (trường "i") và bucket chỉ nhận reading chưa có, nên lô bị ghi lại sau khi
+dừng giữa chừng không tạo reading trùng hay cộng trùng count / sum.
+Collection sensor_data không bị xóa; sau khi kiểm tra xong, đặt SENSOR_DATA_STORAGE=bucket
+và khởi động lại backend.
+"""
+import argparse
+import os
+import sys
+import time
+
+from pymongo.errors import BulkWriteError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.database import db, sensor_data_collection, sensor_data_buckets_collection  # noqa: E402
+from utils.sensor_data_store import DUPLICATE_KEY_ERROR, SensorDataStore  # noqa: E402
+
+MIGRATION_ID = "sensor_data_to_buckets"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Chuyển sensor_data sang bucket theo giờ")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ đếm số document và bucket sẽ tạo")
+    parser.add_argument("--reset", action="store_true", help="Bỏ tiến độ đã lưu và chạy lại từ đầu")
+    args = parser.parse_args()
+
+    migrations = db["migrations"]
+    if args.reset and not args.dry_run:
+        migrations.delete_one({"_id": MIGRATION_ID})
+    progress = migrations.find_one({"_id": MIGRATION_ID}) or {}
+    last_id = progress.get("last_id")
+
+    query = {"timestamp": {"$type": "date"}, "sensor_id": {"$ne": None}, "value": {"$type": "number"}}
+    if last_id is not None:
+        query["_id"] = {"$gt": last_id}
+
+    total = sensor_data_collection.count_documents(query)
+    print(f"Còn {total} document cần chuyển" + (f" (tiếp tục sau _id {last_id})" if last_id is not None else ""))
+
+    migrated = progress.get("migrated", 0)
+    buckets = 0
+    started = time.monotonic()
+    cursor = sensor_data_collection.find(
+        query,
+        {"sensor_id": 1, "device_id": 1, "value": 1, "timestamp": 1, "sensor_type": 1, "unit": 1, "room_id": 1}
+    ).sort("_id", 1).batch_size(args.batch_size)
+
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= args.batch_size:
+            buckets += flush(batch, migrations, args.dry_run, migrated)
+            migrated += len(batch)
+            print(f"  {migrated} document, {buckets} lượt ghi bucket, {time.monotonic() - started:.1f}s")
+            batch = []
+    if batch:
+        buckets += flush(batch, migrations, args.dry_run, migrated)
+        migrated += len(batch)
+
+    print(f"Hoàn tất: {migrated} document, {buckets} lượt ghi bucket" + (" (dry run)" if args.dry_run else ""))
+    return 0
+
+
+def flush(batch: list, migrations, dry_run: bool, migrated: int) -> int:
+    operations = SensorDataStore.build_bucket_operations(batch)
+    if dry_run:
+        return len(operations)
+    try:
+        SensorDataStore.write_buckets(sensor_data_buckets_collection, batch)
+    except BulkWriteError as e:
+        # Reading đã có trong bucket (lô đã chuyển trước khi dừng) không phải lỗi
+        errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY_ERROR]
+        if errors:
+            raise
+    migrations.update_one(
+        {"_id": MIGRATION_ID},
+        {"$set": {"last_id": batch[-1]["_id"], "migrated": migrated + len(batch)}},
+        upsert=True
+    )
+    return len(operations)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
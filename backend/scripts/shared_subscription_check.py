@@ -0,0 +1,92 @@
+"""
+Kiểm tra shared subscription trên broker cục bộ: mỗi message chỉ được giao cho một
+thành viên trong group, và tải được chia giữa các thành viên.
+
+Chạy broker:  docker compose --profile local-mqtt up -d mosquitto
+Chạy script:  python scripts/shared_subscription_check.py --members 3 --messages 300
+"""
+import argparse
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import paho.mqtt.client as mqtt
+
+
+def make_client(client_id: str) -> mqtt.Client:
+    try:
+        return mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+    except AttributeError:
+        return mqtt.Client(client_id=client_id)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Kiểm tra MQTT shared subscription")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--group", default="iot-ingest")
+    parser.add_argument("--members", type=int, default=3)
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--timeout", type=float, default=15.0)
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:6]
+    received = Counter()
+    per_member = Counter()
+    lock = threading.Lock()
+    subscribed = threading.Barrier(args.members + 1, timeout=args.timeout)
+
+    def on_message(client, userdata, msg):
+        with lock:
+            received[msg.payload.decode("utf-8")] += 1
+            per_member[userdata] += 1
+
+    def on_subscribe(client, userdata, *rest):
+        subscribed.wait()
+
+    members = []
+    for i in range(args.members):
+        client = make_client(f"shared-check-{run_id}-{i}")
+        client.user_data_set(i)
+        client.on_message = on_message
+        client.on_subscribe = on_subscribe
+        client.on_connect = lambda c, *a, **k: c.subscribe(f"$share/{args.group}/device/+/data", qos=1)
+        client.connect(args.host, args.port, keepalive=30)
+        client.loop_start()
+        members.append(client)
+    subscribed.wait()
+
+    publisher = make_client(f"shared-check-{run_id}-pub")
+    publisher.connect(args.host, args.port, keepalive=30)
+    publisher.loop_start()
+    for n in range(args.messages):
+        device_id = f"check-{run_id}-{n % args.devices}"
+        publisher.publish(f"device/{device_id}/data", f"{run_id}:{n}", qos=1).wait_for_publish()
+
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline and sum(received.values()) < args.messages:
+        time.sleep(0.1)
+
+    for client in members + [publisher]:
+        client.loop_stop()
+        client.disconnect()
+
+    missing = args.messages - len(received)
+    duplicated = sum(1 for count in received.values() if count > 1)
+    print(f"Đã nhận {sum(received.values())}/{args.messages} message, thiếu {missing}, trùng {duplicated}")
+    for member in range(args.members):
+        print(f"  member {member}: {per_member[member]} message")
+
+    if missing or duplicated:
+        return 1
+    if args.members > 1 and sum(1 for member in range(args.members) if per_member[member]) < 2:
+        print("Broker không chia tải giữa các thành viên (shared subscription không hoạt động?)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
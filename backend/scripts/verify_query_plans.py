@@ -0,0 +1,88 @@
+"""
+Kiểm tra query plan của các truy vấn trong utils/indexes.QUERY_SHAPES.
+
+Chạy từ thư mục backend:
+    python scripts/verify_query_plans.py [--apply] [--verbose]
+
+--apply tạo index theo INDEX_CATALOG trước khi kiểm tra. Với mỗi shape, script chạy
+explain() và báo lỗi nếu winning plan có COLLSCAN (quét toàn collection) hoặc SORT
+(sắp xếp trong bộ nhớ). Exit code 1 nếu có shape bị báo lỗi, dùng được trong CI.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.database import db  # noqa: E402
+from utils.indexes import QUERY_SHAPES, apply_indexes  # noqa: E402
+
+BAD_STAGES = {"COLLSCAN", "SORT"}
+
+
+def collect_stages(plan) -> list:
+    """Lấy tên tất cả stage trong cây plan (hỗ trợ cả classic engine và SBE)"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for key in ("inputStage", "queryPlan", "winningPlan"):
+            if key in plan:
+                stages.extend(collect_stages(plan[key]))
+        for child in plan.get("inputStages", []):
+            stages.extend(collect_stages(child))
+    return stages
+
+
+def winning_plan(explain: dict) -> dict:
+    """winningPlan nằm ở queryPlanner (find) hoặc trong stage $cursor đầu tiên (aggregate)"""
+    if "queryPlanner" in explain:
+        return explain["queryPlanner"].get("winningPlan", {})
+    for stage in explain.get("stages", []):
+        cursor = stage.get("$cursor")
+        if cursor and "queryPlanner" in cursor:
+            return cursor["queryPlanner"].get("winningPlan", {})
+    return {}
+
+
+def explain_shape(shape: dict) -> dict:
+    collection = db[shape["collection"]]
+    if "pipeline" in shape:
+        return db.command("aggregate", shape["collection"], pipeline=shape["pipeline"], explain=True)
+    cursor = collection.find(shape.get("filter", {}))
+    if shape.get("sort"):
+        cursor = cursor.sort(shape["sort"])
+    return cursor.explain()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Kiểm tra query plan của các truy vấn chính")
+    parser.add_argument("--apply", action="store_true", help="Tạo index theo INDEX_CATALOG trước khi kiểm tra")
+    parser.add_argument("--verbose", action="store_true", help="In toàn bộ stage của mỗi plan")
+    args = parser.parse_args()
+
+    if args.apply:
+        for collection_name, names in apply_indexes(db).items():
+            print(f"index {collection_name}: {', '.join(names) or '(lỗi, xem log)'}")
+
+    failures = 0
+    for shape in QUERY_SHAPES:
+        try:
+            stages = collect_stages(winning_plan(explain_shape(shape)))
+        except Exception as e:
+            failures += 1
+            print(f"[LỖI] {shape['collection']:<20} {shape['name']}: {str(e)}")
+            continue
+        bad = sorted(BAD_STAGES.intersection(stages))
+        if bad:
+            failures += 1
+        status = "LỖI" if bad else "OK"
+        detail = " > ".join(stages) if args.verbose or bad else ""
+        print(f"[{status:<3}] {shape['collection']:<20} {shape['name']}" + (f"  ({detail})" if detail else ""))
+
+    print(f"{len(QUERY_SHAPES) - failures}/{len(QUERY_SHAPES)} truy vấn dùng index")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,14 @@
+"""
+Cấu hình pytest cho backend. Chạy từ thư mục backend:
+    python -m pytest -q
+
+Các test chỉ kiểm tra logic trong process (không cần MongoDB / MQTT đang chạy);
+MongoClient trong utils.database chỉ kết nối khi có truy vấn thật.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
@@ -0,0 +1,91 @@
+import pytest
+from bson import ObjectId
+
+import utils.access_control as access_control_module
+from utils.access_control import AccessControl
+
+USER_ID = ObjectId("6761a0000000000000000001")
+
+
+class FakeFind:
+    """find() giả: lọc theo các trường bằng nhau hoặc {"$in": [...]}, đếm số lần gọi"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.calls = 0
+        self.on_find = None
+
+    def find(self, query, projection=None):
+        self.calls += 1
+        if self.on_find:
+            self.on_find()
+        return [document for document in self.documents if all(
+            document.get(field) in value["$in"] if isinstance(value, dict) else document.get(field) == value
+            for field, value in query.items()
+        )]
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    links = FakeFind([
+        {"user_id": str(USER_ID), "device_id": "d1", "room_id": "r1"},
+        {"user_id": str(USER_ID), "device_id": "d2", "room_id": None},
+        {"user_id": "other", "device_id": "d3", "room_id": "r9"}
+    ])
+    sensors = FakeFind([{"_id": "s1", "device_id": "d1"}, {"_id": "s2", "device_id": "d2"}, {"_id": "s3", "device_id": "d3"}])
+    monkeypatch.setattr(access_control_module, "user_room_devices_collection", links)
+    monkeypatch.setattr(access_control_module, "sensors_collection", sensors)
+    return links, sensors
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(access_control_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_builds_index_from_links_and_sensors(collections):
+    access = AccessControl(ttl_seconds=5).get(USER_ID)
+    assert access.device_rooms == {"d1": "r1", "d2": None}
+    assert access.sensor_device("s2") == "d2"
+    assert access.sensor_device("s3") is None
+    assert access.room_device_ids("r1") == ["d1"]
+
+
+def test_entry_reloads_after_ttl(collections, clock):
+    links, _ = collections
+    control = AccessControl(ttl_seconds=5)
+    control.get(USER_ID)
+    # ObjectId và str của cùng user dùng chung một entry
+    assert control.can_access_device(str(USER_ID), "d1")
+    assert links.calls == 1
+
+    links.documents = [document for document in links.documents if document["device_id"] != "d1"]
+    clock[0] += 4
+    assert control.can_access_device(USER_ID, "d1")
+    clock[0] += 2
+    assert not control.can_access_device(USER_ID, "d1")
+    assert links.calls == 2
+
+
+def test_invalidate_during_load_is_not_cached(collections):
+    links, _ = collections
+    control = AccessControl(ttl_seconds=5)
+    links.on_find = lambda: control.invalidate_user(USER_ID)
+    control.get(USER_ID)
+    links.on_find = None
+    control.get(USER_ID)
+    assert links.calls == 2
+
+
+def test_add_sensor_updates_cached_users(collections):
+    _, sensors = collections
+    control = AccessControl(ttl_seconds=5)
+    control.get(USER_ID)
+    control.add_sensor("d1", "s9")
+    control.add_sensor("d3", "s10")
+    access = control.get(USER_ID)
+    assert access.sensor_device("s9") == "d1"
+    assert access.sensor_device("s10") is None
+    assert sensors.calls == 1
@@ -0,0 +1,68 @@
+import pytest
+
+import utils.circuit_breaker as circuit_module
+from utils.circuit_breaker import CircuitBreaker, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_module, "time", fake)
+    return fake
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow_request()
+    assert breaker.retry_after() == pytest.approx(10)
+    assert breaker.get_stats()["trips"] == 1
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+
+
+def test_half_open_after_timeout_then_closes_on_success(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 9.9
+    assert not breaker.allow_request()
+
+    clock.now += 0.2
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.allow_request()
+    assert breaker.retry_after() == 0.0
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+
+
+def test_failure_in_half_open_reopens(clock):
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=10)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 10
+    assert breaker.state == STATE_HALF_OPEN
+
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert breaker.retry_after() == pytest.approx(10)
+    assert breaker.get_stats()["trips"] == 2
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import utils.device_presence as device_presence_module
+from utils.device_presence import DevicePresenceTracker
+
+NOW = datetime(2025, 12, 21, 9, 0)
+
+
+class FakeDevices:
+    """Collection devices giả: chỉ các query mà check_offline / mark_seen dùng"""
+
+    def __init__(self, devices):
+        self.devices = {device["_id"]: dict(device) for device in devices}
+        self.before_update_many = None
+
+    def find(self, query, projection=None):
+        return [
+            {"_id": device_id} for device_id, device in self.devices.items()
+            if device_id not in query["_id"]["$nin"] and device["status"] == query["status"]
+            and (device.get("last_seen") is None or device["last_seen"] < query["$or"][1]["last_seen"]["$lt"])
+        ]
+
+    def update_many(self, query, update):
+        if self.before_update_many:
+            callback, self.before_update_many = self.before_update_many, None
+            callback()
+        for device_id in query["_id"]["$in"]:
+            device = self.devices[device_id]
+            if "status" not in query or device["status"] == query["status"]:
+                device.update(update["$set"])
+
+    def update_one(self, query, update):
+        self.devices[query["_id"]].update(update["$set"])
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [NOW]
+    monkeypatch.setattr(device_presence_module, "get_vietnam_now_naive", lambda: now[0])
+    return now
+
+
+def make_tracker(monkeypatch, devices):
+    monkeypatch.setattr(device_presence_module, "devices_collection", devices)
+    tracker = DevicePresenceTracker(shared=False)
+    events = []
+    tracker.add_listener(lambda device_ids, status: events.append((list(device_ids), status)))
+    return tracker, events
+
+
+def test_quiet_device_goes_offline(monkeypatch, clock):
+    devices = FakeDevices([{"_id": "d1", "status": "offline"}])
+    tracker, events = make_tracker(monkeypatch, devices)
+    tracker.mark_seen("d1")
+    clock[0] += timedelta(minutes=6)
+    assert tracker.check_offline(timeout_minutes=5) == ["d1"]
+    assert devices.devices["d1"]["status"] == "offline"
+    assert tracker.get_status("d1") == "offline"
+    assert events == [(["d1"], "online"), (["d1"], "offline")]
+
+
+def test_message_between_snapshot_and_write_keeps_device_online(monkeypatch, clock):
+    devices = FakeDevices([{"_id": "d1", "status": "offline"}, {"_id": "d2", "status": "offline"}])
+    tracker, events = make_tracker(monkeypatch, devices)
+    tracker.mark_seen("d1")
+    tracker.mark_seen("d2")
+    clock[0] += timedelta(minutes=6)
+    # d1 gửi message ngay trước khi update_many ghi offline
+    devices.before_update_many = lambda: tracker.mark_seen("d1")
+
+    assert tracker.check_offline(timeout_minutes=5) == ["d2"]
+    assert devices.devices["d1"]["status"] == "online"
+    assert tracker.get_status("d1") == "online"
+    assert devices.devices["d2"]["status"] == "offline"
+    assert events[-1] == (["d2"], "offline")
+    assert tracker.get_stats()["transitions"] == 3
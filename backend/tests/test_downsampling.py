@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+from utils.downsampling import BucketAccumulator, lttb
+
+START = datetime(2025, 12, 21, 9, 0)
+
+
+def series(values):
+    return [{"timestamp": START + timedelta(minutes=i), "value": value} for i, value in enumerate(values)]
+
+
+def test_accumulator_keeps_min_max_per_bucket():
+    accumulator = BucketAccumulator(START, timedelta(minutes=10))
+    readings = [
+        {"sensor_type": "temperature", "value": value, "timestamp": START + timedelta(minutes=i)}
+        for i, value in enumerate([20, 35, 21, 5, 22, 23, 24, 25, 26, 27, 30, 31])
+    ]
+    readings.append({"sensor_type": "temperature", "value": True, "timestamp": START})
+    readings.append({"sensor_type": "temperature", "value": None, "timestamp": START})
+    accumulator.add_readings(readings)
+
+    first, second = accumulator.points()
+    assert (first["timestamp"], first["count"], first["min"], first["max"]) == (START, 10, 5, 35)
+    assert first["value"] == sum([20, 35, 21, 5, 22, 23, 24, 25, 26, 27]) / 10
+    assert (second["timestamp"], second["count"], second["value"]) == (START + timedelta(minutes=10), 2, 30.5)
+
+
+def test_accumulator_merges_rollup_partials_by_type():
+    accumulator = BucketAccumulator(START, timedelta(hours=1))
+    accumulator.add("gas", START + timedelta(minutes=5), 2, 10.0, 4.0, 6.0)
+    accumulator.add("gas", START + timedelta(minutes=50), 1, 9.0, 9.0, 9.0)
+    accumulator.add("light", START, 1, 100.0, 100.0, 100.0)
+    accumulator.add("gas", START, 0, 0, 0, 0)
+    points = {point["sensor_type"]: point for point in accumulator.points()}
+    assert (points["gas"]["count"], points["gas"]["min"], points["gas"]["max"]) == (3, 4.0, 9.0)
+    assert points["light"]["value"] == 100.0
+
+
+def test_lttb_returns_threshold_points_and_keeps_ends():
+    points = series([(i * 7) % 11 for i in range(100)])
+    sampled = lttb(points, 10)
+    assert len(sampled) == 10
+    assert sampled[0] is points[0] and sampled[-1] is points[-1]
+    timestamps = [point["timestamp"] for point in sampled]
+    assert timestamps == sorted(timestamps)
+
+
+def test_lttb_keeps_spike():
+    values = [1.0] * 50
+    values[23] = 100.0
+    sampled = lttb(series(values), 5)
+    assert any(point["value"] == 100.0 for point in sampled)
+
+
+def test_lttb_small_thresholds():
+    points = series([1, 2, 3, 4])
+    assert lttb(points, 10) == points
+    assert lttb(points, 2) == [points[0], points[-1]]
+    assert lttb(points, 1) == [points[0]]
+    assert lttb(points, 0) == []
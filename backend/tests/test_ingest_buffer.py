@@ -0,0 +1,142 @@
+import threading
+import time
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from utils.circuit_breaker import CircuitBreaker
+from utils.ingest_buffer import SensorDataBuffer
+
+
+class FakeCollection:
+    """insert_many giả: lưu theo _id, có thể lỗi sau khi đã ghi một phần"""
+
+    def __init__(self):
+        self.documents = {}
+        self.fail_after = None
+
+    def insert_many(self, documents, ordered=False):
+        errors = []
+        for index, document in enumerate(documents):
+            if self.fail_after is not None and index >= self.fail_after:
+                self.fail_after = None
+                raise AutoReconnect("connection reset")
+            if document["_id"] in self.documents:
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+                continue
+            self.documents[document["_id"]] = dict(document)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+def make_buffer(collection, **kwargs):
+    kwargs.setdefault("breaker", CircuitBreaker("test", failure_threshold=100, reset_timeout=0))
+    return SensorDataBuffer(collection, overflow_policy="drop_oldest", **kwargs)
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_retry_after_partial_write_is_idempotent():
+    collection = FakeCollection()
+    buffer = make_buffer(collection, max_batch_size=10, min_batch_size=2)
+    notified = []
+    buffer.add_listener(notified.extend)
+    buffer._queue.extend({"value": i} for i in range(10))
+
+    collection.fail_after = 4
+    assert buffer._write_batch(buffer._take_batch()) is False
+    assert len(collection.documents) == 4
+    assert len(buffer._queue) == 10
+    assert all("_id" in document for document in buffer._queue)
+
+    while buffer._queue:
+        assert buffer._write_batch(buffer._take_batch()) is True
+
+    assert len(collection.documents) == 10
+    stats = buffer.get_stats()
+    assert stats["inserted"] == 10
+    assert stats["failed"] == 0
+    assert wait_for(lambda: len(notified) == 10)
+    assert sorted(document["value"] for document in notified) == list(range(10))
+    buffer.stop()
+
+
+def test_failed_write_halves_batch_size():
+    collection = FakeCollection()
+    buffer = make_buffer(collection, max_batch_size=64, min_batch_size=8)
+    buffer._queue.extend({"value": i} for i in range(64))
+    collection.fail_after = 0
+    buffer._write_batch(buffer._take_batch())
+    assert buffer.get_stats()["batch_size"] == 32
+
+
+def test_batch_size_adapts_to_latency():
+    buffer = make_buffer(FakeCollection(), max_batch_size=100, min_batch_size=10, target_latency_ms=100)
+    buffer._batch_size = 50
+
+    # Lô đầy và nhanh: tăng thêm max_batch_size / 10
+    buffer._last_latency_ms = 10
+    buffer._adapt_batch_size(50)
+    assert buffer._batch_size == 60
+
+    # Lô chưa đầy: giữ nguyên
+    buffer._adapt_batch_size(20)
+    assert buffer._batch_size == 60
+
+    # Chậm hơn mục tiêu: giảm một nửa nhưng không dưới min_batch_size
+    buffer._last_latency_ms = 500
+    for _ in range(5):
+        buffer._adapt_batch_size(60)
+    assert buffer._batch_size == 10
+
+    buffer._last_latency_ms = 10
+    buffer._batch_size = 100
+    buffer._adapt_batch_size(100)
+    assert buffer._batch_size == 100
+
+
+def test_failing_and_slow_listeners_do_not_block_flush():
+    collection = FakeCollection()
+    buffer = make_buffer(collection, max_batch_size=5)
+    release = threading.Event()
+    received = []
+
+    def slow_listener(documents):
+        release.wait(timeout=5)
+
+    def failing_listener(documents):
+        raise RuntimeError("rollup down")
+
+    buffer.add_listener(slow_listener)
+    buffer.add_listener(failing_listener)
+    buffer.add_listener(received.extend)
+
+    for i in range(3):
+        buffer._queue.extend({"value": i * 5 + j} for j in range(5))
+        started = time.monotonic()
+        assert buffer.flush() == 5
+        assert time.monotonic() - started < 1.0
+
+    release.set()
+    buffer.stop()
+    assert len(collection.documents) == 15
+    assert len(received) == 15
+    by_listener = buffer.get_stats()["listeners"]["by_listener"]
+    assert by_listener["test_failing_and_slow_listeners_do_not_block_flush.<locals>.failing_listener"]["errors"] == 3
+
+
+def test_listener_backlog_drops_oldest_batch():
+    buffer = make_buffer(FakeCollection(), listener_max_pending=2)
+    release = threading.Event()
+    buffer.add_listener(lambda documents: release.wait(timeout=5))
+    for i in range(5):
+        buffer._notify([{"value": i}])
+    assert wait_for(lambda: buffer.get_stats()["listeners"]["dropped_batches"] >= 2)
+    release.set()
+    buffer.stop()
@@ -0,0 +1,39 @@
+import asyncio
+
+from utils.live_events import LiveEventHub
+
+
+def test_slow_client_drops_oldest_events():
+    async def scenario():
+        hub = LiveEventHub(max_queue=3)
+        subscription = hub.subscribe("u1")
+        for i in range(5):
+            hub.publish(["u1"], "reading", {"value": i})
+        await asyncio.sleep(0)
+
+        assert subscription.take_dropped() == 2
+        assert subscription.take_dropped() == 0
+        messages = [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+        assert '"value":2' in messages[0] and '"value":4' in messages[-1]
+        hub.unsubscribe(subscription)
+        assert not hub.is_active
+
+    asyncio.run(scenario())
+
+
+def test_device_events_only_reach_linked_subscriptions():
+    async def scenario():
+        hub = LiveEventHub()
+        linked = hub.subscribe("u1", ["d1"])
+        unlinked = hub.subscribe("u1", ["d2"])
+        other_user = hub.subscribe("u2")
+        hub.publish(["u1"], "reading", {"device_id": "d1"}, "d1")
+        hub.publish(["u1"], "notification", {"user_id": "u1"})
+        await asyncio.sleep(0)
+
+        assert linked.queue.qsize() == 2
+        assert unlinked.queue.qsize() == 1
+        assert other_user.queue.qsize() == 0
+        assert hub.get_stats()["connections"] == 3
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import pytest
+
+import utils.metadata_cache as metadata_cache_module
+from utils.metadata_cache import MetadataCache
+
+
+class FakeDevices:
+    def __init__(self, known):
+        self.known = known
+        self.calls = 0
+
+    def find_one(self, query):
+        self.calls += 1
+        return {"_id": query["_id"]} if query["_id"] in self.known else None
+
+
+class EmptyFind:
+    def find(self, query):
+        return []
+
+
+@pytest.fixture
+def devices(monkeypatch):
+    collection = FakeDevices({"d1", "d2"})
+    monkeypatch.setattr(metadata_cache_module, "devices_collection", collection)
+    monkeypatch.setattr(metadata_cache_module, "sensors_collection", EmptyFind())
+    monkeypatch.setattr(metadata_cache_module, "actuators_collection", EmptyFind())
+    return collection
+
+
+def test_random_device_ids_do_not_grow_cache(devices):
+    cache = MetadataCache(max_entries=3)
+    cache.get_device("d1")
+    for i in range(100):
+        assert cache.get_device(f"spoofed-{i}") is None
+        # d1 được dùng liên tục nên không bị bỏ
+        assert cache.get_device("d1") == {"_id": "d1"}
+
+    stats = cache.get_stats()
+    assert stats["devices"] == 3
+    assert stats["evictions"] == 98
+    assert devices.calls == 101
+
+
+def test_expired_entry_is_dropped_on_lookup(devices, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(metadata_cache_module.time, "monotonic", lambda: clock[0])
+    cache = MetadataCache(negative_ttl_seconds=30)
+    assert cache.get_device("unknown") is None
+    clock[0] += 31
+    assert cache.get_device("d9") is None
+    assert cache.get_device("unknown") is None
+    assert devices.calls == 3
+    assert cache.get_stats()["devices"] == 2
@@ -0,0 +1,69 @@
+import pytest
+from pymongo.errors import BulkWriteError
+
+import utils.metadata_cache as metadata_cache_module
+import utils.mqtt_ingest as mqtt_ingest
+from utils.metadata_cache import metadata_cache
+
+
+class FakeActuators:
+    """actuators giả: insert_many lỗi cho actuator trong fail_ids, các actuator khác vẫn được ghi"""
+
+    def __init__(self, existing=()):
+        self.documents = {document["_id"]: dict(document) for document in existing}
+        self.fail_ids = set()
+        self.updates = []
+
+    def find(self, query):
+        return [document for document in self.documents.values() if document["device_id"] == query["device_id"]]
+
+    def find_one(self, query):
+        return self.documents.get(query["_id"])
+
+    def insert_many(self, documents, ordered=False):
+        errors = []
+        for index, document in enumerate(documents):
+            if document["_id"] in self.fail_ids:
+                errors.append({"index": index, "code": 91, "errmsg": "shutdown in progress"})
+            elif document["_id"] in self.documents:
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+            else:
+                self.documents[document["_id"]] = dict(document)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def bulk_write(self, operations, ordered=False):
+        self.updates.extend(operation._filter["_id"] for operation in operations)
+
+
+@pytest.fixture
+def actuators(monkeypatch):
+    collection = FakeActuators(existing=[{"_id": "act_02", "device_id": "d1", "state": False}])
+    monkeypatch.setattr(metadata_cache_module, "actuators_collection", collection)
+    monkeypatch.setattr(mqtt_ingest, "actuators_collection", collection)
+    metadata_cache.clear()
+    yield collection
+    metadata_cache.clear()
+
+
+def state(actuator_id, value):
+    return {"actuator_id": actuator_id, "state": value, "type": None, "name": None, "pin": 0}
+
+
+def test_failed_actuator_insert_is_not_cached(actuators):
+    actuators.fail_ids = {"act_01"}
+    # act_02 đã có trong DB nhưng metadata cache chưa thấy (ví dụ instance khác vừa tạo)
+    actuators.documents.pop("act_02")
+    metadata_cache.get_actuator("d1", "act_02")
+    actuators.documents["act_02"] = {"_id": "act_02", "device_id": "d1", "state": False}
+
+    mqtt_ingest._apply_actuator_states("d1", [state("act_01", True), state("act_02", True), state("act_03", True)])
+
+    assert metadata_cache.get_actuator("d1", "act_03")["state"] is True
+    assert metadata_cache.get_actuator("d1", "act_02")["state"] is True
+    assert actuators.updates == ["act_02"]
+
+    # act_01 không được cache là tồn tại: message sau tạo lại
+    actuators.fail_ids = set()
+    mqtt_ingest._apply_actuator_states("d1", [state("act_01", True)])
+    assert actuators.documents["act_01"]["state"] is True
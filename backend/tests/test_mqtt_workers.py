@@ -0,0 +1,30 @@
+import threading
+import time
+
+from utils.mqtt_workers import PartitionedWorkerPool
+
+from tests.test_ingest_buffer import wait_for
+
+
+def test_worker_submit_drops_when_partition_stays_full():
+    pool = PartitionedWorkerPool(num_workers=1, queue_size=1, submit_timeout=0.05)
+    release = threading.Event()
+    assert pool.submit("device_01", release.wait, 5)
+    assert wait_for(lambda: pool.get_queue_depth() == 0)
+    assert pool.submit("device_01", lambda: None)
+
+    started = time.monotonic()
+    assert pool.submit("device_01", lambda: None) is False
+    assert time.monotonic() - started < 1.0
+    assert pool.get_stats()["dropped"] == 1
+    release.set()
+    pool.stop()
+
+
+def test_messages_of_one_device_stay_in_order():
+    pool = PartitionedWorkerPool(num_workers=4, queue_size=100)
+    processed = []
+    for i in range(50):
+        assert pool.submit("device_01", processed.append, i)
+    pool.stop()
+    assert processed == list(range(50))
@@ -0,0 +1,35 @@
+import threading
+
+import pytest
+
+from utils.password_hasher import PasswordHasher, PasswordHasherBusy
+
+from tests.test_ingest_buffer import wait_for
+
+
+def test_hash_and_check_round_trip():
+    hasher = PasswordHasher(workers=1, queue_size=0, rounds=4)
+    password_hash = hasher.hash_password("password1")
+    assert password_hash.startswith("$2b$04$")
+    assert hasher.check_password("password1", password_hash)
+    assert not hasher.check_password("password2", password_hash)
+    assert hasher.get_stats()["completed"] == 3
+
+
+def test_rejects_when_workers_and_queue_are_full():
+    hasher = PasswordHasher(workers=1, queue_size=1, rounds=4)
+    release = threading.Event()
+    blocked = [threading.Thread(target=hasher._run, args=(release.wait, 5)) for _ in range(2)]
+    for thread in blocked:
+        thread.start()
+    assert wait_for(lambda: hasher.get_stats()["in_flight"] == 2)
+
+    with pytest.raises(PasswordHasherBusy):
+        hasher.hash_password("password1")
+    assert hasher.get_stats()["rejected"] == 1
+
+    release.set()
+    for thread in blocked:
+        thread.join(timeout=5)
+    assert hasher.get_stats()["in_flight"] == 0
+    assert hasher.check_password("password1", hasher.hash_password("password1"))
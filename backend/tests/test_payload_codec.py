@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from utils.payload_codec import (
+    CODEC_CBOR, CODEC_JSON, CODEC_MSGPACK, PayloadDecodeError, decode_payload_bytes, encode_payload,
+    expand_compact, get_supported_codecs, negotiate_codec
+)
+
+COMPACT = {
+    "s": [["sensor_01", 25.5, 0], ["sensor_04", 1, "motion"], ["sensor_09", 3.2]],
+    "a": [["act_01", True]]
+}
+
+
+def test_negotiate_picks_first_supported_codec():
+    assert negotiate_codec(["zstd", CODEC_CBOR, CODEC_JSON]) == (CODEC_CBOR if CODEC_CBOR in get_supported_codecs() else CODEC_JSON)
+    assert negotiate_codec("MSGPACK") == (CODEC_MSGPACK if CODEC_MSGPACK in get_supported_codecs() else CODEC_JSON)
+    assert negotiate_codec(None) == CODEC_JSON
+    assert negotiate_codec(["zstd"]) == CODEC_JSON
+
+
+def test_expand_compact_carries_sensor_type():
+    data = expand_compact(COMPACT)
+    assert data["sensors"] == [
+        {"sensor_id": "sensor_01", "value": 25.5, "type": "temperature"},
+        {"sensor_id": "sensor_04", "value": 1, "type": "motion"},
+        {"sensor_id": "sensor_09", "value": 3.2}
+    ]
+    assert data["actuators"] == [{"actuator_id": "act_01", "state": True}]
+
+
+def test_expand_compact_object_items_and_unknown_code():
+    data = expand_compact({"s": [{"i": "sensor_02", "v": 60, "t": 1, "unit": "%"}, ["sensor_03", 1, 99]]})
+    assert data["sensors"][0] == {"sensor_id": "sensor_02", "value": 60, "unit": "%", "type": "humidity"}
+    assert data["sensors"][1] == {"sensor_id": "sensor_03", "value": 1, "type": None}
+
+
+def test_json_payload_is_never_expanded():
+    payload = json.dumps({"s": "on", "a": 1, "sensors": [{"sensor_id": "x", "value": 1}]}).encode()
+    for codec in (None, CODEC_JSON, CODEC_MSGPACK, CODEC_CBOR):
+        assert decode_payload_bytes(payload, codec) == {"s": "on", "a": 1, "sensors": [{"sensor_id": "x", "value": 1}]}
+
+
+@pytest.mark.parametrize("codec", [CODEC_MSGPACK, CODEC_CBOR])
+def test_binary_compact_payload_is_expanded(codec):
+    if codec not in get_supported_codecs():
+        pytest.skip(f"{codec} chưa được cài")
+    data = decode_payload_bytes(encode_payload(COMPACT, codec), codec)
+    assert data["sensors"][0] == {"sensor_id": "sensor_01", "value": 25.5, "type": "temperature"}
+    assert "s" not in data
+
+
+def test_invalid_payload_raises_decode_error():
+    with pytest.raises(PayloadDecodeError):
+        decode_payload_bytes(b"{not json", CODEC_JSON)
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import utils.retention as retention_module
+from utils.retention import RetentionManager, RetentionTier
+
+NOW = datetime(2025, 12, 21, 9, 0)
+
+
+def make_tier(days=30):
+    return RetentionTier("raw", None, "timestamp", days, {"motion": 2})
+
+
+class FakeDevices:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def distinct(self, field, query=None):
+        cutoff = (query or {}).get("unlinked_at", {}).get("$lte")
+        return [
+            document[field] for document in self.documents
+            if cutoff is None or (document.get("unlinked_at") is not None and document["unlinked_at"] <= cutoff)
+        ]
+
+
+class FakeLinks:
+    def __init__(self, device_ids):
+        self.device_ids = device_ids
+
+    def distinct(self, field, query=None):
+        wanted = query["device_id"]["$in"] if query else self.device_ids
+        return [device_id for device_id in self.device_ids if device_id in wanted]
+
+
+def test_orphan_rule_is_off_by_default():
+    manager = RetentionManager(orphan_days=0)
+    assert manager._retention_days(make_tier(), "s1", {}, {"s1": "d1"}, {"d1"}) == 30
+
+
+def test_orphan_device_uses_orphan_days():
+    manager = RetentionManager(orphan_days=1)
+    orphans = {"d2"}
+    assert manager._retention_days(make_tier(), "s1", {}, {"s1": "d1"}, orphans) == 30
+    assert manager._retention_days(make_tier(0), "s1", {}, {"s1": "d1"}, orphans) == 0
+    assert manager._retention_days(make_tier(), "s2", {}, {"s2": "d2"}, orphans) == 1
+    assert manager._retention_days(make_tier(0), "s2", {}, {"s2": "d2"}, orphans) == 1
+    assert manager._retention_days(make_tier(), "s3", {"s3": "motion"}, {"s3": "d2"}, orphans) == 1
+    # Sensor không rõ device: không coi là mồ côi
+    assert manager._retention_days(make_tier(), "s4", {}, {}, orphans) == 30
+
+
+def test_orphans_are_devices_unlinked_longer_than_orphan_days(monkeypatch):
+    monkeypatch.setattr(retention_module, "get_vietnam_now_naive", lambda: NOW)
+    monkeypatch.setattr(retention_module, "devices_collection", FakeDevices([
+        {"_id": "never_linked"},
+        {"_id": "linked"},
+        {"_id": "unlinked_recently", "unlinked_at": NOW - timedelta(hours=12)},
+        {"_id": "unlinked_long_ago", "unlinked_at": NOW - timedelta(days=3)},
+        {"_id": "relinked", "unlinked_at": NOW - timedelta(days=3)},
+    ]))
+    monkeypatch.setattr(retention_module, "user_room_devices_collection", FakeLinks(["linked", "relinked"]))
+    manager = RetentionManager(orphan_days=1)
+
+    sensor_devices = {"never_linked", "linked", "unlinked_recently", "unlinked_long_ago", "relinked", "deleted"}
+    assert manager._load_orphan_devices(sensor_devices) == {"unlinked_long_ago", "deleted"}
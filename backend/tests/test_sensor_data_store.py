@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from utils.sensor_data_store import SensorDataStore, decode_cursor, encode_cursor, legacy_reading_id
+
+
+class FakeBuckets:
+    """bulk_write giả cho upsert bucket: {_id, readings.i $nin} + $push / $inc"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.fail_bucket = None
+
+    def bulk_write(self, operations, ordered=False):
+        errors = []
+        for index, operation in enumerate(operations):
+            query, update = operation._filter, operation._doc
+            bucket = self.buckets.get(query["_id"])
+            if query["_id"] == self.fail_bucket:
+                errors.append({"index": index, "code": 2, "errmsg": "bad value"})
+                continue
+            if bucket is not None and {r["i"] for r in bucket["readings"]} & set(query["readings.i"]["$nin"]):
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+                continue
+            if bucket is None:
+                bucket = self.buckets[query["_id"]] = dict(update["$setOnInsert"], readings=[], count=0, sum=0)
+            bucket["readings"] = sorted(bucket["readings"] + update["$push"]["readings"]["$each"], key=lambda r: r["t"])
+            bucket["count"] += update["$inc"]["count"]
+            bucket["sum"] += update["$inc"]["sum"]
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+BASE = datetime(2025, 12, 21, 9, 0)
+
+
+def readings(count, sensor_id="s1"):
+    return [{"sensor_id": sensor_id, "device_id": "d1", "value": 1.0, "timestamp": BASE + timedelta(minutes=10 * i)} for i in range(count)]
+
+
+def test_rewriting_a_batch_does_not_double_count():
+    collection = FakeBuckets()
+    documents = readings(8)
+    assert SensorDataStore.write_buckets(collection, documents[:5]) == 5
+
+    with pytest.raises(BulkWriteError) as error:
+        SensorDataStore.write_buckets(collection, documents)
+    assert [(e["index"], e["code"]) for e in error.value.details["writeErrors"]] == [(i, 11000) for i in range(5)]
+
+    hour_9, hour_10 = collection.buckets["s1:2025122109"], collection.buckets["s1:2025122110"]
+    assert (hour_9["count"], len(hour_9["readings"])) == (6, 6)
+    assert (hour_10["count"], len(hour_10["readings"])) == (2, 2)
+    assert [r["i"] for r in hour_9["readings"]] == [str(d["_id"]) for d in documents[:6]]
+
+
+def test_errors_are_reported_at_input_positions():
+    collection = FakeBuckets()
+    collection.fail_bucket = "s2:2025122109"
+    documents = [readings(1, "s1")[0], readings(1, "s2")[0], readings(2, "s1")[1], readings(1, "s2")[0]]
+    with pytest.raises(BulkWriteError) as error:
+        SensorDataStore.write_buckets(collection, documents)
+    assert [(e["index"], e["code"]) for e in error.value.details["writeErrors"]] == [(1, 2), (3, 2)]
+    assert collection.buckets["s1:2025122109"]["count"] == 2
+
+
+def test_write_keeps_existing_ids_and_assigns_missing_ones():
+    documents = readings(2)
+    documents[0]["_id"] = ObjectId("6761a0000000000000000001")
+    collection = FakeBuckets()
+    SensorDataStore.write_buckets(collection, documents)
+    assert str(documents[0]["_id"]) == "6761a0000000000000000001"
+    assert isinstance(documents[1]["_id"], ObjectId)
+    assert [r["i"] for r in collection.buckets["s1:2025122109"]["readings"]] == [str(d["_id"]) for d in documents]
+
+
+def test_legacy_reading_id_uses_timestamp():
+    assert legacy_reading_id("s1:2025122109", datetime(2025, 12, 21, 9, 5, 7, 123456)) == "s1:2025122109:20251221090507123"
+
+
+@pytest.mark.parametrize("reading_id", [ObjectId("6761a0000000000000000001"), "s1:2025122109:20251221090507123"])
+def test_cursor_round_trip(reading_id):
+    timestamp = datetime(2025, 12, 21, 9, 5, 7, 123000)
+    cursor = encode_cursor({"timestamp": timestamp, "_id": reading_id})
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (timestamp, reading_id)
+    assert type(decode_cursor(cursor)[1]) is type(reading_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "eyJ0IjoieCJ9", "eyJpIjoiMSJ9"])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
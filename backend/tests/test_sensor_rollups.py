@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import utils.sensor_rollups as sensor_rollups
+from utils.sensor_rollups import ClosedPeriodCache, RollupTier, SensorRollups
+
+NOW = datetime(2025, 12, 21, 9, 30)
+
+
+@pytest.fixture(autouse=True)
+def frozen_now(monkeypatch):
+    monkeypatch.setattr(sensor_rollups, "get_vietnam_now_naive", lambda: NOW)
+
+
+def make_rollups(raw_days=7, minute_days=90, hour_days=0, day_days=0):
+    tiers = [
+        RollupTier("day", None, timedelta(days=1), day_days, "%Y%m%d"),
+        RollupTier("minute", None, timedelta(minutes=1), minute_days, "%Y%m%d%H%M"),
+        RollupTier("hour", None, timedelta(hours=1), hour_days, "%Y%m%d%H")
+    ]
+    return SensorRollups(tiers, raw_retention_days=raw_days, enabled=True)
+
+
+def names(segments):
+    return [(tier.name if tier else "raw", start, end) for tier, start, end in segments]
+
+
+def test_choose_tier_picks_coarsest_tier_within_resolution():
+    rollups = make_rollups()
+    start = NOW - timedelta(days=1)
+    assert rollups.choose_tier(start, timedelta(seconds=10)) is None
+    assert rollups.choose_tier(start, timedelta(minutes=5)).name == "minute"
+    assert rollups.choose_tier(start, timedelta(hours=3)).name == "hour"
+    assert rollups.choose_tier(start, timedelta(days=7)).name == "day"
+
+
+def test_choose_tier_skips_expired_tiers():
+    rollups = make_rollups(raw_days=7, minute_days=90)
+    old = NOW - timedelta(days=100)
+    # Tầng minute đã hết hạn tại start: lên tầng hour dù resolution nhỏ hơn
+    assert rollups.choose_tier(old, timedelta(minutes=5)).name == "hour"
+    # Raw đã hết hạn: dùng tầng mịn nhất còn dữ liệu
+    assert rollups.choose_tier(NOW - timedelta(days=30), timedelta(seconds=10)).name == "minute"
+
+
+def test_choose_tier_disabled_uses_raw():
+    rollups = make_rollups()
+    rollups.enabled = False
+    assert rollups.choose_tier(NOW - timedelta(days=1), timedelta(days=1)) is None
+
+
+def test_plan_splits_range_across_tiers():
+    rollups = make_rollups()
+    start, end = datetime(2025, 12, 19, 22, 15, 30), datetime(2025, 12, 21, 9, 20, 10)
+    assert names(rollups.plan(start, end)) == [
+        ("raw", start, datetime(2025, 12, 19, 22, 16)),
+        ("minute", datetime(2025, 12, 19, 22, 16), datetime(2025, 12, 19, 23, 0)),
+        ("hour", datetime(2025, 12, 19, 23, 0), datetime(2025, 12, 20, 0, 0)),
+        ("day", datetime(2025, 12, 20), datetime(2025, 12, 21)),
+        ("hour", datetime(2025, 12, 21), datetime(2025, 12, 21, 9, 0)),
+        ("minute", datetime(2025, 12, 21, 9, 0), datetime(2025, 12, 21, 9, 20)),
+        ("raw", datetime(2025, 12, 21, 9, 20), end)
+    ]
+
+
+def test_plan_widens_to_whole_period_when_finer_tier_expired():
+    rollups = make_rollups(raw_days=1, minute_days=1)
+    start, end = datetime(2025, 12, 10, 6, 30), datetime(2025, 12, 10, 8, 0)
+    # Minute và raw đã hết hạn tại start: lấy cả giờ chứa start
+    assert names(rollups.plan(start, end)) == [("hour", datetime(2025, 12, 10, 6, 0), end)]
+
+
+def test_plan_disabled_returns_single_raw_segment():
+    rollups = make_rollups()
+    rollups.enabled = False
+    start, end = NOW - timedelta(days=3), NOW
+    assert names(rollups.plan(start, end)) == [("raw", start, end)]
+
+
+def test_closed_period_cache_merges_and_expires(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(sensor_rollups.time, "monotonic", lambda: clock[0])
+    cache = ClosedPeriodCache(ttl_seconds=60, max_entries=10)
+    key = ("hour", "temperature", ("d1",))
+    hour_8, hour_9 = datetime(2025, 12, 21, 8), datetime(2025, 12, 21, 9)
+
+    assert cache.get(key) == {}
+    cache.update(key, {hour_8: {"avg": 20.0}})
+    clock[0] = 130.0
+    cache.update(key, {hour_9: None})
+    assert cache.get(key) == {hour_8: {"avg": 20.0}, hour_9: None}
+
+    # Cập nhật entry còn hạn không gia hạn TTL
+    clock[0] = 161.0
+    assert cache.get(key) == {}
+    assert cache.get_stats() == {"entries": 0, "hits": 1, "misses": 2}
+
+
+def test_closed_period_cache_evicts_least_recently_used():
+    cache = ClosedPeriodCache(ttl_seconds=60, max_entries=2)
+    period = {datetime(2025, 12, 21, 8): None}
+    cache.update("a", period)
+    cache.update("b", period)
+    cache.get("a")
+    cache.update("c", period)
+    assert cache.get("b") == {}
+    assert cache.get("a") == period
+    assert cache.get("c") == period
+
+
+class FakeRollupCollection:
+    def __init__(self):
+        self.operations = []
+
+    def bulk_write(self, operations, ordered=False):
+        self.operations.extend(operations)
+
+
+def test_apply_writes_rollups_while_reads_are_disabled():
+    collection = FakeRollupCollection()
+    tier = RollupTier("minute", collection, timedelta(minutes=1), 90, "%Y%m%d%H%M")
+    reading = {"sensor_id": "s1", "device_id": "d1", "sensor_type": "temperature", "value": 25.0, "timestamp": NOW}
+
+    SensorRollups([tier], enabled=False).apply([reading])
+    assert len(collection.operations) == 1
+
+    SensorRollups([tier], enabled=False, write_enabled=False).apply([reading])
+    assert len(collection.operations) == 1
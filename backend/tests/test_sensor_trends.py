@@ -0,0 +1,58 @@
+import json
+from datetime import datetime, timedelta
+
+import controllers.sensor_data_controller as controller
+
+NOW = datetime(2025, 12, 21, 9, 0)
+
+
+class FakeAccess:
+    def has_device(self, device_id):
+        return True
+
+
+class FakeStore:
+    def __init__(self, readings):
+        self.readings = readings
+
+    def iter_readings(self, **query):
+        return iter(self.readings)
+
+
+def get_trends(monkeypatch, readings, **kwargs):
+    monkeypatch.setattr(controller, "get_vietnam_now_naive", lambda: NOW)
+    monkeypatch.setattr(controller.access_control, "get", lambda user_id: FakeAccess())
+    monkeypatch.setattr(controller.sensor_rollups, "choose_tier", lambda start, resolution: None)
+    monkeypatch.setattr(controller, "sensor_data_store", FakeStore(readings))
+    response = controller.get_sensor_trends({"_id": "user_01"}, device_id="device_01", hours=1, **kwargs)
+    return json.loads(response.body)["data"]
+
+
+def test_legacy_key_merges_equivalent_types_within_limit(monkeypatch):
+    start = NOW - timedelta(hours=1)
+    readings = [
+        {"sensor_type": sensor_type, "value": value + minute, "timestamp": start + timedelta(minutes=minute)}
+        for minute in range(60)
+        for sensor_type, value in (("temperature", 20.0), ("temp_outdoor", 10.0))
+    ]
+    data = get_trends(monkeypatch, readings, limit_per_type=10)
+
+    assert len(data["series"]["temperature"]) == 10
+    assert len(data["series"]["temp_outdoor"]) == 10
+    assert len(data["temperature"]) == 10
+    assert [point["timestamp"] for point in data["temperature"]] == sorted(point["timestamp"] for point in data["temperature"])
+    # Khoảng đầu tiên: trung bình của cả hai loại, min / max trải trên cả hai
+    first = data["temperature"][0]
+    assert (first["value"], first["min"], first["max"]) == (17.5, 10.0, 25.0)
+
+
+def test_legacy_key_respects_limit_with_lttb(monkeypatch):
+    start = NOW - timedelta(hours=1)
+    readings = [
+        {"sensor_type": sensor_type, "value": float(minute % 7), "timestamp": start + timedelta(minutes=minute)}
+        for minute in range(60)
+        for sensor_type in ("power", "energy_meter")
+    ]
+    data = get_trends(monkeypatch, readings, limit_per_type=5, method="lttb")
+    assert len(data["energy"]) == 5
+    assert data["count"]["energy"] == 5
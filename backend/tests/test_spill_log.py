@@ -0,0 +1,92 @@
+from datetime import datetime
+
+from utils.circuit_breaker import CircuitBreaker
+from utils.ingest_buffer import SensorDataBuffer
+from utils.spill_log import SpillLog
+
+from tests.test_ingest_buffer import FakeCollection
+
+
+def documents(count, start=0):
+    return [{"sensor_id": "s1", "value": float(i), "timestamp": datetime(2025, 12, 21, 9, 0, i % 60)} for i in range(start, start + count)]
+
+
+def test_append_and_read_round_trip(tmp_path):
+    spill = SpillLog(str(tmp_path / "data.wal"), max_bytes=1 << 20)
+    original = documents(3)
+    assert spill.append(original)
+    assert all("_id" in document for document in original)
+
+    replayed, end_offset = spill.read_batch(10)
+    assert replayed == original
+    assert isinstance(replayed[0]["timestamp"], datetime)
+    assert end_offset == spill.pending_bytes()
+
+
+def test_commit_truncates_when_fully_replayed(tmp_path):
+    path = tmp_path / "data.wal"
+    spill = SpillLog(str(path), max_bytes=1 << 20)
+    spill.append(documents(4))
+
+    first, offset = spill.read_batch(2)
+    spill.commit(offset, len(first))
+    assert spill.pending_bytes() > 0
+    assert (tmp_path / "data.wal.offset").exists()
+
+    # Offset được giữ khi mở lại (ví dụ sau khi process khởi động lại)
+    reopened = SpillLog(str(path), max_bytes=1 << 20)
+    rest, offset = reopened.read_batch(10)
+    assert [document["value"] for document in rest] == [2.0, 3.0]
+
+    reopened.commit(offset, len(rest))
+    assert path.stat().st_size == 0
+    assert not (tmp_path / "data.wal.offset").exists()
+    assert reopened.get_stats()["replayed_documents"] == 2
+
+
+def test_append_rejected_when_over_max_bytes(tmp_path):
+    spill = SpillLog(str(tmp_path / "data.wal"), max_bytes=200)
+    assert not spill.append(documents(10))
+    assert spill.pending_bytes() == 0
+    assert spill.get_stats()["rejected_documents"] == 10
+
+
+def test_partial_last_line_is_not_read(tmp_path):
+    path = tmp_path / "data.wal"
+    spill = SpillLog(str(path), max_bytes=1 << 20)
+    spill.append(documents(1))
+    with open(path, "ab") as f:
+        f.write(b'{"sensor_id": "s1", "val')
+
+    replayed, _ = spill.read_batch(10)
+    assert len(replayed) == 1
+
+
+def test_buffer_spills_overflow_and_replays_without_duplicates(tmp_path):
+    collection = FakeCollection()
+    spill = SpillLog(str(tmp_path / "data.wal"), max_bytes=1 << 20)
+    buffer = SensorDataBuffer(
+        collection,
+        max_batch_size=5,
+        max_queue=5,
+        overflow_policy="spill",
+        spill_log=spill,
+        breaker=CircuitBreaker("test", failure_threshold=100, reset_timeout=0)
+    )
+    # Không chạy thread flush nền: test tự gọi flush() / _replay_spill()
+    buffer.start = lambda: None
+
+    assert buffer.add_many(documents(8))
+    assert buffer.get_queue_depth() == 5
+    assert spill.get_stats()["spilled_documents"] == 3
+
+    buffer.flush()
+    # Giả lập crash sau khi đã ghi một document replay nhưng chưa commit offset
+    pending, _ = spill.read_batch(1)
+    collection.documents[pending[0]["_id"]] = pending[0]
+
+    buffer._replay_spill()
+    assert len(collection.documents) == 8
+    assert spill.pending_bytes() == 0
+    assert buffer.get_stats()["failed"] == 0
+    buffer.stop()
@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+import utils.auth as auth
+
+USER = {"_id": ObjectId("6761a0000000000000000001"), "email": "a@b.co"}
+
+
+class FakeTickets:
+    def __init__(self):
+        self.documents = {}
+
+    def insert_one(self, document):
+        self.documents[document["_id"]] = dict(document)
+
+    def find_one_and_delete(self, query):
+        return self.documents.pop(query["_id"], None)
+
+
+class FakeRefreshTokens:
+    def __init__(self, active=True):
+        self.active = active
+
+    def find_one(self, query, projection=None):
+        return {"_id": 1} if self.active else None
+
+
+@pytest.fixture
+def tickets(monkeypatch):
+    collection = FakeTickets()
+    monkeypatch.setattr(auth, "stream_tickets_collection", collection)
+    monkeypatch.setattr(auth, "_load_user", lambda email, user_id=None: dict(USER))
+    return collection
+
+
+def test_ticket_is_single_use_and_not_the_access_token(tickets):
+    expires_at = int(time.time()) + 600
+    ticket = auth.create_stream_ticket({"user": USER, "expires_at": expires_at})
+    assert ticket not in tickets.documents
+
+    session = auth.consume_stream_ticket(ticket)
+    assert session == {"user": USER, "expires_at": expires_at}
+    with pytest.raises(HTTPException) as error:
+        auth.consume_stream_ticket(ticket)
+    assert error.value.status_code == 401
+
+
+def test_expired_ticket_is_rejected(tickets):
+    ticket = auth.create_stream_ticket({"user": USER, "expires_at": None})
+    for document in tickets.documents.values():
+        document["expires_at"] -= timedelta(seconds=auth.STREAM_TICKET_EXPIRE_SECONDS + 1)
+    with pytest.raises(HTTPException):
+        auth.consume_stream_ticket(ticket)
+
+
+def test_check_stream_session_reasons(monkeypatch, tickets):
+    monkeypatch.setattr(auth, "refresh_tokens_collection", FakeRefreshTokens(active=True))
+    assert auth.check_stream_session({"user": USER, "expires_at": time.time() + 60}) is None
+    assert auth.check_stream_session({"user": USER, "expires_at": time.time() - 1}) == "expired"
+
+    monkeypatch.setattr(auth, "refresh_tokens_collection", FakeRefreshTokens(active=False))
+    assert auth.check_stream_session({"user": USER, "expires_at": time.time() + 60}) == "logged_out"
+
+    def removed(email, user_id=None):
+        raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
+
+    monkeypatch.setattr(auth, "_load_user", removed)
+    assert auth.check_stream_session({"user": USER, "expires_at": time.time() + 60}) == "user_removed"
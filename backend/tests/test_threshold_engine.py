@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import utils.threshold_engine as threshold_module
+from utils.threshold_engine import ThresholdEngine
+
+SENSOR = {"_id": "sensor_01", "name": "Nhiệt độ", "unit": "°C", "max_threshold": 30}
+
+
+class FakeLinks:
+    def __init__(self, user_ids):
+        self.user_ids = user_ids
+
+    def find(self, query, projection=None):
+        return [{"user_id": user_id, "room_id": "room_01"} for user_id in self.user_ids]
+
+
+class FakeNotifications:
+    def __init__(self):
+        self.inserted = []
+
+    def find(self, query, projection=None):
+        return []
+
+    def insert_many(self, documents, ordered=False):
+        self.inserted.extend(documents)
+
+
+class FakeCooldowns:
+    """threshold_cooldowns giả với ngữ nghĩa upsert có điều kiện last_alert $lt"""
+
+    def __init__(self):
+        self.documents = {}
+        self.calls = 0
+
+    def find_one(self, query, projection=None):
+        self.calls += 1
+        return self.documents.get(query["_id"])
+
+    def update_one(self, query, update, upsert=False):
+        self.calls += 1
+        document = self.documents.get(query["_id"])
+        if document is not None and document["last_alert"] >= query["last_alert"]["$lt"]:
+            raise DuplicateKeyError("E11000 duplicate key")
+        self.documents[query["_id"]] = dict(update["$set"], **update.get("$setOnInsert", {}))
+
+    def delete_many(self, query):
+        for key in [key for key, document in self.documents.items() if _matches(key, document, query)]:
+            del self.documents[key]
+
+
+def _matches(key, document, query):
+    if "_id" in query:
+        ids = query["_id"]["$in"] if isinstance(query["_id"], dict) else [query["_id"]]
+        return key in ids
+    return all(document.get(field) == value for field, value in query.items())
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {"value": datetime(2025, 12, 21, 9, 0)}
+    monkeypatch.setattr(threshold_module, "get_vietnam_now_naive", lambda: now["value"])
+    return now
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    notifications = FakeNotifications()
+    cooldowns = FakeCooldowns()
+    monkeypatch.setattr(threshold_module, "user_room_devices_collection", FakeLinks(["user_a", "user_b"]))
+    monkeypatch.setattr(threshold_module, "notifications_collection", notifications)
+    monkeypatch.setattr(threshold_module, "threshold_cooldowns_collection", cooldowns)
+    return notifications, cooldowns
+
+
+def test_value_within_threshold_creates_no_notification(clock, collections):
+    engine = ThresholdEngine(cooldown_minutes=5, shared_cooldown=False)
+    assert engine.evaluate("device_01", SENSOR, 25.0) == []
+    assert engine.get_stats()["breaches"] == 0
+
+
+def test_cooldown_suppresses_repeat_alerts_until_window_ends(clock, collections):
+    engine = ThresholdEngine(cooldown_minutes=5, shared_cooldown=False)
+
+    first = engine.evaluate("device_01", SENSOR, 35.0)
+    assert sorted(n["user_id"] for n in first) == ["user_a", "user_b"]
+
+    clock["value"] += timedelta(minutes=4)
+    assert engine.evaluate("device_01", SENSOR, 36.0) == []
+    assert engine.get_stats()["suppressed"] == 2
+
+    clock["value"] += timedelta(minutes=2)
+    assert len(engine.evaluate("device_01", SENSOR, 36.0)) == 2
+
+
+def test_clear_cooldown_allows_alert_for_that_user_only(clock, collections):
+    engine = ThresholdEngine(cooldown_minutes=5, shared_cooldown=False)
+    engine.evaluate("device_01", SENSOR, 35.0)
+
+    engine.clear_cooldown("user_a", "sensor_01")
+    assert [n["user_id"] for n in engine.evaluate("device_01", SENSOR, 35.0)] == ["user_a"]
+
+
+def test_failed_write_releases_cooldown(clock, collections, monkeypatch):
+    engine = ThresholdEngine(cooldown_minutes=5, shared_cooldown=False)
+
+    class BrokenNotifications(FakeNotifications):
+        def insert_many(self, documents, ordered=False):
+            raise RuntimeError("db down")
+
+    monkeypatch.setattr(threshold_module, "notifications_collection", BrokenNotifications())
+    assert engine.write_notifications(engine.evaluate("device_01", SENSOR, 35.0)) == 0
+    assert len(engine.evaluate("device_01", SENSOR, 35.0)) == 2
+
+
+def test_shared_cooldown_alerts_once_across_instances(clock, collections):
+    _, cooldowns = collections
+    first = ThresholdEngine(cooldown_minutes=5, shared_cooldown=True)
+    second = ThresholdEngine(cooldown_minutes=5, shared_cooldown=True)
+
+    assert len(first.evaluate("device_01", SENSOR, 35.0)) == 2
+    assert second.evaluate("device_01", SENSOR, 35.0) == []
+    assert sorted(cooldowns.documents) == ["user_a:sensor_01", "user_b:sensor_01"]
+
+    # Đọc cảnh báo bỏ cooldown trong DB; instance khác chỉ thấy khi cửa sổ trong RAM hết hạn
+    first.clear_cooldown("user_b")
+    assert "user_b:sensor_01" not in cooldowns.documents
+    assert second.evaluate("device_01", SENSOR, 35.0) == []
+    assert [n["user_id"] for n in first.evaluate("device_01", SENSOR, 35.0)] == ["user_b"]
+
+    clock["value"] += timedelta(minutes=6)
+    assert len(second.evaluate("device_01", SENSOR, 35.0)) == 2
+    assert first.evaluate("device_01", SENSOR, 35.0) == []
+
+
+def test_shared_cooldown_sustained_breach_skips_database(clock, collections):
+    _, cooldowns = collections
+    winner = ThresholdEngine(cooldown_minutes=5, shared_cooldown=True)
+    loser = ThresholdEngine(cooldown_minutes=5, shared_cooldown=True)
+    winner.evaluate("device_01", SENSOR, 35.0)
+    loser.evaluate("device_01", SENSOR, 35.0)
+    calls = cooldowns.calls
+
+    for _ in range(50):
+        clock["value"] += timedelta(seconds=5)
+        assert winner.evaluate("device_01", SENSOR, 35.0) == []
+        assert loser.evaluate("device_01", SENSOR, 35.0) == []
+    assert cooldowns.calls == calls
+
+    # Cửa sổ hết hạn: thử giành lại đúng một lần cho mỗi user
+    clock["value"] += timedelta(minutes=1)
+    assert len(winner.evaluate("device_01", SENSOR, 35.0)) == 2
+    assert cooldowns.calls == calls + 2
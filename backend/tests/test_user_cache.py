@@ -0,0 +1,68 @@
+import pytest
+
+import utils.user_cache as user_cache_module
+from utils.user_cache import UserCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(user_cache_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def user(email="a@b.co", user_id="u1"):
+    return {"_id": user_id, "email": email, "full_name": "A", "password_hash": "$2b$12$secret"}
+
+
+def test_cached_user_has_no_password_hash_and_is_a_copy(clock):
+    cache = UserCache(ttl_seconds=30)
+    cache.put(user())
+    cached = cache.get("a@b.co", "u1")
+    assert cached == {"_id": "u1", "email": "a@b.co", "full_name": "A"}
+    cached["full_name"] = "changed"
+    assert cache.get("a@b.co")["full_name"] == "A"
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = UserCache(ttl_seconds=30)
+    cache.put(user())
+    clock[0] += 29
+    assert cache.get("a@b.co") is not None
+    clock[0] += 2
+    assert cache.get("a@b.co") is None
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_uid_mismatch_drops_entry(clock):
+    cache = UserCache(ttl_seconds=30)
+    cache.put(user(user_id="old"))
+    # Token của user mới tạo lại cùng email
+    assert cache.get("a@b.co", "new") is None
+    assert cache.get("a@b.co") is None
+
+
+def test_invalidate_and_disabled_cache(clock):
+    cache = UserCache(ttl_seconds=30)
+    cache.put(user())
+    cache.invalidate("a@b.co")
+    assert cache.get("a@b.co") is None
+    assert cache.get_stats()["invalidations"] == 1
+
+    disabled = UserCache(ttl_seconds=0)
+    disabled.put(user())
+    assert disabled.get("a@b.co") is None
+
+
+def test_full_cache_evicts_expired_then_oldest(clock):
+    cache = UserCache(ttl_seconds=30, max_entries=2)
+    cache.put(user("a@b.co", "u1"))
+    clock[0] += 20
+    cache.put(user("b@b.co", "u2"))
+    clock[0] += 15
+    # a@b.co đã hết hạn nên bị bỏ trước
+    cache.put(user("c@b.co", "u3"))
+    assert cache.get("b@b.co") is not None and cache.get("c@b.co") is not None
+    cache.put(user("d@b.co", "u4"))
+    assert cache.get_stats()["entries"] == 2
+    assert cache.get("b@b.co") is None
@@ -0,0 +1,152 @@
+"""
+Chỉ mục quyền truy cập của từng user, dùng chung cho mọi controller.
+
+Mỗi user có một UserAccess dựng từ user_room_devices và sensors (2 query):
+    device_rooms:   {device_id: room_id | None}  device user đang liên kết
+    sensor_devices: {sensor_id: device_id}       sensor thuộc các device đó
+
+Kiểm tra quyền trở thành phép thử thuộc tập hợp thay vì 1-3 truy vấn MongoDB.
+- Controllers ghi user_room_devices gọi invalidate_user() ngay sau khi ghi (cùng chỗ gọi
+  threshold_engine.invalidate_device_users)
+- Luồng tạo sensor (MQTT, iot_device) gọi add_sensor() để sensor mới xuất hiện ngay
+- Thay đổi từ process khác (nhiều worker / instance) hoặc script chỉ được thấy khi entry hết
+  TTL: sau khi một liên kết bị gỡ ở process A, process B vẫn cho phép truy cập device đó tối
+  đa ACCESS_CONTROL_TTL_SECONDS giây (mặc định 5). Giữ TTL ngắn vì đây là quyền truy cập;
+  mỗi user đang hoạt động tốn 2 query mỗi TTL
+- Fan-out sự kiện SSE dựa vào threshold_engine.get_device_users (TTL METADATA_CACHE_TTL_SECONDS),
+  nhưng mỗi luồng SSE lọc theo tập device lấy từ đây khi kiểm tra lại session, nên sự kiện
+  của liên kết đã gỡ ngừng tới trình duyệt sau tối đa
+  LIVE_EVENTS_REVALIDATE_SECONDS + ACCESS_CONTROL_TTL_SECONDS giây
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from utils.database import user_room_devices_collection, sensors_collection
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ACCESS_CONTROL_TTL_SECONDS = float(os.getenv("ACCESS_CONTROL_TTL_SECONDS", "5"))
+
+
+class UserAccess:
+    """Quyền của một user tại thời điểm dựng (không sửa trực tiếp, AccessControl thay bản mới)"""
+
+    __slots__ = ("user_id", "device_rooms", "sensor_devices")
+
+    def __init__(self, user_id: str, device_rooms: Dict[str, Optional[str]], sensor_devices: Dict[str, str]):
+        self.user_id = user_id
+        self.device_rooms = device_rooms
+        self.sensor_devices = sensor_devices
+
+    @property
+    def device_ids(self) -> List[str]:
+        return list(self.device_rooms)
+
+    def has_device(self, device_id) -> bool:
+        return str(device_id) in self.device_rooms
+
+    def room_of(self, device_id) -> Optional[str]:
+        return self.device_rooms.get(str(device_id))
+
+    def room_device_ids(self, room_id) -> List[str]:
+        room_id = str(room_id)
+        return [device_id for device_id, device_room in self.device_rooms.items() if device_room == room_id]
+
+    def sensor_device(self, sensor_id) -> Optional[str]:
+        """device_id của sensor nếu user có quyền với sensor, ngược lại None"""
+        return self.sensor_devices.get(str(sensor_id))
+
+    def sensor_ids(self, device_id=None) -> List[str]:
+        if device_id is None:
+            return list(self.sensor_devices)
+        device_id = str(device_id)
+        return [sensor_id for sensor_id, sensor_device in self.sensor_devices.items() if sensor_device == device_id]
+
+
+class AccessControl:
+    def __init__(self, ttl_seconds: float = ACCESS_CONTROL_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # user_id -> (expires_at, UserAccess)
+        self._users: Dict[str, tuple] = {}
+        # Tăng mỗi lần invalidate: kết quả _load() bắt đầu trước đó không được lưu lại
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, user_id) -> UserAccess:
+        user_id = str(user_id)
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+            generation = self._generation
+
+        access = self._load(user_id)
+        with self._lock:
+            if generation == self._generation:
+                self._users[user_id] = (time.monotonic() + self.ttl_seconds, access)
+        return access
+
+    def can_access_device(self, user_id, device_id) -> bool:
+        return self.get(user_id).has_device(device_id)
+
+    # ---------- write-through ----------
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._generation += 1
+            if self._users.pop(str(user_id), None) is not None:
+                self._invalidations += 1
+
+    def add_sensor(self, device_id, sensor_id):
+        """Thêm sensor mới tạo vào chỉ mục của các user đang liên kết với device"""
+        device_id, sensor_id = str(device_id), str(sensor_id)
+        with self._lock:
+            self._generation += 1
+            for user_id, (expires_at, access) in list(self._users.items()):
+                if device_id in access.device_rooms and access.sensor_devices.get(sensor_id) != device_id:
+                    sensor_devices = dict(access.sensor_devices)
+                    sensor_devices[sensor_id] = device_id
+                    self._users[user_id] = (expires_at, UserAccess(user_id, access.device_rooms, sensor_devices))
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._users.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "hits": self._hits,
+            "misses": self._misses,
+            "invalidations": self._invalidations
+        }
+
+    # ---------- nội bộ ----------
+
+    def _load(self, user_id: str) -> UserAccess:
+        device_rooms = {}
+        for link in user_room_devices_collection.find({"user_id": user_id}, {"device_id": 1, "room_id": 1}):
+            if not link.get("device_id"):
+                continue
+            device_id = str(link["device_id"])
+            room_id = link.get("room_id")
+            if room_id is not None or device_id not in device_rooms:
+                device_rooms[device_id] = str(room_id) if room_id is not None else None
+
+        sensor_devices = {}
+        if device_rooms:
+            for sensor in sensors_collection.find({"device_id": {"$in": list(device_rooms)}}, {"device_id": 1}):
+                sensor_devices[str(sensor["_id"])] = str(sensor["device_id"])
+        return UserAccess(user_id, device_rooms, sensor_devices)
+
+
+# Global access control instance
+access_control = AccessControl()
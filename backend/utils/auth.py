@@ -1,11 +1,14 @@
 from jose import jwt, ExpiredSignatureError, JWTError
-from fastapi import Depends, HTTPException, Header, status
+from fastapi import Depends, HTTPException, Header, Query, status
 from datetime import datetime, timedelta
-from utils.database import users_collection, refresh_tokens_collection
+from utils.database import users_collection, refresh_tokens_collection, stream_tickets_collection
 from utils.timezone import get_vietnam_now_naive
+from utils.user_cache import user_cache
+from pymongo import ReturnDocument
 import secrets
 import hashlib
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,6 +17,8 @@ SECRET_KEY = os.environ.get("SECRET_KEY")
 ALGORITHM = os.environ.get("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 15))
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+# Ticket mở luồng SSE: dùng một lần, sống ngắn để không lộ access token trong URL / log
+STREAM_TICKET_EXPIRE_SECONDS = int(os.environ.get("STREAM_TICKET_EXPIRE_SECONDS", 30))
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -88,17 +93,22 @@ def verify_refresh_token(token: str) -> dict:
 
 
 def revoke_refresh_token(token: str):
+    """Thu hồi refresh token, trả về email của user sở hữu token (None nếu không tìm thấy)"""
     try:
         if not token or not token.strip():
-            return
+            return None
             
         token_hash = hashlib.sha256(token.strip().encode()).hexdigest()
-        refresh_tokens_collection.update_one(
+        token_doc = refresh_tokens_collection.find_one_and_update(
             {"token_hash": token_hash},
-            {"$set": {"is_revoked": True}}
+            {"$set": {"is_revoked": True}},
+            projection={"user_email": 1},
+            return_document=ReturnDocument.AFTER
         )
+        return token_doc.get("user_email") if token_doc else None
     except Exception as e:
         print(f"Lỗi thu hồi refresh token: {e}")
+        return None
 
 
 def revoke_all_user_refresh_tokens(user_email: str):
@@ -106,12 +116,17 @@ def revoke_all_user_refresh_tokens(user_email: str):
         {"user_email": user_email, "is_revoked": False},
         {"$set": {"is_revoked": True}}
     )
+    user_cache.invalidate(user_email)
 
 
 def verify_token(token: str):
+    return decode_access_token(token).get("sub")
+
+
+def decode_access_token(token: str) -> dict:
+    """Giải mã access token, trả về toàn bộ claims (sub = email, uid = _id của user)"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload.get("sub")
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -126,19 +141,109 @@ def verify_token(token: str):
         )
 
 
-def get_current_user(Authorization: str = Header(None)):
-    if not Authorization or not Authorization.startswith("Bearer "):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Thiếu hoặc sai header Authorization",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+def _unauthorized(detail: str):
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
 
-    token = Authorization.split(" ")[1]
-    email = verify_token(token)
-    user = users_collection.find_one({"email": email})
 
+def _load_user(email: str, user_id=None) -> dict:
+    """User theo email (qua user_cache), 401 nếu token cấp cho user khác cùng email"""
+    user = user_cache.get(email, user_id)
+    if user is not None:
+        return user
+
+    user = users_collection.find_one({"email": email}, {"password_hash": 0})
     if not user:
         raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
 
+    if user_id is not None and str(user["_id"]) != str(user_id):
+        # Token cấp cho một user cũ cùng email đã bị xóa
+        raise _unauthorized("Token không hợp lệ")
+
+    user_cache.put(user)
     return user
+
+
+def get_current_session(Authorization: str = Header(None)) -> dict:
+    """{"user", "expires_at"}: user của access token và thời điểm token hết hạn (epoch giây)"""
+    if not Authorization or not Authorization.startswith("Bearer "):
+        raise _unauthorized("Thiếu hoặc sai header Authorization")
+
+    token = Authorization.split(" ")[1]
+    claims = decode_access_token(token)
+    return {"user": _load_user(claims.get("sub"), claims.get("uid")), "expires_at": claims.get("exp")}
+
+
+def get_current_user(Authorization: str = Header(None)):
+    return get_current_session(Authorization)["user"]
+
+
+# ==========================
+# Ticket cho luồng SSE
+# ==========================
+def create_stream_ticket(session: dict) -> str:
+    """
+    Ticket ngẫu nhiên đổi được đúng một lần lấy luồng /events/stream trong
+    STREAM_TICKET_EXPIRE_SECONDS giây; luồng không sống lâu hơn access token đã cấp ticket
+    """
+    ticket = secrets.token_urlsafe(32)
+    user = session["user"]
+    stream_tickets_collection.insert_one({
+        "_id": hashlib.sha256(ticket.encode()).hexdigest(),
+        "user_email": user["email"],
+        "user_id": str(user["_id"]),
+        "session_expires_at": session["expires_at"],
+        "expires_at": get_vietnam_now_naive() + timedelta(seconds=STREAM_TICKET_EXPIRE_SECONDS)
+    })
+    return ticket
+
+
+def consume_stream_ticket(ticket: str) -> dict:
+    """Đổi ticket lấy session {"user", "expires_at"}; ticket bị xóa ngay nên không dùng lại được"""
+    if not ticket or not ticket.strip():
+        raise _unauthorized("Ticket không hợp lệ")
+    ticket_doc = stream_tickets_collection.find_one_and_delete(
+        {"_id": hashlib.sha256(ticket.strip().encode()).hexdigest()}
+    )
+    if not ticket_doc or ticket_doc["expires_at"] < get_vietnam_now_naive():
+        raise _unauthorized("Ticket không hợp lệ hoặc đã hết hạn")
+    return {
+        "user": _load_user(ticket_doc["user_email"], ticket_doc["user_id"]),
+        "expires_at": ticket_doc.get("session_expires_at")
+    }
+
+
+def get_stream_session(ticket: str = Query(None), Authorization: str = Header(None)) -> dict:
+    """
+    Session cho /events/stream: ?ticket= (EventSource không gửi được header) hoặc header
+    Authorization: Bearer. Không nhận access token qua query vì URL bị ghi vào log
+    """
+    if ticket:
+        return consume_stream_ticket(ticket)
+    return get_current_session(Authorization)
+
+
+def check_stream_session(session: dict):
+    """
+    Kiểm tra lại session của luồng SSE đang mở, trả về lý do cần đóng luồng hoặc None:
+    "expired" (access token đã hết hạn), "user_removed" (user bị xóa / tạo lại cùng email),
+    "logged_out" (user không còn refresh token nào hiệu lực)
+    """
+    expires_at = session.get("expires_at")
+    if expires_at is not None and time.time() >= expires_at:
+        return "expired"
+    user = session["user"]
+    try:
+        _load_user(user["email"], user["_id"])
+    except HTTPException:
+        return "user_removed"
+    active_token = refresh_tokens_collection.find_one(
+        {"user_email": user["email"], "is_revoked": False, "expires_at": {"$gt": get_vietnam_now_naive()}},
+        {"_id": 1}
+    )
+    if active_token is None:
+        return "logged_out"
+    return None
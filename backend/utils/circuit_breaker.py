@@ -0,0 +1,71 @@
+"""
+Circuit breaker đơn giản cho các thao tác ghi MongoDB chạy nền.
+
+- closed: cho phép ghi; đủ failure_threshold lỗi liên tiếp thì chuyển sang open
+- open: từ chối ghi trong reset_timeout giây để không dồn thêm tải lên DB đang lỗi
+- half_open: hết reset_timeout thì cho phép thử lại; thành công -> closed, lỗi -> open
+"""
+import threading
+import time
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trips = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def allow_request(self) -> bool:
+        """True nếu được phép thử ghi lúc này"""
+        with self._lock:
+            return self._current_state() != STATE_OPEN
+
+    def retry_after(self) -> float:
+        """Số giây còn lại trước khi được thử lại (0 nếu không bị open)"""
+        with self._lock:
+            if self._current_state() != STATE_OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self._state = STATE_CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            self._failures += 1
+            if state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+                if state != STATE_OPEN:
+                    self._trips += 1
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                "trips": self._trips
+            }
+
+    def _current_state(self) -> str:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = STATE_HALF_OPEN
+        return self._state
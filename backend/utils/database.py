@@ -19,23 +19,18 @@ user_room_devices_collection = db["user_room_devices"]
 sensors_collection = db["sensors"]
 actuators_collection = db["actuators"]
 sensor_data_collection = db["sensor_data"]
+sensor_data_buckets_collection = db["sensor_data_buckets"]
+sensor_rollups_minute_collection = db["sensor_rollups_minute"]
+sensor_rollups_hour_collection = db["sensor_rollups_hour"]
+sensor_rollups_day_collection = db["sensor_rollups_day"]
+sensor_latest_collection = db["sensor_latest"]
+room_summaries_collection = db["room_summaries"]
 notifications_collection = db["notifications"]
 refresh_tokens_collection = db["refresh_tokens"]
+threshold_cooldowns_collection = db["threshold_cooldowns"]
+stream_tickets_collection = db["stream_tickets"]
 
-try:
-    user_room_devices_collection.create_index([("user_id", 1), ("room_id", 1), ("device_id", 1)], unique=True)
-    user_room_devices_collection.create_index([("user_id", 1)])
-    user_room_devices_collection.create_index([("room_id", 1)])
-    user_room_devices_collection.create_index([("device_id", 1)])
-except Exception as e:
-    pass
-
-try:
-    refresh_tokens_collection.create_index([("token_hash", 1)], unique=True)
-    refresh_tokens_collection.create_index([("user_email", 1)])
-    refresh_tokens_collection.create_index([("expires_at", 1)], expireAfterSeconds=0)
-except Exception as e:
-    pass
+# Index được quản lý tập trung trong utils/indexes.py (apply_indexes khi startup)
 
 
 def sanitize_for_json(obj: Any) -> Any:
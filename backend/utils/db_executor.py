@@ -0,0 +1,49 @@
+"""
+Chạy controller đồng bộ (pymongo) trong thread pool có giới hạn để route async không chặn
+event loop của uvicorn trong lúc chờ MongoDB.
+
+- Route gọi: return await run_db(controller.func, *args, **kwargs)
+- Tối đa DB_THREADPOOL_SIZE controller chạy đồng thời, request vượt quá chờ trong event loop
+  (không chiếm thread); nên để nhỏ hơn maxPoolSize của MongoClient (mặc định 100) để thread
+  không phải chờ connection. Mặc định 32 chọn theo benchmarks/dashboard_concurrency_benchmark.py
+  (100 client x 2 lượt, MongoDB giả lập round-trip 5 ms): p99 8 -> 612 ms, 32 -> 240 ms,
+  64 -> 240 ms; đo lại với MongoDB thật của môi trường triển khai trước khi đổi
+- Limiter riêng, không dùng chung thread pool mặc định của anyio mà FastAPI dùng cho
+  dependency đồng bộ (get_current_user), nên xác thực không bị xếp hàng sau truy vấn chậm
+"""
+import functools
+import os
+from typing import Callable, Optional
+
+import anyio
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", "32"))
+
+# Tạo khi dùng lần đầu vì CapacityLimiter cần event loop đang chạy
+_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+def _get_limiter() -> anyio.CapacityLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(DB_THREADPOOL_SIZE)
+    return _limiter
+
+
+async def run_db(func: Callable, *args, **kwargs):
+    """Gọi func(*args, **kwargs) trong thread pool truy cập DB và chờ kết quả"""
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=_get_limiter())
+
+
+def get_stats() -> dict:
+    if _limiter is None:
+        return {"size": DB_THREADPOOL_SIZE, "busy": 0, "waiting": 0}
+    statistics = _limiter.statistics()
+    return {
+        "size": int(_limiter.total_tokens),
+        "busy": statistics.borrowed_tokens,
+        "waiting": statistics.tasks_waiting
+    }
@@ -0,0 +1,283 @@
+"""
+Bảng last_seen / trạng thái online của device trong bộ nhớ.
+
+- Mỗi message dữ liệu chỉ cập nhật bảng trong RAM
+- Chỉ ghi MongoDB ngay lập tức khi device chuyển offline -> online (hoặc ngược lại)
+- last_seen được gom lại và ghi định kỳ bằng một bulk_write duy nhất
+- check_offline() đọc trực tiếp từ bảng này thay vì quét collection devices
+- Listener đăng ký qua add_listener() nhận (device_ids, status) mỗi khi device chuyển trạng thái
+
+Khi chạy nhiều instance với MQTT_SHARED_GROUP, broker chia message của cùng một device cho
+nhiều instance nên bảng trong RAM của mỗi process chỉ thấy một phần. Khi đó (shared=True):
+- check_offline() ghi last_seen của process trước rồi chỉ dựa vào DB: device chỉ bị đánh dấu
+  offline bằng update có điều kiện (status online và last_seen cũ hơn timeout) nên không
+  instance nào đánh dấu offline device mà instance khác vừa nhận message
+- Chuyển online là update có điều kiện status != online; chỉ instance ghi thành công gửi
+  thông báo. Device đã online trong RAM được kiểm tra lại với DB tối đa mỗi flush_interval
+  giây để thấy trạng thái offline do instance khác ghi
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from pymongo import UpdateOne
+from utils.database import devices_collection
+from utils.room_summary import room_summary
+from utils.live_events import live_events
+from utils.timezone import get_vietnam_now_naive
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEVICE_LAST_SEEN_FLUSH_INTERVAL = float(os.getenv("DEVICE_LAST_SEEN_FLUSH_INTERVAL", "15"))
+DEVICE_PRESENCE_SHARED = bool(os.getenv("MQTT_SHARED_GROUP", "").strip())
+
+
+class DevicePresenceTracker:
+    def __init__(self, flush_interval: float = DEVICE_LAST_SEEN_FLUSH_INTERVAL, shared: bool = DEVICE_PRESENCE_SHARED):
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._last_seen = {}
+        self._status = {}
+        self._dirty = set()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._flushes = 0
+        self._transitions = 0
+        self._listeners: List[Callable[[List[str], str], None]] = []
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="device-last-seen", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def mark_seen(self, device_id: str, status_hint: Optional[str] = None, persist: bool = True):
+        """
+        Ghi nhận device vừa gửi message.
+
+        Args:
+            status_hint: trạng thái đang lưu trong DB (ví dụ từ metadata cache), dùng khi
+                device chưa có trong bảng để tránh ghi thừa sau khi khởi động lại
+            persist: False nếu caller đã tự ghi status/last_seen vào DB
+        """
+        device_id = str(device_id)
+        now = get_vietnam_now_naive()
+        with self._lock:
+            previous = self._status.get(device_id, status_hint)
+            previous_seen = self._last_seen.get(device_id)
+            self._last_seen[device_id] = now
+            self._status[device_id] = "online"
+            came_online = previous != "online"
+            # Shared group: instance khác có thể đã đánh dấu offline khi process này không nhận message của device
+            recheck = (
+                self.shared and persist and not came_online
+                and (previous_seen is None or (now - previous_seen).total_seconds() >= self.flush_interval)
+            )
+            if (came_online or recheck) and persist:
+                self._dirty.discard(device_id)
+            else:
+                self._dirty.add(device_id)
+
+        if (came_online or recheck) and persist:
+            query = {"_id": device_id}
+            if self.shared:
+                query["status"] = {"$ne": "online"}
+            try:
+                result = devices_collection.update_one(
+                    query,
+                    {"$set": {"status": "online", "last_seen": now, "updated_at": now}}
+                )
+            except Exception as e:
+                logger.error(f"Lỗi cập nhật trạng thái online cho device {device_id}: {str(e)}")
+                with self._lock:
+                    # Lần message sau sẽ thử ghi lại
+                    self._status[device_id] = previous
+                    self._dirty.add(device_id)
+                return
+            if self.shared and not result.modified_count:
+                # Đã online trong DB (instance khác ghi trước): last_seen được ghi gộp như bình thường
+                with self._lock:
+                    self._dirty.add(device_id)
+                return
+            self._transitions += 1
+            came_online = True
+        if came_online:
+            self._notify([device_id], "online")
+
+    def mark_offline(self, device_id: str):
+        """Đánh dấu device offline (LWT) và ghi ngay vào DB"""
+        device_id = str(device_id)
+        now = get_vietnam_now_naive()
+        with self._lock:
+            self._status[device_id] = "offline"
+            self._dirty.discard(device_id)
+        self._transitions += 1
+        devices_collection.update_one(
+            {"_id": device_id},
+            {"$set": {"status": "offline", "updated_at": now}}
+        )
+        self._notify([device_id], "offline")
+
+    def add_listener(self, listener: Callable[[List[str], str], None]):
+        """Đăng ký hàm nhận (device_ids, status) khi device chuyển online / offline"""
+        self._listeners.append(listener)
+
+    def get_last_seen(self, device_id: str) -> Optional[datetime]:
+        return self._last_seen.get(str(device_id))
+
+    def get_status(self, device_id: str) -> Optional[str]:
+        return self._status.get(str(device_id))
+
+    def flush(self) -> int:
+        """Ghi last_seen của các device đã thay đổi bằng một bulk_write"""
+        with self._lock:
+            dirty = [(device_id, self._last_seen[device_id]) for device_id in self._dirty]
+            self._dirty.clear()
+        if not dirty:
+            return 0
+
+        operations = [
+            UpdateOne({"_id": device_id}, {"$max": {"last_seen": last_seen, "updated_at": last_seen}})
+            for device_id, last_seen in dirty
+        ]
+        try:
+            devices_collection.bulk_write(operations, ordered=False)
+            self._flushes += 1
+        except Exception as e:
+            logger.error(f"Lỗi ghi last_seen cho {len(operations)} device: {str(e)}")
+            with self._lock:
+                self._dirty.update(device_id for device_id, _ in dirty)
+            return 0
+        return len(operations)
+
+    def check_offline(self, timeout_minutes: int = 5) -> List[str]:
+        """
+        Đánh dấu offline các device không gửi message trong timeout_minutes.
+        Device đang theo dõi được kiểm tra từ bảng trong RAM; device online trong DB nhưng
+        chưa từng gửi message tới process này (ví dụ sau khi khởi động lại) được kiểm tra qua DB.
+        Với shared=True chỉ dựa vào last_seen trong DB (xem docstring của module).
+        """
+        now = get_vietnam_now_naive()
+        threshold = now - timedelta(minutes=timeout_minutes)
+        if self.shared:
+            return self._check_offline_shared(now, threshold)
+
+        with self._lock:
+            tracked_ids = list(self._status.keys())
+            stale_ids = [
+                device_id for device_id, status in self._status.items()
+                if status == "online" and self._last_seen.get(device_id, threshold) <= threshold
+            ]
+
+        untracked = devices_collection.find(
+            {
+                "_id": {"$nin": tracked_ids},
+                "status": "online",
+                "$or": [
+                    {"last_seen": {"$exists": False}},
+                    {"last_seen": {"$lt": threshold}}
+                ]
+            },
+            {"_id": 1}
+        )
+        offline_ids = stale_ids + [str(device["_id"]) for device in untracked]
+        if not offline_ids:
+            return []
+
+        devices_collection.update_many(
+            {"_id": {"$in": offline_ids}},
+            {"$set": {"status": "offline", "updated_at": now}}
+        )
+        # Message đến giữa lúc lấy danh sách và lúc ghi: device vẫn online trong RAM nên
+        # mark_seen không ghi lại, phải tự ghi trả status online và không gửi sự kiện offline
+        with self._lock:
+            revived_ids = [device_id for device_id in offline_ids if self._last_seen.get(device_id, threshold) > threshold]
+            offline_ids = [device_id for device_id in offline_ids if self._last_seen.get(device_id, threshold) <= threshold]
+            for device_id in offline_ids:
+                self._status[device_id] = "offline"
+        if revived_ids:
+            devices_collection.update_many(
+                {"_id": {"$in": revived_ids}, "status": "offline"},
+                {"$set": {"status": "online", "updated_at": now}}
+            )
+        if not offline_ids:
+            return []
+        self._transitions += len(offline_ids)
+        self._notify(offline_ids, "offline")
+        return offline_ids
+
+    def _check_offline_shared(self, now: datetime, threshold: datetime) -> List[str]:
+        # last_seen của process này phải nằm trong DB trước khi so sánh
+        self.flush()
+        stale = {
+            "status": "online",
+            "$or": [
+                {"last_seen": {"$exists": False}},
+                {"last_seen": {"$lt": threshold}}
+            ]
+        }
+        offline_ids = []
+        for device in devices_collection.find(stale, {"_id": 1}):
+            device_id = str(device["_id"])
+            if self._last_seen.get(device_id, threshold) > threshold:
+                # Vừa nhận message nhưng last_seen chưa ghi được (flush lỗi)
+                continue
+            result = devices_collection.update_one(
+                {"_id": device["_id"], **stale},
+                {"$set": {"status": "offline", "updated_at": now}}
+            )
+            if result.modified_count:
+                offline_ids.append(device_id)
+        if not offline_ids:
+            return []
+
+        with self._lock:
+            for device_id in offline_ids:
+                if self._last_seen.get(device_id, threshold) <= threshold:
+                    self._status[device_id] = "offline"
+        self._transitions += len(offline_ids)
+        self._notify(offline_ids, "offline")
+        return offline_ids
+
+    def get_stats(self) -> dict:
+        return {
+            "shared": self.shared,
+            "tracked_devices": len(self._status),
+            "online": sum(1 for status in self._status.values() if status == "online"),
+            "pending_last_seen": len(self._dirty),
+            "flushes": self._flushes,
+            "transitions": self._transitions
+        }
+
+    def _notify(self, device_ids: List[str], status: str):
+        for listener in self._listeners:
+            try:
+                listener(device_ids, status)
+            except Exception as e:
+                logger.error(f"Lỗi listener trạng thái device: {str(e)}")
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Lỗi flush last_seen: {str(e)}")
+
+
+# Global device presence tracker instance
+device_presence = DevicePresenceTracker()
+device_presence.add_listener(room_summary.apply_presence)
+device_presence.add_listener(live_events.publish_device_status)
@@ -0,0 +1,104 @@
+"""
+Giảm số điểm dữ liệu cho biểu đồ (trends) với bộ nhớ giới hạn.
+
+- BucketAccumulator: gom reading / rollup theo (sensor_type, khoảng resolution) trong một
+  lượt duyệt, mỗi khoảng giữ count / sum / min / max nên đỉnh và đáy không bị mất
+  như khi lấy mỗi điểm thứ N; bộ nhớ tỉ lệ với số khoảng chứ không với số reading
+- lttb(): Largest-Triangle-Three-Buckets trên chuỗi điểm đã gom, giữ hình dạng đường cong
+  với đúng threshold điểm
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+
+class BucketAccumulator:
+    def __init__(self, origin: datetime, resolution: timedelta):
+        self.origin = origin
+        self.resolution = resolution
+        # (sensor_type, bucket_start) -> [count, sum, min, max]
+        self._buckets: Dict[tuple, list] = {}
+
+    def bucket_start(self, timestamp: datetime) -> datetime:
+        return self.origin + self.resolution * ((timestamp - self.origin) // self.resolution)
+
+    def add(self, sensor_type: Optional[str], timestamp: datetime, count: int, total: float, minimum: float, maximum: float):
+        if not count:
+            return
+        key = (sensor_type, self.bucket_start(timestamp))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [count, total, minimum, maximum]
+            return
+        bucket[0] += count
+        bucket[1] += total
+        bucket[2] = min(bucket[2], minimum)
+        bucket[3] = max(bucket[3], maximum)
+
+    def add_readings(self, readings: Iterable[dict]):
+        """Duyệt cursor reading ({sensor_type, value, timestamp}) mà không giữ lại reading nào"""
+        for reading in readings:
+            value = reading.get("value")
+            timestamp = reading.get("timestamp")
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or not isinstance(timestamp, datetime):
+                continue
+            self.add(reading.get("sensor_type"), timestamp, 1, value, value, value)
+
+    def points(self) -> List[dict]:
+        """Danh sách điểm {sensor_type, timestamp, value (trung bình), min, max, count} theo thời gian"""
+        return sorted(
+            (
+                {
+                    "sensor_type": sensor_type,
+                    "timestamp": bucket_start,
+                    "value": total / count,
+                    "min": minimum,
+                    "max": maximum,
+                    "count": count
+                }
+                for (sensor_type, bucket_start), (count, total, minimum, maximum) in self._buckets.items()
+            ),
+            key=lambda point: point["timestamp"]
+        )
+
+
+def lttb(points: List[dict], threshold: int) -> List[dict]:
+    """
+    Chọn threshold điểm từ points (đã sắp xếp theo timestamp) bằng thuật toán
+    Largest-Triangle-Three-Buckets; luôn giữ điểm đầu và điểm cuối
+    """
+    if threshold >= len(points):
+        return list(points)
+    if threshold < 3:
+        return [points[0], points[-1]][:max(threshold, 0)]
+
+    origin = points[0]["timestamp"]
+    xs = [(point["timestamp"] - origin).total_seconds() for point in points]
+    ys = [point["value"] for point in points]
+
+    sampled = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+    selected = 0
+    for i in range(threshold - 2):
+        # Trung bình của bucket kế tiếp
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(points))
+        next_len = max(1, next_end - next_start)
+        avg_x = sum(xs[next_start:next_end]) / next_len
+        avg_y = sum(ys[next_start:next_end]) / next_len
+
+        # Điểm trong bucket hiện tại tạo tam giác lớn nhất với điểm đã chọn và trung bình bucket sau
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax, ay = xs[selected], ys[selected]
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        selected = best
+
+    sampled.append(points[-1])
+    return sampled
@@ -0,0 +1,198 @@
+"""
+Danh mục index cho tất cả collection và các dạng truy vấn (query shape) mà chúng phục vụ.
+
+- INDEX_CATALOG: index cần có cho từng collection, được apply_indexes() tạo khi startup
+  (create_indexes idempotent: index đã tồn tại với cùng key/option sẽ được bỏ qua)
+- QUERY_SHAPES: các truy vấn controllers / utils thực sự dùng; scripts/verify_query_plans.py
+  chạy explain() trên từng shape và báo lỗi nếu có COLLSCAN hoặc SORT trong bộ nhớ.
+  Khi thêm truy vấn mới trên collection lớn, thêm shape tương ứng vào đây.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+logger = logging.getLogger(__name__)
+
+INDEX_CATALOG: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True),
+    ],
+    "rooms": [
+        IndexModel([("user_id", ASCENDING), ("name", ASCENDING)]),
+    ],
+    "devices": [
+        IndexModel([("device_id", ASCENDING)], sparse=True),
+        IndexModel([("status", ASCENDING), ("last_seen", ASCENDING)]),
+    ],
+    "user_room_devices": [
+        IndexModel([("user_id", ASCENDING), ("room_id", ASCENDING), ("device_id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING)]),
+        IndexModel([("room_id", ASCENDING)]),
+        IndexModel([("device_id", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("device_id", ASCENDING)]),
+    ],
+    "sensors": [
+        IndexModel([("device_id", ASCENDING)]),
+    ],
+    "actuators": [
+        IndexModel([("device_id", ASCENDING)]),
+    ],
+    "sensor_data": [
+        # _id ở cuối để phân trang keyset (timestamp, _id) không phải sắp xếp trong bộ nhớ
+        IndexModel([("sensor_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("device_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("device_id", ASCENDING), ("sensor_type", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "sensor_data_buckets": [
+        IndexModel([("sensor_id", ASCENDING), ("bucket_start", DESCENDING)]),
+        IndexModel([("device_id", ASCENDING), ("bucket_start", DESCENDING)]),
+        IndexModel([("device_id", ASCENDING), ("sensor_type", ASCENDING), ("bucket_start", DESCENDING)]),
+    ],
+    "sensor_rollups_minute": [
+        IndexModel([("sensor_id", ASCENDING), ("period_start", DESCENDING)]),
+        IndexModel([("device_id", ASCENDING), ("period_start", DESCENDING)]),
+    ],
+    "sensor_rollups_hour": [
+        IndexModel([("sensor_id", ASCENDING), ("period_start", DESCENDING)]),
+        IndexModel([("device_id", ASCENDING), ("period_start", DESCENDING)]),
+    ],
+    "sensor_rollups_day": [
+        IndexModel([("sensor_id", ASCENDING), ("period_start", DESCENDING)]),
+        IndexModel([("device_id", ASCENDING), ("period_start", DESCENDING)]),
+    ],
+    "room_summaries": [
+        IndexModel([("device_ids", ASCENDING)]),
+    ],
+    "notifications": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("read", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("sensor_id", ASCENDING), ("user_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("message_id", ASCENDING)]),
+    ],
+    "refresh_tokens": [
+        IndexModel([("token_hash", ASCENDING)], unique=True),
+        IndexModel([("user_email", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "threshold_cooldowns": [
+        IndexModel([("sensor_id", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "stream_tickets": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+_SAMPLE_ID = "sample"
+_SAMPLE_IDS = ["sample_1", "sample_2"]
+_SAMPLE_TIME = datetime(2025, 1, 1)
+
+# collection, filter, sort (tùy chọn) hoặc pipeline cho aggregate
+QUERY_SHAPES: List[dict] = [
+    {"name": "users by email", "collection": "users", "filter": {"email": _SAMPLE_ID}},
+    {"name": "rooms of user", "collection": "rooms", "filter": {"user_id": _SAMPLE_ID}},
+    {"name": "room by name", "collection": "rooms", "filter": {"name": _SAMPLE_ID, "user_id": _SAMPLE_ID}},
+    {"name": "devices by legacy device_id", "collection": "devices", "filter": {"device_id": {"$in": _SAMPLE_IDS}}},
+    {"name": "online devices past timeout", "collection": "devices", "filter": {"status": "online", "last_seen": {"$lt": _SAMPLE_TIME}}},
+    {"name": "links of user", "collection": "user_room_devices", "filter": {"user_id": _SAMPLE_ID}},
+    {"name": "link of user and device", "collection": "user_room_devices", "filter": {"user_id": _SAMPLE_ID, "device_id": _SAMPLE_ID}},
+    {"name": "links of device", "collection": "user_room_devices", "filter": {"device_id": _SAMPLE_ID}},
+    {"name": "links of room", "collection": "user_room_devices", "filter": {"user_id": _SAMPLE_ID, "room_id": _SAMPLE_ID}},
+    {"name": "sensors of devices", "collection": "sensors", "filter": {"device_id": {"$in": _SAMPLE_IDS}}},
+    {"name": "actuators of devices", "collection": "actuators", "filter": {"device_id": {"$in": _SAMPLE_IDS}}},
+    {
+        "name": "readings of sensor (newest first)", "collection": "sensor_data",
+        "filter": {"sensor_id": _SAMPLE_ID, "timestamp": {"$gte": _SAMPLE_TIME}}, "sort": [("timestamp", DESCENDING), ("_id", DESCENDING)]
+    },
+    {
+        "name": "readings of devices (newest first)", "collection": "sensor_data",
+        "filter": {"device_id": {"$in": _SAMPLE_IDS}}, "sort": [("timestamp", DESCENDING), ("_id", DESCENDING)]
+    },
+    {
+        "name": "readings of devices after cursor", "collection": "sensor_data",
+        "filter": {
+            "device_id": {"$in": _SAMPLE_IDS},
+            "timestamp": {"$lte": _SAMPLE_TIME},
+            "$or": [{"timestamp": {"$lt": _SAMPLE_TIME}}, {"timestamp": _SAMPLE_TIME, "_id": {"$lt": _SAMPLE_ID}}]
+        },
+        "sort": [("timestamp", DESCENDING), ("_id", DESCENDING)]
+    },
+    {
+        "name": "readings of devices since (trends)", "collection": "sensor_data",
+        "filter": {"device_id": {"$in": _SAMPLE_IDS}, "timestamp": {"$gte": _SAMPLE_TIME}}, "sort": [("timestamp", ASCENDING)]
+    },
+    {
+        "name": "readings of devices in range (export)", "collection": "sensor_data",
+        "filter": {"device_id": {"$in": _SAMPLE_IDS}, "timestamp": {"$gte": _SAMPLE_TIME}},
+        "sort": [("timestamp", ASCENDING), ("_id", ASCENDING)]
+    },
+    {
+        "name": "readings of devices by type", "collection": "sensor_data",
+        "filter": {"device_id": {"$in": _SAMPLE_IDS}, "sensor_type": "temperature", "timestamp": {"$gte": _SAMPLE_TIME}},
+        "sort": [("timestamp", DESCENDING), ("_id", DESCENDING)]
+    },
+    {"name": "latest value of sensors", "collection": "sensor_latest", "filter": {"_id": {"$in": _SAMPLE_IDS}}},
+    {"name": "room summaries containing device", "collection": "room_summaries", "filter": {"device_ids": _SAMPLE_ID}},
+    {
+        "name": "latest reading per sensor (seed)", "collection": "sensor_data",
+        "pipeline": [
+            {"$match": {"sensor_id": {"$in": _SAMPLE_IDS}}},
+            {"$sort": {"sensor_id": 1, "timestamp": -1}},
+            {"$group": {"_id": "$sensor_id", "latest_data": {"$first": "$$ROOT"}}}
+        ]
+    },
+    {
+        "name": "retention purge batch", "collection": "sensor_data",
+        "filter": {"sensor_id": _SAMPLE_ID, "timestamp": {"$lt": _SAMPLE_TIME}}
+    },
+    {
+        "name": "buckets of sensor", "collection": "sensor_data_buckets",
+        "filter": {"sensor_id": _SAMPLE_ID, "bucket_start": {"$gte": _SAMPLE_TIME}}, "sort": [("bucket_start", DESCENDING)]
+    },
+    {
+        "name": "buckets of devices", "collection": "sensor_data_buckets",
+        "filter": {"device_id": {"$in": _SAMPLE_IDS}, "bucket_start": {"$gte": _SAMPLE_TIME}}, "sort": [("bucket_start", DESCENDING)]
+    },
+    {
+        "name": "rollup statistics of devices", "collection": "sensor_rollups_hour",
+        "filter": {"device_id": {"$in": _SAMPLE_IDS}, "period_start": {"$gte": _SAMPLE_TIME, "$lt": datetime(2025, 1, 2)}}
+    },
+    {
+        "name": "rollup series of devices", "collection": "sensor_rollups_minute",
+        "filter": {"device_id": {"$in": _SAMPLE_IDS}, "period_start": {"$gte": _SAMPLE_TIME}}, "sort": [("period_start", ASCENDING)]
+    },
+    {
+        "name": "notifications of user", "collection": "notifications",
+        "filter": {"user_id": _SAMPLE_ID}, "sort": [("created_at", DESCENDING)]
+    },
+    {
+        "name": "unread notifications of user", "collection": "notifications",
+        "filter": {"user_id": _SAMPLE_ID, "read": False}, "sort": [("created_at", DESCENDING)]
+    },
+    {
+        "name": "threshold cooldown seed", "collection": "notifications",
+        "filter": {"user_id": {"$in": _SAMPLE_IDS}, "sensor_id": _SAMPLE_ID, "read": False, "type": "warning", "created_at": {"$gte": _SAMPLE_TIME}}
+    },
+    {"name": "notification by message_id", "collection": "notifications", "filter": {"message_id": _SAMPLE_ID, "user_id": _SAMPLE_ID}},
+    {"name": "refresh token by hash", "collection": "refresh_tokens", "filter": {"token_hash": _SAMPLE_ID}},
+    {"name": "refresh tokens of user", "collection": "refresh_tokens", "filter": {"user_email": _SAMPLE_ID}},
+    {"name": "active refresh token of user", "collection": "refresh_tokens", "filter": {"user_email": _SAMPLE_ID, "is_revoked": False, "expires_at": {"$gt": _SAMPLE_TIME}}},
+    {"name": "threshold cooldowns of sensor", "collection": "threshold_cooldowns", "filter": {"sensor_id": _SAMPLE_ID}},
+    {"name": "threshold cooldowns of user", "collection": "threshold_cooldowns", "filter": {"user_id": _SAMPLE_ID}},
+]
+
+
+def apply_indexes(database) -> Dict[str, List[str]]:
+    """Tạo các index trong INDEX_CATALOG (an toàn khi gọi lại nhiều lần). Trả về tên index theo collection"""
+    created = {}
+    for collection_name, models in INDEX_CATALOG.items():
+        try:
+            created[collection_name] = database[collection_name].create_indexes(models)
+        except Exception as e:
+            # Ví dụ: dữ liệu cũ trùng lặp khiến unique index không tạo được
+            logger.error(f"Lỗi tạo index cho collection {collection_name}: {str(e)}")
+            created[collection_name] = []
+    return created
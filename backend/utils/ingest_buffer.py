@@ -0,0 +1,442 @@
+"""
+Bộ đệm ghi dữ liệu sensor (ingest buffer) nằm giữa MQTT on_message và MongoDB.
+
+Thay vì insert_one cho từng reading, các document được đưa vào hàng đợi và ghi theo lô
+bằng insert_many(ordered=False) khi:
+- hàng đợi đạt kích thước lô hiện tại, hoặc
+- quá hạn INGEST_FLUSH_INTERVAL giây kể từ lần flush trước.
+
+Kích thước lô tự điều chỉnh theo độ trễ ghi MongoDB quan sát được (tăng dần khi nhanh,
+giảm một nửa khi chậm) và hàng đợi được xả hết khi FastAPI shutdown.
+
+Khi hàng đợi đầy, INGEST_OVERFLOW_POLICY quyết định cách xử lý:
+- spill: ghi phần tràn xuống write-ahead file cục bộ (INGEST_SPILL_PATH), replay theo lô
+  khi MongoDB hoạt động lại (mặc định)
+- drop_oldest: bỏ document cũ nhất trong hàng đợi
+- block: caller chờ tới khi có chỗ. add() được gọi từ MQTT worker nên khi MongoDB chậm,
+  hàng đợi worker đầy theo và message bị bỏ ở mqtt_workers.submit(); chỉ dùng khi caller
+  chịu được việc bị chặn (ví dụ script import)
+Circuit breaker ngừng ghi khi MongoDB lỗi liên tiếp và chỉ thử lại sau một khoảng thời gian.
+
+Mỗi document được gán _id trước lần ghi đầu tiên và giữ nguyên _id khi lô được đưa lại vào
+hàng đợi, nên khi insert_many lỗi giữa chừng (ví dụ timeout sau khi server đã ghi một phần),
+lần thử lại gặp lỗi trùng khóa (11000) cho các document đã ghi và chúng được tính là đã ghi.
+
+Listener đăng ký qua add_listener() nhận danh sách document đã ghi thành công sau mỗi lô
+(ví dụ cập nhật rollup). Listener chạy trên thread riêng (sensor-data-listeners) để listener
+chậm hoặc lỗi không chặn vòng flush; mỗi listener được gọi độc lập, lỗi và lần chạy chậm được
+đếm theo từng listener trong get_stats()["listeners"]. Tối đa INGEST_LISTENER_MAX_PENDING lô
+chờ listener; vượt quá thì bỏ lô cũ nhất (đếm vào dropped_batches) - rollup của các lô đó
+tính lại bằng scripts/backfill_sensor_rollups.py.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from utils.sensor_data_store import sensor_data_store
+from utils.sensor_rollups import sensor_rollups
+from utils.sensor_latest import sensor_latest
+from utils.room_summary import room_summary
+from utils.circuit_breaker import CircuitBreaker
+from utils.spill_log import SpillLog
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_MIN_BATCH_SIZE = int(os.getenv("INGEST_MIN_BATCH_SIZE", "20"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0"))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "50000"))
+INGEST_TARGET_LATENCY_MS = float(os.getenv("INGEST_TARGET_LATENCY_MS", "250"))
+INGEST_RETRY_DELAY_SECONDS = 1.0
+INGEST_OVERFLOW_POLICY = os.getenv("INGEST_OVERFLOW_POLICY", "spill").lower()
+INGEST_SPILL_PATH = os.getenv("INGEST_SPILL_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "sensor_data.wal"))
+INGEST_SPILL_MAX_BYTES = int(os.getenv("INGEST_SPILL_MAX_BYTES", str(512 * 1024 * 1024)))
+INGEST_BREAKER_FAILURES = int(os.getenv("INGEST_BREAKER_FAILURES", "5"))
+INGEST_BREAKER_RESET_SECONDS = float(os.getenv("INGEST_BREAKER_RESET_SECONDS", "10"))
+INGEST_LISTENER_MAX_PENDING = int(os.getenv("INGEST_LISTENER_MAX_PENDING", "1000"))
+INGEST_LISTENER_SLOW_MS = float(os.getenv("INGEST_LISTENER_SLOW_MS", "1000"))
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_SPILL = "spill"
+DUPLICATE_KEY_ERROR = 11000
+
+
+class SensorDataBuffer:
+    def __init__(
+        self,
+        collection,
+        max_batch_size: int = INGEST_BATCH_SIZE,
+        min_batch_size: int = INGEST_MIN_BATCH_SIZE,
+        flush_interval: float = INGEST_FLUSH_INTERVAL,
+        max_queue: int = INGEST_MAX_QUEUE,
+        target_latency_ms: float = INGEST_TARGET_LATENCY_MS,
+        overflow_policy: str = INGEST_OVERFLOW_POLICY,
+        spill_log: Optional[SpillLog] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        listener_max_pending: int = INGEST_LISTENER_MAX_PENDING
+    ):
+        if overflow_policy not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL):
+            logger.error(f"INGEST_OVERFLOW_POLICY không hợp lệ: {overflow_policy}, dùng '{OVERFLOW_SPILL}'")
+            overflow_policy = OVERFLOW_SPILL
+        if overflow_policy == OVERFLOW_SPILL and spill_log is None:
+            spill_log = SpillLog(INGEST_SPILL_PATH, INGEST_SPILL_MAX_BYTES)
+        self.collection = collection
+        self.max_batch_size = max(1, max_batch_size)
+        self.min_batch_size = max(1, min(min_batch_size, self.max_batch_size))
+        self.flush_interval = flush_interval
+        self.max_queue = max(1, max_queue)
+        self.target_latency_ms = target_latency_ms
+        self.overflow_policy = overflow_policy
+        self.spill_log = spill_log
+        self.breaker = breaker or CircuitBreaker("sensor_data", INGEST_BREAKER_FAILURES, INGEST_BREAKER_RESET_SECONDS)
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._batch_size = self.max_batch_size
+        self._last_flush = time.monotonic()
+
+        self._inserted = 0
+        self._failed = 0
+        self._batches = 0
+        self._last_latency_ms = 0.0
+        self._dropped = 0
+        self._listeners: List[Callable[[List[dict]], None]] = []
+
+        # Lô đã ghi chờ listener, xử lý trên thread riêng
+        self.listener_max_pending = max(1, listener_max_pending)
+        self._listener_queue = deque()
+        self._listener_cond = threading.Condition()
+        self._listener_thread: Optional[threading.Thread] = None
+        self._listener_stopping = False
+        self._listener_dropped = 0
+        # tên listener -> {"calls", "errors", "slow"}
+        self._listener_stats: Dict[str, dict] = {}
+
+    def start(self):
+        """Khởi động thread flush nền (gọi nhiều lần không sao)"""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="sensor-data-ingest", daemon=True)
+            self._thread.start()
+        self._start_listeners()
+
+    def add(self, document: dict) -> bool:
+        """Đưa một document vào hàng đợi, chờ nếu hàng đợi đầy"""
+        return self.add_many([document])
+
+    def add_many(self, documents: List[dict]) -> bool:
+        """
+        Đưa nhiều document vào hàng đợi (giữ nguyên thứ tự).
+        Trả về False nếu có document bị bỏ (drop_oldest, hoặc file spill đã đầy)
+        """
+        if not documents:
+            return True
+        if not self._thread or not self._thread.is_alive():
+            self.start()
+        overflow = []
+        dropped = 0
+        with self._cond:
+            for document in documents:
+                if len(self._queue) >= self.max_queue:
+                    if self.overflow_policy == OVERFLOW_SPILL:
+                        overflow.append(document)
+                        continue
+                    if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                        self._queue.popleft()
+                        dropped += 1
+                    while len(self._queue) >= self.max_queue and not self._stopping:
+                        self._cond.wait(timeout=self.flush_interval)
+                self._queue.append(document)
+            self._dropped += dropped
+            if len(self._queue) >= self._batch_size:
+                self._cond.notify_all()
+
+        if overflow and not self._spill(overflow):
+            dropped += len(overflow)
+        if dropped:
+            logger.warning(f"Ingest buffer đầy, đã bỏ {dropped} document (policy={self.overflow_policy})")
+        return dropped == 0
+
+    def add_listener(self, listener: Callable[[List[dict]], None]):
+        """Đăng ký hàm nhận các document đã ghi thành công sau mỗi lô"""
+        self._listeners.append(listener)
+        self._listener_stats[_listener_name(listener)] = {"calls": 0, "errors": 0, "slow": 0}
+
+    def get_queue_depth(self) -> int:
+        """Số document đang chờ ghi"""
+        return len(self._queue)
+
+    def get_stats(self) -> dict:
+        """Thông số hiện tại của bộ đệm để theo dõi / tinh chỉnh khi chạy tải"""
+        return {
+            "queue_depth": len(self._queue),
+            "max_queue": self.max_queue,
+            "batch_size": self._batch_size,
+            "min_batch_size": self.min_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "flush_interval": self.flush_interval,
+            "inserted": self._inserted,
+            "failed": self._failed,
+            "batches": self._batches,
+            "last_latency_ms": round(self._last_latency_ms, 2),
+            "running": bool(self._thread and self._thread.is_alive()),
+            "overflow_policy": self.overflow_policy,
+            "dropped": self._dropped,
+            "circuit": self.breaker.get_stats(),
+            "spill": self.spill_log.get_stats() if self.spill_log else None,
+            "listeners": {
+                "pending_batches": len(self._listener_queue),
+                "dropped_batches": self._listener_dropped,
+                "running": bool(self._listener_thread and self._listener_thread.is_alive()),
+                "by_listener": {name: dict(stats) for name, stats in self._listener_stats.items()}
+            }
+        }
+
+    def flush(self) -> int:
+        """Ghi ngay một lô (dùng cho test / script). Trả về số document đã lấy ra khỏi hàng đợi"""
+        batch = self._take_batch()
+        if batch:
+            self._write_batch(batch)
+        return len(batch)
+
+    def stop(self, timeout: float = 30.0):
+        """Dừng thread nền và xả hết hàng đợi"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        # Phần còn sót lại (thread chưa chạy hoặc join timeout) được ghi trực tiếp
+        while self._queue and self.breaker.allow_request():
+            if not self._write_batch(self._take_batch()):
+                break
+        if self._queue and self.spill_log is not None:
+            with self._cond:
+                remaining = list(self._queue)
+                self._queue.clear()
+            if not self._spill(remaining):
+                self._requeue(remaining)
+        if self._queue:
+            logger.error(f"Ingest buffer dừng với {len(self._queue)} document chưa ghi được")
+        self._stop_listeners(timeout)
+
+    def _take_batch(self) -> List[dict]:
+        with self._cond:
+            size = min(self._batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(size)]
+            self._last_flush = time.monotonic()
+            self._cond.notify_all()
+        return batch
+
+    def _requeue(self, batch: List[dict]):
+        with self._cond:
+            self._queue.extendleft(reversed(batch))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    remaining = self.flush_interval - (time.monotonic() - self._last_flush)
+                    if len(self._queue) >= self._batch_size or (self._queue and remaining <= 0):
+                        break
+                    if self._replay_pending():
+                        break
+                    self._cond.wait(timeout=remaining if remaining > 0 else self.flush_interval)
+                if self._stopping and (not self._queue or not self.breaker.allow_request()):
+                    return
+
+            if not self.breaker.allow_request():
+                # DB đang lỗi: không ghi, hàng đợi đầy sẽ xử lý theo overflow policy
+                with self._cond:
+                    self._cond.wait(timeout=min(self.flush_interval, self.breaker.retry_after()) or self.flush_interval)
+                continue
+
+            batch = self._take_batch()
+            if batch:
+                if not self._write_batch(batch):
+                    if self._stopping:
+                        return
+                    time.sleep(INGEST_RETRY_DELAY_SECONDS)
+            elif self._replay_pending():
+                self._replay_spill()
+
+    def _write_batch(self, batch: List[dict]) -> bool:
+        """Ghi một lô, trả về False nếu cần thử lại (lô đã được đưa lại vào đầu hàng đợi)"""
+        if not batch:
+            return True
+        # _id cố định từ lần ghi đầu tiên để thử lại không tạo bản ghi trùng
+        for document in batch:
+            document.setdefault("_id", ObjectId())
+        started = time.monotonic()
+        written = batch
+        try:
+            self.collection.insert_many(batch, ordered=False)
+            self._inserted += len(batch)
+        except BulkWriteError as e:
+            # ordered=False: các document hợp lệ vẫn được ghi, chỉ bỏ qua document lỗi.
+            # Trùng _id nghĩa là document đã được ghi ở lần thử trước của chính lô này
+            # (lần đó lỗi nên listener chưa chạy): tính là đã ghi
+            write_errors = e.details.get("writeErrors", [])
+            errors = [error for error in write_errors if error.get("code") != DUPLICATE_KEY_ERROR]
+            self._inserted += len(batch) - len(errors)
+            self._failed += len(errors)
+            written = self._without_errors(batch, errors)
+            if errors:
+                logger.error(f"Lỗi ghi {len(errors)}/{len(batch)} sensor data trong lô")
+        except Exception as e:
+            logger.error(f"Lỗi ghi lô sensor data ({len(batch)} document): {str(e)}")
+            self.breaker.record_failure()
+            self._requeue(batch)
+            self._batch_size = max(self.min_batch_size, self._batch_size // 2)
+            return False
+
+        self.breaker.record_success()
+
+        self._batches += 1
+        self._last_latency_ms = (time.monotonic() - started) * 1000
+        self._adapt_batch_size(len(batch))
+        self._notify(written)
+        return True
+
+    def _spill(self, documents: List[dict]) -> bool:
+        if self.spill_log is None:
+            return False
+        try:
+            return self.spill_log.append(documents)
+        except OSError as e:
+            logger.error(f"Lỗi ghi {len(documents)} document xuống spill file: {str(e)}")
+            return False
+
+    def _replay_pending(self) -> bool:
+        """Có dữ liệu spill cần replay và hàng đợi đang rảnh"""
+        return (
+            self.spill_log is not None
+            and len(self._queue) < self._batch_size
+            and self.breaker.allow_request()
+            and self.spill_log.pending_bytes() > 0
+        )
+
+    def _replay_spill(self):
+        """Replay một lô từ spill file bằng insert_many"""
+        documents, end_offset = self.spill_log.read_batch(self._batch_size)
+        if not documents:
+            if end_offset:
+                self.spill_log.commit(end_offset)
+            return
+        written = documents
+        try:
+            self.collection.insert_many(documents, ordered=False)
+            self._inserted += len(documents)
+        except BulkWriteError as e:
+            # Trùng _id nghĩa là document đã được replay trước đó (ví dụ crash giữa chừng)
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY_ERROR]
+            duplicates = len(e.details.get("writeErrors", [])) - len(errors)
+            self._inserted += len(documents) - len(errors) - duplicates
+            self._failed += len(errors)
+            written = self._without_errors(documents, e.details.get("writeErrors", []))
+        except Exception as e:
+            logger.error(f"Lỗi replay {len(documents)} document từ spill file: {str(e)}")
+            self.breaker.record_failure()
+            return
+        self.breaker.record_success()
+        self.spill_log.commit(end_offset, len(documents))
+        self._notify(written)
+
+    @staticmethod
+    def _without_errors(documents: List[dict], errors: List[dict]) -> List[dict]:
+        failed = set(error.get("index") for error in errors)
+        return [document for index, document in enumerate(documents) if index not in failed]
+
+    def _notify(self, documents: List[dict]):
+        """Chuyển lô đã ghi cho thread listener (không chờ listener chạy xong)"""
+        if not documents or not self._listeners:
+            return
+        self._start_listeners()
+        dropped = 0
+        with self._listener_cond:
+            if len(self._listener_queue) >= self.listener_max_pending:
+                dropped = len(self._listener_queue.popleft())
+                self._listener_dropped += 1
+            self._listener_queue.append(documents)
+            self._listener_cond.notify_all()
+        if dropped:
+            logger.error(
+                f"Listener của ingest buffer chậm, đã bỏ một lô {dropped} document chưa xử lý; "
+                f"chạy scripts/backfill_sensor_rollups.py để tính lại rollup"
+            )
+
+    def _start_listeners(self):
+        with self._listener_cond:
+            if self._listener_thread and self._listener_thread.is_alive():
+                return
+            self._listener_stopping = False
+            self._listener_thread = threading.Thread(target=self._run_listeners, name="sensor-data-listeners", daemon=True)
+            self._listener_thread.start()
+
+    def _stop_listeners(self, timeout: float):
+        """Chờ thread listener xử lý hết các lô đang chờ rồi dừng"""
+        with self._listener_cond:
+            self._listener_stopping = True
+            self._listener_cond.notify_all()
+        if self._listener_thread:
+            self._listener_thread.join(timeout=timeout)
+        if self._listener_queue:
+            logger.error(f"Ingest buffer dừng với {len(self._listener_queue)} lô chưa chạy listener")
+
+    def _run_listeners(self):
+        while True:
+            with self._listener_cond:
+                while not self._listener_queue and not self._listener_stopping:
+                    self._listener_cond.wait()
+                if not self._listener_queue:
+                    return
+                documents = self._listener_queue.popleft()
+            for listener in self._listeners:
+                self._call_listener(listener, documents)
+
+    def _call_listener(self, listener: Callable[[List[dict]], None], documents: List[dict]):
+        """Gọi một listener, lỗi / chạy chậm chỉ được đếm và log, không ảnh hưởng listener khác"""
+        stats = self._listener_stats.setdefault(_listener_name(listener), {"calls": 0, "errors": 0, "slow": 0})
+        stats["calls"] += 1
+        started = time.monotonic()
+        try:
+            listener(documents)
+        except Exception as e:
+            stats["errors"] += 1
+            logger.error(f"Lỗi listener {_listener_name(listener)} của ingest buffer: {str(e)}")
+        elapsed_ms = (time.monotonic() - started) * 1000
+        if elapsed_ms > INGEST_LISTENER_SLOW_MS:
+            stats["slow"] += 1
+            logger.warning(f"Listener {_listener_name(listener)} chạy {elapsed_ms:.0f} ms cho {len(documents)} document")
+
+    def _adapt_batch_size(self, written: int):
+        """Tăng cộng khi MongoDB nhanh và lô đầy, giảm nhân khi vượt độ trễ mục tiêu"""
+        if self._last_latency_ms > self.target_latency_ms:
+            self._batch_size = max(self.min_batch_size, self._batch_size // 2)
+        elif written >= self._batch_size and self._last_latency_ms < self.target_latency_ms / 2:
+            step = max(1, self.max_batch_size // 10)
+            self._batch_size = min(self.max_batch_size, self._batch_size + step)
+
+
+def _listener_name(listener) -> str:
+    return getattr(listener, "__qualname__", None) or repr(listener)
+
+
+# Global ingest buffer instance
+sensor_data_buffer = SensorDataBuffer(sensor_data_store)
+sensor_data_buffer.add_listener(sensor_rollups.apply)
+sensor_data_buffer.add_listener(sensor_latest.apply)
+sensor_data_buffer.add_listener(room_summary.apply)
@@ -0,0 +1,167 @@
+"""
+Đẩy sự kiện thời gian thực tới trình duyệt (Server-Sent Events) thay cho polling.
+
+- Mỗi kết nối là một LiveSubscription với hàng đợi asyncio giới hạn LIVE_EVENTS_QUEUE_SIZE;
+  index user_id -> các subscription nên fan-out chỉ tốn O(số kết nối của các user liên quan)
+- publish*() được gọi từ thread xử lý MQTT: sự kiện được serialize một lần rồi chuyển vào
+  event loop bằng call_soon_threadsafe, không bao giờ chờ client
+- Hàng đợi đầy (client chậm): bỏ sự kiện cũ nhất và đếm lại, client nhận sự kiện "overflow"
+  để tự tải lại dữ liệu
+- Khi không có ai kết nối, publish*() trả về ngay mà không tra cứu user của device
+- Mỗi subscription giữ tập device user đang liên kết (events_controller làm mới khi kiểm tra
+  lại session); sự kiện của device ngoài tập bị bỏ qua, nên liên kết bị gỡ ở process khác
+  không còn nhận sự kiện dù threshold_engine.get_device_users chưa hết TTL
+
+Hub chỉ nằm trong bộ nhớ của một process: sự kiện chỉ tới các trình duyệt đang kết nối
+vào đúng instance đã nhận message MQTT. Khi chạy nhiều instance với MQTT_SHARED_GROUP,
+mỗi message chỉ được một instance xử lý nên mỗi trình duyệt chỉ thấy phần sự kiện của
+instance mình đang kết nối; cần một kênh fan-out chung (ví dụ Redis pub/sub) hoặc để
+luồng SSE chạy trên instance không dùng shared group trước khi mở rộng ngang.
+
+Loại sự kiện: reading, device_status, actuator, notification.
+"""
+import asyncio
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+from utils.database import sanitize_for_json
+from utils.payload_codec import dumps_json
+from utils.threshold_engine import threshold_engine
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LIVE_EVENTS_QUEUE_SIZE = int(os.getenv("LIVE_EVENTS_QUEUE_SIZE", "256"))
+LIVE_EVENTS_KEEPALIVE_SECONDS = float(os.getenv("LIVE_EVENTS_KEEPALIVE_SECONDS", "15"))
+LIVE_EVENTS_REVALIDATE_SECONDS = float(os.getenv("LIVE_EVENTS_REVALIDATE_SECONDS", "15"))
+
+
+def format_event(event_type: str, data) -> str:
+    """Một sự kiện theo định dạng text/event-stream"""
+    return f"event: {event_type}\ndata: {dumps_json(sanitize_for_json(data)).decode('utf-8')}\n\n"
+
+
+class LiveSubscription:
+    def __init__(
+        self,
+        user_id: str,
+        loop: asyncio.AbstractEventLoop,
+        max_queue: int = LIVE_EVENTS_QUEUE_SIZE,
+        device_ids: Optional[Set[str]] = None
+    ):
+        self.user_id = user_id
+        self.loop = loop
+        # None: nhận sự kiện của mọi device mà publish_device gửi tới user
+        self.device_ids = device_ids
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def offer(self, message: str):
+        """Chạy trong event loop: thêm sự kiện, bỏ sự kiện cũ nhất nếu hàng đợi đầy"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    def accepts(self, device_id: Optional[str]) -> bool:
+        return device_id is None or self.device_ids is None or str(device_id) in self.device_ids
+
+    def take_dropped(self) -> int:
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class LiveEventHub:
+    def __init__(self, max_queue: int = LIVE_EVENTS_QUEUE_SIZE):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._by_user: Dict[str, Set[LiveSubscription]] = {}
+        self._published = 0
+        self._delivered = 0
+
+    def subscribe(self, user_id: str, device_ids: Optional[Iterable[str]] = None) -> LiveSubscription:
+        """Gọi trong event loop của kết nối"""
+        subscription = LiveSubscription(
+            str(user_id),
+            asyncio.get_running_loop(),
+            self.max_queue,
+            set(str(device_id) for device_id in device_ids) if device_ids is not None else None
+        )
+        with self._lock:
+            self._by_user.setdefault(subscription.user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: LiveSubscription):
+        with self._lock:
+            subscriptions = self._by_user.get(subscription.user_id)
+            if subscriptions is None:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._by_user[subscription.user_id]
+
+    @property
+    def is_active(self) -> bool:
+        return bool(self._by_user)
+
+    def publish(self, user_ids: Iterable[str], event_type: str, data, device_id: Optional[str] = None):
+        """
+        Gửi sự kiện tới mọi kết nối của các user (gọi được từ bất kỳ thread nào);
+        có device_id thì chỉ gửi tới kết nối còn liên kết với device đó
+        """
+        if not self._by_user:
+            return
+        with self._lock:
+            targets = [
+                subscription
+                for user_id in set(str(user_id) for user_id in user_ids)
+                for subscription in self._by_user.get(user_id, ())
+                if subscription.accepts(device_id)
+            ]
+        if not targets:
+            return
+        message = format_event(event_type, data)
+        self._published += 1
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, message)
+                self._delivered += 1
+            except RuntimeError:
+                # Event loop đã đóng: kết nối sẽ tự hủy đăng ký
+                pass
+
+    def publish_device(self, device_id: str, event_type: str, data):
+        """Gửi sự kiện của device tới các user đang liên kết với device"""
+        if not self._by_user:
+            return
+        self.publish(threshold_engine.get_device_users(device_id), event_type, data, device_id)
+
+    def publish_device_status(self, device_ids: List[str], status: str):
+        """Listener của device_presence"""
+        for device_id in device_ids:
+            self.publish_device(device_id, "device_status", {"device_id": device_id, "status": status})
+
+    def publish_notifications(self, notifications: List[dict]):
+        if not self._by_user:
+            return
+        for notification in notifications:
+            self.publish([notification["user_id"]], "notification", notification)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            connections = sum(len(subscriptions) for subscriptions in self._by_user.values())
+            users = len(self._by_user)
+        return {
+            "connections": connections,
+            "users": users,
+            "published": self._published,
+            "delivered": self._delivered
+        }
+
+
+# Global live event hub instance
+live_events = LiveEventHub()
@@ -0,0 +1,62 @@
+"""
+Bộ lọc message MQTT trùng lặp do QoS 1 gửi lại (redelivery).
+
+Với QoS 1 broker có thể gửi lại cùng một PUBLISH (cờ DUP) khi chưa nhận được PUBACK,
+nhất là khi chạy nhiều instance với shared subscription. Bộ lọc nhớ digest
+(topic + payload) của các message gần đây trong MQTT_DEDUP_WINDOW_SECONDS giây;
+message có cờ DUP và digest đã thấy sẽ bị bỏ qua.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MQTT_DEDUP_WINDOW_SECONDS = float(os.getenv("MQTT_DEDUP_WINDOW_SECONDS", "30"))
+MQTT_DEDUP_MAX_ENTRIES = int(os.getenv("MQTT_DEDUP_MAX_ENTRIES", "100000"))
+
+
+class RecentMessageFilter:
+    def __init__(self, window_seconds: float = MQTT_DEDUP_WINDOW_SECONDS, max_entries: int = MQTT_DEDUP_MAX_ENTRIES):
+        self.window_seconds = window_seconds
+        self.max_entries = max(1, max_entries)
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def is_duplicate(self, topic: str, payload: bytes, dup_flag: bool) -> bool:
+        """Ghi nhận message và trả về True nếu đây là bản gửi lại của message đã xử lý"""
+        digest = hashlib.blake2b(topic.encode("utf-8") + b"\x00" + payload, digest_size=16).digest()
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            if dup_flag and digest in self._seen:
+                self.duplicates += 1
+                return True
+            self._seen[digest] = now
+            self._seen.move_to_end(digest)
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+        return False
+
+    def get_stats(self) -> dict:
+        return {
+            "window_seconds": self.window_seconds,
+            "tracked_messages": len(self._seen),
+            "duplicates_dropped": self.duplicates
+        }
+
+    def _evict(self, now: float):
+        threshold = now - self.window_seconds
+        while self._seen:
+            digest, seen_at = next(iter(self._seen.items()))
+            if seen_at >= threshold:
+                break
+            self._seen.popitem(last=False)
+
+
+# Global duplicate filter instance
+message_filter = RecentMessageFilter()
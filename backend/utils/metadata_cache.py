@@ -0,0 +1,175 @@
+"""
+Cache metadata device / sensor / actuator trong process cho luồng xử lý MQTT.
+
+- Key theo device_id, (device_id, sensor_id) và (device_id, actuator_id)
+- Mỗi entry có TTL; controllers gọi invalidate_* khi thay đổi dữ liệu tương ứng
+- Negative cache: device_id không tồn tại được nhớ trong METADATA_NEGATIVE_TTL_SECONDS
+  để message từ thiết bị lạ không truy vấn MongoDB mỗi lần
+- Lần đầu nạp một device sẽ nạp luôn toàn bộ sensors/actuators của device đó
+- Mỗi bảng tối đa METADATA_CACHE_MAX_ENTRIES entry (LRU): khi đầy bỏ entry ít dùng nhất
+  (O(1)), entry hết hạn bị bỏ khi được tra lại; device_id giả / ngẫu nhiên trên topic MQTT
+  không làm bộ nhớ tăng vô hạn
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from utils.database import devices_collection, sensors_collection, actuators_collection
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METADATA_CACHE_TTL_SECONDS = float(os.getenv("METADATA_CACHE_TTL_SECONDS", "60"))
+METADATA_NEGATIVE_TTL_SECONDS = float(os.getenv("METADATA_NEGATIVE_TTL_SECONDS", "30"))
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", "50000"))
+
+_MISSING = object()
+
+
+class MetadataCache:
+    def __init__(
+        self,
+        ttl_seconds: float = METADATA_CACHE_TTL_SECONDS,
+        negative_ttl_seconds: float = METADATA_NEGATIVE_TTL_SECONDS,
+        max_entries: int = METADATA_CACHE_MAX_ENTRIES
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.RLock()
+        # key -> (expires_at, value); value None nghĩa là "không tồn tại" (negative entry)
+        # Thứ tự trong OrderedDict là thứ tự dùng gần nhất (cuối = mới nhất)
+        self._devices = OrderedDict()
+        self._sensors = OrderedDict()
+        self._actuators = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    # ---------- đọc ----------
+
+    def get_device(self, device_id: str) -> Optional[dict]:
+        """Lấy device theo _id, None nếu không tồn tại"""
+        device_id = str(device_id)
+        cached = self._get(self._devices, device_id)
+        if cached is not _MISSING:
+            return cached
+
+        device = devices_collection.find_one({"_id": device_id})
+        if device:
+            self._prefetch_children(device_id)
+        self._put(self._devices, device_id, device)
+        return device
+
+    def get_sensor(self, device_id: str, sensor_id: str) -> Optional[dict]:
+        """Lấy sensor theo (device_id, sensor_id), None nếu không tồn tại"""
+        key = (str(device_id), str(sensor_id))
+        cached = self._get(self._sensors, key)
+        if cached is not _MISSING:
+            return cached
+
+        sensor = sensors_collection.find_one({"_id": key[1], "device_id": key[0]})
+        self._put(self._sensors, key, sensor)
+        return sensor
+
+    def get_actuator(self, device_id: str, actuator_id: str) -> Optional[dict]:
+        """Lấy actuator theo (device_id, actuator_id), None nếu không tồn tại"""
+        key = (str(device_id), str(actuator_id))
+        cached = self._get(self._actuators, key)
+        if cached is not _MISSING:
+            return cached
+
+        actuator = actuators_collection.find_one({"_id": key[1], "device_id": key[0]})
+        self._put(self._actuators, key, actuator)
+        return actuator
+
+    # ---------- ghi (sau khi luồng MQTT tự tạo / cập nhật bản ghi) ----------
+
+    def put_sensor(self, device_id: str, sensor: dict):
+        self._put(self._sensors, (str(device_id), str(sensor["_id"])), sensor)
+
+    def put_actuator(self, device_id: str, actuator: dict):
+        self._put(self._actuators, (str(device_id), str(actuator["_id"])), actuator)
+
+    # ---------- invalidation ----------
+
+    def invalidate_device(self, device_id: str):
+        """Xóa device cùng toàn bộ sensors/actuators của nó khỏi cache (kể cả negative entry)"""
+        device_id = str(device_id)
+        with self._lock:
+            self._devices.pop(device_id, None)
+            for key in [k for k in self._sensors if k[0] == device_id]:
+                del self._sensors[key]
+            for key in [k for k in self._actuators if k[0] == device_id]:
+                del self._actuators[key]
+
+    def invalidate_sensor(self, sensor_id: str, device_id: str = None):
+        sensor_id = str(sensor_id)
+        with self._lock:
+            for key in [k for k in self._sensors if k[1] == sensor_id and (device_id is None or k[0] == str(device_id))]:
+                del self._sensors[key]
+
+    def invalidate_actuator(self, actuator_id: str, device_id: str = None):
+        actuator_id = str(actuator_id)
+        with self._lock:
+            for key in [k for k in self._actuators if k[1] == actuator_id and (device_id is None or k[0] == str(device_id))]:
+                del self._actuators[key]
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+            self._sensors.clear()
+            self._actuators.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "devices": len(self._devices),
+            "sensors": len(self._sensors),
+            "actuators": len(self._actuators),
+            "max_entries": self.max_entries,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions
+        }
+
+    # ---------- nội bộ ----------
+
+    def _get(self, table: OrderedDict, key):
+        with self._lock:
+            entry = table.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                table.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+            if entry is not None:
+                del table[key]
+            self._misses += 1
+            return _MISSING
+
+    def _put(self, table: OrderedDict, key, value):
+        ttl = self.ttl_seconds if value is not None else self.negative_ttl_seconds
+        with self._lock:
+            table[key] = (time.monotonic() + ttl, value)
+            table.move_to_end(key)
+            while len(table) > self.max_entries:
+                table.popitem(last=False)
+                self._evictions += 1
+
+    def _prefetch_children(self, device_id: str):
+        """Nạp sẵn sensors/actuators của device (2 query thay vì 1 query cho mỗi sensor)"""
+        try:
+            for sensor in sensors_collection.find({"device_id": device_id}):
+                self.put_sensor(device_id, sensor)
+            for actuator in actuators_collection.find({"device_id": device_id}):
+                self.put_actuator(device_id, actuator)
+        except Exception as e:
+            logger.error(f"Lỗi nạp metadata cho device {device_id}: {str(e)}")
+
+
+# Global metadata cache instance
+metadata_cache = MetadataCache()
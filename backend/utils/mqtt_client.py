@@ -5,14 +5,21 @@ import os
 import ssl
 import time
 import traceback
+import uuid
 from datetime import datetime, timedelta
 from typing import Callable, Optional
-from utils.database import sensor_data_collection, devices_collection, sensors_collection, actuators_collection, rooms_collection, notifications_collection, user_room_devices_collection
+from utils.database import devices_collection, sensors_collection, actuators_collection, rooms_collection
 from models.device_models import create_device_dict
 from models.sensor_models import create_sensor_dict
 from models.actuator_models import create_actuator_dict
-from models.data_models import create_sensor_data_dict
 from utils.timezone import get_vietnam_now_naive
+from utils.metadata_cache import metadata_cache
+from utils.access_control import access_control
+from utils.device_presence import device_presence
+from utils.mqtt_workers import mqtt_workers
+from utils.message_dedup import message_filter
+from utils.payload_codec import loads_json, decode_payload_bytes, negotiate_codec, PayloadDecodeError
+from utils.mqtt_ingest import topic_router, decode_payload, process_device_payload, TOPIC_REGISTER, TOPIC_LWT
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,12 +32,34 @@ MQTT_PORT = int(os.getenv("MQTT_PORT", "8883"))
 MQTT_PORT_WS = int(os.getenv("MQTT_PORT_WS", "8884"))
 MQTT_USERNAME = os.getenv("MQTT_USERNAME", None)
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", None)
+MQTT_TLS = os.getenv("MQTT_TLS", "true").lower() in ("1", "true", "yes")
+# Khi đặt MQTT_SHARED_GROUP, các instance backend cùng group dùng shared subscription
+# ($share/<group>/...) để broker chia message của các device cho nhau thay vì gửi cho tất cả.
+# Broker chia theo từng message, không theo device, nên khi bật:
+# - Thứ tự message của cùng một device KHÔNG được đảm bảo giữa các instance (hai reading liên
+#   tiếp có thể được ghi theo thứ tự ngược); sensor_latest / room_summary so sánh timestamp
+#   nên vẫn giữ giá trị mới nhất, còn trạng thái actuator lấy theo message xử lý sau cùng
+# - Lọc message trùng (message_dedup) chỉ có tác dụng trong từng process
+# - Trạng thái online / offline (device_presence) và cooldown cảnh báo (threshold_engine)
+#   chuyển sang update có điều kiện trong MongoDB thay vì bảng trong RAM
+# - Cache metadata / quyền truy cập của mỗi process chỉ được làm mới theo TTL khi instance
+#   khác thay đổi dữ liệu (METADATA_CACHE_TTL_SECONDS, ACCESS_CONTROL_TTL_SECONDS)
+MQTT_SHARED_GROUP = os.getenv("MQTT_SHARED_GROUP", "").strip()
+MQTT_INSTANCE_ID = os.getenv("MQTT_INSTANCE_ID", "").strip() or str(uuid.uuid4())[:8]
 
 DEVICE_REGISTER_TOPIC = "device/register"
 DEVICE_DATA_TOPIC_OLD = "iot/device/+/data"
 DEVICE_DATA_TOPIC = "device/+/sensor/+/data"
 DEVICE_DATA_TOPIC_NEW = "device/+/data"
 DEVICE_LWT_TOPIC = "device/+/lwt"
+INGEST_TOPICS = [DEVICE_REGISTER_TOPIC, DEVICE_DATA_TOPIC_OLD, DEVICE_DATA_TOPIC, DEVICE_DATA_TOPIC_NEW, DEVICE_LWT_TOPIC]
+
+
+def get_subscription_topic(topic: str, shared_group: str = MQTT_SHARED_GROUP) -> str:
+    """Trả về topic filter để subscribe (có tiền tố $share/<group>/ nếu chạy ingest theo group)"""
+    if shared_group:
+        return f"$share/{shared_group}/{topic}"
+    return topic
 
 
 class MQTTClient:
@@ -38,21 +67,13 @@ class MQTTClient:
         self.client = None
         self.is_connected = False
     
-    def update_device_online_status(self, device_id: str):
-        """Cập nhật trạng thái device thành online và last_seen timestamp"""
+    def update_device_online_status(self, device_id: str, status_hint: Optional[str] = None):
+        """
+        Cập nhật trạng thái device thành online và last_seen timestamp
+        Chỉ ghi DB ngay khi device chuyển sang online, last_seen được ghi gộp định kỳ
+        """
         try:
-            device_id = str(device_id)
-            now = get_vietnam_now_naive()
-            result = devices_collection.update_one(
-                {"_id": device_id},
-                {"$set": {
-                    "status": "online",
-                    "last_seen": now,
-                    "updated_at": now
-                }}
-            )
-            if result.modified_count > 0:
-                pass
+            device_presence.mark_seen(str(device_id), status_hint=status_hint)
         except Exception as e:
             logger.error(f"Lỗi cập nhật trạng thái online cho device {device_id}: {str(e)}")
             import traceback
@@ -64,18 +85,11 @@ class MQTTClient:
             self.is_connected = True
             logger.info("Đã kết nối đến MQTT broker thành công")
             
-            result_register = client.subscribe(DEVICE_REGISTER_TOPIC, qos=1)
-            result_data_old = client.subscribe(DEVICE_DATA_TOPIC_OLD, qos=1)
-            result_data = client.subscribe(DEVICE_DATA_TOPIC, qos=1)
-            result_data_new = client.subscribe(DEVICE_DATA_TOPIC_NEW, qos=1)
-            result_lwt = client.subscribe(DEVICE_LWT_TOPIC, qos=1)
+            results = [client.subscribe(get_subscription_topic(topic), qos=1) for topic in INGEST_TOPICS]
             
-            if (result_register[0] == mqtt.MQTT_ERR_SUCCESS and
-                result_data[0] == mqtt.MQTT_ERR_SUCCESS and
-                result_data_old[0] == mqtt.MQTT_ERR_SUCCESS and
-                result_data_new[0] == mqtt.MQTT_ERR_SUCCESS and
-                result_lwt[0] == mqtt.MQTT_ERR_SUCCESS):
-                pass
+            if all(result[0] == mqtt.MQTT_ERR_SUCCESS for result in results):
+                if MQTT_SHARED_GROUP:
+                    logger.info(f"Đã subscribe theo shared group '{MQTT_SHARED_GROUP}' (instance {MQTT_INSTANCE_ID})")
             else:
                 logger.warning(f"Một số đăng ký có thể đã thất bại")
         else:
@@ -108,405 +122,68 @@ class MQTTClient:
             logger.warning("Đã ngắt kết nối MQTT broker")
     
     def on_message(self, client, userdata, msg):
-        """Callback khi nhận được message từ MQTT broker"""
+        """
+        Callback khi nhận được message từ MQTT broker (chạy trên network thread của paho)
+        Chỉ phân loại topic rồi chuyển message sang worker pool theo device_id,
+        mọi thao tác MongoDB được thực hiện trong worker
+        """
         try:
             topic = msg.topic
-            payload = msg.payload.decode('utf-8')
-            
-            topic_parts = topic.split('/')
-            
-            if len(topic_parts) >= 5 and topic_parts[0] == "device" and topic_parts[2] == "sensor" and topic_parts[4] == "data":
-                device_id = topic_parts[1]
-                sensor_id = topic_parts[3]
-                self.handle_sensor_data_new_format(device_id, sensor_id, payload)
-            
-            elif len(topic_parts) >= 3 and topic_parts[0] == "device" and topic_parts[2] == "lwt":
-                device_id = topic_parts[1]
-                self.handle_device_lwt(device_id, payload)
-            
-            elif len(topic_parts) >= 4 and topic_parts[0] == "iot" and topic_parts[1] == "device" and topic_parts[3] == "data":
-                device_id = topic_parts[2]
-                self.handle_sensor_data(device_id, payload)
-            
-            elif len(topic_parts) >= 3 and topic_parts[0] == "device" and topic_parts[2] == "data":
-                device_id = topic_parts[1]
-                self.handle_device_data_new_format(device_id, payload)
-            
-            elif len(topic_parts) >= 2 and topic_parts[0] == "device" and topic_parts[1] == "register":
-                self.handle_device_register(payload)
-            else:
-                logger.warning(f"Định dạng topic không xác định: {topic}")
-                    
-        except Exception as e:
-            logger.error(f"Lỗi xử lý MQTT message: {str(e)}")
-    
-    def handle_sensor_data_new_format(self, device_id: str, sensor_id: str, payload: str):
-        """Xử lý dữ liệu sensor từ thiết bị IoT (format mới: device/{device_id}/sensor/{sensor_id}/data)"""
-        try:
-            device_id = str(device_id)
-            sensor_id = str(sensor_id)
-            data = json.loads(payload)
-            
-            device = devices_collection.find_one({"_id": device_id})
-            if not device:
-                logger.warning(f"Thiết bị {device_id} không tìm thấy trong database")
+            if message_filter.is_duplicate(topic, msg.payload, bool(getattr(msg, "dup", False))):
                 return
+            # Payload giữ nguyên dạng bytes: device có thể gửi JSON, MessagePack hoặc CBOR
+            payload = msg.payload
             
-            self.update_device_online_status(device_id)
-            
-            sensor_data = {
-                "sensor_id": sensor_id,
-                "value": data.get("value"),
-                "type": self.infer_sensor_type_from_unit(data.get("unit", "")),
-                "unit": data.get("unit", ""),
-                "extra": {k: v for k, v in data.items() if k not in ["value", "unit"]}
-            }
-            
-            self.save_sensor_data(device_id, sensor_data)
-            
-        except json.JSONDecodeError:
-            logger.error(f"JSON payload không hợp lệ: {payload}")
-        except Exception as e:
-            logger.error(f"Lỗi xử lý dữ liệu sensor: {str(e)}")
-    
-    def handle_sensor_data(self, device_id: str, payload: str):
-        """Xử lý dữ liệu sensor từ thiết bị IoT (format cũ: iot/device/{device_id}/data)"""
-        try:
-            device_id = str(device_id)
-            data = json.loads(payload)
-            
-            device = devices_collection.find_one({"_id": device_id})
-            if not device:
-                logger.warning(f"Thiết bị {device_id} không tìm thấy trong database")
-                return
-            
-            self.update_device_online_status(device_id)
-            
-            if "sensors" in data:
-                for sensor_data in data["sensors"]:
-                    self.save_sensor_data(device_id, sensor_data)
-            else:
-                self.save_sensor_data(device_id, data)
-            
-        except json.JSONDecodeError:
-            logger.error(f"JSON payload không hợp lệ: {payload}")
-        except Exception as e:
-            logger.error(f"Lỗi xử lý dữ liệu sensor: {str(e)}")
-    
-    def infer_sensor_type_from_unit(self, unit: str) -> str:
-        """Suy luận sensor type từ unit"""
-        unit_lower = unit.lower()
-        if '°c' in unit_lower or '°f' in unit_lower or 'celsius' in unit_lower or 'fahrenheit' in unit_lower:
-            return "temperature"
-        elif '%' in unit_lower or 'percent' in unit_lower:
-            return "humidity"
-        elif 'w' in unit_lower or 'watts' in unit_lower or 'kw' in unit_lower:
-            return "energy"
-        elif 'lux' in unit_lower or 'lm' in unit_lower:
-            return "light"
-        elif 'motion' in unit_lower or 'detection' in unit_lower:
-            return "motion"
-        else:
-            return "temperature"
-    
-    def save_sensor_data(self, device_id: str, sensor_data: dict):
-        """Lưu dữ liệu sensor vào database"""
-        try:
-            device_id = str(device_id)
-            sensor_id = sensor_data.get("sensor_id")
-            value = sensor_data.get("value")
-            sensor_type = sensor_data.get("type", sensor_data.get("sensor_type", ""))
-            
-            if not sensor_id or value is None:
-                logger.warning(f"Thiếu sensor_id hoặc value trong dữ liệu: {sensor_data}")
+            route = topic_router.match(topic)
+            if route is None:
+                logger.warning(f"Định dạng topic không xác định: {topic}")
                 return
-            
-            sensor_id = str(sensor_id)
-            sensor = sensors_collection.find_one({"_id": sensor_id, "device_id": device_id})
-            if not sensor:
-                logger.warning(f"Sensor {sensor_id} không tìm thấy, đang tạo sensor mới")
-                from models.sensor_models import get_default_thresholds
-                new_sensor = {
-                    "_id": str(sensor_id),
-                    "device_id": str(device_id),
-                    "type": sensor_type,
-                    "name": sensor_data.get("name", f"Sensor {sensor_id}"),
-                    "unit": sensor_data.get("unit", ""),
-                    "pin": sensor_data.get("pin", 0),
-                    "enabled": True,
-                    "created_at": get_vietnam_now_naive(),
-                    "updated_at": get_vietnam_now_naive()
-                }
-                default_min, default_max = get_default_thresholds(sensor_type)
-                if default_min is not None:
-                    new_sensor["min_threshold"] = default_min
-                if default_max is not None:
-                    new_sensor["max_threshold"] = default_max
-                sensors_collection.insert_one(new_sensor)
+            kind, params = route
+            
+            if kind == TOPIC_REGISTER:
+                # Đăng ký đi cùng partition với dữ liệu của device để giữ thứ tự
+                try:
+                    register_key = str(loads_json(payload).get("device_id") or DEVICE_REGISTER_TOPIC)
+                except Exception:
+                    register_key = DEVICE_REGISTER_TOPIC
+                mqtt_workers.submit(register_key, self.handle_device_register, payload)
+            elif kind == TOPIC_LWT:
+                mqtt_workers.submit(params["device_id"], self.handle_device_lwt, params["device_id"], payload)
             else:
-                from models.sensor_models import get_default_thresholds
-                needs_update = False
-                update_data = {}
-                
-                if "min_threshold" not in sensor and "max_threshold" not in sensor:
-                    default_min, default_max = get_default_thresholds(sensor_type)
-                    if default_min is not None:
-                        update_data["min_threshold"] = default_min
-                        needs_update = True
-                    if default_max is not None:
-                        update_data["max_threshold"] = default_max
-                        needs_update = True
-                    
-                    if needs_update:
-                        update_data["updated_at"] = get_vietnam_now_naive()
-                        sensors_collection.update_one(
-                            {"_id": sensor_id, "device_id": device_id},
-                            {"$set": update_data}
-                        )
-            
-            sensor_value = float(value)
-            min_threshold = sensor.get("min_threshold")
-            max_threshold = sensor.get("max_threshold")
-            
-            is_over_threshold = False
-            threshold_message = ""
-            
-            if min_threshold is not None and sensor_value < min_threshold:
-                is_over_threshold = True
-                threshold_message = f"Giá trị {sensor_value:.1f}{sensor.get('unit', '')} thấp hơn ngưỡng dưới {min_threshold}{sensor.get('unit', '')}"
-            elif max_threshold is not None and sensor_value > max_threshold:
-                is_over_threshold = True
-                threshold_message = f"Giá trị {sensor_value:.1f}{sensor.get('unit', '')} vượt quá ngưỡng trên {max_threshold}{sensor.get('unit', '')}"
-            
-            if is_over_threshold:
-                from models.notification_models import create_notification_dict
-                from datetime import timedelta
-                
-                user_links = list(user_room_devices_collection.find({"device_id": device_id}))
-                user_ids = list(set([link["user_id"] for link in user_links]))
-                
-                sensor_name = sensor.get("name", f"Sensor {sensor_id}")
-                notification_message = f"{sensor_name}: {threshold_message}"
-                
-                notification_cooldown_minutes = 5
-                cooldown_time = get_vietnam_now_naive() - timedelta(minutes=notification_cooldown_minutes)
-                
-                for user_id in user_ids:
-                    existing_notification = notifications_collection.find_one({
-                        "user_id": user_id,
-                        "sensor_id": sensor_id,
-                        "read": False,
-                        "type": "warning",
-                        "created_at": {"$gte": cooldown_time}
-                    })
+                mqtt_workers.submit(params["device_id"], self.handle_device_data, kind, params, payload)
                     
-                    if not existing_notification:
-                        notification = create_notification_dict(
-                            user_id=user_id,
-                            sensor_id=sensor_id,
-                            type_="warning",
-                            message=notification_message,
-                            note=f"Device: {device_id}",
-                            read=False
-                        )
-                        notifications_collection.insert_one(notification)
-                        logger.warning(f"Đã tạo cảnh báo ngưỡng cho user {user_id}: {notification_message}")
-            
-            from models.data_models import create_sensor_data_dict
-            sensor_data_dict = create_sensor_data_dict(
-                sensor_id=sensor_id,
-                value=sensor_value,
-                device_id=device_id
-            )
-            
-            sensor_data_collection.insert_one(sensor_data_dict)
-            
         except Exception as e:
-            logger.error(f"Lỗi lưu dữ liệu sensor: {str(e)}")
+            logger.error(f"Lỗi xử lý MQTT message: {str(e)}")
     
-    def handle_device_data_new_format(self, device_id: str, payload: str):
+    def handle_device_data(self, kind: str, params: dict, payload: bytes):
         """
-        Xử lý dữ liệu từ ESP32 (format mới chuẩn)
-        Format: {
-          "device_id": "device_01",
-          "sensors": [
-            { "sensor_id": "sensor_01", "value": 30 },
-            { "sensor_id": "sensor_02", "value": 65 }
-          ],
-          "actuators": [
-            { "actuator_id": "act_01", "state": true }
-          ]
-        }
+        Xử lý dữ liệu sensor / actuator của cả 3 format topic:
+          - device/{device_id}/sensor/{sensor_id}/data: {"value": 30, "unit": "°C"}
+          - iot/device/{device_id}/data (format cũ): {"sensors": [...]} hoặc một sensor ở gốc payload
+          - device/{device_id}/data: {"sensors": [{"sensor_id", "value"}], "actuators": [{"actuator_id", "state"}]}
+        Payload được giải mã theo codec đã thỏa thuận khi đăng ký (device.payload_codec)
         """
         try:
-            device_id = str(device_id)
-            data = json.loads(payload)
+            device_id = str(params["device_id"])
             
-            device = devices_collection.find_one({"_id": device_id})
+            device = metadata_cache.get_device(device_id)
             if not device:
                 logger.warning(f"Thiết bị {device_id} không tìm thấy trong database")
                 return
             
-            self.update_device_online_status(device_id)
-            
-            if "sensors" in data and isinstance(data["sensors"], list):
-                for sensor_data_item in data["sensors"]:
-                    sensor_id = sensor_data_item.get("sensor_id")
-                    value = sensor_data_item.get("value")
-                    
-                    if sensor_id and value is not None:
-                        sensor_id = str(sensor_id)
-                        sensor_value = float(value)
-                        
-                        sensor = sensors_collection.find_one({"_id": sensor_id, "device_id": device_id})
-                        
-                        if not sensor:
-                            from models.sensor_models import get_default_thresholds
-                            sensor_type = sensor_data_item.get("type", "temperature")
-                            if "humidity" in sensor_id.lower() or "do_am" in sensor_id.lower() or "_02" in sensor_id:
-                                sensor_type = "humidity"
-                            elif "gas" in sensor_id.lower() or "khi" in sensor_id.lower() or "_03" in sensor_id:
-                                sensor_type = "gas"
-                            elif "light" in sensor_id.lower() or "anh_sang" in sensor_id.lower():
-                                sensor_type = "light"
-                            elif "motion" in sensor_id.lower() or "chuyen_dong" in sensor_id.lower():
-                                sensor_type = "motion"
-                            
-                            new_sensor = {
-                                "_id": str(sensor_id),
-                                "device_id": str(device_id),
-                                "type": sensor_type,
-                                "name": sensor_data_item.get("name", f"Sensor {sensor_id}"),
-                                "unit": sensor_data_item.get("unit", ""),
-                                "pin": sensor_data_item.get("pin", 0),
-                                "enabled": True,
-                                "created_at": get_vietnam_now_naive(),
-                                "updated_at": get_vietnam_now_naive()
-                            }
-                            default_min, default_max = get_default_thresholds(sensor_type)
-                            if default_min is not None:
-                                new_sensor["min_threshold"] = default_min
-                            if default_max is not None:
-                                new_sensor["max_threshold"] = default_max
-                            try:
-                                sensors_collection.insert_one(new_sensor)
-                                sensor = new_sensor
-                            except Exception as e:
-                                logger.error(f"Lỗi tạo sensor {sensor_id}: {str(e)}")
-                                sensor = None
-                        
-                        if sensor:
-                            min_threshold = sensor.get("min_threshold")
-                            max_threshold = sensor.get("max_threshold")
-                            
-                            is_over_threshold = False
-                            threshold_message = ""
-                            
-                            if min_threshold is not None and sensor_value < min_threshold:
-                                is_over_threshold = True
-                                threshold_message = f"Giá trị {sensor_value:.1f}{sensor.get('unit', '')} thấp hơn ngưỡng dưới {min_threshold}{sensor.get('unit', '')}"
-                            elif max_threshold is not None and sensor_value > max_threshold:
-                                is_over_threshold = True
-                                threshold_message = f"Giá trị {sensor_value:.1f}{sensor.get('unit', '')} vượt quá ngưỡng trên {max_threshold}{sensor.get('unit', '')}"
-                            
-                            if is_over_threshold:
-                                from models.notification_models import create_notification_dict
-                                from datetime import timedelta
-                                
-                                user_links = list(user_room_devices_collection.find({"device_id": device_id}))
-                                user_ids = list(set([link["user_id"] for link in user_links]))
-                                
-                                sensor_name = sensor.get("name", f"Sensor {sensor_id}")
-                                notification_message = f"{sensor_name}: {threshold_message}"
-                                
-                                notification_cooldown_minutes = 5
-                                cooldown_time = get_vietnam_now_naive() - timedelta(minutes=notification_cooldown_minutes)
-                                
-                                for user_id in user_ids:
-                                    existing_notification = notifications_collection.find_one({
-                                        "user_id": user_id,
-                                        "sensor_id": sensor_id,
-                                        "read": False,
-                                        "type": "warning",
-                                        "created_at": {"$gte": cooldown_time}
-                                    })
-                                    
-                                    if not existing_notification:
-                                        notification = create_notification_dict(
-                                            user_id=user_id,
-                                            sensor_id=sensor_id,
-                                            type_="warning",
-                                            message=notification_message,
-                                            note=f"Device: {device_id}",
-                                            read=False
-                                        )
-                                        notifications_collection.insert_one(notification)
-                                        logger.warning(f"Đã tạo cảnh báo ngưỡng cho user {user_id}: {notification_message}")
-                        
-                        try:
-                            from models.data_models import create_sensor_data_dict
-                            sensor_data_dict = create_sensor_data_dict(sensor_id, sensor_value, device_id=device_id)
-                            sensor_data_collection.insert_one(sensor_data_dict)
-                        except Exception as e:
-                            logger.error(f"Lỗi lưu dữ liệu sensor {sensor_id}: {str(e)}")
-                            logger.error(traceback.format_exc())
-            
-            if "actuators" in data and isinstance(data["actuators"], list):
-                for actuator_data in data["actuators"]:
-                    actuator_id = actuator_data.get("actuator_id")
-                    state = actuator_data.get("state")
-                    
-                    if actuator_id is not None and state is not None:
-                        actuator_id = str(actuator_id)
-                        
-                        actuator = actuators_collection.find_one({"_id": actuator_id, "device_id": device_id})
-                        
-                        if not actuator:
-                            actuator_type = actuator_data.get("type", "relay")
-                            if "motor" in actuator_id.lower() or "dong_co" in actuator_id.lower():
-                                actuator_type = "motor"
-                            elif "led" in actuator_id.lower():
-                                actuator_type = "led"
-                            elif "fan" in actuator_id.lower() or "quat" in actuator_id.lower():
-                                actuator_type = "fan"
-                            
-                            new_actuator = {
-                                "_id": str(actuator_id),
-                                "device_id": str(device_id),
-                                "type": actuator_type,
-                                "name": actuator_data.get("name", f"Actuator {actuator_id}"),
-                                "pin": actuator_data.get("pin", 0),
-                                "state": bool(state),
-                                "enabled": True,
-                                "created_at": get_vietnam_now_naive(),
-                                "updated_at": get_vietnam_now_naive()
-                            }
-                            try:
-                                actuators_collection.insert_one(new_actuator)
-                                actuator = new_actuator
-                            except Exception as e:
-                                logger.error(f"Lỗi tạo actuator {actuator_id}: {str(e)}")
-                                logger.error(traceback.format_exc())
-                                actuator = None
-                        
-                        try:
-                            result = actuators_collection.update_one(
-                                {"_id": actuator_id, "device_id": device_id},
-                                {"$set": {"state": bool(state), "updated_at": get_vietnam_now_naive()}}
-                            )
-                            if result.modified_count > 0:
-                                pass
-                        except Exception as e:
-                            logger.error(f"Lỗi cập nhật actuator {actuator_id}: {str(e)}")
-                            logger.error(traceback.format_exc())
+            data = decode_payload_bytes(payload, device.get("payload_codec"))
+            self.update_device_online_status(device_id, device.get("status"))
             
+            readings, actuator_states = decode_payload(kind, params, data)
+            process_device_payload(device_id, readings, actuator_states)
             
-        except json.JSONDecodeError:
-            logger.error(f"JSON payload không hợp lệ: {payload}")
+        except PayloadDecodeError:
+            logger.error(f"Payload không hợp lệ từ device {params.get('device_id')}: {payload[:200]!r}")
         except Exception as e:
             logger.error(f"Lỗi xử lý dữ liệu thiết bị: {str(e)}")
+            logger.error(traceback.format_exc())
     
-    def handle_device_lwt(self, device_id: str, payload: str):
+    def handle_device_lwt(self, device_id: str, payload: bytes):
         """
         Xử lý Last Will and Testament message từ MQTT broker
         Được broker tự động publish khi device disconnect bất thường
@@ -515,20 +192,12 @@ class MQTTClient:
             device_id = str(device_id)
             # LWT message thường là "offline" hoặc có thể là JSON
             try:
-                data = json.loads(payload)
+                data = loads_json(payload)
                 status = data.get("status", "offline")
             except:
                 status = "offline"
             
-            now = get_vietnam_now_naive()
-            
-            devices_collection.update_one(
-                {"_id": device_id},
-                {"$set": {
-                    "status": "offline",
-                    "updated_at": now
-                }}
-            )
+            device_presence.mark_offline(device_id)
             
             logger.warning(f"Device {device_id} đã disconnect (LWT triggered)")
             
@@ -541,7 +210,7 @@ class MQTTClient:
         """Kết nối đến MQTT broker"""
         try:
             self.client = mqtt.Client(
-                client_id=f"iot_backend_{int(get_vietnam_now_naive().timestamp())}",
+                client_id=f"iot_backend_{MQTT_INSTANCE_ID}_{int(get_vietnam_now_naive().timestamp())}",
                 protocol=mqtt.MQTTv311
             )
             
@@ -549,17 +218,20 @@ class MQTTClient:
             self.client.on_disconnect = self.on_disconnect
             self.client.on_message = self.on_message
             
-            self.client.tls_set(
-                ca_certs=None,
-                certfile=None,
-                keyfile=None,
-                cert_reqs=ssl.CERT_NONE,
-                tls_version=ssl.PROTOCOL_TLS,
-                ciphers=None
-            )
-            self.client.tls_insecure_set(True)
+            if MQTT_TLS:
+                self.client.tls_set(
+                    ca_certs=None,
+                    certfile=None,
+                    keyfile=None,
+                    cert_reqs=ssl.CERT_NONE,
+                    tls_version=ssl.PROTOCOL_TLS,
+                    ciphers=None
+                )
+                self.client.tls_insecure_set(True)
             
-            if not MQTT_USERNAME or not MQTT_PASSWORD:
+            if MQTT_USERNAME and MQTT_PASSWORD:
+                self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+            elif MQTT_TLS:
                 logger.error("MQTT_USERNAME và MQTT_PASSWORD là BẮT BUỘC cho HiveMQ Cloud!")
                 logger.error("Vui lòng thêm vào file .env hoặc cập nhật trong mqtt_client.py")
                 logger.error("Lấy thông tin từ: https://console.hivemq.cloud/")
@@ -567,8 +239,6 @@ class MQTTClient:
                 self.is_connected = False
                 return
             
-            self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-            
             result = self.client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
             
             if result != mqtt.MQTT_ERR_SUCCESS:
@@ -583,6 +253,7 @@ class MQTTClient:
                 self.is_connected = False
                 return
             
+            mqtt_workers.start()
             self.client.loop_start()
             time.sleep(1)
             
@@ -596,10 +267,11 @@ class MQTTClient:
             self.is_connected = False
     
     def disconnect(self):
-        """Ngắt kết nối MQTT broker"""
+        """Ngắt kết nối MQTT broker và xử lý nốt các message đang chờ trong worker pool"""
         if self.client:
             self.client.loop_stop()
             self.client.disconnect()
+        mqtt_workers.stop()
     
     def publish(self, topic: str, payload: dict, qos: int = 0):
         """Gửi message đến MQTT broker"""
@@ -618,7 +290,7 @@ class MQTTClient:
             logger.error(f"Lỗi gửi message: {str(e)}")
             return False
     
-    def handle_device_register(self, payload: str):
+    def handle_device_register(self, payload: bytes):
         """
         Xử lý đăng ký thiết bị từ ESP32
         Topic: device/register
@@ -637,11 +309,13 @@ class MQTTClient:
           "actuators": [
             {"actuator_id": "act_01", "type": "relay", "name": "Đèn trần", "pin": 23},
             {"actuator_id": "act_02", "type": "relay", "name": "Quạt", "pin": 22}
-          ]
+          ],
+          "codecs": ["cbor", "msgpack", "json"]  // tùy chọn, codec cho device/{device_id}/data theo thứ tự ưu tiên
         }
         """
         try:
-            data = json.loads(payload)
+            data = loads_json(payload)
+            payload_codec = negotiate_codec(data.get("codecs"))
             
             device_id = data.get("device_id")
             if device_id:
@@ -653,11 +327,13 @@ class MQTTClient:
                         "name": data.get("name", existing_device.get("name")),
                         "type": data.get("type", existing_device.get("type")),
                         "ip": data.get("ip", existing_device.get("ip", "")),
+                        "payload_codec": payload_codec,
                         "status": "online",
                         "last_seen": now,
                         "updated_at": now
                     }
                     devices_collection.update_one({"_id": device_id}, {"$set": update_data})
+                    device_presence.mark_seen(device_id, persist=False)
                 else:
                     device = create_device_dict(
                         name=data.get("name", "Unnamed Device"),
@@ -668,6 +344,7 @@ class MQTTClient:
                         enabled=True
                     )
                     device["_id"] = str(device_id)
+                    device["payload_codec"] = payload_codec
                     devices_collection.insert_one(device)
             else:
                 device = create_device_dict(
@@ -678,6 +355,7 @@ class MQTTClient:
                     status="online",
                     enabled=True
                 )
+                device["payload_codec"] = payload_codec
                 devices_collection.insert_one(device)
                 device_id = str(device["_id"])
             
@@ -713,6 +391,7 @@ class MQTTClient:
                     if default_max is not None:
                         sensor["max_threshold"] = default_max
                     sensors_collection.insert_one(sensor)
+                    access_control.add_sensor(device_id, sensor_id)
                 else:
                     from models.sensor_models import get_default_thresholds, get_default_unit, get_default_name
                     sensor_type = existing_sensor.get("type", sensor_info.get("type", "temperature"))
@@ -767,16 +446,19 @@ class MQTTClient:
                     actuator["_id"] = str(actuator_id)
                     actuators_collection.insert_one(actuator)
             
+            metadata_cache.invalidate_device(device_id)
+            
             response_topic = f"device/{device_id}/register/response"
             response = {
                 "status": "success",
                 "device_id": str(device_id),
+                "codec": payload_codec,
                 "message": "Device registered successfully"
             }
             self.publish(response_topic, response, qos=1)
             
-        except json.JSONDecodeError:
-            logger.error(f"JSON payload không hợp lệ trong register: {payload}")
+        except PayloadDecodeError:
+            logger.error(f"JSON payload không hợp lệ trong register: {payload[:200]!r}")
         except Exception as e:
             logger.error(f"Lỗi xử lý đăng ký thiết bị: {str(e)}")
             import traceback
@@ -806,33 +488,7 @@ class MQTTClient:
             timeout_minutes: Số phút không nhận được message thì coi như offline (mặc định: 5 phút)
         """
         try:
-            now = get_vietnam_now_naive()
-            timeout_threshold = now - timedelta(minutes=timeout_minutes)
-            
-            # Tìm tất cả các device đang online nhưng không có last_seen hoặc last_seen quá cũ
-            offline_devices = devices_collection.find({
-                "status": "online",
-                "$or": [
-                    {"last_seen": {"$exists": False}},
-                    {"last_seen": {"$lt": timeout_threshold}}
-                ]
-            })
-            
-            updated_count = 0
-            for device in offline_devices:
-                device_id = str(device["_id"])
-                last_seen = device.get("last_seen")
-                
-                # Log thông tin debug
-                
-                devices_collection.update_one(
-                    {"_id": device_id},
-                    {"$set": {
-                        "status": "offline",
-                        "updated_at": now
-                    }}
-                )
-                updated_count += 1
+            device_presence.check_offline(timeout_minutes=timeout_minutes)
             
         except Exception as e:
             logger.error(f"Lỗi kiểm tra và cập nhật trạng thái offline: {str(e)}")
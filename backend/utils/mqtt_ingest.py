@@ -0,0 +1,357 @@
+"""
+Luồng ingest dữ liệu MQTT: topic router -> decoder -> một stage xử lý chung.
+
+- topic_router: bảng regex biên dịch sẵn cho các topic được subscribe
+- decode_payload(): đưa cả 3 format dữ liệu về cùng một dạng
+    readings:  [{"sensor_id", "value", "type", "unit", "name", "pin"}]
+    actuators: [{"actuator_id", "state", "type", "name", "pin"}]
+- process_device_payload(): xử lý cả batch của một payload với một lần lấy metadata,
+  một lượt kiểm tra ngưỡng, một insert_many cảnh báo và một lần đưa vào bộ đệm ghi
+"""
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from pymongo import UpdateOne
+from utils.database import sensors_collection, actuators_collection
+from utils.metadata_cache import metadata_cache
+from utils.access_control import access_control
+from utils.threshold_engine import threshold_engine
+from utils.ingest_buffer import sensor_data_buffer
+from utils.live_events import live_events
+from utils.timezone import get_vietnam_now_naive
+from models.sensor_models import get_default_thresholds
+from models.data_models import create_sensor_data_dict
+
+logger = logging.getLogger(__name__)
+
+# Loại topic
+TOPIC_REGISTER = "register"
+TOPIC_LWT = "lwt"
+TOPIC_SENSOR_DATA = "sensor_data"      # device/{device_id}/sensor/{sensor_id}/data
+TOPIC_LEGACY_DATA = "legacy_data"      # iot/device/{device_id}/data
+TOPIC_DEVICE_DATA = "device_data"      # device/{device_id}/data
+
+
+class TopicRouter:
+    def __init__(self, routes: List[Tuple[str, str]]):
+        self._routes = [(re.compile(pattern), kind) for pattern, kind in routes]
+
+    def match(self, topic: str) -> Optional[Tuple[str, dict]]:
+        """Trả về (loại topic, tham số trong topic) hoặc None nếu không khớp"""
+        for pattern, kind in self._routes:
+            matched = pattern.fullmatch(topic)
+            if matched:
+                return kind, matched.groupdict()
+        return None
+
+
+topic_router = TopicRouter([
+    (r"device/register", TOPIC_REGISTER),
+    (r"device/(?P<device_id>[^/]+)/sensor/(?P<sensor_id>[^/]+)/data", TOPIC_SENSOR_DATA),
+    (r"device/(?P<device_id>[^/]+)/lwt", TOPIC_LWT),
+    (r"device/(?P<device_id>[^/]+)/data", TOPIC_DEVICE_DATA),
+    (r"iot/device/(?P<device_id>[^/]+)/data", TOPIC_LEGACY_DATA),
+])
+
+
+# ---------- suy luận loại sensor / actuator ----------
+
+def infer_sensor_type_from_unit(unit: str) -> Optional[str]:
+    """Suy luận sensor type từ unit, None nếu không nhận ra"""
+    unit_lower = (unit or "").lower()
+    if not unit_lower:
+        return None
+    if '°c' in unit_lower or '°f' in unit_lower or 'celsius' in unit_lower or 'fahrenheit' in unit_lower:
+        return "temperature"
+    if '%' in unit_lower or 'percent' in unit_lower:
+        return "humidity"
+    if 'w' in unit_lower or 'watts' in unit_lower or 'kw' in unit_lower:
+        return "energy"
+    if 'lux' in unit_lower or 'lm' in unit_lower:
+        return "light"
+    if 'motion' in unit_lower or 'detection' in unit_lower:
+        return "motion"
+    return None
+
+
+def infer_sensor_type_from_id(sensor_id: str) -> Optional[str]:
+    sensor_id_lower = sensor_id.lower()
+    if "humidity" in sensor_id_lower or "do_am" in sensor_id_lower or "_02" in sensor_id:
+        return "humidity"
+    if "gas" in sensor_id_lower or "khi" in sensor_id_lower or "_03" in sensor_id:
+        return "gas"
+    if "light" in sensor_id_lower or "anh_sang" in sensor_id_lower:
+        return "light"
+    if "motion" in sensor_id_lower or "chuyen_dong" in sensor_id_lower:
+        return "motion"
+    return None
+
+
+def infer_sensor_type(sensor_id: str, unit: str = "", declared_type: str = None) -> str:
+    """Thứ tự ưu tiên: type thiết bị gửi lên -> unit -> sensor_id -> temperature"""
+    return declared_type or infer_sensor_type_from_unit(unit) or infer_sensor_type_from_id(sensor_id) or "temperature"
+
+
+def infer_actuator_type(actuator_id: str, declared_type: str = None) -> str:
+    if declared_type:
+        return declared_type
+    actuator_id_lower = actuator_id.lower()
+    if "motor" in actuator_id_lower or "dong_co" in actuator_id_lower:
+        return "motor"
+    if "led" in actuator_id_lower:
+        return "led"
+    if "fan" in actuator_id_lower or "quat" in actuator_id_lower:
+        return "fan"
+    return "relay"
+
+
+# ---------- decoder ----------
+
+def _reading(sensor_id, item: dict) -> Optional[dict]:
+    value = item.get("value")
+    if not sensor_id or value is None:
+        logger.warning(f"Thiếu sensor_id hoặc value trong dữ liệu: {item}")
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        logger.warning(f"Giá trị sensor {sensor_id} không hợp lệ: {value}")
+        return None
+    return {
+        "sensor_id": str(sensor_id),
+        "value": value,
+        "type": item.get("type") or item.get("sensor_type"),
+        "unit": item.get("unit", ""),
+        "name": item.get("name"),
+        "pin": item.get("pin", 0)
+    }
+
+
+def _actuator_state(item: dict) -> Optional[dict]:
+    actuator_id = item.get("actuator_id")
+    state = item.get("state")
+    if actuator_id is None or state is None:
+        return None
+    return {
+        "actuator_id": str(actuator_id),
+        "state": bool(state),
+        "type": item.get("type"),
+        "name": item.get("name"),
+        "pin": item.get("pin", 0)
+    }
+
+
+def decode_payload(kind: str, params: dict, data: dict) -> Tuple[List[dict], List[dict]]:
+    """Chuyển payload (đã parse JSON) của một topic dữ liệu thành (readings, actuators)"""
+    readings = []
+    actuators = []
+    if not isinstance(data, dict):
+        return readings, actuators
+
+    if kind == TOPIC_SENSOR_DATA:
+        reading = _reading(params["sensor_id"], data)
+        if reading:
+            readings.append(reading)
+        return readings, actuators
+
+    items = data.get("sensors")
+    if isinstance(items, list):
+        for item in items:
+            if isinstance(item, dict):
+                reading = _reading(item.get("sensor_id"), item)
+                if reading:
+                    readings.append(reading)
+    elif kind == TOPIC_LEGACY_DATA:
+        # Format cũ cho phép gửi một sensor ngay ở gốc payload
+        reading = _reading(data.get("sensor_id"), data)
+        if reading:
+            readings.append(reading)
+
+    if isinstance(data.get("actuators"), list):
+        for item in data["actuators"]:
+            if isinstance(item, dict):
+                actuator = _actuator_state(item)
+                if actuator:
+                    actuators.append(actuator)
+    return readings, actuators
+
+
+# ---------- stage xử lý ----------
+
+def _resolve_sensors(device_id: str, readings: List[dict]) -> dict:
+    """Lấy sensor cho mọi reading; sensor chưa có được tạo bằng một insert_many"""
+    sensors = {}
+    missing = {}
+    needs_defaults = []
+    for reading in readings:
+        sensor_id = reading["sensor_id"]
+        if sensor_id in sensors or sensor_id in missing:
+            continue
+        sensor = metadata_cache.get_sensor(device_id, sensor_id)
+        if sensor:
+            sensors[sensor_id] = sensor
+            if "min_threshold" not in sensor and "max_threshold" not in sensor:
+                needs_defaults.append((sensor, reading))
+        else:
+            missing[sensor_id] = reading
+
+    now = get_vietnam_now_naive()
+    if missing:
+        new_sensors = []
+        for sensor_id, reading in missing.items():
+            sensor_type = infer_sensor_type(sensor_id, reading["unit"], reading["type"])
+            new_sensor = {
+                "_id": sensor_id,
+                "device_id": device_id,
+                "type": sensor_type,
+                "name": reading["name"] or f"Sensor {sensor_id}",
+                "unit": reading["unit"],
+                "pin": reading["pin"],
+                "enabled": True,
+                "created_at": now,
+                "updated_at": now
+            }
+            default_min, default_max = get_default_thresholds(sensor_type)
+            if default_min is not None:
+                new_sensor["min_threshold"] = default_min
+            if default_max is not None:
+                new_sensor["max_threshold"] = default_max
+            new_sensors.append(new_sensor)
+        logger.warning(f"Tạo {len(new_sensors)} sensor mới cho device {device_id}: {list(missing)}")
+        try:
+            sensors_collection.insert_many(new_sensors, ordered=False)
+            for new_sensor in new_sensors:
+                metadata_cache.put_sensor(device_id, new_sensor)
+                access_control.add_sensor(device_id, new_sensor["_id"])
+                sensors[new_sensor["_id"]] = new_sensor
+        except Exception as e:
+            # Một phần có thể đã tồn tại (trùng _id): đọc lại bản trong DB
+            logger.error(f"Lỗi tạo sensor cho device {device_id}: {str(e)}")
+            for new_sensor in new_sensors:
+                metadata_cache.invalidate_sensor(new_sensor["_id"], device_id)
+                sensor = metadata_cache.get_sensor(device_id, new_sensor["_id"])
+                if sensor:
+                    access_control.add_sensor(device_id, sensor["_id"])
+                    sensors[sensor["_id"]] = sensor
+
+    if needs_defaults:
+        operations = []
+        for sensor, reading in needs_defaults:
+            sensor_type = sensor.get("type") or infer_sensor_type(sensor["_id"], reading["unit"], reading["type"])
+            default_min, default_max = get_default_thresholds(sensor_type)
+            update_data = {}
+            if default_min is not None:
+                update_data["min_threshold"] = default_min
+            if default_max is not None:
+                update_data["max_threshold"] = default_max
+            if not update_data:
+                continue
+            update_data["updated_at"] = now
+            operations.append(UpdateOne({"_id": sensor["_id"], "device_id": device_id}, {"$set": update_data}))
+            sensors[sensor["_id"]] = {**sensor, **update_data}
+            metadata_cache.put_sensor(device_id, sensors[sensor["_id"]])
+        if operations:
+            sensors_collection.bulk_write(operations, ordered=False)
+    return sensors
+
+
+def _apply_actuator_states(device_id: str, states: List[dict]):
+    """Cập nhật trạng thái actuator bằng một bulk_write, tạo actuator chưa có"""
+    now = get_vietnam_now_naive()
+    new_actuators = []
+    operations = []
+    changed = []
+    for item in states:
+        actuator_id = item["actuator_id"]
+        actuator = metadata_cache.get_actuator(device_id, actuator_id)
+        if not actuator or actuator.get("state") != item["state"]:
+            changed.append({"actuator_id": actuator_id, "state": item["state"]})
+        if not actuator:
+            new_actuators.append({
+                "_id": actuator_id,
+                "device_id": device_id,
+                "type": infer_actuator_type(actuator_id, item["type"]),
+                "name": item["name"] or f"Actuator {actuator_id}",
+                "pin": item["pin"],
+                "state": item["state"],
+                "enabled": True,
+                "created_at": now,
+                "updated_at": now
+            })
+            continue
+        operations.append(UpdateOne(
+            {"_id": actuator_id, "device_id": device_id},
+            {"$set": {"state": item["state"], "updated_at": now}}
+        ))
+        metadata_cache.put_actuator(device_id, {**actuator, "state": item["state"]})
+
+    if new_actuators:
+        try:
+            actuators_collection.insert_many(new_actuators, ordered=False)
+            for new_actuator in new_actuators:
+                metadata_cache.put_actuator(device_id, new_actuator)
+        except Exception as e:
+            # Chỉ cache bản có trong DB: actuator đã tồn tại (trùng _id) được cập nhật trạng thái,
+            # actuator chưa ghi được sẽ được tạo lại ở message sau
+            logger.error(f"Lỗi tạo actuator cho device {device_id}: {str(e)}")
+            for new_actuator in new_actuators:
+                metadata_cache.invalidate_actuator(new_actuator["_id"], device_id)
+                actuator = metadata_cache.get_actuator(device_id, new_actuator["_id"])
+                if actuator and actuator.get("state") != new_actuator["state"]:
+                    operations.append(UpdateOne(
+                        {"_id": actuator["_id"], "device_id": device_id},
+                        {"$set": {"state": new_actuator["state"], "updated_at": now}}
+                    ))
+                    metadata_cache.put_actuator(device_id, {**actuator, "state": new_actuator["state"]})
+    if operations:
+        actuators_collection.bulk_write(operations, ordered=False)
+    if changed:
+        live_events.publish_device(device_id, "actuator", {"device_id": device_id, "actuators": changed, "timestamp": now})
+
+
+def process_device_payload(device_id: str, readings: List[dict], actuator_states: List[dict] = None) -> int:
+    """
+    Xử lý toàn bộ readings / trạng thái actuator của một payload.
+    Device phải tồn tại (caller đã kiểm tra). Trả về số reading đã đưa vào bộ đệm ghi.
+    """
+    device_id = str(device_id)
+    stored = 0
+    if readings:
+        sensors = _resolve_sensors(device_id, readings)
+        notifications = []
+        documents = []
+        timestamp = get_vietnam_now_naive()
+        room_id = threshold_engine.get_device_room(device_id)
+        for reading in readings:
+            sensor = sensors.get(reading["sensor_id"]) or {}
+            if sensor:
+                notifications.extend(threshold_engine.evaluate(device_id, sensor, reading["value"]))
+            documents.append(create_sensor_data_dict(
+                reading["sensor_id"],
+                reading["value"],
+                timestamp=timestamp,
+                device_id=device_id,
+                sensor_type=sensor.get("type") or reading["type"],
+                unit=sensor.get("unit") or reading["unit"],
+                room_id=room_id
+            ))
+        if threshold_engine.write_notifications(notifications):
+            live_events.publish_notifications(notifications)
+        sensor_data_buffer.add_many(documents)
+        stored = len(documents)
+        live_events.publish_device(device_id, "reading", {
+            "device_id": device_id,
+            "room_id": room_id,
+            "readings": [
+                {key: document.get(key) for key in ("sensor_id", "sensor_type", "unit", "value", "timestamp")}
+                for document in documents
+            ]
+        })
+
+    if actuator_states:
+        try:
+            _apply_actuator_states(device_id, actuator_states)
+        except Exception as e:
+            logger.error(f"Lỗi cập nhật actuator của device {device_id}: {str(e)}")
+    return stored
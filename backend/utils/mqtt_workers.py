@@ -0,0 +1,154 @@
+"""
+Pool worker xử lý MQTT message, tách khỏi network thread của paho (loop_start).
+
+Message được chia partition theo hash(device_id): mọi message của cùng một device đi vào
+cùng một worker nên thứ tự xử lý theo từng device được giữ nguyên, trong khi các device
+khác nhau được xử lý song song. Mỗi partition có hàng đợi giới hạn; khi đầy, submit()
+chỉ chờ tối đa MQTT_SUBMIT_TIMEOUT_SECONDS rồi bỏ message (đếm vào "dropped"). Chờ lâu hơn
+sẽ chặn network thread của paho: keepalive không được gửi và broker ngắt kết nối, khiến
+mất nhiều message hơn. Nếu "dropped" tăng, tăng MQTT_WORKER_COUNT / MQTT_WORKER_QUEUE_SIZE
+hoặc kiểm tra độ trễ ghi MongoDB.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MQTT_WORKER_COUNT = int(os.getenv("MQTT_WORKER_COUNT", "4"))
+MQTT_WORKER_QUEUE_SIZE = int(os.getenv("MQTT_WORKER_QUEUE_SIZE", "1000"))
+MQTT_SUBMIT_TIMEOUT_SECONDS = float(os.getenv("MQTT_SUBMIT_TIMEOUT_SECONDS", "0.5"))
+
+_STOP = object()
+
+
+class _Partition:
+    def __init__(self, index: int, queue_size: int):
+        self.index = index
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread: Optional[threading.Thread] = None
+        self.processed = 0
+        self.errors = 0
+        self.dropped = 0
+        self.busy_seconds = 0.0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+
+class PartitionedWorkerPool:
+    def __init__(
+        self,
+        num_workers: int = MQTT_WORKER_COUNT,
+        queue_size: int = MQTT_WORKER_QUEUE_SIZE,
+        submit_timeout: float = MQTT_SUBMIT_TIMEOUT_SECONDS
+    ):
+        self.num_workers = max(1, num_workers)
+        self.queue_size = max(1, queue_size)
+        self.submit_timeout = max(0.0, submit_timeout)
+        self._partitions: List[_Partition] = [_Partition(i, self.queue_size) for i in range(self.num_workers)]
+        self._lock = threading.Lock()
+        self._running = False
+        self._started_at: Optional[float] = None
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._started_at = time.monotonic()
+            for partition in self._partitions:
+                partition.thread = threading.Thread(
+                    target=self._run,
+                    args=(partition,),
+                    name=f"mqtt-worker-{partition.index}",
+                    daemon=True
+                )
+                partition.thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Dừng các worker sau khi xử lý hết message đang chờ"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        for partition in self._partitions:
+            partition.queue.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for partition in self._partitions:
+            if partition.thread:
+                partition.thread.join(timeout=max(0.0, deadline - time.monotonic()))
+
+    def partition_for(self, key: str) -> int:
+        return zlib.crc32(str(key).encode("utf-8")) % self.num_workers
+
+    def submit(self, key: str, func: Callable, *args) -> bool:
+        """Đưa một tác vụ vào partition của key (device_id); False nếu partition đầy quá submit_timeout"""
+        if not self._running:
+            self.start()
+        partition = self._partitions[self.partition_for(key)]
+        try:
+            partition.queue.put((time.monotonic(), func, args), timeout=self.submit_timeout)
+        except queue.Full:
+            partition.dropped += 1
+            logger.warning(
+                f"Hàng đợi MQTT worker {partition.index} đầy sau {self.submit_timeout}s, "
+                f"bỏ message của {key} (đã bỏ {partition.dropped})"
+            )
+            return False
+        return True
+
+    def get_queue_depth(self) -> int:
+        return sum(partition.queue.qsize() for partition in self._partitions)
+
+    def get_stats(self) -> dict:
+        """Mức sử dụng worker và độ trễ (lag) của từng partition"""
+        elapsed = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+        partitions = []
+        for partition in self._partitions:
+            partitions.append({
+                "partition": partition.index,
+                "queue_depth": partition.queue.qsize(),
+                "processed": partition.processed,
+                "errors": partition.errors,
+                "dropped": partition.dropped,
+                "utilisation": round(partition.busy_seconds / elapsed, 4) if elapsed > 0 else 0.0,
+                "last_lag_ms": round(partition.last_lag_ms, 2),
+                "max_lag_ms": round(partition.max_lag_ms, 2)
+            })
+        return {
+            "workers": self.num_workers,
+            "queue_size": self.queue_size,
+            "queue_depth": self.get_queue_depth(),
+            "dropped": sum(partition.dropped for partition in self._partitions),
+            "running": self._running,
+            "partitions": partitions
+        }
+
+    def _run(self, partition: _Partition):
+        while True:
+            item = partition.queue.get()
+            if item is _STOP:
+                return
+            enqueued_at, func, args = item
+            started = time.monotonic()
+            partition.last_lag_ms = (started - enqueued_at) * 1000
+            partition.max_lag_ms = max(partition.max_lag_ms, partition.last_lag_ms)
+            try:
+                func(*args)
+            except Exception as e:
+                partition.errors += 1
+                logger.error(f"Lỗi xử lý MQTT message trong worker {partition.index}: {str(e)}")
+            finally:
+                partition.processed += 1
+                partition.busy_seconds += time.monotonic() - started
+
+
+# Global MQTT worker pool instance
+mqtt_workers = PartitionedWorkerPool()
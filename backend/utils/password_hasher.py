@@ -0,0 +1,84 @@
+"""
+Băm / kiểm tra mật khẩu bcrypt trong pool thread riêng, có giới hạn hàng đợi.
+
+- bcrypt tốn ~250 ms CPU mỗi lần (cost 12) và nhả GIL khi chạy, nên PASSWORD_HASH_WORKERS
+  thread chạy song song thật trên nhiều core; số core dành cho bcrypt bị giới hạn riêng
+- Tối đa PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE yêu cầu cùng lúc; vượt quá thì
+  raise PasswordHasherBusy ngay (controller trả 503) thay vì để request xếp hàng vô hạn.
+  Controller chờ kết quả trong thread của db_executor, nên tổng này phải nhỏ hơn nhiều so
+  với DB_THREADPOOL_SIZE để loạt đăng nhập không chiếm hết thread của các API khác
+- BCRYPT_ROUNDS: cost factor cho hash mới; hash cũ vẫn kiểm tra được vì cost nằm trong hash
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 2))))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "8"))
+
+
+class PasswordHasherBusy(Exception):
+    """Pool băm mật khẩu đã đầy"""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_size: int = PASSWORD_HASH_QUEUE_SIZE, rounds: int = BCRYPT_ROUNDS):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hasher")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def hash_password(self, password: str) -> str:
+        return self._run(self._hash, password)
+
+    def check_password(self, password: str, password_hash: str) -> bool:
+        return self._run(self._check, password, password_hash)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "rounds": self.rounds,
+            "in_flight": in_flight,
+            "completed": self._completed,
+            "rejected": self._rejected
+        }
+
+    # ---------- nội bộ ----------
+
+    def _hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=self.rounds)).decode()
+
+    @staticmethod
+    def _check(password: str, password_hash: str) -> bool:
+        return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+
+    def _run(self, func, *args):
+        """Chạy func trong pool và chờ kết quả (gọi từ thread của controller)"""
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue_size:
+                self._rejected += 1
+                raise PasswordHasherBusy()
+            self._in_flight += 1
+        try:
+            return self._executor.submit(func, *args).result()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+
+
+# Global password hasher instance
+password_hasher = PasswordHasher()
@@ -0,0 +1,167 @@
+"""
+Codec cho payload MQTT của thiết bị.
+
+- json: mặc định và luôn dùng được (orjson nếu có cài, nếu không dùng json chuẩn)
+- msgpack, cbor: payload nhị phân gọn hơn, chỉ bật khi thư viện tương ứng được cài
+
+Thiết bị khai báo danh sách codec hỗ trợ ("codecs") khi đăng ký ở device/register;
+server chọn codec đầu tiên mà cả hai bên hỗ trợ, lưu vào device.payload_codec và trả về
+trong register response. Payload bắt đầu bằng '{' luôn được đọc như JSON để thiết bị
+cũ / firmware chưa cập nhật vẫn hoạt động.
+
+Payload gọn (compact) chỉ dùng với codec nhị phân đã thỏa thuận (msgpack / cbor), gồm khóa
+ngắn và mảng [id, giá trị, loại]:
+    {"s": [["sensor_01", 30.5, 0], ["sensor_04", 1, "motion"]], "a": [["act_01", true]]}
+Phần tử thứ ba (tùy chọn) là loại sensor: chuỗi, hoặc số thứ tự trong SENSOR_TYPE_CODES.
+Payload được mở rộng về format chuẩn {"sensors": [...], "actuators": [...]} trước khi xử lý.
+Payload JSON không bao giờ được mở rộng, nên JSON có khóa "s" / "a" giữ nguyên nghĩa.
+"""
+import json
+import logging
+from typing import Iterable, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+logger = logging.getLogger(__name__)
+
+CODEC_JSON = "json"
+CODEC_MSGPACK = "msgpack"
+CODEC_CBOR = "cbor"
+# Codec được gửi payload compact
+COMPACT_CODECS = (CODEC_MSGPACK, CODEC_CBOR)
+
+# Mã loại sensor trong payload compact (chỉ thêm vào cuối để mã cũ giữ nguyên nghĩa)
+SENSOR_TYPE_CODES = ["temperature", "humidity", "gas", "light", "motion", "obstacle", "energy"]
+
+
+class PayloadDecodeError(ValueError):
+    """Payload không giải mã được bằng codec đã chọn"""
+
+
+def loads_json(payload: Union[bytes, str]):
+    """Parse JSON (orjson nếu có)"""
+    try:
+        if orjson is not None:
+            return orjson.loads(payload)
+        return json.loads(payload)
+    except ValueError as e:
+        raise PayloadDecodeError(str(e)) from e
+
+
+def dumps_json(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def _loads_msgpack(payload: bytes):
+    try:
+        return msgpack.unpackb(payload, raw=False)
+    except Exception as e:
+        raise PayloadDecodeError(str(e)) from e
+
+
+def _loads_cbor(payload: bytes):
+    try:
+        return cbor2.loads(payload)
+    except Exception as e:
+        raise PayloadDecodeError(str(e)) from e
+
+
+_DECODERS = {CODEC_JSON: loads_json}
+_ENCODERS = {CODEC_JSON: dumps_json}
+if msgpack is not None:
+    _DECODERS[CODEC_MSGPACK] = _loads_msgpack
+    _ENCODERS[CODEC_MSGPACK] = lambda data: msgpack.packb(data, use_bin_type=True)
+if cbor2 is not None:
+    _DECODERS[CODEC_CBOR] = _loads_cbor
+    _ENCODERS[CODEC_CBOR] = cbor2.dumps
+
+
+def get_supported_codecs() -> List[str]:
+    return list(_DECODERS)
+
+
+def negotiate_codec(device_codecs: Optional[Iterable]) -> str:
+    """Chọn codec đầu tiên trong danh sách thiết bị gửi lên mà server hỗ trợ, mặc định json"""
+    if isinstance(device_codecs, str):
+        device_codecs = [device_codecs]
+    for codec in device_codecs or []:
+        codec = str(codec).lower()
+        if codec in _DECODERS:
+            return codec
+    return CODEC_JSON
+
+
+def encode_payload(data, codec: str = CODEC_JSON) -> bytes:
+    encoder = _ENCODERS.get(codec)
+    if encoder is None:
+        raise ValueError(f"Codec không được hỗ trợ: {codec}")
+    return encoder(data)
+
+
+def decode_payload_bytes(payload: bytes, codec: Optional[str] = None):
+    """
+    Giải mã payload theo codec của device; JSON được nhận diện qua ký tự '{' đầu tiên.
+    Chỉ payload của codec compact (msgpack / cbor) mới được mở rộng khóa ngắn
+    """
+    payload = bytes(payload)
+    if not codec or codec == CODEC_JSON or payload.lstrip()[:1] == b"{":
+        return loads_json(payload)
+    decoder = _DECODERS.get(codec)
+    if decoder is None:
+        raise PayloadDecodeError(f"Codec không được hỗ trợ: {codec}")
+    data = decoder(payload)
+    return expand_compact(data) if codec in COMPACT_CODECS else data
+
+
+def expand_compact(data):
+    """Chuyển payload khóa ngắn ("s"/"a") về format chuẩn ("sensors"/"actuators")"""
+    if not isinstance(data, dict) or ("s" not in data and "a" not in data):
+        return data
+    expanded = {key: value for key, value in data.items() if key not in ("s", "a")}
+    if "s" in data:
+        expanded["sensors"] = [_expand_item(item, "sensor_id", "value", SENSOR_TYPE_CODES) for item in data["s"] or []]
+    if "a" in data:
+        expanded["actuators"] = [_expand_item(item, "actuator_id", "state") for item in data["a"] or []]
+    return expanded
+
+
+def sensor_type_from_code(code) -> Optional[str]:
+    """Loại sensor từ mã compact (số thứ tự trong SENSOR_TYPE_CODES hoặc chuỗi), None nếu không hợp lệ"""
+    if isinstance(code, str):
+        return code or None
+    if isinstance(code, int) and not isinstance(code, bool) and 0 <= code < len(SENSOR_TYPE_CODES):
+        return SENSOR_TYPE_CODES[code]
+    return None
+
+
+def _expand_item(item, id_key: str, value_key: str, type_codes: Optional[List[str]] = None):
+    if isinstance(item, (list, tuple)) and len(item) >= 2:
+        expanded = {id_key: item[0], value_key: item[1]}
+        if len(item) >= 3 and item[2] is not None:
+            expanded["type"] = sensor_type_from_code(item[2]) if type_codes is not None else item[2]
+        return expanded
+    if isinstance(item, dict):
+        expanded = {
+            id_key: item.get("i", item.get(id_key)),
+            value_key: item.get("v", item.get(value_key)),
+            **{key: value for key, value in item.items() if key not in ("i", "v", "t", id_key, value_key)}
+        }
+        if "t" in item and "type" not in item:
+            expanded["type"] = sensor_type_from_code(item["t"]) if type_codes is not None else item["t"]
+        return expanded
+    return item
@@ -0,0 +1,267 @@
+"""
+Xóa dữ liệu sensor cũ theo thời hạn lưu trữ (retention) của từng tầng dữ liệu.
+
+Mỗi tầng (RetentionTier) là một collection chứa dữ liệu theo sensor_id và một trường thời gian:
+- raw: sensor_data (timestamp) và sensor_data_buckets (bucket_start), mặc định giữ
+  SENSOR_DATA_RETENTION_DAYS ngày, có thể ghi đè theo loại sensor bằng
+  SENSOR_DATA_RETENTION_BY_TYPE, ví dụ "motion:2,energy:30"
+- các tầng tổng hợp đăng ký thêm qua retention_manager.register_tier()
+
+Số ngày = 0 nghĩa là giữ vĩnh viễn, và đó là mặc định: việc xóa dữ liệu phải được bật
+rõ ràng qua biến môi trường.
+
+RETENTION_ORPHAN_DAYS (mặc định 0 = tắt) rút ngắn thời hạn cho dữ liệu mồ côi, tức là sensor
+thuộc device:
+- đã không còn liên kết user_room_devices nào lâu hơn RETENTION_ORPHAN_DAYS ngày: delete_device
+  chỉ xóa liên kết (KHÔNG xóa sensor_data) và ghi devices.unlinked_at khi mất liên kết cuối cùng;
+  device được liên kết lại thì không còn là mồ côi dù unlinked_at vẫn còn
+- hoặc có device_id mà document device không còn trong collection devices
+Device chưa từng được liên kết (không có unlinked_at) giữ thời hạn bình thường.
+
+Không dùng TTL index vì thời hạn khác nhau theo loại sensor; thay vào đó một thread nền
+chạy mỗi RETENTION_INTERVAL_SECONDS, xóa theo từng sensor qua index (sensor_id, thời gian),
+mỗi lô RETENTION_BATCH_SIZE document, nghỉ RETENTION_BATCH_PAUSE_SECONDS giữa các lô và
+dừng khi đã xóa RETENTION_MAX_DELETES_PER_RUN document để không ảnh hưởng tới ingest.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from utils.database import (
+    devices_collection, sensor_data_collection, sensor_data_buckets_collection, sensors_collection,
+    user_room_devices_collection
+)
+from utils.sensor_data_store import BUCKET_SPAN
+from utils.timezone import get_vietnam_now_naive
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def parse_days_by_type(value: str) -> Dict[str, float]:
+    """"motion:2,energy:30" -> {"motion": 2.0, "energy": 30.0} (bỏ qua mục sai định dạng)"""
+    days_by_type = {}
+    for item in (value or "").split(","):
+        sensor_type, _, days = item.partition(":")
+        try:
+            days_by_type[sensor_type.strip().lower()] = float(days)
+        except ValueError:
+            if item.strip():
+                logger.error(f"Cấu hình retention không hợp lệ: {item}")
+    return days_by_type
+
+
+SENSOR_DATA_RETENTION_DAYS = float(os.getenv("SENSOR_DATA_RETENTION_DAYS", "0"))
+SENSOR_DATA_RETENTION_BY_TYPE = parse_days_by_type(os.getenv("SENSOR_DATA_RETENTION_BY_TYPE", ""))
+RETENTION_ORPHAN_DAYS = float(os.getenv("RETENTION_ORPHAN_DAYS", "0"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_BATCH_PAUSE_SECONDS = float(os.getenv("RETENTION_BATCH_PAUSE_SECONDS", "0.2"))
+RETENTION_MAX_DELETES_PER_RUN = int(os.getenv("RETENTION_MAX_DELETES_PER_RUN", "200000"))
+
+
+class RetentionTier:
+    def __init__(
+        self,
+        name: str,
+        collection,
+        time_field: str,
+        default_days: float,
+        days_by_type: Optional[Dict[str, float]] = None,
+        span: timedelta = timedelta(0)
+    ):
+        """
+        Args:
+            span: độ dài khoảng thời gian một document bao phủ tính từ time_field
+                (bucket theo giờ: 1 giờ), document chỉ bị xóa khi toàn bộ khoảng đã hết hạn
+        """
+        self.name = name
+        self.collection = collection
+        self.time_field = time_field
+        self.default_days = default_days
+        self.days_by_type = days_by_type or {}
+        self.span = span
+
+    def days_for(self, sensor_type: Optional[str]) -> float:
+        if sensor_type and sensor_type.lower() in self.days_by_type:
+            return self.days_by_type[sensor_type.lower()]
+        return self.default_days
+
+
+class RetentionManager:
+    def __init__(
+        self,
+        interval: float = RETENTION_INTERVAL_SECONDS,
+        batch_size: int = RETENTION_BATCH_SIZE,
+        batch_pause: float = RETENTION_BATCH_PAUSE_SECONDS,
+        max_deletes_per_run: int = RETENTION_MAX_DELETES_PER_RUN,
+        orphan_days: float = RETENTION_ORPHAN_DAYS
+    ):
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.batch_pause = batch_pause
+        self.max_deletes_per_run = max_deletes_per_run
+        self.orphan_days = orphan_days
+        self.tiers: List[RetentionTier] = []
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._run_lock = threading.Lock()
+        self._runs = 0
+        self._deleted: Dict[str, int] = {}
+        self._last_run_at = None
+        self._last_duration = None
+        self._last_error = None
+
+    def register_tier(self, tier: RetentionTier):
+        self.tiers = [existing for existing in self.tiers if existing.name != tier.name] + [tier]
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sensor-data-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+
+    def run_once(self) -> Dict[str, int]:
+        """Chạy một lượt xóa cho tất cả tầng, trả về số document đã xóa theo tầng"""
+        with self._run_lock:
+            started = time.monotonic()
+            budget = self.max_deletes_per_run
+            deleted = {}
+            try:
+                sensor_types, sensor_devices, orphan_devices = self._load_sensor_context()
+                for tier in self.tiers:
+                    count = self._purge_tier(tier, sensor_types, sensor_devices, orphan_devices, budget)
+                    deleted[tier.name] = deleted.get(tier.name, 0) + count
+                    self._deleted[tier.name] = self._deleted.get(tier.name, 0) + count
+                    budget -= count
+                    if budget <= 0 or self._stop_event.is_set():
+                        break
+                self._last_error = None
+            except Exception as e:
+                self._last_error = str(e)
+                logger.error(f"Lỗi xóa dữ liệu sensor hết hạn: {str(e)}")
+            self._runs += 1
+            self._last_run_at = get_vietnam_now_naive()
+            self._last_duration = round(time.monotonic() - started, 3)
+            if any(deleted.values()):
+                logger.info(f"Retention: đã xóa {deleted} trong {self._last_duration}s")
+            return deleted
+
+    def get_stats(self) -> dict:
+        return {
+            "tiers": {
+                tier.name: {
+                    "collection": tier.collection.name,
+                    "default_days": tier.default_days,
+                    "days_by_type": tier.days_by_type
+                }
+                for tier in self.tiers
+            },
+            "orphan_days": self.orphan_days,
+            "runs": self._runs,
+            "deleted": dict(self._deleted),
+            "last_run_at": self._last_run_at.isoformat() if self._last_run_at else None,
+            "last_duration_seconds": self._last_duration,
+            "last_error": self._last_error
+        }
+
+    # ---------- nội bộ ----------
+
+    def _load_sensor_context(self):
+        sensor_types = {}
+        sensor_devices = {}
+        for sensor in sensors_collection.find({}, {"type": 1, "device_id": 1}):
+            sensor_types[str(sensor["_id"])] = sensor.get("type")
+            sensor_devices[str(sensor["_id"])] = sensor.get("device_id")
+        # Chỉ tải danh sách device khi bật quy tắc mồ côi
+        orphan_devices = None
+        if self.orphan_days > 0:
+            orphan_devices = self._load_orphan_devices(set(
+                str(device_id) for device_id in sensor_devices.values() if device_id is not None
+            ))
+        return sensor_types, sensor_devices, orphan_devices
+
+    def _load_orphan_devices(self, sensor_device_ids: set) -> set:
+        """device_id mất liên kết lâu hơn orphan_days hoặc không còn document trong devices"""
+        unlinked_before = get_vietnam_now_naive() - timedelta(days=self.orphan_days)
+        existing = set(str(device_id) for device_id in devices_collection.distinct("_id"))
+        long_unlinked = set(
+            str(device_id)
+            for device_id in devices_collection.distinct("_id", {"unlinked_at": {"$lte": unlinked_before}})
+        )
+        if long_unlinked:
+            # Đã liên kết lại sau unlinked_at thì không còn là mồ côi
+            long_unlinked -= set(
+                str(device_id) for device_id in user_room_devices_collection.distinct(
+                    "device_id", {"device_id": {"$in": list(long_unlinked)}}
+                )
+            )
+        return long_unlinked | (sensor_device_ids - existing)
+
+    def _retention_days(self, tier: RetentionTier, sensor_id: str, sensor_types, sensor_devices, orphan_devices) -> float:
+        days = tier.days_for(sensor_types.get(sensor_id))
+        if self._is_orphan(sensor_devices.get(sensor_id), orphan_devices):
+            days = min(days, self.orphan_days) if days > 0 else self.orphan_days
+        return days
+
+    def _is_orphan(self, device_id, orphan_devices) -> bool:
+        if self.orphan_days <= 0 or device_id is None or orphan_devices is None:
+            return False
+        return str(device_id) in orphan_devices
+
+    def _purge_tier(self, tier: RetentionTier, sensor_types, sensor_devices, orphan_devices, budget: int) -> int:
+        now = get_vietnam_now_naive()
+        deleted = 0
+        # distinct trên sensor_id dùng index (sensor_id, thời gian) nên không quét collection
+        for sensor_id in tier.collection.distinct("sensor_id"):
+            if deleted >= budget or self._stop_event.is_set():
+                break
+            days = self._retention_days(tier, str(sensor_id), sensor_types, sensor_devices, orphan_devices)
+            if days <= 0:
+                continue
+            cutoff = now - timedelta(days=days) - tier.span
+            deleted += self._delete_in_batches(
+                tier.collection,
+                {"sensor_id": sensor_id, tier.time_field: {"$lt": cutoff}},
+                budget - deleted
+            )
+        return deleted
+
+    def _delete_in_batches(self, collection, query: dict, budget: int) -> int:
+        deleted = 0
+        while deleted < budget and not self._stop_event.is_set():
+            limit = min(self.batch_size, budget - deleted)
+            ids = [document["_id"] for document in collection.find(query, {"_id": 1}).limit(limit)]
+            if not ids:
+                break
+            deleted += collection.delete_many({"_id": {"$in": ids}}).deleted_count
+            if len(ids) < limit:
+                break
+            self._stop_event.wait(self.batch_pause)
+        return deleted
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.run_once()
+
+
+# Global retention manager instance
+retention_manager = RetentionManager()
+retention_manager.register_tier(RetentionTier(
+    "raw", sensor_data_collection, "timestamp", SENSOR_DATA_RETENTION_DAYS, SENSOR_DATA_RETENTION_BY_TYPE
+))
+retention_manager.register_tier(RetentionTier(
+    "raw_buckets", sensor_data_buckets_collection, "bucket_start", SENSOR_DATA_RETENTION_DAYS,
+    SENSOR_DATA_RETENTION_BY_TYPE, span=BUCKET_SPAN
+))
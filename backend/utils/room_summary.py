@@ -0,0 +1,226 @@
+"""
+Tóm tắt dữ liệu của từng phòng (collection room_summaries, _id = room_id).
+
+Mỗi document giữ:
+    device_ids: device đang liên kết với phòng (theo user sở hữu phòng)
+    devices:    {device_id: "online" | "offline"}
+    sensors:    {sensor_id: {type, unit, device_id, value, timestamp}}
+
+- Ingest buffer gọi apply() sau mỗi lô ghi thành công: một bulk_write cập nhật giá trị của
+  sensor trong mọi phòng chứa device, chỉ ghi đè khi reading mới hơn giá trị đang lưu
+- device_presence gọi apply_presence() khi device chuyển online / offline
+- Khi liên kết user_room_devices thay đổi, controller gọi refresh_device() / remove() để
+  tính lại phòng bị ảnh hưởng
+Trang chi tiết phòng chỉ cần đọc một document (get) rồi tính giá trị mới nhất / trung bình
+gần đây theo loại sensor trong bộ nhớ (summarize), không phụ thuộc số sensor trong phòng.
+"""
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateMany, UpdateOne
+from utils.database import (
+    room_summaries_collection, rooms_collection, devices_collection, sensors_collection, user_room_devices_collection
+)
+from utils.sensor_latest import sensor_latest
+from utils.threshold_engine import threshold_engine
+from utils.timezone import get_vietnam_now_naive
+
+logger = logging.getLogger(__name__)
+
+
+class RoomSummaryStore:
+    def __init__(self, collection):
+        self.collection = collection
+        self._reads = 0
+        self._rebuilds = 0
+        self._updates = 0
+
+    def get(self, room_id: str) -> Optional[dict]:
+        """Tóm tắt của phòng, tính lần đầu nếu chưa có (None nếu phòng không tồn tại)"""
+        self._reads += 1
+        summary = self.collection.find_one({"_id": str(room_id)})
+        if summary is None:
+            summary = self.rebuild(room_id)
+        return summary
+
+    def rebuild(self, room_id: str) -> Optional[dict]:
+        """Tính lại toàn bộ tóm tắt của phòng từ liên kết, sensor và sensor_latest"""
+        room_id = str(room_id)
+        room = rooms_collection.find_one({"_id": room_id}, {"user_id": 1})
+        if not room:
+            self.remove(room_id)
+            return None
+
+        links = user_room_devices_collection.find({"room_id": room_id, "user_id": room.get("user_id")}, {"device_id": 1})
+        device_ids = list(dict.fromkeys(str(link["device_id"]) for link in links if link.get("device_id")))
+
+        devices = {}
+        sensors = {}
+        if device_ids:
+            for device in devices_collection.find({"_id": {"$in": device_ids}}, {"status": 1}):
+                devices[str(device["_id"])] = device.get("status") or "offline"
+            sensor_docs = list(sensors_collection.find({"device_id": {"$in": device_ids}}, {"type": 1, "unit": 1, "device_id": 1}))
+            latest = sensor_latest.get_many([sensor["_id"] for sensor in sensor_docs])
+            for sensor in sensor_docs:
+                sensor_id = str(sensor["_id"])
+                reading = latest.get(sensor_id) or {}
+                sensors[sensor_id] = {
+                    "type": sensor.get("type", "unknown"),
+                    "unit": sensor.get("unit", ""),
+                    "device_id": str(sensor.get("device_id")),
+                    "value": reading.get("value"),
+                    "timestamp": reading.get("timestamp") or reading.get("created_at")
+                }
+
+        summary = {
+            "_id": room_id,
+            "user_id": room.get("user_id"),
+            "device_ids": device_ids,
+            "devices": devices,
+            "sensors": sensors,
+            "updated_at": get_vietnam_now_naive()
+        }
+        self.collection.replace_one({"_id": room_id}, summary, upsert=True)
+        self._rebuilds += 1
+        return summary
+
+    def refresh_device(self, device_id: str):
+        """Tính lại mọi phòng đang hoặc từng chứa device (sau khi liên kết của device thay đổi)"""
+        device_id = str(device_id)
+        room_ids = {str(summary["_id"]) for summary in self.collection.find({"device_ids": device_id}, {"_id": 1})}
+        room_ids.update(
+            str(link["room_id"])
+            for link in user_room_devices_collection.find({"device_id": device_id}, {"room_id": 1})
+            if link.get("room_id")
+        )
+        for room_id in room_ids:
+            try:
+                self.rebuild(room_id)
+            except Exception as e:
+                logger.error(f"Lỗi tính lại tóm tắt phòng {room_id}: {str(e)}")
+
+    def remove(self, room_id: str):
+        self.collection.delete_one({"_id": str(room_id)})
+
+    def apply(self, documents: List[dict]):
+        """Cập nhật giá trị sensor trong các phòng từ các reading vừa ghi (listener của ingest buffer)"""
+        newest: Dict[str, dict] = {}
+        for document in documents:
+            if document.get("timestamp") is None or document.get("sensor_id") is None or document.get("device_id") is None:
+                continue
+            sensor_id = str(document["sensor_id"])
+            current = newest.get(sensor_id)
+            if current is None or document["timestamp"] >= current["timestamp"]:
+                newest[sensor_id] = document
+
+        operations = []
+        now = get_vietnam_now_naive()
+        for sensor_id, document in newest.items():
+            device_id = str(document["device_id"])
+            room_ids = set(threshold_engine.get_device_rooms(device_id))
+            if document.get("room_id"):
+                room_ids.add(str(document["room_id"]))
+            if not room_ids:
+                continue
+
+            prefix = f"sensors.{sensor_id}"
+            fields = {
+                f"{prefix}.device_id": device_id,
+                f"{prefix}.value": document.get("value"),
+                f"{prefix}.timestamp": document["timestamp"],
+                "updated_at": now
+            }
+            if document.get("sensor_type"):
+                fields[f"{prefix}.type"] = document["sensor_type"]
+            if document.get("unit"):
+                fields[f"{prefix}.unit"] = document["unit"]
+            for room_id in room_ids:
+                # Chỉ phòng đang chứa device, và chỉ khi reading mới hơn giá trị đang lưu
+                operations.append(UpdateOne(
+                    {"_id": room_id, "device_ids": device_id, f"{prefix}.timestamp": {"$not": {"$gte": document["timestamp"]}}},
+                    {"$set": fields}
+                ))
+        self._write(operations)
+
+    def apply_presence(self, device_ids: Iterable[str], status: str):
+        """Cập nhật trạng thái online / offline của device trong các phòng chứa nó (listener của device_presence)"""
+        self._write([
+            UpdateMany({"device_ids": str(device_id)}, {"$set": {f"devices.{device_id}": status}})
+            for device_id in device_ids
+        ])
+
+    def get_stats(self) -> dict:
+        return {
+            "reads": self._reads,
+            "rebuilds": self._rebuilds,
+            "updates": self._updates
+        }
+
+    # ---------- nội bộ ----------
+
+    def _write(self, operations: list):
+        if not operations:
+            return
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+            self._updates += len(operations)
+        except Exception as e:
+            logger.error(f"Lỗi cập nhật room_summaries ({len(operations)} thao tác): {str(e)}")
+
+
+def summarize(summary: dict, recent_seconds: float) -> dict:
+    """
+    Giá trị theo loại sensor và số device online từ một document tóm tắt.
+
+    Với mỗi loại: lấy reading mới nhất, trung bình các sensor cùng loại có reading trong
+    recent_seconds so với reading mới nhất đó (một sensor thì giữ nguyên giá trị).
+    Trả về {"types": [{type, unit, value, lastUpdate, sensor_count}], "online_devices", "total_devices"}
+    """
+    by_type: Dict[str, List[dict]] = {}
+    for sensor in (summary.get("sensors") or {}).values():
+        by_type.setdefault(sensor.get("type") or "unknown", []).append(sensor)
+
+    types = []
+    for sensor_type, sensors in by_type.items():
+        valid = [
+            sensor for sensor in sensors
+            if sensor.get("value") is not None and sensor.get("timestamp") is not None
+        ]
+        if not valid:
+            types.append({
+                "type": sensor_type,
+                "unit": sensors[0].get("unit", ""),
+                "value": None,
+                "lastUpdate": None,
+                "sensor_count": len(sensors)
+            })
+            continue
+
+        latest = max(valid, key=lambda sensor: sensor["timestamp"])
+        recent = [
+            sensor for sensor in valid
+            if abs((latest["timestamp"] - sensor["timestamp"]).total_seconds()) <= recent_seconds
+        ]
+        if len(recent) == 1:
+            value = latest["value"]
+        else:
+            value = round(sum(sensor["value"] for sensor in recent) / len(recent), 1)
+        types.append({
+            "type": sensor_type,
+            "unit": latest.get("unit", ""),
+            "value": value,
+            "lastUpdate": latest["timestamp"],
+            "sensor_count": len(sensors)
+        })
+
+    statuses = summary.get("devices") or {}
+    device_ids = summary.get("device_ids") or []
+    return {
+        "types": types,
+        "online_devices": sum(1 for device_id in device_ids if statuses.get(device_id) == "online"),
+        "total_devices": len(device_ids)
+    }
+
+
+# Global room summary store instance
+room_summary = RoomSummaryStore(room_summaries_collection)
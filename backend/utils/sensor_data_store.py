@@ -0,0 +1,632 @@
+"""
+Lớp truy vấn / ghi dữ liệu sensor, ẩn cách lưu trữ bên dưới.
+
+SENSOR_DATA_STORAGE chọn cách lưu:
+- raw (mặc định): mỗi reading là một document trong collection sensor_data
+- bucket: mỗi sensor mỗi giờ là một document trong sensor_data_buckets
+    {
+      "_id": "sensor_01:2025122109",
+      "sensor_id": "sensor_01", "device_id": "device_01",
+      "bucket_start": datetime(2025, 12, 21, 9),
+      "sensor_type": "temperature", "unit": "°C", "room_id": "room_01",
+      "count": 720, "sum": 18000.5, "min": 23.1, "max": 27.9,
+      "first_ts": ..., "last_ts": ...,
+      "readings": [{"t": datetime, "v": 25.1, "i": "6761..."}, ...]   // sắp xếp theo t
+    }
+  Bucket có _id xác định nên ghi là upsert; count/sum/min/max được cập nhật khi ghi để
+  thống kê không phải duyệt từng reading. "i" là id cố định của reading (_id do ingest buffer
+  gán); upsert chỉ khớp khi bucket chưa chứa các id đó nên ghi lại cùng một lô (thử lại sau
+  lỗi, replay spill file, chạy lại migration) không cộng trùng count / sum.
+
+Mọi nơi đọc sensor_data (controllers) đi qua sensor_data_store; kết quả luôn có dạng
+document raw ({sensor_id, device_id, value, timestamp, ...}) dù lưu theo cách nào.
+
+Phân trang theo keyset: find(after=...) trả về các reading đứng sau (timestamp, _id) của
+reading cuối trang trước theo thứ tự sắp xếp; encode_cursor / decode_cursor chuyển vị trí
+đó thành chuỗi opaque cho client. Ở chế độ bucket, _id của reading là "i" (reading ghi
+trước khi có "i": "<bucket _id>:<timestamp tới mili giây>"), không phụ thuộc vị trí trong
+mảng readings nên không bị lệch khi $sort chèn reading đến muộn.
+"""
+import base64
+import heapq
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from utils.database import sensor_data_collection, sensor_data_buckets_collection
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STORAGE_RAW = "raw"
+STORAGE_BUCKET = "bucket"
+SENSOR_DATA_STORAGE = os.getenv("SENSOR_DATA_STORAGE", STORAGE_RAW).lower()
+
+BUCKET_SPAN = timedelta(hours=1)
+# Metadata sensor được sao chép vào reading / bucket lúc ingest
+READING_METADATA_FIELDS = ("sensor_type", "unit", "room_id")
+DUPLICATE_KEY_ERROR = 11000
+
+# Id của reading trong bucket (xem legacy_reading_id cho reading chưa có "i")
+_READING_ID_EXPR = {"$ifNull": ["$readings.i", {"$concat": [
+    "$_id", ":", {"$dateToString": {"date": "$readings.t", "format": "%Y%m%d%H%M%S%L"}}
+]}]}
+
+IdFilter = Optional[Union[str, Iterable[str]]]
+
+
+def bucket_start_for(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_id_for(sensor_id: str, timestamp: datetime) -> str:
+    return f"{sensor_id}:{timestamp.strftime('%Y%m%d%H')}"
+
+
+def legacy_reading_id(bucket_id: str, timestamp: datetime) -> str:
+    """Id của reading trong bucket được ghi trước khi có trường "i" (giống _READING_ID_EXPR)"""
+    return f"{bucket_id}:{timestamp.strftime('%Y%m%d%H%M%S')}{timestamp.microsecond // 1000:03d}"
+
+
+def encode_cursor(reading: dict) -> str:
+    """Chuỗi opaque chỉ vị trí (timestamp, _id) của reading"""
+    reading_id = reading["_id"]
+    payload = {"t": reading["timestamp"].isoformat(), "i": str(reading_id)}
+    if isinstance(reading_id, ObjectId):
+        payload["o"] = 1
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, Union[str, ObjectId]]:
+    """(timestamp, _id) từ chuỗi của encode_cursor; ValueError nếu cursor không hợp lệ"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        timestamp = datetime.fromisoformat(payload["t"])
+        reading_id = ObjectId(payload["i"]) if payload.get("o") else str(payload["i"])
+    except Exception:
+        raise ValueError("Cursor không hợp lệ")
+    return timestamp, reading_id
+
+
+def _id_condition(ids: IdFilter):
+    if ids is None:
+        return None
+    if isinstance(ids, str):
+        return ids
+    return {"$in": [str(value) for value in ids]}
+
+
+class SensorDataStore:
+    def __init__(self, raw_collection, bucket_collection, mode: str = SENSOR_DATA_STORAGE):
+        if mode not in (STORAGE_RAW, STORAGE_BUCKET):
+            logger.error(f"SENSOR_DATA_STORAGE không hợp lệ: {mode}, dùng '{STORAGE_RAW}'")
+            mode = STORAGE_RAW
+        self.mode = mode
+        self.raw_collection = raw_collection
+        self.bucket_collection = bucket_collection
+
+    @property
+    def is_bucketed(self) -> bool:
+        return self.mode == STORAGE_BUCKET
+
+    # ---------- ghi ----------
+
+    def insert_many(self, documents: List[dict], ordered: bool = False):
+        """Ghi một lô reading (cùng giao diện với Collection.insert_many để dùng trong ingest buffer)"""
+        if not self.is_bucketed:
+            return self.raw_collection.insert_many(documents, ordered=ordered)
+        return self.write_buckets(self.bucket_collection, documents)
+
+    @classmethod
+    def write_buckets(cls, collection, documents: List[dict]) -> int:
+        """
+        Ghi các reading vào bucket, idempotent theo _id của document (gán ObjectId nếu chưa có).
+        Trả về số reading đã ghi. Nếu có lỗi, raise BulkWriteError với writeErrors theo vị trí
+        trong documents; reading đã có sẵn trong bucket được báo với code 11000.
+        """
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+        groups = list(cls._group_readings(documents).items())
+        write_errors = []
+
+        # Lượt 1: một upsert cho mỗi bucket. Lỗi trùng khóa nghĩa là bucket đã chứa một phần
+        # các reading (hoặc upsert tranh chấp với instance khác): ghi lại từng reading
+        retry = []
+        errors = cls._write_operations(collection, [
+            cls._bucket_operation(bucket_id, group, group["readings"]) for bucket_id, group in groups
+        ])
+        for position, error in errors.items():
+            bucket_id, group = groups[position]
+            if error.get("code") == DUPLICATE_KEY_ERROR:
+                retry.extend((bucket_id, group, reading, index) for reading, index in zip(group["readings"], group["indexes"]))
+            else:
+                write_errors.extend(_write_error(index, error) for index in group["indexes"])
+
+        # Lượt 2 và 3: trùng khóa lần đầu có thể do upsert tranh chấp, lần sau là reading đã có
+        for attempt in range(2):
+            if not retry:
+                break
+            errors = cls._write_operations(collection, [
+                cls._bucket_operation(bucket_id, group, [reading]) for bucket_id, group, reading, _ in retry
+            ])
+            pending = []
+            for position, error in errors.items():
+                if error.get("code") == DUPLICATE_KEY_ERROR and attempt == 0:
+                    pending.append(retry[position])
+                else:
+                    write_errors.append(_write_error(retry[position][3], error))
+            retry = pending
+
+        if write_errors:
+            write_errors.sort(key=lambda error: error["index"])
+            raise BulkWriteError({
+                "writeErrors": write_errors,
+                "writeConcernErrors": [],
+                "nInserted": len(documents) - len(write_errors),
+                "nUpserted": 0,
+                "nMatched": 0,
+                "nModified": 0,
+                "nRemoved": 0,
+                "upserted": []
+            })
+        return len(documents)
+
+    @classmethod
+    def build_bucket_operations(cls, documents: List[dict]) -> List[UpdateOne]:
+        """Gom các reading theo (sensor_id, giờ) thành một upsert cho mỗi bucket (documents phải có _id)"""
+        return [
+            cls._bucket_operation(bucket_id, group, group["readings"])
+            for bucket_id, group in cls._group_readings(documents).items()
+        ]
+
+    @staticmethod
+    def _group_readings(documents: List[dict]) -> Dict[str, dict]:
+        groups: Dict[str, dict] = {}
+        for index, document in enumerate(documents):
+            timestamp = document["timestamp"]
+            sensor_id = str(document["sensor_id"])
+            bucket_id = bucket_id_for(sensor_id, timestamp)
+            group = groups.get(bucket_id)
+            if group is None:
+                group = groups[bucket_id] = {
+                    "sensor_id": sensor_id,
+                    "device_id": document.get("device_id"),
+                    "bucket_start": bucket_start_for(timestamp),
+                    "metadata": {key: document[key] for key in READING_METADATA_FIELDS if document.get(key)},
+                    "readings": [],
+                    "indexes": []
+                }
+            group["readings"].append({"t": timestamp, "v": document["value"], "i": str(document["_id"])})
+            group["indexes"].append(index)
+        return groups
+
+    @staticmethod
+    def _bucket_operation(bucket_id: str, group: dict, readings: List[dict]) -> UpdateOne:
+        """Upsert thêm readings vào bucket, chỉ khớp khi bucket chưa chứa reading nào trong số đó"""
+        values = [reading["v"] for reading in readings]
+        timestamps = [reading["t"] for reading in readings]
+        update = {
+            "$setOnInsert": {
+                "sensor_id": group["sensor_id"],
+                "device_id": group["device_id"],
+                "bucket_start": group["bucket_start"]
+            },
+            "$push": {"readings": {"$each": readings, "$sort": {"t": 1}}},
+            "$inc": {"count": len(readings), "sum": sum(values)},
+            "$min": {"min": min(values), "first_ts": min(timestamps)},
+            "$max": {"max": max(values), "last_ts": max(timestamps)}
+        }
+        if group["metadata"]:
+            update["$set"] = group["metadata"]
+        return UpdateOne(
+            {"_id": bucket_id, "readings.i": {"$nin": [reading["i"] for reading in readings]}},
+            update,
+            upsert=True
+        )
+
+    @staticmethod
+    def _write_operations(collection, operations: List[UpdateOne]) -> Dict[int, dict]:
+        """bulk_write(ordered=False), trả về {vị trí operation: lỗi}"""
+        if not operations:
+            return {}
+        try:
+            collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            return {error["index"]: error for error in e.details.get("writeErrors", [])}
+        return {}
+
+    # ---------- đọc ----------
+
+    def find(
+        self,
+        sensor_ids: IdFilter = None,
+        device_ids: IdFilter = None,
+        sensor_type: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        sort_direction: int = -1,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[datetime, Union[str, ObjectId]]] = None
+    ) -> List[dict]:
+        """
+        Danh sách reading theo bộ lọc, sắp xếp theo (timestamp, _id).
+        after: (timestamp, _id) của reading cuối trang trước (xem decode_cursor), chỉ lấy
+        các reading đứng sau nó nên mỗi trang có chi phí như trang đầu
+        """
+        operator = "$lt" if sort_direction < 0 else "$gt"
+        if after is not None:
+            # Thu hẹp khoảng thời gian tới vị trí cursor để index cắt bớt phần đã đọc
+            if sort_direction < 0:
+                end = min(end, after[0]) if end is not None else after[0]
+            else:
+                start = max(start, after[0]) if start is not None else after[0]
+
+        if not self.is_bucketed:
+            query = self._raw_match(sensor_ids, device_ids, sensor_type, start, end)
+            if after is not None:
+                query["$or"] = [
+                    {"timestamp": {operator: after[0]}},
+                    {"timestamp": after[0], "_id": {operator: after[1]}}
+                ]
+            cursor = self.raw_collection.find(query).sort([("timestamp", sort_direction), ("_id", sort_direction)])
+            if limit:
+                cursor = cursor.limit(limit)
+            return list(cursor)
+
+        pipeline = [
+            {"$match": self._bucket_match(sensor_ids, device_ids, sensor_type, start, end)},
+            {"$sort": {"bucket_start": sort_direction}},
+            {"$unwind": "$readings"}
+        ]
+        reading_match = self._time_condition("readings.t", start, end)
+        if reading_match:
+            pipeline.append({"$match": reading_match})
+        pipeline.append({"$addFields": {"reading_id": _READING_ID_EXPR}})
+        if after is not None:
+            pipeline.append({"$match": {"$or": [
+                {"readings.t": {operator: after[0]}},
+                {"readings.t": after[0], "reading_id": {operator: str(after[1])}}
+            ]}})
+        pipeline.append({"$sort": {"readings.t": sort_direction, "reading_id": sort_direction}})
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$project": {
+            "sensor_id": 1,
+            "device_id": 1,
+            "sensor_type": 1,
+            "unit": 1,
+            "room_id": 1,
+            "value": "$readings.v",
+            "timestamp": "$readings.t",
+            "reading_id": 1
+        }})
+        readings = list(self.bucket_collection.aggregate(pipeline))
+        for reading in readings:
+            reading["_id"] = reading["sensor_data_id"] = reading.pop("reading_id")
+        return readings
+
+    def iter_readings(
+        self,
+        sensor_ids: IdFilter = None,
+        device_ids: IdFilter = None,
+        sensor_type: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> Iterable[dict]:
+        """Cursor {sensor_type, value, timestamp} (không sắp xếp) để duyệt một lượt mà không nạp hết vào bộ nhớ"""
+        if not self.is_bucketed:
+            return self.raw_collection.find(
+                self._raw_match(sensor_ids, device_ids, sensor_type, start, end),
+                {"_id": 0, "sensor_type": 1, "value": 1, "timestamp": 1}
+            )
+
+        pipeline = [
+            {"$match": self._bucket_match(sensor_ids, device_ids, sensor_type, start, end)},
+            {"$project": {"_id": 0, "sensor_type": 1, "readings": 1}},
+            {"$unwind": "$readings"}
+        ]
+        reading_match = self._time_condition("readings.t", start, end)
+        if reading_match:
+            pipeline.append({"$match": reading_match})
+        pipeline.append({"$project": {"sensor_type": 1, "value": "$readings.v", "timestamp": "$readings.t"}})
+        return self.bucket_collection.aggregate(pipeline)
+
+    def stream(
+        self,
+        sensor_ids: IdFilter = None,
+        device_ids: IdFilter = None,
+        sensor_type: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        batch_size: int = 1000
+    ) -> Iterable[dict]:
+        """
+        Duyệt mọi reading theo thứ tự thời gian tăng dần bằng cursor phía server, bộ nhớ
+        không phụ thuộc độ dài khoảng thời gian (chế độ bucket: tối đa các bucket của một giờ)
+        """
+        if not self.is_bucketed:
+            yield from self.raw_collection.find(
+                self._raw_match(sensor_ids, device_ids, sensor_type, start, end),
+                {"_id": 0, "sensor_id": 1, "device_id": 1, "sensor_type": 1, "unit": 1, "room_id": 1, "value": 1, "timestamp": 1},
+                batch_size=batch_size
+            ).sort([("timestamp", 1), ("_id", 1)])
+            return
+
+        cursor = self.bucket_collection.find(
+            self._bucket_match(sensor_ids, device_ids, sensor_type, start, end),
+            {"sensor_id": 1, "device_id": 1, "sensor_type": 1, "unit": 1, "room_id": 1, "bucket_start": 1, "readings": 1},
+            batch_size=batch_size
+        ).sort("bucket_start", 1)
+        hour: List[dict] = []
+        for bucket in cursor:
+            if hour and bucket["bucket_start"] != hour[0]["bucket_start"]:
+                yield from self._merge_buckets(hour, start, end)
+                hour = []
+            hour.append(bucket)
+        if hour:
+            yield from self._merge_buckets(hour, start, end)
+
+    @staticmethod
+    def _merge_buckets(buckets: List[dict], start: Optional[datetime], end: Optional[datetime]) -> Iterable[dict]:
+        """Trộn reading của các bucket cùng giờ (mỗi bucket đã sắp xếp theo t) theo thời gian"""
+        def readings_of(bucket: dict) -> Iterable[dict]:
+            metadata = {key: bucket[key] for key in ("sensor_id", "device_id", *READING_METADATA_FIELDS) if bucket.get(key)}
+            for reading in bucket.get("readings", []):
+                if (start is None or reading["t"] >= start) and (end is None or reading["t"] <= end):
+                    yield dict(metadata, value=reading["v"], timestamp=reading["t"])
+
+        yield from heapq.merge(*(readings_of(bucket) for bucket in buckets), key=lambda reading: reading["timestamp"])
+
+    def count(
+        self,
+        sensor_ids: IdFilter = None,
+        device_ids: IdFilter = None,
+        sensor_type: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> int:
+        if not self.is_bucketed:
+            return self.raw_collection.count_documents(self._raw_match(sensor_ids, device_ids, sensor_type, start, end))
+
+        if start is None and end is None:
+            size = "$count"
+        else:
+            size = {"$size": {"$filter": {
+                "input": "$readings",
+                "as": "reading",
+                "cond": {"$and": self._expr_time_conditions("$$reading.t", start, end)}
+            }}}
+        result = list(self.bucket_collection.aggregate([
+            {"$match": self._bucket_match(sensor_ids, device_ids, sensor_type, start, end)},
+            {"$group": {"_id": None, "total": {"$sum": size}}}
+        ]))
+        return result[0]["total"] if result else 0
+
+    def latest(self, sensor_ids: Iterable[str]) -> Dict[str, dict]:
+        """Reading mới nhất của từng sensor: {sensor_id: document}"""
+        sensor_ids = [str(sensor_id) for sensor_id in sensor_ids]
+        if not sensor_ids:
+            return {}
+        if not self.is_bucketed:
+            pipeline = [
+                {"$match": {"sensor_id": {"$in": sensor_ids}}},
+                {"$sort": {"timestamp": -1}},
+                {"$group": {"_id": "$sensor_id", "latest_data": {"$first": "$$ROOT"}}},
+                {"$replaceRoot": {"newRoot": "$latest_data"}}
+            ]
+            return {str(document["sensor_id"]): document for document in self.raw_collection.aggregate(pipeline)}
+
+        pipeline = [
+            {"$match": {"sensor_id": {"$in": sensor_ids}}},
+            {"$sort": {"bucket_start": -1}},
+            {"$group": {"_id": "$sensor_id", "bucket": {"$first": "$$ROOT"}}},
+            {"$project": {
+                "_id": "$bucket._id",
+                "sensor_id": "$bucket.sensor_id",
+                "device_id": "$bucket.device_id",
+                "sensor_type": "$bucket.sensor_type",
+                "reading": {"$arrayElemAt": ["$bucket.readings", -1]}
+            }}
+        ]
+        latest = {}
+        for bucket in self.bucket_collection.aggregate(pipeline):
+            reading = bucket.get("reading") or {}
+            reading_id = reading.get("i") or (legacy_reading_id(bucket["_id"], reading["t"]) if reading.get("t") else str(bucket["_id"]))
+            latest[str(bucket["sensor_id"])] = {
+                "_id": reading_id,
+                "sensor_data_id": reading_id,
+                "sensor_id": bucket["sensor_id"],
+                "device_id": bucket.get("device_id"),
+                "sensor_type": bucket.get("sensor_type"),
+                "value": reading.get("v"),
+                "timestamp": reading.get("t")
+            }
+        return latest
+
+    def statistics(
+        self,
+        sensor_ids: IdFilter = None,
+        device_ids: IdFilter = None,
+        sensor_type: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> List[dict]:
+        """count / min / max / avg / khoảng thời gian theo từng sensor"""
+        project = {
+            "$project": {
+                "_id": 0,
+                "sensor_id": "$_id.sensor_id",
+                "sensor_type": "$_id.sensor_type",
+                "device_id": "$_id.device_id",
+                "count": 1,
+                "min_value": {"$round": ["$min_value", 2]},
+                "max_value": {"$round": ["$max_value", 2]},
+                "avg_value": {"$round": ["$avg_value", 2]},
+                "latest_timestamp": 1,
+                "earliest_timestamp": 1
+            }
+        }
+        group_id = {"sensor_id": "$sensor_id", "sensor_type": "$sensor_type", "device_id": "$device_id"}
+
+        if not self.is_bucketed:
+            return list(self.raw_collection.aggregate([
+                {"$match": self._raw_match(sensor_ids, device_ids, sensor_type, start, end)},
+                {"$group": {
+                    "_id": group_id,
+                    "count": {"$sum": 1},
+                    "min_value": {"$min": "$value"},
+                    "max_value": {"$max": "$value"},
+                    "avg_value": {"$avg": "$value"},
+                    "latest_timestamp": {"$max": "$timestamp"},
+                    "earliest_timestamp": {"$min": "$timestamp"}
+                }},
+                project
+            ]))
+
+        match = {"$match": self._bucket_match(sensor_ids, device_ids, sensor_type, start, end)}
+        if start is None and end is None:
+            # Không giới hạn thời gian: dùng tổng đã tính sẵn trong bucket
+            pipeline = [
+                match,
+                {"$group": {
+                    "_id": group_id,
+                    "count": {"$sum": "$count"},
+                    "total": {"$sum": "$sum"},
+                    "min_value": {"$min": "$min"},
+                    "max_value": {"$max": "$max"},
+                    "latest_timestamp": {"$max": "$last_ts"},
+                    "earliest_timestamp": {"$min": "$first_ts"}
+                }},
+                {"$addFields": {"avg_value": {"$cond": [{"$gt": ["$count", 0]}, {"$divide": ["$total", "$count"]}, None]}}},
+                project
+            ]
+        else:
+            pipeline = [
+                match,
+                {"$unwind": "$readings"},
+                {"$match": self._time_condition("readings.t", start, end)},
+                {"$group": {
+                    "_id": group_id,
+                    "count": {"$sum": 1},
+                    "min_value": {"$min": "$readings.v"},
+                    "max_value": {"$max": "$readings.v"},
+                    "avg_value": {"$avg": "$readings.v"},
+                    "latest_timestamp": {"$max": "$readings.t"},
+                    "earliest_timestamp": {"$min": "$readings.t"}
+                }},
+                project
+            ]
+        return list(self.bucket_collection.aggregate(pipeline))
+
+    def partials(
+        self,
+        sensor_ids: IdFilter = None,
+        device_ids: IdFilter = None,
+        sensor_type: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> List[dict]:
+        """
+        Tổng chưa làm tròn theo sensor trong khoảng [start, end) (end không tính), để ghép với
+        dữ liệu rollup: sensor_id, device_id, sensor_type, count, sum, sumsq, min, max, first_ts, last_ts
+        """
+        group = {
+            "_id": "$sensor_id",
+            "device_id": {"$first": "$device_id"},
+            "sensor_type": {"$first": "$sensor_type"},
+            "count": {"$sum": 1},
+            "sum": {"$sum": "$value"},
+            "sumsq": {"$sum": {"$multiply": ["$value", "$value"]}},
+            "min": {"$min": "$value"},
+            "max": {"$max": "$value"},
+            "first_ts": {"$min": "$timestamp"},
+            "last_ts": {"$max": "$timestamp"}
+        }
+        if not self.is_bucketed:
+            match = self._raw_match(sensor_ids, device_ids, sensor_type, start, None)
+            if end is not None:
+                match.setdefault("timestamp", {})["$lt"] = end
+            pipeline = [{"$match": match}, {"$group": group}]
+            results = self.raw_collection.aggregate(pipeline)
+        else:
+            match = self._bucket_match(sensor_ids, device_ids, sensor_type, start, None)
+            if end is not None:
+                match.setdefault("bucket_start", {})["$lt"] = end
+            reading_match = self._time_condition("readings.t", start, None)
+            if end is not None:
+                reading_match.setdefault("readings.t", {})["$lt"] = end
+            pipeline = [
+                {"$match": match},
+                {"$unwind": "$readings"},
+                {"$match": reading_match},
+                {"$project": {"sensor_id": 1, "device_id": 1, "sensor_type": 1, "value": "$readings.v", "timestamp": "$readings.t"}},
+                {"$group": group}
+            ]
+            results = self.bucket_collection.aggregate(pipeline)
+        partials = []
+        for result in results:
+            result["sensor_id"] = result.pop("_id")
+            partials.append(result)
+        return partials
+
+    # ---------- nội bộ ----------
+
+    @staticmethod
+    def _time_condition(field: str, start: Optional[datetime], end: Optional[datetime]) -> dict:
+        condition = {}
+        if start is not None:
+            condition["$gte"] = start
+        if end is not None:
+            condition["$lte"] = end
+        return {field: condition} if condition else {}
+
+    @staticmethod
+    def _expr_time_conditions(field: str, start: Optional[datetime], end: Optional[datetime]) -> list:
+        conditions = []
+        if start is not None:
+            conditions.append({"$gte": [field, start]})
+        if end is not None:
+            conditions.append({"$lte": [field, end]})
+        return conditions
+
+    def _raw_match(self, sensor_ids, device_ids, sensor_type, start, end) -> dict:
+        query = {}
+        if sensor_ids is not None:
+            query["sensor_id"] = _id_condition(sensor_ids)
+        if device_ids is not None:
+            query["device_id"] = _id_condition(device_ids)
+        if sensor_type:
+            query["sensor_type"] = sensor_type
+        query.update(self._time_condition("timestamp", start, end))
+        return query
+
+    def _bucket_match(self, sensor_ids, device_ids, sensor_type, start, end) -> dict:
+        query = {}
+        if sensor_ids is not None:
+            query["sensor_id"] = _id_condition(sensor_ids)
+        if device_ids is not None:
+            query["device_id"] = _id_condition(device_ids)
+        if sensor_type:
+            query["sensor_type"] = sensor_type
+        # Bucket giao với khoảng [start, end] khi bucket_start nằm trong [giờ của start, end]
+        query.update(self._time_condition(
+            "bucket_start",
+            bucket_start_for(start) if start is not None else None,
+            end
+        ))
+        return query
+
+
+def _write_error(index: int, error: dict) -> dict:
+    return {"index": index, "code": error.get("code"), "errmsg": error.get("errmsg", "")}
+
+
+# Global sensor data store instance
+sensor_data_store = SensorDataStore(sensor_data_collection, sensor_data_buckets_collection)
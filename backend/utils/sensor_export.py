@@ -0,0 +1,84 @@
+"""
+Xuất lịch sử sensor dạng luồng (NDJSON hoặc CSV, có thể nén gzip).
+
+Reading được đọc từ cursor của sensor_data_store.stream(), chuyển thành từng dòng và gom
+thành khối khoảng SENSOR_EXPORT_CHUNK_BYTES trước khi gửi, nên bộ nhớ không phụ thuộc số
+reading được xuất. Nén gzip theo từng khối bằng zlib.compressobj (không giữ toàn bộ file).
+"""
+import csv
+import io
+import os
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from utils.payload_codec import dumps_json
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SENSOR_EXPORT_CHUNK_BYTES = int(os.getenv("SENSOR_EXPORT_CHUNK_BYTES", "65536"))
+SENSOR_EXPORT_BATCH_SIZE = int(os.getenv("SENSOR_EXPORT_BATCH_SIZE", "1000"))
+
+FORMAT_NDJSON = "ndjson"
+FORMAT_CSV = "csv"
+EXPORT_FIELDS = ("timestamp", "sensor_id", "device_id", "sensor_type", "unit", "room_id", "value")
+MEDIA_TYPES = {
+    FORMAT_NDJSON: "application/x-ndjson",
+    FORMAT_CSV: "text/csv; charset=utf-8"
+}
+
+
+def _row(reading: dict) -> dict:
+    row = {field: reading.get(field) for field in EXPORT_FIELDS}
+    if isinstance(row["timestamp"], datetime):
+        row["timestamp"] = row["timestamp"].isoformat()
+    return row
+
+
+def ndjson_lines(readings: Iterable[dict]) -> Iterator[bytes]:
+    for reading in readings:
+        yield dumps_json(_row(reading)) + b"\n"
+
+
+def csv_lines(readings: Iterable[dict]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for reading in readings:
+        writer.writerow(_row(reading))
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def chunked(lines: Iterable[bytes], chunk_bytes: int = SENSOR_EXPORT_CHUNK_BYTES) -> Iterator[bytes]:
+    """Gom các dòng nhỏ thành khối để giảm số lần ghi ra socket"""
+    parts = []
+    size = 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b"".join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b"".join(parts)
+
+
+def gzipped(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: định dạng gzip
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(readings: Iterable[dict], export_format: str = FORMAT_NDJSON, compress: bool = True) -> Iterator[bytes]:
+    lines = csv_lines(readings) if export_format == FORMAT_CSV else ndjson_lines(readings)
+    chunks = chunked(lines)
+    return gzipped(chunks) if compress else chunks
@@ -0,0 +1,158 @@
+"""
+Giá trị mới nhất của từng sensor (collection sensor_latest, _id = sensor_id).
+
+- Ingest buffer gọi apply() sau mỗi lô ghi thành công: một bulk_write upsert cho các sensor
+  trong lô, chỉ ghi đè khi reading mới hơn bản đang lưu (filter timestamp $lt; trùng _id
+  nghĩa là bản đang lưu mới hơn và được bỏ qua)
+- get_many() đọc qua cache trong process (SENSOR_LATEST_CACHE_TTL_SECONDS), phần thiếu
+  lấy bằng một truy vấn _id $in; sensor chưa có bản ghi (dữ liệu trước khi có collection
+  này) được tính từ lịch sử một lần rồi lưu lại
+Kết quả có dạng document reading ({_id, sensor_data_id, sensor_id, device_id, value, timestamp, ...})
+như sensor_data_store.latest().
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from utils.database import sensor_latest_collection
+from utils.sensor_data_store import READING_METADATA_FIELDS, sensor_data_store
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SENSOR_LATEST_CACHE_TTL_SECONDS = float(os.getenv("SENSOR_LATEST_CACHE_TTL_SECONDS", "5"))
+DUPLICATE_KEY_ERROR = 11000
+
+
+def _record(reading: dict) -> dict:
+    """Bản ghi sensor_latest từ một reading"""
+    record = {
+        "sensor_id": str(reading["sensor_id"]),
+        "device_id": reading.get("device_id"),
+        "value": reading.get("value"),
+        "timestamp": reading["timestamp"],
+        "created_at": reading.get("created_at"),
+        "reading_id": str(reading.get("_id") or reading.get("sensor_data_id") or "")
+    }
+    for key in READING_METADATA_FIELDS:
+        if reading.get(key):
+            record[key] = reading[key]
+    return record
+
+
+def _as_reading(record: dict) -> dict:
+    reading = dict(record)
+    reading_id = reading.pop("reading_id", None) or reading["_id"]
+    reading["_id"] = reading["sensor_data_id"] = reading_id
+    return reading
+
+
+class SensorLatestStore:
+    def __init__(self, collection, ttl_seconds: float = SENSOR_LATEST_CACHE_TTL_SECONDS):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # sensor_id -> (expires_at, record hoặc None nếu sensor chưa có dữ liệu)
+        self._cache: Dict[str, tuple] = {}
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._seeded = 0
+
+    def apply(self, documents: List[dict]):
+        """Cập nhật giá trị mới nhất từ các reading vừa ghi (listener của ingest buffer)"""
+        newest: Dict[str, dict] = {}
+        for document in documents:
+            if document.get("timestamp") is None or document.get("sensor_id") is None:
+                continue
+            sensor_id = str(document["sensor_id"])
+            current = newest.get(sensor_id)
+            if current is None or document["timestamp"] >= current["timestamp"]:
+                newest[sensor_id] = document
+        self._write([_record(document) for document in newest.values()])
+
+    def get_many(self, sensor_ids: Iterable[str]) -> Dict[str, dict]:
+        """Reading mới nhất của từng sensor: {sensor_id: document}"""
+        sensor_ids = list(dict.fromkeys(str(sensor_id) for sensor_id in sensor_ids))
+        now = time.monotonic()
+        records: Dict[str, Optional[dict]] = {}
+        misses = []
+        with self._lock:
+            for sensor_id in sensor_ids:
+                entry = self._cache.get(sensor_id)
+                if entry is not None and entry[0] > now:
+                    records[sensor_id] = entry[1]
+                else:
+                    misses.append(sensor_id)
+        self._hits += len(sensor_ids) - len(misses)
+        self._misses += len(misses)
+
+        if misses:
+            found = {str(record["_id"]): record for record in self.collection.find({"_id": {"$in": misses}})}
+            unknown = [sensor_id for sensor_id in misses if sensor_id not in found]
+            if unknown:
+                # Sensor chưa có bản ghi: tính từ lịch sử một lần và lưu lại
+                seeded = [_record(reading) for reading in sensor_data_store.latest(unknown).values()]
+                self._write(seeded)
+                self._seeded += len(seeded)
+                for record in seeded:
+                    found[record["sensor_id"]] = {"_id": record["sensor_id"], **record}
+            expires_at = time.monotonic() + self.ttl_seconds
+            with self._lock:
+                for sensor_id in misses:
+                    self._cache[sensor_id] = (expires_at, found.get(sensor_id))
+            records.update((sensor_id, found.get(sensor_id)) for sensor_id in misses)
+
+        return {sensor_id: _as_reading(record) for sensor_id, record in records.items() if record}
+
+    def invalidate(self, sensor_id: str):
+        with self._lock:
+            self._cache.pop(str(sensor_id), None)
+
+    def get_stats(self) -> dict:
+        return {
+            "cached_sensors": len(self._cache),
+            "hits": self._hits,
+            "misses": self._misses,
+            "writes": self._writes,
+            "seeded": self._seeded
+        }
+
+    # ---------- nội bộ ----------
+
+    def _write(self, records: List[dict]):
+        if not records:
+            return
+        operations = [
+            UpdateOne({"_id": record["sensor_id"], "timestamp": {"$lt": record["timestamp"]}}, {"$set": record}, upsert=True)
+            for record in records
+        ]
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Trùng _id: bản đang lưu mới hơn reading này
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY_ERROR]
+            if errors:
+                logger.error(f"Lỗi cập nhật sensor_latest cho {len(errors)}/{len(operations)} sensor")
+        except Exception as e:
+            logger.error(f"Lỗi cập nhật sensor_latest ({len(operations)} sensor): {str(e)}")
+            return
+        self._writes += len(operations)
+
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for record in records:
+                entry = self._cache.get(record["sensor_id"])
+                cached = entry[1] if entry else None
+                if cached is None or cached["timestamp"] <= record["timestamp"]:
+                    self._cache[record["sensor_id"]] = (expires_at, {"_id": record["sensor_id"], **record})
+
+
+# Global sensor latest store instance
+sensor_latest = SensorLatestStore(sensor_latest_collection)
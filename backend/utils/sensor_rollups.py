@@ -0,0 +1,622 @@
+"""
+Rollup dữ liệu sensor theo phút / giờ / ngày, cập nhật liên tục từ ingest buffer.
+
+Mỗi tầng là một collection, mỗi sensor mỗi khoảng thời gian một document:
+    {
+      "_id": "sensor_01:202512210930",
+      "sensor_id": "sensor_01", "device_id": "device_01", "sensor_type": "temperature",
+      "period_start": datetime(2025, 12, 21, 9, 30),
+      "count": 12, "sum": 301.2, "sumsq": 7560.1, "min": 24.8, "max": 25.3,
+      "first": {"t": datetime, "v": 25.0}, "last": {"t": datetime, "v": 25.2}
+    }
+Sau mỗi lô ghi thành công, ingest buffer gọi sensor_rollups.apply() với các reading đã ghi;
+mỗi tầng được cập nhật bằng một bulk_write upsert ($inc / $min / $max nên ghi nhiều lần
+cùng một khoảng vẫn đúng). first/last là document {t, v}: MongoDB so sánh document theo
+từng trường nên $min / $max trên {t, v} giữ reading sớm nhất / muộn nhất.
+
+Planner:
+- plan(start, end): chia [start, end) thành các đoạn khớp ranh giới ngày / giờ / phút,
+  phần lẻ ở hai đầu lấy từ tầng mịn hơn, cuối cùng là dữ liệu raw; statistics() ghép
+  các đoạn nên số document phải đọc không phụ thuộc độ dài khoảng thời gian
+- choose_tier(start, resolution): tầng thô nhất có độ phân giải không vượt quá
+  resolution và còn dữ liệu tại start (theo retention), dùng cho trends
+- period_table(tier, ...): min / max / avg / count theo từng chu kỳ giờ hoặc ngày cho bảng
+  thống kê; chu kỳ đã đóng được cache (ClosedPeriodCache) nên mỗi request chỉ tính lại
+  chu kỳ hiện tại
+Operation của một tầng ghi lỗi được giữ lại (tối đa SENSOR_ROLLUP_RETRY_MAX_OPS) và ghi lại
+ở lần apply() sau; với BulkWriteError chỉ giữ các operation lỗi. Lỗi mạng sau khi server đã
+ghi một phần có thể làm cộng trùng: chạy backfill cho các ngày đó nếu cần số liệu chính xác.
+
+Bật rollup (mặc định tắt, statistics / trends đọc dữ liệu raw):
+- SENSOR_ROLLUPS_WRITE_ENABLED (mặc định true): ingest luôn cập nhật rollup, kể cả khi chưa đọc
+- chạy scripts/backfill_sensor_rollups.py --days N để tính rollup cho N ngày đã có dữ liệu
+  (không gồm hôm nay, phần đó đã được ingest ghi nếu rollup được ghi từ đầu ngày)
+- đặt SENSOR_ROLLUPS_ENABLED=true để planner đọc từ rollup; bật trước khi backfill thì
+  statistics / trends thiếu dữ liệu các ngày chưa được tính
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from utils.downsampling import BucketAccumulator
+from utils.database import (
+    sensor_rollups_minute_collection, sensor_rollups_hour_collection, sensor_rollups_day_collection
+)
+from utils.metadata_cache import metadata_cache
+from utils.retention import RetentionTier, SENSOR_DATA_RETENTION_DAYS, retention_manager
+from utils.sensor_data_store import IdFilter, _id_condition, sensor_data_store
+from utils.timezone import get_vietnam_now_naive
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SENSOR_ROLLUPS_ENABLED = os.getenv("SENSOR_ROLLUPS_ENABLED", "false").lower() == "true"
+SENSOR_ROLLUPS_WRITE_ENABLED = os.getenv("SENSOR_ROLLUPS_WRITE_ENABLED", "true").lower() == "true"
+SENSOR_ROLLUP_MINUTE_RETENTION_DAYS = float(os.getenv("SENSOR_ROLLUP_MINUTE_RETENTION_DAYS", "90"))
+SENSOR_ROLLUP_HOUR_RETENTION_DAYS = float(os.getenv("SENSOR_ROLLUP_HOUR_RETENTION_DAYS", "0"))
+SENSOR_ROLLUP_DAY_RETENTION_DAYS = float(os.getenv("SENSOR_ROLLUP_DAY_RETENTION_DAYS", "0"))
+SENSOR_TABLE_CACHE_TTL_SECONDS = float(os.getenv("SENSOR_TABLE_CACHE_TTL_SECONDS", "3600"))
+SENSOR_TABLE_CACHE_MAX_ENTRIES = int(os.getenv("SENSOR_TABLE_CACHE_MAX_ENTRIES", "1000"))
+SENSOR_ROLLUP_RETRY_MAX_OPS = int(os.getenv("SENSOR_ROLLUP_RETRY_MAX_OPS", "100000"))
+
+# Segment của plan(): (tier, start, end); tier None là dữ liệu raw
+Segment = Tuple[Optional["RollupTier"], Optional[datetime], datetime]
+
+
+class RollupTier:
+    def __init__(self, name: str, collection, span: timedelta, retention_days: float, id_format: str):
+        self.name = name
+        self.collection = collection
+        self.span = span
+        self.retention_days = retention_days
+        self.id_format = id_format
+
+    def truncate(self, timestamp: datetime) -> datetime:
+        if self.span >= timedelta(days=1):
+            return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.span >= timedelta(hours=1):
+            return timestamp.replace(minute=0, second=0, microsecond=0)
+        return timestamp.replace(second=0, microsecond=0)
+
+    def ceil(self, timestamp: datetime) -> datetime:
+        truncated = self.truncate(timestamp)
+        return truncated if truncated == timestamp else truncated + self.span
+
+    def rollup_id(self, sensor_id: str, period_start: datetime) -> str:
+        return f"{sensor_id}:{period_start.strftime(self.id_format)}"
+
+
+class ClosedPeriodCache:
+    """
+    Kết quả theo chu kỳ đã đóng, key là (tầng, loại sensor, danh sách device).
+    Reading đến muộn cho chu kỳ đã đóng chỉ hiện ra sau khi entry hết TTL.
+    """
+
+    def __init__(self, ttl_seconds: float = SENSOR_TABLE_CACHE_TTL_SECONDS, max_entries: int = SENSOR_TABLE_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        # key -> (expires_at, {period_start: row hoặc None nếu chu kỳ không có dữ liệu})
+        self._entries: "OrderedDict[tuple, Tuple[float, Dict[datetime, Optional[dict]]]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: tuple) -> Dict[datetime, Optional[dict]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self._entries.pop(key, None)
+                self._misses += 1
+                return {}
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return dict(entry[1])
+
+    def update(self, key: tuple, periods: Dict[datetime, Optional[dict]]):
+        if not periods:
+            return
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > time.monotonic():
+                expires_at, cached = entry
+                cached.update(periods)
+            else:
+                expires_at, cached = time.monotonic() + self.ttl_seconds, dict(periods)
+            self._entries[key] = (expires_at, cached)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+class SensorRollups:
+    def __init__(
+        self,
+        tiers: List[RollupTier],
+        raw_retention_days: float = SENSOR_DATA_RETENTION_DAYS,
+        enabled: bool = SENSOR_ROLLUPS_ENABLED,
+        write_enabled: bool = SENSOR_ROLLUPS_WRITE_ENABLED
+    ):
+        """
+        Args:
+            enabled: planner / period_table đọc từ rollup (False: đọc raw)
+            write_enabled: apply() cập nhật rollup từ ingest
+        """
+        # Sắp xếp từ mịn tới thô
+        self.tiers = sorted(tiers, key=lambda tier: tier.span)
+        self.raw_retention_days = raw_retention_days
+        self.enabled = enabled
+        self.write_enabled = write_enabled
+        self.table_cache = ClosedPeriodCache()
+        self._applied = 0
+        self._failed = 0
+        # (tier, operation) ghi lỗi, chờ ghi lại ở lần apply() sau
+        self._retry = deque()
+        self._retry_dropped = 0
+
+    # ---------- ghi ----------
+
+    def apply(self, documents: List[dict]):
+        """Cập nhật rollup cho các reading vừa được ghi (listener của ingest buffer)"""
+        if not self.write_enabled or not documents:
+            return
+        self.retry_failed()
+        for tier in self.tiers:
+            self._write(tier, self.build_operations(tier, documents))
+        self._applied += len(documents)
+
+    def retry_failed(self):
+        """Ghi lại các operation lỗi trước đó; lỗi lần nữa thì tiếp tục được giữ lại"""
+        if not self._retry:
+            return
+        pending = list(self._retry)
+        self._retry.clear()
+        for tier in self.tiers:
+            operations = [operation for operation_tier, operation in pending if operation_tier is tier]
+            if operations:
+                logger.info(f"Ghi lại {len(operations)} rollup {tier.name} bị lỗi trước đó")
+                self._write(tier, operations)
+
+    def _write(self, tier: "RollupTier", operations: List[UpdateOne]):
+        if not operations:
+            return
+        try:
+            tier.collection.bulk_write(operations, ordered=False)
+            return
+        except BulkWriteError as e:
+            indexes = {error.get("index") for error in e.details.get("writeErrors", [])}
+            failed = [operation for index, operation in enumerate(operations) if index in indexes]
+            message = str(e.details.get("writeErrors", [{}])[0].get("errmsg")) if indexes else str(e)
+        except Exception as e:
+            failed = operations
+            message = str(e)
+        self._failed += len(failed)
+        logger.error(f"Lỗi cập nhật rollup {tier.name} ({len(failed)}/{len(operations)} document), sẽ ghi lại: {message}")
+        for operation in failed:
+            if len(self._retry) >= SENSOR_ROLLUP_RETRY_MAX_OPS:
+                self._retry.popleft()
+                self._retry_dropped += 1
+            self._retry.append((tier, operation))
+
+    @classmethod
+    def build_operations(cls, tier: RollupTier, documents: List[dict]) -> List[UpdateOne]:
+        """Một upsert cộng dồn cho mỗi (sensor, khoảng thời gian) trong lô"""
+        operations = []
+        for rollup_id, group in cls._aggregate(tier, documents).items():
+            update = {
+                "$setOnInsert": {
+                    "sensor_id": group["sensor_id"],
+                    "device_id": group["device_id"],
+                    "period_start": group["period_start"]
+                },
+                "$inc": {"count": group["count"], "sum": group["sum"], "sumsq": group["sumsq"]},
+                "$min": {"min": group["min"], "first": group["first"]},
+                "$max": {"max": group["max"], "last": group["last"]}
+            }
+            if group["sensor_type"]:
+                update["$set"] = {"sensor_type": group["sensor_type"]}
+            operations.append(UpdateOne({"_id": rollup_id}, update, upsert=True))
+        return operations
+
+    @classmethod
+    def build_replace_operations(cls, tier: RollupTier, documents: List[dict]) -> List[ReplaceOne]:
+        """Ghi đè rollup bằng giá trị tính từ toàn bộ reading của khoảng (dùng khi backfill)"""
+        operations = []
+        for rollup_id, group in cls._aggregate(tier, documents).items():
+            operations.append(ReplaceOne({"_id": rollup_id}, group, upsert=True))
+        return operations
+
+    @staticmethod
+    def _aggregate(tier: RollupTier, documents: Iterable[dict]) -> Dict[str, dict]:
+        groups: Dict[str, dict] = {}
+        for document in documents:
+            value = document.get("value")
+            timestamp = document.get("timestamp")
+            if not _is_number(value) or not isinstance(timestamp, datetime):
+                continue
+            sensor_id = str(document["sensor_id"])
+            period_start = tier.truncate(timestamp)
+            rollup_id = tier.rollup_id(sensor_id, period_start)
+            group = groups.get(rollup_id)
+            point = {"t": timestamp, "v": value}
+            if group is None:
+                groups[rollup_id] = {
+                    "sensor_id": sensor_id,
+                    "device_id": document.get("device_id"),
+                    "sensor_type": document.get("sensor_type") or _sensor_type(document.get("device_id"), sensor_id),
+                    "period_start": period_start,
+                    "count": 1,
+                    "sum": value,
+                    "sumsq": value * value,
+                    "min": value,
+                    "max": value,
+                    "first": point,
+                    "last": point
+                }
+                continue
+            group["count"] += 1
+            group["sum"] += value
+            group["sumsq"] += value * value
+            group["min"] = min(group["min"], value)
+            group["max"] = max(group["max"], value)
+            if timestamp < group["first"]["t"]:
+                group["first"] = point
+            if timestamp >= group["last"]["t"]:
+                group["last"] = point
+        return groups
+
+    # ---------- planner ----------
+
+    def is_available(self, tier: Optional[RollupTier], timestamp: Optional[datetime], now: Optional[datetime] = None) -> bool:
+        """Tầng (None = raw) còn giữ dữ liệu tại thời điểm timestamp theo retention"""
+        days = self.raw_retention_days if tier is None else tier.retention_days
+        if days <= 0:
+            return True
+        if timestamp is None:
+            return False
+        return timestamp >= (now or get_vietnam_now_naive()) - timedelta(days=days)
+
+    def plan(self, start: Optional[datetime], end: datetime) -> List[Segment]:
+        """Chia [start, end) thành các đoạn theo tầng; start None nghĩa là từ đầu"""
+        if not self.enabled:
+            return [(None, start, end)]
+        return self._split(start, end, len(self.tiers) - 1, get_vietnam_now_naive())
+
+    def _split(self, start: Optional[datetime], end: datetime, level: int, now: datetime) -> List[Segment]:
+        if start is not None and start >= end:
+            return []
+        if level < 0:
+            return [(None, start, end)]
+        tier = self.tiers[level]
+        finer = self.tiers[level - 1] if level > 0 else None
+        finer_available = self.is_available(finer, start, now)
+
+        lower = tier.ceil(start) if start is not None else None
+        upper = tier.truncate(end)
+        if lower is not None and lower >= upper:
+            # Khoảng ngắn hơn một chu kỳ của tầng này
+            if finer_available:
+                return self._split(start, end, level - 1, now)
+            return [(tier, tier.truncate(start), tier.ceil(end))]
+
+        segments = []
+        if start is not None and start < lower:
+            if finer_available:
+                segments.extend(self._split(start, lower, level - 1, now))
+            else:
+                # Tầng mịn hơn đã hết hạn: lấy cả chu kỳ chứa start (xấp xỉ)
+                lower = tier.truncate(start)
+        segments.append((tier, lower, upper))
+        segments.extend(self._split(upper, end, level - 1, now))
+        return segments
+
+    def choose_tier(self, start: datetime, resolution: timedelta) -> Optional[RollupTier]:
+        """Tầng thô nhất có chu kỳ <= resolution và còn dữ liệu tại start; None là dùng raw"""
+        if not self.enabled:
+            return None
+        now = get_vietnam_now_naive()
+        for tier in reversed(self.tiers):
+            if tier.span <= resolution and self.is_available(tier, start, now):
+                return tier
+        if self.is_available(None, start, now):
+            return None
+        # Raw đã hết hạn tại start: dùng tầng mịn nhất còn dữ liệu
+        for tier in self.tiers:
+            if self.is_available(tier, start, now):
+                return tier
+        return None
+
+    # ---------- đọc ----------
+
+    def statistics(
+        self,
+        sensor_ids: IdFilter = None,
+        device_ids: IdFilter = None,
+        sensor_type: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> List[dict]:
+        """Cùng định dạng với sensor_data_store.statistics() nhưng đọc từ rollup theo plan()"""
+        if not self.enabled:
+            return sensor_data_store.statistics(sensor_ids, device_ids, sensor_type, start, end)
+        # end được tính là thời điểm cuối cùng có trong kết quả
+        end = (end or get_vietnam_now_naive()) + timedelta(microseconds=1)
+
+        totals: Dict[str, dict] = {}
+        for tier, segment_start, segment_end in self.plan(start, end):
+            if tier is None:
+                partials = sensor_data_store.partials(sensor_ids, device_ids, sensor_type, segment_start, segment_end)
+            else:
+                partials = self._tier_partials(tier, sensor_ids, device_ids, sensor_type, segment_start, segment_end)
+            for partial in partials:
+                self._merge(totals, partial)
+
+        statistics = []
+        for total in totals.values():
+            count = total["count"]
+            avg = total["sum"] / count if count else None
+            variance = max(0.0, total["sumsq"] / count - avg * avg) if count else None
+            statistics.append({
+                "sensor_id": total["sensor_id"],
+                "sensor_type": total.get("sensor_type"),
+                "device_id": total.get("device_id"),
+                "count": count,
+                "min_value": round(total["min"], 2) if total["min"] is not None else None,
+                "max_value": round(total["max"], 2) if total["max"] is not None else None,
+                "avg_value": round(avg, 2) if avg is not None else None,
+                "stddev_value": round(math.sqrt(variance), 2) if variance is not None else None,
+                "latest_timestamp": total.get("last_ts"),
+                "earliest_timestamp": total.get("first_ts")
+            })
+        return statistics
+
+    def estimate_count(
+        self,
+        sensor_ids: IdFilter = None,
+        device_ids: IdFilter = None,
+        sensor_type: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> Optional[int]:
+        """
+        Số reading xấp xỉ trong [start, end] chỉ từ trường count của rollup: đoạn lẻ ở hai đầu
+        được làm tròn ra cả phút thay vì đọc raw. None nếu rollup bị tắt
+        """
+        if not self.enabled:
+            return None
+        end = (end or get_vietnam_now_naive()) + timedelta(microseconds=1)
+        total = 0
+        for tier, segment_start, segment_end in self.plan(start, end):
+            if tier is None:
+                tier = self.tiers[0]
+                segment_start = tier.truncate(segment_start) if segment_start is not None else None
+                segment_end = tier.ceil(segment_end)
+            match = self._match(sensor_ids, device_ids, sensor_type)
+            match["period_start"] = {"$lt": segment_end}
+            if segment_start is not None:
+                match["period_start"]["$gte"] = segment_start
+            for result in tier.collection.aggregate([
+                {"$match": match},
+                {"$group": {"_id": None, "count": {"$sum": "$count"}}}
+            ]):
+                total += result["count"]
+        return total
+
+    def series(
+        self,
+        tier: RollupTier,
+        sensor_ids: IdFilter = None,
+        device_ids: IdFilter = None,
+        sensor_type: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        resolution: Optional[timedelta] = None
+    ) -> List[dict]:
+        """
+        Điểm theo (sensor_type, khoảng resolution) từ tầng tier: value là trung bình, kèm
+        min / max / count; sắp xếp theo thời gian tăng dần
+        """
+        match = self._match(sensor_ids, device_ids, sensor_type)
+        period = {}
+        if start is not None:
+            period["$gte"] = tier.truncate(start)
+        if end is not None:
+            period["$lte"] = end
+        if period:
+            match["period_start"] = period
+        rows = tier.collection.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": {"sensor_type": "$sensor_type", "period_start": "$period_start"},
+                "count": {"$sum": "$count"},
+                "sum": {"$sum": "$sum"},
+                "min": {"$min": "$min"},
+                "max": {"$max": "$max"}
+            }}
+        ])
+
+        origin = tier.truncate(start) if start is not None else datetime(2000, 1, 1)
+        step = resolution if resolution and resolution > tier.span else tier.span
+        accumulator = BucketAccumulator(origin, step)
+        for row in rows:
+            accumulator.add(row["_id"].get("sensor_type"), row["_id"]["period_start"], row["count"], row["sum"], row["min"], row["max"])
+        return accumulator.points()
+
+    def get_tier(self, name: str) -> RollupTier:
+        return next(tier for tier in self.tiers if tier.name == name)
+
+    def period_table(
+        self,
+        tier: RollupTier,
+        device_ids: IdFilter = None,
+        sensor_type: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> List[dict]:
+        """
+        count / sum / min / max theo từng chu kỳ của tier trong [start, end] (gộp mọi sensor
+        khớp bộ lọc). Chu kỳ đã đóng lấy từ cache, chỉ chu kỳ còn thiếu và chu kỳ hiện tại
+        được truy vấn.
+        """
+        now = get_vietnam_now_naive()
+        end = end or now
+        open_start = tier.truncate(now)
+        periods = []
+        period = tier.truncate(start or end)
+        while period <= end:
+            periods.append(period)
+            period += tier.span
+
+        if isinstance(device_ids, str) or device_ids is None:
+            device_key = device_ids
+        else:
+            device_key = tuple(sorted(str(device_id) for device_id in device_ids))
+        key = (tier.name, sensor_type, device_key)
+        cached = self.table_cache.get(key)
+        missing = [period for period in periods if period < open_start and period not in cached]
+        query_start = missing[0] if missing else open_start
+
+        rows = {}
+        if query_start <= end:
+            rows = self._period_rows(tier, device_ids, sensor_type, query_start, end)
+        self.table_cache.update(key, {
+            period: rows.get(period) for period in periods if query_start <= period < open_start
+        })
+        cached.update(rows)
+        return [cached[period] for period in periods if cached.get(period)]
+
+    def _period_rows(self, tier, device_ids, sensor_type, start: datetime, end: datetime) -> Dict[datetime, dict]:
+        if self.enabled:
+            match = self._match(None, device_ids, sensor_type)
+            match["period_start"] = {"$gte": start, "$lte": end}
+            results = tier.collection.aggregate([
+                {"$match": match},
+                {"$group": {
+                    "_id": "$period_start",
+                    "count": {"$sum": "$count"},
+                    "sum": {"$sum": "$sum"},
+                    "min": {"$min": "$min"},
+                    "max": {"$max": "$max"}
+                }}
+            ])
+            return {
+                result["_id"]: {"period_start": result["_id"], "count": result["count"], "sum": result["sum"], "min": result["min"], "max": result["max"]}
+                for result in results
+            }
+
+        # Rollup tắt: tính trực tiếp từ reading
+        readings = sensor_data_store.find(device_ids=device_ids, sensor_type=sensor_type, start=start, end=end, sort_direction=1)
+        rows: Dict[datetime, dict] = {}
+        for group in self._aggregate(tier, readings).values():
+            row = rows.get(group["period_start"])
+            if row is None:
+                rows[group["period_start"]] = {key: group[key] for key in ("period_start", "count", "sum", "min", "max")}
+                continue
+            row["count"] += group["count"]
+            row["sum"] += group["sum"]
+            row["min"] = min(row["min"], group["min"])
+            row["max"] = max(row["max"], group["max"])
+        return rows
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "write_enabled": self.write_enabled,
+            "tiers": {tier.name: {"collection": tier.collection.name, "retention_days": tier.retention_days} for tier in self.tiers},
+            "table_cache": self.table_cache.get_stats(),
+            "applied_readings": self._applied,
+            "failed_operations": self._failed,
+            "retry_pending": len(self._retry),
+            "retry_dropped": self._retry_dropped
+        }
+
+    # ---------- nội bộ ----------
+
+    @staticmethod
+    def _match(sensor_ids: IdFilter, device_ids: IdFilter, sensor_type: Optional[str]) -> dict:
+        match = {}
+        if sensor_ids is not None:
+            match["sensor_id"] = _id_condition(sensor_ids)
+        if device_ids is not None:
+            match["device_id"] = _id_condition(device_ids)
+        if sensor_type:
+            match["sensor_type"] = sensor_type
+        return match
+
+    def _tier_partials(self, tier, sensor_ids, device_ids, sensor_type, start, end) -> List[dict]:
+        match = self._match(sensor_ids, device_ids, sensor_type)
+        match["period_start"] = {"$lt": end}
+        if start is not None:
+            match["period_start"]["$gte"] = start
+        partials = []
+        for result in tier.collection.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": "$sensor_id",
+                "device_id": {"$first": "$device_id"},
+                "sensor_type": {"$first": "$sensor_type"},
+                "count": {"$sum": "$count"},
+                "sum": {"$sum": "$sum"},
+                "sumsq": {"$sum": "$sumsq"},
+                "min": {"$min": "$min"},
+                "max": {"$max": "$max"},
+                "first_ts": {"$min": "$first.t"},
+                "last_ts": {"$max": "$last.t"}
+            }}
+        ]):
+            result["sensor_id"] = result.pop("_id")
+            partials.append(result)
+        return partials
+
+    @staticmethod
+    def _merge(totals: Dict[str, dict], partial: dict):
+        sensor_id = str(partial["sensor_id"])
+        total = totals.get(sensor_id)
+        if total is None:
+            totals[sensor_id] = dict(partial)
+            return
+        for key in ("count", "sum", "sumsq"):
+            total[key] += partial.get(key) or 0
+        for key, pick in (("min", min), ("first_ts", min), ("max", max), ("last_ts", max)):
+            values = [value for value in (total.get(key), partial.get(key)) if value is not None]
+            total[key] = pick(values) if values else None
+        total["device_id"] = total.get("device_id") or partial.get("device_id")
+        total["sensor_type"] = total.get("sensor_type") or partial.get("sensor_type")
+
+
+def _sensor_type(device_id: Optional[str], sensor_id: str) -> Optional[str]:
+    if not device_id:
+        return None
+    sensor = metadata_cache.get_sensor(device_id, sensor_id)
+    return sensor.get("type") if sensor else None
+
+
+ROLLUP_TIERS = [
+    RollupTier("minute", sensor_rollups_minute_collection, timedelta(minutes=1), SENSOR_ROLLUP_MINUTE_RETENTION_DAYS, "%Y%m%d%H%M"),
+    RollupTier("hour", sensor_rollups_hour_collection, timedelta(hours=1), SENSOR_ROLLUP_HOUR_RETENTION_DAYS, "%Y%m%d%H"),
+    RollupTier("day", sensor_rollups_day_collection, timedelta(days=1), SENSOR_ROLLUP_DAY_RETENTION_DAYS, "%Y%m%d"),
+]
+
+for _tier in ROLLUP_TIERS:
+    retention_manager.register_tier(RetentionTier(f"rollup_{_tier.name}", _tier.collection, "period_start", _tier.retention_days, span=_tier.span))
+
+# Global sensor rollups instance
+sensor_rollups = SensorRollups(ROLLUP_TIERS)
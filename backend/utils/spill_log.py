@@ -0,0 +1,135 @@
+"""
+Write-ahead file chỉ ghi nối (append-only) để giữ document khi MongoDB không ghi được.
+
+Mỗi dòng là một document dạng Extended JSON (bson.json_util, giữ nguyên datetime/ObjectId).
+Vị trí đã replay được lưu ở file <path>.offset; khi replay hết, file được cắt về 0.
+Document được gán _id trước khi ghi xuống file nên replay lại sau khi crash chỉ sinh lỗi
+trùng khóa (bỏ qua được) chứ không tạo bản ghi trùng.
+"""
+import logging
+import os
+import threading
+from typing import List, Tuple
+
+from bson import ObjectId, json_util
+
+logger = logging.getLogger(__name__)
+
+
+class SpillLog:
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.offset_path = f"{path}.offset"
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._offset = 0
+        self._spilled_bytes = 0
+        self._spilled_documents = 0
+        self._replayed_bytes = 0
+        self._replayed_documents = 0
+        self._rejected_documents = 0
+        self._load_offset()
+
+    def append(self, documents: List[dict]) -> bool:
+        """Ghi nối các document xuống file; False nếu vượt max_bytes (không ghi gì)"""
+        if not documents:
+            return True
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+        data = "".join(json_util.dumps(document) + "\n" for document in documents).encode("utf-8")
+        with self._lock:
+            if self._size() + len(data) > self.max_bytes:
+                self._rejected_documents += len(documents)
+                return False
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._spilled_bytes += len(data)
+            self._spilled_documents += len(documents)
+        return True
+
+    def pending_bytes(self) -> int:
+        with self._lock:
+            return max(0, self._size() - self._offset)
+
+    def read_batch(self, max_documents: int) -> Tuple[List[dict], int]:
+        """Đọc tối đa max_documents document chưa replay, trả về (documents, offset kết thúc)"""
+        with self._lock:
+            offset = self._offset
+        documents = []
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                while len(documents) < max_documents:
+                    line = f.readline()
+                    if not line or not line.endswith(b"\n"):
+                        # Dòng cuối ghi dở (crash giữa chừng) sẽ được đọc lại khi hoàn chỉnh
+                        break
+                    offset += len(line)
+                    try:
+                        documents.append(json_util.loads(line))
+                    except ValueError:
+                        logger.error(f"Bỏ qua dòng hỏng trong {self.path} tại offset {offset - len(line)}")
+        except FileNotFoundError:
+            pass
+        return documents, offset
+
+    def commit(self, offset: int, documents: int = 0):
+        """Đánh dấu đã replay tới offset; cắt file về 0 nếu đã replay hết"""
+        with self._lock:
+            self._replayed_bytes += max(0, offset - self._offset)
+            self._replayed_documents += documents
+            self._offset = offset
+            if self._offset >= self._size():
+                try:
+                    open(self.path, "wb").close()
+                except FileNotFoundError:
+                    pass
+                self._offset = 0
+            self._save_offset()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            size = self._size()
+            return {
+                "path": self.path,
+                "file_bytes": size,
+                "pending_bytes": max(0, size - self._offset),
+                "max_bytes": self.max_bytes,
+                "spilled_bytes": self._spilled_bytes,
+                "spilled_documents": self._spilled_documents,
+                "replayed_bytes": self._replayed_bytes,
+                "replayed_documents": self._replayed_documents,
+                "rejected_documents": self._rejected_documents
+            }
+
+    def _size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _load_offset(self):
+        try:
+            with open(self.offset_path, "r") as f:
+                self._offset = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            self._offset = 0
+        if self._offset > self._size():
+            self._offset = 0
+
+    def _save_offset(self):
+        if self._offset == 0:
+            try:
+                os.remove(self.offset_path)
+            except FileNotFoundError:
+                pass
+            return
+        tmp_path = f"{self.offset_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self._offset))
+        os.replace(tmp_path, self.offset_path)
@@ -0,0 +1,331 @@
+"""
+Engine kiểm tra ngưỡng cảm biến trong bộ nhớ cho luồng xử lý MQTT.
+
+- Rule (min/max, tên, đơn vị) được biên dịch một lần cho mỗi sensor và tự biên dịch lại
+  khi metadata cache trả về bản sensor mới; reload_sensor() nạp lại ngay khi đổi ngưỡng
+- Bảng cooldown trong RAM theo (user_id, sensor_id): mỗi user chỉ nhận một cảnh báo
+  chưa đọc cho mỗi sensor trong THRESHOLD_COOLDOWN_MINUTES phút. Khi gặp key lần đầu,
+  bảng được nạp từ notifications bằng một query cho tất cả user của sensor
+- Danh sách user của device được cache, notifications được ghi bằng một insert_many
+
+Khi chạy nhiều instance với MQTT_SHARED_GROUP (shared_cooldown=True), các lần vượt ngưỡng
+của cùng một sensor rơi vào nhiều process nên bảng trong RAM không đủ. Cooldown khi đó nằm
+trong collection threshold_cooldowns ({_id: "user_id:sensor_id", last_alert, expires_at}):
+mỗi cảnh báo phải "giành" cooldown bằng một upsert có điều kiện last_alert < now - cooldown;
+instance thua nhận lỗi trùng khóa và bỏ cảnh báo. TTL index xóa document hết hạn.
+Cửa sổ cooldown đã biết (giành được, hoặc đọc từ DB khi thua) được nhớ trong bảng RAM nên
+trong lúc sensor vượt ngưỡng liên tục mỗi reading không tốn thêm round-trip nào; upsert chỉ
+chạy lại khi cửa sổ trong RAM hết hạn. Đổi lại, clear_cooldown() ở instance khác (user đọc
+cảnh báo) chỉ có hiệu lực với process này khi cửa sổ của nó hết hạn.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+from utils.database import (
+    sensors_collection, notifications_collection, user_room_devices_collection, threshold_cooldowns_collection
+)
+from utils.metadata_cache import metadata_cache, METADATA_CACHE_TTL_SECONDS
+from utils.timezone import get_vietnam_now_naive
+from models.notification_models import create_notification_dict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+THRESHOLD_COOLDOWN_MINUTES = float(os.getenv("THRESHOLD_COOLDOWN_MINUTES", "5"))
+THRESHOLD_COOLDOWN_MAX_ENTRIES = int(os.getenv("THRESHOLD_COOLDOWN_MAX_ENTRIES", "100000"))
+THRESHOLD_SHARED_COOLDOWN = bool(os.getenv("MQTT_SHARED_GROUP", "").strip())
+
+# Key đã nạp từ DB nhưng chưa có cảnh báo nào trong cửa sổ cooldown
+_NO_ALERT = datetime.min
+
+
+class ThresholdRule:
+    __slots__ = ("sensor_id", "name", "unit", "min_threshold", "max_threshold", "source")
+
+    def __init__(self, sensor: dict):
+        self.sensor_id = str(sensor["_id"])
+        self.name = sensor.get("name", f"Sensor {self.sensor_id}")
+        self.unit = sensor.get("unit", "")
+        self.min_threshold = sensor.get("min_threshold")
+        self.max_threshold = sensor.get("max_threshold")
+        self.source = sensor
+
+    def check(self, value: float) -> Optional[str]:
+        """Trả về nội dung cảnh báo nếu value nằm ngoài ngưỡng, None nếu bình thường"""
+        if self.min_threshold is not None and value < self.min_threshold:
+            return f"Giá trị {value:.1f}{self.unit} thấp hơn ngưỡng dưới {self.min_threshold}{self.unit}"
+        if self.max_threshold is not None and value > self.max_threshold:
+            return f"Giá trị {value:.1f}{self.unit} vượt quá ngưỡng trên {self.max_threshold}{self.unit}"
+        return None
+
+
+class ThresholdEngine:
+    def __init__(
+        self,
+        cooldown_minutes: float = THRESHOLD_COOLDOWN_MINUTES,
+        users_ttl_seconds: float = METADATA_CACHE_TTL_SECONDS,
+        shared_cooldown: bool = THRESHOLD_SHARED_COOLDOWN
+    ):
+        self.cooldown = timedelta(minutes=cooldown_minutes)
+        self.users_ttl_seconds = users_ttl_seconds
+        self.shared_cooldown = shared_cooldown
+        self._lock = threading.RLock()
+        self._rules = {}
+        self._device_users = {}
+        # (user_id, sensor_id) -> thời điểm cảnh báo chưa đọc gần nhất
+        self._last_alert = {}
+        self._breaches = 0
+        self._notifications = 0
+        self._suppressed = 0
+
+    # ---------- rule ----------
+
+    def get_rule(self, device_id: str, sensor: dict) -> ThresholdRule:
+        key = (str(device_id), str(sensor["_id"]))
+        with self._lock:
+            rule = self._rules.get(key)
+            if rule is None or rule.source is not sensor:
+                rule = ThresholdRule(sensor)
+                self._rules[key] = rule
+            return rule
+
+    def reload_sensor(self, sensor_id: str, device_id: str):
+        """Nạp lại rule của sensor từ DB (gọi sau khi đổi ngưỡng) và reset cooldown của sensor"""
+        key = (str(device_id), str(sensor_id))
+        sensor = sensors_collection.find_one({"_id": key[1], "device_id": key[0]})
+        with self._lock:
+            self._rules.pop(key, None)
+            for cooldown_key in [k for k in self._last_alert if k[1] == key[1]]:
+                del self._last_alert[cooldown_key]
+        if self.shared_cooldown:
+            self._delete_shared_cooldowns({"sensor_id": key[1]})
+        if sensor:
+            metadata_cache.put_sensor(key[0], sensor)
+            self.get_rule(key[0], sensor)
+
+    # ---------- đánh giá ----------
+
+    def evaluate(self, device_id: str, sensor: dict, value: float) -> List[dict]:
+        """
+        Kiểm tra một giá trị và trả về danh sách notification cần tạo (chưa ghi DB).
+        Gom kết quả của nhiều giá trị rồi gọi write_notifications() một lần.
+        """
+        rule = self.get_rule(device_id, sensor)
+        threshold_message = rule.check(value)
+        if threshold_message is None:
+            return []
+
+        self._breaches += 1
+        device_id = str(device_id)
+        user_ids = self.get_device_users(device_id)
+        if not user_ids:
+            return []
+
+        now = get_vietnam_now_naive()
+        notification_message = f"{rule.name}: {threshold_message}"
+        if self.shared_cooldown:
+            user_ids = self._claim_shared_cooldowns(user_ids, rule.sensor_id, now)
+        else:
+            self._seed_cooldown(user_ids, rule.sensor_id, now)
+        notifications = []
+        with self._lock:
+            for user_id in user_ids:
+                key = (user_id, rule.sensor_id)
+                if not self.shared_cooldown:
+                    if self._last_alert.get(key, _NO_ALERT) >= now - self.cooldown:
+                        self._suppressed += 1
+                        continue
+                    self._last_alert[key] = now
+                notifications.append(create_notification_dict(
+                    user_id=user_id,
+                    sensor_id=rule.sensor_id,
+                    type_="warning",
+                    message=notification_message,
+                    note=f"Device: {device_id}",
+                    read=False
+                ))
+            if len(self._last_alert) > THRESHOLD_COOLDOWN_MAX_ENTRIES:
+                self._prune(now)
+        return notifications
+
+    def write_notifications(self, notifications: List[dict]) -> int:
+        """Ghi các notification bằng một insert_many"""
+        if not notifications:
+            return 0
+        try:
+            notifications_collection.insert_many(notifications, ordered=False)
+        except Exception as e:
+            logger.error(f"Lỗi ghi {len(notifications)} cảnh báo ngưỡng: {str(e)}")
+            with self._lock:
+                # Cho phép cảnh báo lại ở lần vượt ngưỡng sau
+                for notification in notifications:
+                    self._last_alert.pop((notification["user_id"], notification["sensor_id"]), None)
+            if self.shared_cooldown:
+                self._delete_shared_cooldowns({"_id": {"$in": [
+                    _cooldown_id(notification["user_id"], notification["sensor_id"]) for notification in notifications
+                ]}})
+            return 0
+        self._notifications += len(notifications)
+        for notification in notifications:
+            logger.warning(f"Đã tạo cảnh báo ngưỡng cho user {notification['user_id']}: {notification['message']}")
+        return len(notifications)
+
+    # ---------- user của device ----------
+
+    def get_device_users(self, device_id: str) -> List[str]:
+        return self._get_device_links(device_id)[0]
+
+    def get_device_room(self, device_id: str) -> Optional[str]:
+        """room_id của device nếu mọi liên kết đều cùng một phòng, ngược lại None"""
+        room_ids = self._get_device_links(device_id)[1]
+        return room_ids[0] if len(room_ids) == 1 else None
+
+    def get_device_rooms(self, device_id: str) -> List[str]:
+        """Mọi room_id mà device đang được liên kết"""
+        return self._get_device_links(device_id)[1]
+
+    def _get_device_links(self, device_id: str) -> Tuple[List[str], List[str]]:
+        device_id = str(device_id)
+        with self._lock:
+            entry = self._device_users.get(device_id)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1], entry[2]
+        links = list(user_room_devices_collection.find({"device_id": device_id}, {"user_id": 1, "room_id": 1}))
+        user_ids = sorted({link["user_id"] for link in links})
+        room_ids = sorted({str(link["room_id"]) for link in links if link.get("room_id")})
+        with self._lock:
+            self._device_users[device_id] = (time.monotonic() + self.users_ttl_seconds, user_ids, room_ids)
+        return user_ids, room_ids
+
+    def invalidate_device_users(self, device_id: str):
+        with self._lock:
+            self._device_users.pop(str(device_id), None)
+
+    # ---------- cooldown ----------
+
+    def clear_cooldown(self, user_id: str, sensor_id: str = None):
+        """Bỏ cooldown khi user đã đọc cảnh báo (sensor_id None: tất cả sensor của user)"""
+        with self._lock:
+            if sensor_id is not None:
+                self._last_alert.pop((user_id, str(sensor_id)), None)
+            else:
+                for key in [k for k in self._last_alert if k[0] == user_id]:
+                    del self._last_alert[key]
+        if self.shared_cooldown:
+            if sensor_id is not None:
+                self._delete_shared_cooldowns({"_id": _cooldown_id(user_id, sensor_id)})
+            else:
+                self._delete_shared_cooldowns({"user_id": user_id})
+
+    def get_stats(self) -> dict:
+        return {
+            "shared_cooldown": self.shared_cooldown,
+            "rules": len(self._rules),
+            "cooldown_entries": len(self._last_alert),
+            "breaches": self._breaches,
+            "notifications": self._notifications,
+            "suppressed": self._suppressed
+        }
+
+    def _seed_cooldown(self, user_ids: List[str], sensor_id: str, now: datetime):
+        with self._lock:
+            cold_users = [user_id for user_id in user_ids if (user_id, sensor_id) not in self._last_alert]
+        if not cold_users:
+            return
+        try:
+            recent = notifications_collection.find(
+                {
+                    "user_id": {"$in": cold_users},
+                    "sensor_id": sensor_id,
+                    "read": False,
+                    "type": "warning",
+                    "created_at": {"$gte": now - self.cooldown}
+                },
+                {"user_id": 1, "created_at": 1}
+            )
+            seeded = {user_id: _NO_ALERT for user_id in cold_users}
+            for notification in recent:
+                seeded[notification["user_id"]] = max(seeded[notification["user_id"]], notification["created_at"])
+        except Exception as e:
+            logger.error(f"Lỗi nạp cooldown cảnh báo cho sensor {sensor_id}: {str(e)}")
+            return
+        with self._lock:
+            for user_id, last_alert in seeded.items():
+                self._last_alert.setdefault((user_id, sensor_id), last_alert)
+
+    def _claim_shared_cooldowns(self, user_ids: List[str], sensor_id: str, now: datetime) -> List[str]:
+        """
+        User được phép nhận cảnh báo. User còn trong cửa sổ cooldown đã biết ở RAM bị bỏ qua
+        mà không truy vấn DB; với user còn lại, giành cooldown trong threshold_cooldowns bằng
+        upsert có điều kiện rồi ghi cửa sổ vào RAM
+        """
+        window_start = now - self.cooldown
+        with self._lock:
+            cold_users = [
+                user_id for user_id in user_ids
+                if self._last_alert.get((user_id, sensor_id), _NO_ALERT) < window_start
+            ]
+            self._suppressed += len(user_ids) - len(cold_users)
+        claimed = []
+        for user_id in cold_users:
+            cooldown_id = _cooldown_id(user_id, sensor_id)
+            try:
+                threshold_cooldowns_collection.update_one(
+                    {"_id": cooldown_id, "last_alert": {"$lt": window_start}},
+                    {
+                        "$set": {"last_alert": now, "expires_at": datetime.utcnow() + self.cooldown},
+                        "$setOnInsert": {"user_id": user_id, "sensor_id": sensor_id}
+                    },
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                # Document tồn tại và còn trong cooldown (có thể do instance khác vừa giành):
+                # nhớ cửa sổ của instance đó để các reading sau không thử lại
+                self._suppressed += 1
+                self._remember_shared_cooldown(cooldown_id, user_id, sensor_id, now)
+                continue
+            except Exception as e:
+                # Không đọc được cooldown: vẫn cảnh báo, thà trùng còn hơn bỏ sót
+                logger.error(f"Lỗi ghi cooldown cảnh báo cho sensor {sensor_id}: {str(e)}")
+            claimed.append(user_id)
+        with self._lock:
+            for user_id in claimed:
+                self._last_alert[(user_id, sensor_id)] = now
+        return claimed
+
+    def _remember_shared_cooldown(self, cooldown_id: str, user_id: str, sensor_id: str, now: datetime):
+        try:
+            document = threshold_cooldowns_collection.find_one({"_id": cooldown_id}, {"last_alert": 1})
+        except Exception as e:
+            logger.error(f"Lỗi đọc cooldown cảnh báo cho sensor {sensor_id}: {str(e)}")
+            return
+        last_alert = document.get("last_alert") if document else None
+        with self._lock:
+            self._last_alert[(user_id, sensor_id)] = min(last_alert, now) if last_alert else now
+
+    @staticmethod
+    def _delete_shared_cooldowns(query: dict):
+        try:
+            threshold_cooldowns_collection.delete_many(query)
+        except Exception as e:
+            logger.error(f"Lỗi xóa cooldown cảnh báo: {str(e)}")
+
+    def _prune(self, now: datetime):
+        threshold = now - self.cooldown
+        for key in [k for k, last_alert in self._last_alert.items() if last_alert < threshold]:
+            del self._last_alert[key]
+
+
+def _cooldown_id(user_id: str, sensor_id: str) -> str:
+    return f"{user_id}:{sensor_id}"
+
+
+# Global threshold engine instance
+threshold_engine = ThresholdEngine()
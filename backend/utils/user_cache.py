@@ -0,0 +1,87 @@
+"""
+Cache user đã xác thực trong process để get_current_user không truy vấn users mỗi request.
+
+- Key theo subject của access token (email); entry có TTL AUTH_USER_CACHE_TTL_SECONDS
+- Bản ghi được cache không có password_hash
+- Nếu token có claim uid mà khác _id của entry (user bị xóa rồi tạo lại cùng email) thì
+  entry bị bỏ và tra lại MongoDB
+- user_controller gọi invalidate() khi đổi thông tin, đổi mật khẩu hoặc đăng xuất
+- Tối đa AUTH_USER_CACHE_MAX_ENTRIES entry; khi đầy bỏ các entry hết hạn rồi entry cũ nhất
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+AUTH_USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "30"))
+AUTH_USER_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_USER_CACHE_MAX_ENTRIES", "10000"))
+
+
+class UserCache:
+    def __init__(self, ttl_seconds: float = AUTH_USER_CACHE_TTL_SECONDS, max_entries: int = AUTH_USER_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # email -> (expires_at, user)
+        self._users = {}
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, email: str, user_id: str = None) -> Optional[dict]:
+        """User đang cache theo email (bản sao), None nếu chưa có, hết hạn hoặc khác user_id"""
+        if self.ttl_seconds <= 0:
+            return None
+        with self._lock:
+            entry = self._users.get(email)
+            if entry is not None and entry[0] > time.monotonic() and (user_id is None or str(entry[1]["_id"]) == str(user_id)):
+                self._hits += 1
+                return dict(entry[1])
+            if entry is not None:
+                del self._users[email]
+            self._misses += 1
+            return None
+
+    def put(self, user: dict):
+        if self.ttl_seconds <= 0:
+            return
+        user = {key: value for key, value in user.items() if key != "password_hash"}
+        with self._lock:
+            if len(self._users) >= self.max_entries and user["email"] not in self._users:
+                self._evict()
+            self._users[user["email"]] = (time.monotonic() + self.ttl_seconds, user)
+
+    def invalidate(self, email: str):
+        with self._lock:
+            if self._users.pop(email, None) is not None:
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "entries": len(self._users),
+            "hits": self._hits,
+            "misses": self._misses,
+            "invalidations": self._invalidations
+        }
+
+    # ---------- nội bộ ----------
+
+    def _evict(self):
+        now = time.monotonic()
+        for email in [email for email, entry in self._users.items() if entry[0] <= now]:
+            del self._users[email]
+        if len(self._users) >= self.max_entries:
+            # dict giữ thứ tự chèn: entry đầu tiên là entry cũ nhất
+            del self._users[next(iter(self._users))]
+
+
+# Global user cache instance
+user_cache = UserCache()
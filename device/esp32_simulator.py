@@ -9,6 +9,16 @@ from typing import Dict, List
 import os
 import requests
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
 MQTT_BROKER = "707d6798baa54e22a0d6a43694d39e47.s1.eu.hivemq.cloud"
 MQTT_PORT = 8883
 MQTT_USERNAME = "ngohai"
@@ -26,6 +36,12 @@ SENSOR_IR_ID = "test7"
 ACTUATOR_RELAY1_ID = "test4"
 ACTUATOR_RELAY2_ID = "test5"
 
+# Codec cho device/{id}/data: json (mặc định), msgpack hoặc cbor - server xác nhận khi đăng ký
+PAYLOAD_CODEC = os.getenv("PAYLOAD_CODEC", "json").lower()
+negotiated_codec = "json"
+# Mã loại sensor trong payload gọn (giống SENSOR_TYPE_CODES của backend)
+SENSOR_TYPE_CODES = ["temperature", "humidity", "gas", "light", "motion", "obstacle", "energy"]
+
 API_BASE_URL = "http://localhost:8000"
 API_BASE_URL = 'https://iot-20251.onrender.com'
 device_enabled = True
@@ -58,6 +74,7 @@ def on_connect(client, userdata, flags, rc, properties=None):
         if DEVICE_ID:
             command_topic = f"device/{DEVICE_ID}/command"
             client.subscribe(command_topic, qos=1)
+            client.subscribe(f"device/{DEVICE_ID}/register/response", qos=1)
             print(f"Subscribed to: {command_topic}")
         else:
             print(f"Device ID not yet registered, skipping MQTT subscriptions")
@@ -82,8 +99,11 @@ def on_message(client, userdata, msg):
         if "register/response" in topic:
             data = json.loads(payload)
             if data.get("status") == "success":
+                global negotiated_codec
+                negotiated_codec = data.get("codec", "json")
                 print(f"   Device registered successfully!")
                 print(f"   Device ID: {data.get('device_id')}")
+                print(f"   Payload codec: {negotiated_codec}")
                 print(f"   Room ID: {data.get('room_id')}")
             else:
                 print(f"   Registration failed: {data.get('message', 'Unknown error')}")
@@ -123,6 +143,25 @@ def on_message(client, userdata, msg):
         print(f"Error processing message: {e}")
 
 
+def encode_data_payload(payload: dict) -> bytes:
+    """
+    Mã hóa payload dữ liệu theo codec đã thỏa thuận.
+    msgpack/cbor dùng format gọn: {"s": [[sensor_id, value, type_code]], "a": [[actuator_id, state]]}
+    """
+    if negotiated_codec == "json" or (negotiated_codec == "msgpack" and msgpack is None) or (negotiated_codec == "cbor" and cbor2 is None):
+        return json.dumps(payload).encode("utf-8")
+    compact = {
+        "s": [
+            [sensor["sensor_id"], sensor["value"]] + ([SENSOR_TYPE_CODES.index(sensor["type"])] if sensor.get("type") in SENSOR_TYPE_CODES else [])
+            for sensor in payload["sensors"]
+        ],
+        "a": [[actuator["actuator_id"], actuator["state"]] for actuator in payload["actuators"]]
+    }
+    if negotiated_codec == "msgpack":
+        return msgpack.packb(compact, use_bin_type=True)
+    return cbor2.dumps(compact)
+
+
 def send_sensor_data(client):
     """Gửi dữ liệu sensor lên server"""
     global DEVICE_ID
@@ -188,9 +227,10 @@ def send_sensor_data(client):
     })
     
     topic = f"device/{DEVICE_ID}/data"
-    client.publish(topic, json.dumps(payload), qos=1)
+    message = encode_data_payload(payload)
+    client.publish(topic, message, qos=1)
     
-    print(f"Published to {topic}:")
+    print(f"Published to {topic} ({negotiated_codec}, {len(message)} bytes):")
     print(f"   Sensors: {len(payload['sensors'])}")
     print(f"   Actuators: {len(payload['actuators'])}")
     if payload['sensors']:
@@ -255,7 +295,8 @@ def register_device(client=None):
         "actuators": [
             {"actuator_id": ACTUATOR_RELAY1_ID, "type": "relay", "name": "Đèn trần", "pin": 23},
             {"actuator_id": ACTUATOR_RELAY2_ID, "type": "relay", "name": "Quạt", "pin": 22}
-        ]
+        ],
+        "codecs": [PAYLOAD_CODEC, "json"] if PAYLOAD_CODEC != "json" else ["json"]
     }
     
     try: